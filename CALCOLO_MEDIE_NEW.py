@@ -2,10 +2,13 @@ import os
 import glob
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import shutil
 import subprocess
 import json
-import math
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 
 # === CONFIGURAZIONE ===
@@ -45,6 +48,55 @@ PERC_TIER_BOTTOM = 0.25 # Es. 25% -> 5 squadre su 20
 # Mid tier sarà il resto
 POSIZIONI_RANGO_SIMILE = 2 # +/- 2 posizioni per "Rango Simile"
 
+# Stimatore di forza con decadimento esponenziale (aggiornato in modo incrementale tra un'esecuzione e l'altra)
+EMIVITA_GIORNI_FORZA = 180 # Dopo questi giorni una partita pesa la metà
+FILE_STATO_FORZA_ESPONENZIALE = "./stato_forza_esponenziale.json" # Fuori da medie_csv_V2, che viene svuotata a ogni giro
+
+# Feature walk-forward: per ogni partita storica, le statistiche che ciascuna squadra aveva prima del calcio d'inizio
+CARTELLA_CLASSIFICHE_PROGRESSIVE = "./classifiche_progressive" # Classifica dopo ogni giornata, scritta da CREA_CLASSIFICA.py
+FILE_FEATURE_WALK_FORWARD = "./feature_walk_forward_V2.parquet" # Una riga per partita, colonne casa_* e trasferta_*
+
+# Store binario delle statistiche V2 (letto da PRONOSTICI_GENERATI.py; il CSV resta come esportazione)
+VERSIONE_SCHEMA_STORE_V2 = 1
+
+# === CACHE DELLE STAGIONI (un parsing per file per esecuzione) ===
+
+class CacheStagioni:
+    """
+    Cache per esecuzione dei CSV stagione: ogni file viene letto una sola volta, con 'data' già
+    convertita in datetime e le colonne statistiche numeriche. I DataFrame restituiti sono condivisi:
+    chi li usa non deve modificarli sul posto (usare assign/copy). Tiene i contatori di letture,
+    hit e byte parsati per rendere visibile il risparmio.
+    """
+    def __init__(self):
+        self._stagioni = {}
+        self.letture = 0
+        self.hit = 0
+        self.byte_parsati = 0
+        self.byte_risparmiati = 0
+
+    def leggi(self, percorso_file: str) -> pd.DataFrame:
+        chiave = os.path.abspath(percorso_file)
+        dimensione = os.path.getsize(percorso_file)
+        if chiave in self._stagioni:
+            self.hit += 1
+            self.byte_risparmiati += dimensione
+            return self._stagioni[chiave]
+        df_stagione = pd.read_csv(percorso_file)
+        df_stagione['data'] = pd.to_datetime(df_stagione['data'], errors='coerce')
+        for _, col_casa, col_trasferta in STATISTICHE_DA_ANALIZZARE:
+            for col in (col_casa, col_trasferta):
+                if col in df_stagione.columns:
+                    df_stagione[col] = pd.to_numeric(df_stagione[col], errors='coerce')
+        self.letture += 1
+        self.byte_parsati += dimensione
+        self._stagioni[chiave] = df_stagione
+        return df_stagione
+
+    def riepilogo(self) -> str:
+        return (f"📦 Cache stagioni: {self.letture} file parsati ({self.byte_parsati / 1e6:.2f} MB), "
+                f"{self.hit} hit ({self.byte_risparmiati / 1e6:.2f} MB non riletti)")
+
 # === FUNZIONI DI UTILITÀ ===
 def svuota_e_crea_cartella(path):
     if os.path.exists(path): shutil.rmtree(path)
@@ -53,7 +105,7 @@ def svuota_e_crea_cartella(path):
 
 def git_push_medie_v2(commit_msg="Aggiornamento CALCOLO_MEDIE_V2.py"):
     try:
-        subprocess.run(["git", "add", CARTELLA_MEDIE_OUTPUT_V2], check=True)
+        subprocess.run(["git", "add", CARTELLA_MEDIE_OUTPUT_V2, FILE_STATO_FORZA_ESPONENZIALE], check=True)
         result = subprocess.run(["git", "diff", "--staged", "--quiet"])
         if result.returncode == 1:
             subprocess.run(["git", "commit", "-m", commit_msg], check=True)
@@ -64,119 +116,101 @@ def git_push_medie_v2(commit_msg="Aggiornamento CALCOLO_MEDIE_V2.py"):
     except subprocess.CalledProcessError as e:
         print(f"❌ Errore durante il processo Git per Medie V2: {e}")
 
-def get_tier_squadra(posizione: int, num_squadre: int) -> str:
-    if num_squadre == 0: return "Mid" # Evita divisione per zero
-    num_top = math.ceil(PERC_TIER_TOP * num_squadre)
-    num_bottom = math.ceil(PERC_TIER_BOTTOM * num_squadre)
-    
-    if posizione <= num_top:
-        return "Top"
-    elif posizione > (num_squadre - num_bottom):
-        return "Bottom"
-    else:
-        return "Mid"
+def get_tier_squadre_array(posizioni: np.ndarray, num_squadre: np.ndarray) -> np.ndarray:
+    """Tier dell'avversario (Top, Mid, Bottom) su array di posizioni e dimensioni campionato; Mid se il campionato è vuoto."""
+    num_top = np.ceil(PERC_TIER_TOP * num_squadre)
+    num_bottom = np.ceil(PERC_TIER_BOTTOM * num_squadre)
+    return np.where((num_squadre == 0) | ((posizioni > num_top) & (posizioni <= num_squadre - num_bottom)), "Mid",
+                    np.where(posizioni <= num_top, "Top", "Bottom"))
 
-def calcola_medie_forza_da_df(df_partite_target: pd.DataFrame, squadra_analisi: str, stat_campionato_generali: dict, nome_stat_base:str, col_casa:str, col_trasferta:str, contesto:str = ""):
+def aggiungi_posizioni_storiche(df_storico: pd.DataFrame, df_classifiche_storiche: pd.DataFrame) -> pd.DataFrame:
     """
-    Calcola medie e forza per una squadra da un DataFrame di partite filtrato.
-    Contesto può essere es. "_VS_Top", "_VS_Mid", "_VS_Bottom", "_VS_Simile"
+    Attacca a ogni partita, con un unico merge per lato contro le classifiche finali della sua stagione,
+    posizione e tier di squadra di casa e di trasferta. Le squadre assenti dalla classifica prendono
+    num_squadre // 2; 'classifica_disponibile' è False se manca del tutto la classifica della stagione.
     """
-    risultati = {}
-    df_casa_squadra = df_partite_target[df_partite_target['squadra_casa'] == squadra_analisi]
-    df_trasf_squadra = df_partite_target[df_partite_target['squadra_trasferta'] == squadra_analisi]
-
-    # Medie Fatte/Subite dalla squadra nel contesto specifico
-    media_fatti_casa = df_casa_squadra[col_casa].mean() if not df_casa_squadra.empty else 0
-    media_subiti_casa = df_casa_squadra[col_trasferta].mean() if not df_casa_squadra.empty else 0 # Avversario era in trasferta
-    media_fatti_trasferta = df_trasf_squadra[col_trasferta].mean() if not df_trasf_squadra.empty else 0
-    media_subiti_trasferta = df_trasf_squadra[col_casa].mean() if not df_trasf_squadra.empty else 0 # Avversario era in casa
-
-    risultati[f'media_{nome_stat_base}_fatti_casa{contesto}'] = round(media_fatti_casa, 2)
-    risultati[f'media_{nome_stat_base}_subiti_casa{contesto}'] = round(media_subiti_casa, 2)
-    risultati[f'media_{nome_stat_base}_fatti_trasferta{contesto}'] = round(media_fatti_trasferta, 2)
-    risultati[f'media_{nome_stat_base}_subiti_trasferta{contesto}'] = round(media_subiti_trasferta, 2)
-    
-    # Numero di partite usate per queste medie condizionali
-    risultati[f'num_partite_casa{contesto}'] = len(df_casa_squadra)
-    risultati[f'num_partite_trasferta{contesto}'] = len(df_trasf_squadra)
-
-    # Indici di Forza (relativi alle medie GENERALI del campionato)
-    den_casa = stat_campionato_generali.get(f'media_{nome_stat_base}_casa_campionato', 1.0)
-    den_trasf = stat_campionato_generali.get(f'media_{nome_stat_base}_trasferta_campionato', 1.0)
-
-    risultati[f'forza_attacco_{nome_stat_base}_casa{contesto}'] = round(media_fatti_casa / den_casa, 3) if den_casa > 0.01 else 1.0
-    risultati[f'forza_difesa_{nome_stat_base}_casa{contesto}'] = round(media_subiti_casa / den_trasf, 3) if den_trasf > 0.01 else 1.0
-    risultati[f'forza_attacco_{nome_stat_base}_trasferta{contesto}'] = round(media_fatti_trasferta / den_trasf, 3) if den_trasf > 0.01 else 1.0
-    risultati[f'forza_difesa_{nome_stat_base}_trasferta{contesto}'] = round(media_subiti_trasferta / den_casa, 3) if den_casa > 0.01 else 1.0
-    return risultati
-
-def calcola_forma_avanzata(partite_squadra: pd.DataFrame, df_classifica: pd.DataFrame, max_partite: int = 7) -> float:
+    df = df_storico.copy()
+    num_per_stagione = df_classifiche_storiche.groupby('stagione_file')['Pos'].size()
+    df['num_squadre_stagione'] = df['stagione_file'].map(num_per_stagione)
+    df['classifica_disponibile'] = df['num_squadre_stagione'].notna()
+    df['num_squadre_stagione'] = df['num_squadre_stagione'].fillna(20).astype(int)
+    for lato in ['casa', 'trasferta']:
+        posizioni_lato = df_classifiche_storiche.rename(columns={'Squadra': f'squadra_{lato}', 'Pos': f'pos_{lato}'})
+        df = df.merge(posizioni_lato[['stagione_file', f'squadra_{lato}', f'pos_{lato}']],
+                      on=['stagione_file', f'squadra_{lato}'], how='left', validate='many_to_one')
+        df[f'pos_{lato}'] = df[f'pos_{lato}'].fillna(df['num_squadre_stagione'] // 2).astype(int)
+        df[f'tier_{lato}'] = get_tier_squadre_array(df[f'pos_{lato}'].to_numpy(), df['num_squadre_stagione'].to_numpy())
+    df.index = df_storico.index # Il merge left conserva l'ordine delle righe
+    return df
+
+def pesi_recenza_lineari(n: int) -> np.ndarray:
+    """Pesi 1..n dalla partita più vecchia alla più recente (quelli della forma originale partita per partita)."""
+    return np.arange(1, n + 1, dtype=float)
+
+def calcola_forma_campionato(df_partite: pd.DataFrame, df_classifica: pd.DataFrame, max_partite: int = 7,
+                             pesi_recenza=pesi_recenza_lineari, storico: bool = False, difficolta_as_of: bool = False):
     """
-    Calcola la forma tenendo conto di:
-    1. Punti (3, 1, 0)
-    2. Pesi per recenza (la partita più recente pesa di più)
-    3. Forza dell'avversario (pesata in base alla sua posizione in classifica)
+    Forma avanzata di tutte le squadre di un campionato in un colpo solo, con la stessa formula di
+    forma originale partita per partita: somma di punti x peso di recenza x difficoltà dell'avversario, divisa per 3 x somma pesi.
+    Le partite diventano una vista impilata per squadra e le finestre mobili (sliding_window_view) vengono pesate
+    con un kernel per ogni lunghezza di finestra 1..max_partite, così le prime partite di ogni squadra usano
+    finestre parziali come nel calcolo originale. `pesi_recenza(n)` restituisce n pesi dal più vecchio al più recente.
+
+    storico=False: Series squadra -> forma sulle ultime `max_partite` partite.
+    storico=True: DataFrame con una riga per squadra e partita (squadra, data, forma dopo la partita,
+    forma_pre_partita = quella con cui la squadra arrivava alla partita, 0.0 alla prima).
+    difficolta_as_of=True: la difficoltà di ogni partita usa la posizione dell'avversario prima di quella partita
+    (colonne di aggiungi_posizioni_as_of) invece di df_classifica; 0.5 dove la classifica non è disponibile.
     """
-    if partite_squadra.empty or len(partite_squadra) < 1: # Modificato controllo per permettere calcolo anche con meno di 3 partite
-        return 0.0
-    
-    # Se df_classifica è vuoto o manca 'Squadra'/'Pos', non possiamo pesare per avversario.
-    # In tal caso, potremmo procedere senza quel peso o ritornare una forma neutra/default.
-    # Per ora, se manca la classifica, il .get(avversario, ...) userà il default.
     classifica_valida = not df_classifica.empty and 'Squadra' in df_classifica.columns and 'Pos' in df_classifica.columns
-    
-    partite_recenti = partite_squadra.tail(max_partite)
-    if partite_recenti.empty: # Ulteriore controllo
-        return 0.0
-
-    punti_ottenuti = []
-    coefficienti_difficolta = []
-    
-    num_squadre = len(df_classifica) if classifica_valida else 20 # Default a 20 se classifica non disponibile
+    num_squadre = len(df_classifica) if classifica_valida else 20
     posizioni_classifica = df_classifica.set_index('Squadra')['Pos'].to_dict() if classifica_valida else {}
 
-    for _, row in partite_recenti.iterrows():
-        # Assicurati che 'squadra_in_analisi' sia presente nel DataFrame 'row'
-        # Questa colonna viene aggiunta prima di chiamare calcola_forma_avanzata nel main
-        if 'squadra_in_analisi' not in row:
-            # Fallback o errore se 'squadra_in_analisi' non è definita
-            # Per ora, assumiamo che sia sempre presente come da logica in elabora_statistiche_campionato_V2
-            print(f"ATTENZIONE: 'squadra_in_analisi' non trovata nella riga della partita durante calcolo forma. Salto partita.")
-            continue
-
-        squadra_in_analisi = row['squadra_in_analisi']
-        squadra_in_casa = row['squadra_casa'] == squadra_in_analisi
-        
-        avversario = row['squadra_trasferta'] if squadra_in_casa else row['squadra_casa']
-        
-        punti = 0
-        if squadra_in_casa:
-            if row['gol_casa'] > row['gol_trasferta']: punti = 3
-            elif row['gol_casa'] == row['gol_trasferta']: punti = 1
-        else: 
-            if row['gol_trasferta'] > row['gol_casa']: punti = 3
-            elif row['gol_trasferta'] == row['gol_casa']: punti = 1
-        punti_ottenuti.append(punti)
-
-        if classifica_valida:
-            pos_avversario = posizioni_classifica.get(avversario, num_squadre // 2) 
-            difficolta = (num_squadre - pos_avversario + 1) / float(num_squadre) if num_squadre > 0 else 0.5
-        else:
-            difficolta = 0.5 # Coefficiente di difficoltà neutro se la classifica non è disponibile
-        coefficienti_difficolta.append(difficolta)
-
-    if not punti_ottenuti: # Se non sono state processate partite (es. per 'squadra_in_analisi' mancante)
-        return 0.0
-
-    pesi_recenza = np.arange(1, len(punti_ottenuti) + 1)
-    
-    punteggio_ponderato = np.sum(np.array(punti_ottenuti) * pesi_recenza * np.array(coefficienti_difficolta))
-    massimo_punteggio_possibile = np.sum(3 * pesi_recenza) # Massimo teorico se si vincono tutte le partite con difficoltà 1 e peso massimo
-                                                        # Non considera il coeff. difficoltà nel massimo per normalizzare la forma tra 0 e ~1
-                                                        # dove 1 è vincere tutte le partite recenti. La difficoltà modula questo.
-    
-    forma = punteggio_ponderato / massimo_punteggio_possibile if massimo_punteggio_possibile > 0 else 0.0
-    return round(forma, 3)
+    viste = []
+    for lato, lato_avversario in [('casa', 'trasferta'), ('trasferta', 'casa')]:
+        fatti, subiti = df_partite[f'gol_{lato}'].to_numpy(), df_partite[f'gol_{lato_avversario}'].to_numpy()
+        viste.append(pd.DataFrame({
+            'squadra': df_partite[f'squadra_{lato}'].to_numpy(),
+            'avversario': df_partite[f'squadra_{lato_avversario}'].to_numpy(),
+            'data': df_partite['data'].to_numpy(),
+            'punti': np.where(fatti > subiti, 3.0, np.where(fatti == subiti, 1.0, 0.0)),
+        }))
+        if difficolta_as_of:
+            viste[-1]['pos_avversario'] = df_partite[f'pos_{lato_avversario}'].to_numpy(dtype=float)
+            viste[-1]['num_squadre'] = df_partite['num_squadre_stagione'].to_numpy(dtype=float)
+            viste[-1]['classifica_disponibile'] = df_partite['classifica_disponibile'].to_numpy()
+    vista = pd.concat(viste, ignore_index=True).sort_values(by=['squadra', 'data'], kind='mergesort').reset_index(drop=True)
+    if difficolta_as_of:
+        difficolta = np.where(vista['classifica_disponibile'].to_numpy(dtype=bool),
+                              (vista['num_squadre'] - vista['pos_avversario'] + 1).to_numpy() / vista['num_squadre'].to_numpy(), 0.5)
+    elif classifica_valida:
+        pos_avversario = vista['avversario'].map(posizioni_classifica).fillna(num_squadre // 2).to_numpy(dtype=float)
+        difficolta = (num_squadre - pos_avversario + 1) / float(num_squadre) if num_squadre > 0 else np.full(len(vista), 0.5)
+    else:
+        difficolta = np.full(len(vista), 0.5) # Coefficiente di difficoltà neutro se la classifica non è disponibile
+
+    # Kernel per finestre di lunghezza 1..L allineati a destra: le posizioni prima dell'inizio
+    # della squadra (o del file) hanno peso 0, quindi le finestre non si mescolano tra squadre
+    L = max_partite
+    kernel = np.zeros((L, L))
+    for n in range(1, L + 1):
+        kernel[n - 1, L - n:] = pesi_recenza(n)
+    lunghezza_finestra = np.minimum(vista.groupby('squadra', sort=False).cumcount().to_numpy() + 1, L)
+    pesi = kernel[lunghezza_finestra - 1]
+
+    riempimento = np.zeros(L - 1)
+    finestre_punti = sliding_window_view(np.concatenate([riempimento, vista['punti'].to_numpy()]), L)
+    finestre_difficolta = sliding_window_view(np.concatenate([riempimento, difficolta]), L)
+    punteggio_ponderato = (finestre_punti * pesi * finestre_difficolta).sum(axis=1)
+    massimo_punteggio_possibile = (3 * pesi).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        forma = np.where(massimo_punteggio_possibile > 0, punteggio_ponderato / massimo_punteggio_possibile, 0.0)
+    vista['forma'] = np.round(forma, 3)
+
+    if storico:
+        vista['forma_pre_partita'] = vista.groupby('squadra', sort=False)['forma'].shift(1).fillna(0.0)
+        return vista[['squadra', 'data', 'avversario', 'punti', 'forma', 'forma_pre_partita']]
+    return vista.groupby('squadra', sort=False)['forma'].last()
 
 def calcola_statistiche_medie_campionato(df_campionato: pd.DataFrame) -> dict:
     """
@@ -206,57 +240,248 @@ def calcola_statistiche_medie_campionato(df_campionato: pd.DataFrame) -> dict:
             stat_campionato[f'media_{nome_base}_trasferta_campionato'] = 1.0 # Default generico
             
     return stat_campionato
+# Contesti del tensore statistiche, nell'ordine in cui compaiono nel CSV
+CONTESTI_TENSORE = ["_generale_recente", "_VS_Top", "_VS_Mid", "_VS_Bottom", "_VS_Simile"]
+
+def costruisci_vista_squadre(df_partite: pd.DataFrame) -> pd.DataFrame:
+    """
+    Vista impilata: ogni partita diventa due righe, una dal punto di vista di ciascuna squadra
+    (ruolo 0 = casa, 1 = trasferta), con valori fatti/subiti per ogni statistica, posizioni e tier.
+    """
+    viste = []
+    for ruolo, lato, lato_avversario in [(0, 'casa', 'trasferta'), (1, 'trasferta', 'casa')]:
+        colonne = {
+            'squadra': df_partite[f'squadra_{lato}'].to_numpy(),
+            'ruolo': ruolo,
+            'data': df_partite['data'].to_numpy(),
+            'stagione_file': df_partite['stagione_file'].to_numpy(),
+            'classifica_disponibile': df_partite['classifica_disponibile'].to_numpy(),
+            'pos_squadra': df_partite[f'pos_{lato}'].to_numpy(),
+            'pos_avversario': df_partite[f'pos_{lato_avversario}'].to_numpy(),
+            'tier_avversario': df_partite[f'tier_{lato_avversario}'].to_numpy(),
+        }
+        for nome_base, col_casa, col_trasferta in STATISTICHE_DA_ANALIZZARE:
+            col_fatti, col_subiti = (col_casa, col_trasferta) if lato == 'casa' else (col_trasferta, col_casa)
+            colonne[f'{nome_base}_fatti'] = pd.to_numeric(df_partite[col_fatti], errors='coerce').to_numpy(dtype=float)
+            colonne[f'{nome_base}_subiti'] = pd.to_numeric(df_partite[col_subiti], errors='coerce').to_numpy(dtype=float)
+        viste.append(pd.DataFrame(colonne))
+    return pd.concat(viste, ignore_index=True)
+
+def calcola_tensore_statistiche(df_storico_completo: pd.DataFrame, squadre: list, stagione_corrente: str,
+                                stagione_precedente, stat_campionato_generali: dict) -> dict:
+    """
+    Medie, conteggi e indici di forza di tutte le squadre in tutti i contesti con un'unica riduzione
+    raggruppata per campionato. Restituisce array densi:
+      'media'  squadra x contesto x statistica x ruolo(casa/trasferta) x (fatti/subiti)
+      'forza'  squadra x contesto x statistica x ruolo x (attacco/difesa)
+      'num'    squadra x contesto x ruolo
+    Le regole per contesto (finestra 19/38 per generale_recente, tier dell'avversario, rango simile)
+    sono le stesse del calcolo squadra per squadra.
+    """
+    vista = costruisci_vista_squadre(df_storico_completo)
+    indice_squadra = {nome: i for i, nome in enumerate(squadre)}
+    vista['codice'] = vista['squadra'].map(indice_squadra)
+    vista = vista[vista['codice'].notna()].reset_index(drop=True)
+    codice = vista['codice'].to_numpy(dtype=np.int64)
+    num_squadre, num_contesti, num_stat = len(squadre), len(CONTESTI_TENSORE), len(STATISTICHE_DA_ANALIZZARE)
+
+    # Finestra generale recente: ultime 38 della stagione corrente; sotto le 19 si completa
+    # con le ultime partite della stagione precedente
+    ordinata = vista.sort_values(by='data', kind='mergesort')
+    dalla_fine = ordinata.groupby(['codice', 'stagione_file'], sort=False).cumcount(ascending=False).reindex(vista.index).to_numpy()
+    in_corrente = (vista['stagione_file'] == stagione_corrente).to_numpy()
+    partite_correnti = np.bincount(codice[in_corrente], minlength=num_squadre)[codice]
+    maschera_generale = in_corrente & (dalla_fine < FINESTRA_MOBILE_PARTITE_GENERALE)
+    if stagione_precedente is not None:
+        in_precedente = (vista['stagione_file'] == stagione_precedente).to_numpy()
+        maschera_generale |= in_precedente & (partite_correnti < SOGLIA_PARTITE_STAGIONE_CORRENTE_GENERALE) & \
+                             (dalla_fine < FINESTRA_MOBILE_PARTITE_GENERALE - partite_correnti)
+
+    valide = vista['classifica_disponibile'].to_numpy()
+    tier_avversario = vista['tier_avversario'].to_numpy()
+    differenza_pos = np.abs(vista['pos_squadra'].to_numpy() - vista['pos_avversario'].to_numpy())
+    maschere = [
+        maschera_generale,
+        valide & (tier_avversario == "Top"),
+        valide & (tier_avversario == "Mid"),
+        valide & (tier_avversario == "Bottom"),
+        valide & (differenza_pos <= POSIZIONI_RANGO_SIMILE) & (differenza_pos != 0),
+    ]
+
+    # Un'unica riduzione: le righe di ogni contesto vengono concatenate con chiave (squadra, contesto, ruolo)
+    colonne_valori = [f'{nome_base}_{tipo}' for nome_base, _, _ in STATISTICHE_DA_ANALIZZARE for tipo in ('fatti', 'subiti')]
+    valori = vista[colonne_valori].to_numpy()
+    righe = np.concatenate([np.flatnonzero(m) for m in maschere])
+    contesto = np.concatenate([np.full(int(m.sum()), c) for c, m in enumerate(maschere)])
+    chiave = (codice[righe] * num_contesti + contesto) * 2 + vista['ruolo'].to_numpy()[righe]
+    num_gruppi = num_squadre * num_contesti * 2
+    valori_righe = valori[righe]
+    presenti = ~np.isnan(valori_righe)
+    somme = np.stack([np.bincount(chiave, weights=np.where(presenti[:, j], valori_righe[:, j], 0.0), minlength=num_gruppi)
+                      for j in range(valori.shape[1])], axis=1)
+    validi = np.stack([np.bincount(chiave, weights=presenti[:, j], minlength=num_gruppi)
+                       for j in range(valori.shape[1])], axis=1)
+    num = np.bincount(chiave, minlength=num_gruppi).reshape(num_squadre, num_contesti, 2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = somme / validi
+    media = media.reshape(num_squadre, num_contesti, 2, num_stat, 2).transpose(0, 1, 3, 2, 4)
+    media = np.where(num[:, :, None, :, None] == 0, 0.0, media) # Nessuna partita: media 0 come nel calcolo originale
+
+    # Indici di forza relativi alle medie generali del campionato
+    den_casa = np.array([stat_campionato_generali.get(f'media_{nome_base}_casa_campionato', 1.0) for nome_base, _, _ in STATISTICHE_DA_ANALIZZARE], dtype=float)
+    den_trasf = np.array([stat_campionato_generali.get(f'media_{nome_base}_trasferta_campionato', 1.0) for nome_base, _, _ in STATISTICHE_DA_ANALIZZARE], dtype=float)
+    # attacco casa / den casa, difesa casa / den trasferta, attacco trasferta / den trasferta, difesa trasferta / den casa
+    den = np.stack([np.stack([den_casa, den_trasf], axis=1), np.stack([den_trasf, den_casa], axis=1)], axis=1) # stat x ruolo x (att/dif)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        forza = np.where(den > 0.01, np.round(media / den, 3), 1.0)
+
+    return {'squadre': squadre, 'media': np.round(media, 2), 'forza': forza, 'num': num}
+
+def record_contesto_da_tensore(tensore: dict, i_squadra: int, i_contesto: int) -> dict:
+    """Colonne larghe di un contesto per una squadra, con gli stessi nomi e ordine del calcolo originale squadra per squadra."""
+    contesto = CONTESTI_TENSORE[i_contesto]
+    media, forza, num = tensore['media'][i_squadra, i_contesto], tensore['forza'][i_squadra, i_contesto], tensore['num'][i_squadra, i_contesto]
+    vuoto_casa, vuoto_trasferta = num[0] == 0, num[1] == 0
+    risultati = {}
+    for i_stat, (nome_base, _, _) in enumerate(STATISTICHE_DA_ANALIZZARE):
+        # Senza partite il calcolo originale restituisce lo 0 intero
+        risultati[f'media_{nome_base}_fatti_casa{contesto}'] = 0 if vuoto_casa else media[i_stat, 0, 0]
+        risultati[f'media_{nome_base}_subiti_casa{contesto}'] = 0 if vuoto_casa else media[i_stat, 0, 1]
+        risultati[f'media_{nome_base}_fatti_trasferta{contesto}'] = 0 if vuoto_trasferta else media[i_stat, 1, 0]
+        risultati[f'media_{nome_base}_subiti_trasferta{contesto}'] = 0 if vuoto_trasferta else media[i_stat, 1, 1]
+        risultati[f'num_partite_casa{contesto}'] = int(num[0])
+        risultati[f'num_partite_trasferta{contesto}'] = int(num[1])
+        risultati[f'forza_attacco_{nome_base}_casa{contesto}'] = forza[i_stat, 0, 0]
+        risultati[f'forza_difesa_{nome_base}_casa{contesto}'] = forza[i_stat, 0, 1]
+        risultati[f'forza_attacco_{nome_base}_trasferta{contesto}'] = forza[i_stat, 1, 0]
+        risultati[f'forza_difesa_{nome_base}_trasferta{contesto}'] = forza[i_stat, 1, 1]
+    return risultati
+
+def record_contesto_default(tier_nome: str) -> dict:
+    """Valori neutri per un contesto VS_* senza abbastanza partite (stesso ordine di chiavi di sempre)."""
+    record = {}
+    for nome_base, _, _ in STATISTICHE_DA_ANALIZZARE:
+        for tipo_val in ['media', 'forza_attacco', 'forza_difesa']:
+            for ruolo in ['fatti_casa', 'subiti_casa', 'fatti_trasferta', 'subiti_trasferta']:
+                if tipo_val == 'media':
+                    record[f'{tipo_val}_{nome_base}_{ruolo}_VS_{tier_nome}'] = 0.0
+                else: # Forza
+                    record[f'{tipo_val}_{nome_base}_{ruolo.split("_")[1]}_VS_{tier_nome}'] = 1.0 # Forza neutra
+        record[f'num_partite_casa_VS_{tier_nome}'] = 0
+        record[f'num_partite_trasferta_VS_{tier_nome}'] = 0
+    return record
+
+def record_squadre_da_tensore(tensore: dict, df_storico_completo: pd.DataFrame, stagione_corrente: str,
+                              df_classifica_corrente: pd.DataFrame, num_squadre_campionato_attuale: int) -> list:
+    """Genera i record larghi (una riga per squadra) dal tensore, più posizione attuale e forma."""
+    posizioni_correnti = df_classifica_corrente.drop_duplicates('Squadra').set_index('Squadra')['Pos'].to_dict() \
+                         if not df_classifica_corrente.empty else {}
+    df_corrente = df_storico_completo[df_storico_completo['stagione_file'] == stagione_corrente]
+    # Forma avanzata (ultime 7 partite della stagione corrente) per tutte le squadre insieme
+    forma_per_squadra = calcola_forma_campionato(df_corrente, df_classifica_corrente).to_dict()
+    lista_record_squadre = []
+    for i_squadra, squadra_analisi in enumerate(tensore['squadre']):
+        record_squadra = {'squadra': squadra_analisi}
+        record_squadra['posizione_classifica_attuale'] = int(posizioni_correnti.get(squadra_analisi, num_squadre_campionato_attuale // 2))
+
+        if tensore['num'][i_squadra, 0].sum() >= MIN_PARTITE_PER_STAT_COND:
+            record_squadra.update(record_contesto_da_tensore(tensore, i_squadra, 0))
+
+        record_squadra['forma_avanzata_totale'] = forma_per_squadra.get(squadra_analisi, 0.0)
+
+        for i_contesto in range(1, len(CONTESTI_TENSORE)):
+            if tensore['num'][i_squadra, i_contesto].sum() >= MIN_PARTITE_PER_STAT_COND:
+                record_squadra.update(record_contesto_da_tensore(tensore, i_squadra, i_contesto))
+            else:
+                record_squadra.update(record_contesto_default(CONTESTI_TENSORE[i_contesto].replace("_VS_", "")))
+        lista_record_squadre.append(record_squadra)
+    return lista_record_squadre
+
 # === FUNZIONE PRINCIPALE DI ELABORAZIONE V2 ===
-def elabora_statistiche_campionato_V2(nome_campionato_prefix: str):
-    print(f"--- Elaborazione V2 per: {nome_campionato_prefix} ---")
+def elabora_statistiche_campionato_V2(nome_campionato_prefix: str, salva_medie_campionato: bool = True, cache: CacheStagioni = None):
+    """
+    Tutte le letture dei CSV stagione passano da `cache` (se None se ne usa una locale alla chiamata).
+    salva_medie_campionato=False non scrive il JSON delle medie generali.
+    """
+    df_finale_campionato, stat_campionato_generali = calcola_statistiche_campionato_V2(nome_campionato_prefix, cache)
+    if salva_medie_campionato and stat_campionato_generali is not None:
+        salva_medie_campionato_V2(stat_campionato_generali, nome_campionato_prefix)
+    return df_finale_campionato
+
+def medie_campionato_serializzabili(stat_campionato_generali: dict) -> dict:
+    return {k: (float(v) if isinstance(v, (np.floating, np.integer, np.float64)) else v) for k, v in stat_campionato_generali.items()}
+
+def salva_medie_campionato_V2(stat_campionato_generali: dict, nome_campionato_prefix: str, cartella_output=CARTELLA_MEDIE_OUTPUT_V2) -> str:
+    nome_file_medie_campionato = f"{nome_campionato_prefix}_medie_campionato_V2.json" # Nuovo nome per V2
+    path_medie_campionato = os.path.join(cartella_output, nome_file_medie_campionato)
+    with open(path_medie_campionato, 'w', encoding='utf-8') as f:
+        json.dump(medie_campionato_serializzabili(stat_campionato_generali), f, ensure_ascii=False, indent=4)
+    print(f"✅ Salvate medie generali campionato V2: {nome_file_medie_campionato}")
+    return path_medie_campionato
+
+def carica_dati_campionato_V2(nome_campionato_prefix: str, cache: CacheStagioni = None, classifiche_storiche: dict = None,
+                              df_classifica_corrente: pd.DataFrame = None) -> dict:
+    """
+    Dati di ingresso delle statistiche V2 di un campionato: partite delle ultime stagioni con posizioni e tier,
+    classifiche, medie generali, squadre e stagioni corrente/precedente. None se mancano i dati delle partite.
+    classifiche_storiche ({stagione: classifica}) e df_classifica_corrente, se passate (pipeline in memoria),
+    sostituiscono la lettura di classifiche_storiche_csv e classifiche_csv.
+    """
+    cache = cache or CacheStagioni()
     
     # 1. Carica tutti i dati storici delle partite per questo campionato (ultime N stagioni)
     files_partite_storiche = sorted(glob.glob(os.path.join(CARTELLA_DATI_CSV, f"{nome_campionato_prefix}_*.csv")), reverse=True)
     if not files_partite_storiche:
         print(f"ERRORE: Nessun file CSV di partite trovato per {nome_campionato_prefix}")
-        return pd.DataFrame()
+        return None
 
     # Carichiamo un massimo di NUM_STAGIONI_PER_COND + 1 (quella attuale) stagioni storiche
     df_storico_completo_list = []
     for f_path in files_partite_storiche[:NUM_STAGIONI_STORICHE_PER_COND + 1]:
         try:
-            df_s = pd.read_csv(f_path)
-            df_s['data'] = pd.to_datetime(df_s['data'], errors='coerce')
+            df_s = cache.leggi(f_path) # Date già convertite; il DataFrame in cache non va modificato
             # Estrai stagione dal nome file per filtraggio corretto neopromosse
             nomefile = os.path.basename(f_path)
             stagione_file = nomefile.replace(f"{nome_campionato_prefix}_", "").replace(".csv","") #es 2324
-            df_s['stagione_file'] = stagione_file 
-            df_storico_completo_list.append(df_s)
+            df_storico_completo_list.append(df_s.assign(stagione_file=stagione_file))
         except Exception as e:
             print(f"Errore lettura file storico {f_path}: {e}")
     if not df_storico_completo_list:
         print(f"ERRORE: Nessun dato storico valido caricato per {nome_campionato_prefix}")
-        return pd.DataFrame()
+        return None
     df_storico_completo = pd.concat(df_storico_completo_list).sort_values(by='data', ascending=False).reset_index(drop=True)
 
     # 2. Carica tutte le classifiche finali storiche necessarie
-    classifiche_storiche_dict = {}
-    for f_path in glob.glob(os.path.join(CARTELLA_CLASSIFICHE_STORICHE, f"classifica_{nome_campionato_prefix}_*_finale.csv")):
-        try:
-            stagione_class = os.path.basename(f_path).split('_')[-2] # es. 2223 da classifica_serie_a_2223_finale.csv
-            df_c = pd.read_csv(f_path)
-            classifiche_storiche_dict[stagione_class] = df_c.set_index('Squadra')['Pos'].to_dict()
-            classifiche_storiche_dict[stagione_class + "_num_squadre"] = len(df_c)
-        except Exception as e:
-            print(f"Errore lettura classifica storica {f_path}: {e}")
+    classifiche_storiche_list = []
+    if classifiche_storiche is None:
+        classifiche_storiche = {}
+        for f_path in glob.glob(os.path.join(CARTELLA_CLASSIFICHE_STORICHE, f"classifica_{nome_campionato_prefix}_*_finale.csv")):
+            try:
+                stagione_class = os.path.basename(f_path).split('_')[-2] # es. 2223 da classifica_serie_a_2223_finale.csv
+                classifiche_storiche[stagione_class] = pd.read_csv(f_path)
+            except Exception as e:
+                print(f"Errore lettura classifica storica {f_path}: {e}")
+    for stagione_class, df_c in classifiche_storiche.items():
+        classifiche_storiche_list.append(df_c[['Squadra', 'Pos']].assign(stagione_file=stagione_class))
+    df_classifiche_storiche = pd.concat(classifiche_storiche_list, ignore_index=True) if classifiche_storiche_list else \
+                              pd.DataFrame(columns=['Squadra', 'Pos', 'stagione_file'])
+    # Posizione e tier di entrambe le squadre attaccati una volta sola a tutte le partite storiche
+    df_storico_completo = aggiungi_posizioni_storiche(df_storico_completo, df_classifiche_storiche)
 
     # 3. Carica la classifica corrente
-    df_classifica_corrente = pd.DataFrame()
-    path_classifica_corrente = os.path.join(CARTELLA_CLASSIFICHE_CORRENTI, f"classifica_{nome_campionato_prefix}_corrente.csv")
-    if os.path.exists(path_classifica_corrente):
-        df_classifica_corrente = pd.read_csv(path_classifica_corrente)
-    else:
-        print(f"ATTENZIONE: Classifica corrente non trovata: {path_classifica_corrente}")
+    if df_classifica_corrente is None:
+        df_classifica_corrente = pd.DataFrame()
+        path_classifica_corrente = os.path.join(CARTELLA_CLASSIFICHE_CORRENTI, f"classifica_{nome_campionato_prefix}_corrente.csv")
+        if os.path.exists(path_classifica_corrente):
+            df_classifica_corrente = pd.read_csv(path_classifica_corrente)
+        else:
+            print(f"ATTENZIONE: Classifica corrente non trovata: {path_classifica_corrente}")
     
     num_squadre_campionato_attuale = len(df_classifica_corrente) if not df_classifica_corrente.empty else 20 # Default
 
     # 4. Calcola le medie generali del campionato (usando le ultime 2 stagioni per stabilità)
-    df_ultime_due_stagioni = pd.concat([pd.read_csv(f) for f in files_partite_storiche[:2]] if len(files_partite_storiche) >=1 else [])
+    df_ultime_due_stagioni = pd.concat([cache.leggi(f) for f in files_partite_storiche[:2]] if len(files_partite_storiche) >=1 else [])
     stat_campionato_generali = {}
     if not df_ultime_due_stagioni.empty:
         for nome_base, col_casa, col_trasferta in STATISTICHE_DA_ANALIZZARE:
@@ -264,143 +489,533 @@ def elabora_statistiche_campionato_V2(nome_campionato_prefix: str):
              df_ultime_due_stagioni[col_trasferta] = pd.to_numeric(df_ultime_due_stagioni[col_trasferta], errors='coerce').fillna(0)
         stat_campionato_generali = calcola_statistiche_medie_campionato(df_ultime_due_stagioni) # Funzione definita in precedenza
     stat_campionato_generali['num_squadre_campionato'] = num_squadre_campionato_attuale
-    
-    # Salva le medie generali del campionato
-    nome_file_medie_campionato = f"{nome_campionato_prefix}_medie_campionato_V2.json" # Nuovo nome per V2
-    path_medie_campionato = os.path.join(CARTELLA_MEDIE_OUTPUT_V2, nome_file_medie_campionato)
-    stat_campionato_serializzabile = {k: (float(v) if isinstance(v, (np.floating, np.integer, np.float64)) else v) for k, v in stat_campionato_generali.items()}
-    with open(path_medie_campionato, 'w', encoding='utf-8') as f:
-        json.dump(stat_campionato_serializzabile, f, ensure_ascii=False, indent=4)
-    print(f"✅ Salvate medie generali campionato V2: {nome_file_medie_campionato}")
 
-    # 5. Estrai le squadre della stagione corrente
-    squadre_stagione_corrente = set(df_classifica_corrente['Squadra'].unique()) if not df_classifica_corrente.empty else \
-                                set(pd.unique(df_storico_completo[df_storico_completo['stagione_file'] == os.path.basename(files_partite_storiche[0]).replace(f"{nome_campionato_prefix}_", "").replace(".csv","")][['squadra_casa', 'squadra_trasferta']].values.ravel('K')))
+    # 5. Estrai le squadre della stagione corrente (ordinate: righe e colonne dell'output deterministiche)
+    squadre_stagione_corrente = sorted(df_classifica_corrente['Squadra'].unique()) if not df_classifica_corrente.empty else \
+                                sorted(sq for sq in pd.unique(df_storico_completo[df_storico_completo['stagione_file'] == os.path.basename(files_partite_storiche[0]).replace(f"{nome_campionato_prefix}_", "").replace(".csv","")][['squadra_casa', 'squadra_trasferta']].values.ravel('K')) if pd.notna(sq))
     
-    if not squadre_stagione_corrente:
+    stagione_corrente = os.path.basename(files_partite_storiche[0]).replace(f"{nome_campionato_prefix}_", "").replace(".csv","")
+    stagione_precedente = os.path.basename(files_partite_storiche[1]).replace(f"{nome_campionato_prefix}_", "").replace(".csv","") \
+                          if len(files_partite_storiche) > 1 else None
+    return {'files_partite_storiche': files_partite_storiche, 'df_storico_completo': df_storico_completo,
+            'df_classifica_corrente': df_classifica_corrente,
+            'num_squadre_campionato_attuale': num_squadre_campionato_attuale, 'stat_campionato_generali': stat_campionato_generali,
+            'squadre_stagione_corrente': squadre_stagione_corrente, 'stagione_corrente': stagione_corrente,
+            'stagione_precedente': stagione_precedente}
+
+def calcola_statistiche_campionato_V2(nome_campionato_prefix: str, cache: CacheStagioni = None,
+                                      classifiche_storiche: dict = None, df_classifica_corrente: pd.DataFrame = None):
+    """
+    Calcolo delle statistiche V2 senza scritture. Restituisce (DataFrame per squadra, medie generali del campionato);
+    le medie sono None se mancano i dati delle partite. Ingressi come carica_dati_campionato_V2.
+    """
+    print(f"--- Elaborazione V2 per: {nome_campionato_prefix} ---")
+    cache = cache or CacheStagioni()
+    dati = carica_dati_campionato_V2(nome_campionato_prefix, cache, classifiche_storiche, df_classifica_corrente)
+    if dati is None:
+        return pd.DataFrame(), None
+    if not dati['squadre_stagione_corrente']:
         print(f"Nessuna squadra trovata per la stagione corrente di {nome_campionato_prefix}. Salto.")
-        return pd.DataFrame()
+        return pd.DataFrame(), dati['stat_campionato_generali']
 
-    lista_record_squadre = []
-    for squadra_analisi in squadre_stagione_corrente:
-        print(f"  Elaboro squadra: {squadra_analisi}")
-        record_squadra = {'squadra': squadra_analisi}
-        
-        # Posizione attuale
-        if not df_classifica_corrente.empty:
-            riga_class_corr = df_classifica_corrente[df_classifica_corrente['Squadra'] == squadra_analisi]
-            record_squadra['posizione_classifica_attuale'] = int(riga_class_corr['Pos'].iloc[0]) if not riga_class_corr.empty else num_squadre_campionato_attuale // 2
-        else:
-            record_squadra['posizione_classifica_attuale'] = num_squadre_campionato_attuale // 2
-
-        # A. Statistiche Generali Recenti (19/38 partite, solo lega attuale)
-        df_corrente_squadra = df_storico_completo[
-            ((df_storico_completo['squadra_casa'] == squadra_analisi) | (df_storico_completo['squadra_trasferta'] == squadra_analisi)) &
-            (df_storico_completo['stagione_file'] == os.path.basename(files_partite_storiche[0]).replace(f"{nome_campionato_prefix}_", "").replace(".csv","")) # Solo stagione corrente
-        ].sort_values(by='data')
-        
-        df_precedente_squadra_stessa_lega = pd.DataFrame()
-        if len(files_partite_storiche) > 1:
-             # Cerco la squadra nella stagione precedente SOLO SE era nella stessa lega
-             # Questo richiede di sapere in che lega era la squadra l'anno prima, il che complica.
-             # Per ora, semplifichiamo: se era nel file della stagione precedente del *medesimo campionato*, la usiamo.
-            df_prec_temp = pd.read_csv(files_partite_storiche[1]) # Carica il file della stagione precedente
-            df_precedente_squadra_stessa_lega = df_prec_temp[
-                ((df_prec_temp['squadra_casa'] == squadra_analisi) | (df_prec_temp['squadra_trasferta'] == squadra_analisi))
-            ].sort_values(by='data')
-
-
-        df_analisi_generale = pd.DataFrame()
-        if len(df_corrente_squadra) >= SOGLIA_PARTITE_STAGIONE_CORRENTE_GENERALE:
-            df_analisi_generale = df_corrente_squadra.tail(FINESTRA_MOBILE_PARTITE_GENERALE) # Prendi fino a 38 partite se disponibili
-        else:
-            partite_da_prec = FINESTRA_MOBILE_PARTITE_GENERALE - len(df_corrente_squadra)
-            if partite_da_prec > 0 and not df_precedente_squadra_stessa_lega.empty:
-                df_analisi_generale = pd.concat([df_precedente_squadra_stessa_lega.tail(partite_da_prec), df_corrente_squadra])
-            else:
-                df_analisi_generale = df_corrente_squadra
-        
-        if len(df_analisi_generale) >= MIN_PARTITE_PER_STAT_COND: # Uso la stessa soglia minima
-            for nome_base, col_casa, col_trasferta in STATISTICHE_DA_ANALIZZARE:
-                record_squadra.update(calcola_medie_forza_da_df(df_analisi_generale, squadra_analisi, stat_campionato_generali, nome_base, col_casa, col_trasferta, "_generale_recente"))
-        
-        # Calcolo forma avanzata generale (sulle ultime 7 partite della stagione corrente)
-        df_corrente_squadra_per_forma = df_corrente_squadra.copy()
-        df_corrente_squadra_per_forma['squadra_in_analisi'] = squadra_analisi
-        record_squadra['forma_avanzata_totale'] = calcola_forma_avanzata(df_corrente_squadra_per_forma, df_classifica_corrente)
-
-
-        # B. Statistiche Condizionali vs Tier e C. vs Rango Simile
-        # Usiamo df_storico_completo (ultime N stagioni della stessa lega)
-        df_storico_squadra_stessa_lega = df_storico_completo[
-            (df_storico_completo['squadra_casa'] == squadra_analisi) | (df_storico_completo['squadra_trasferta'] == squadra_analisi)
-        ]
-
-        partite_vs_top, partite_vs_mid, partite_vs_bottom, partite_vs_simile = pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
-
-        for _, partita_storica in df_storico_squadra_stessa_lega.iterrows():
-            stagione_partita = partita_storica['stagione_file']
-            classifica_stagione_partita = classifiche_storiche_dict.get(stagione_partita)
-            num_squadre_stag_partita = classifiche_storiche_dict.get(stagione_partita + "_num_squadre", 20)
-
-            if not classifica_stagione_partita: continue # Salta se non abbiamo la classifica per quella stagione
-
-            squadra_casa_storica = partita_storica['squadra_casa']
-            squadra_trasf_storica = partita_storica['squadra_trasferta']
-            
-            avversario_storico = squadra_trasf_storica if squadra_casa_storica == squadra_analisi else squadra_casa_storica
-            pos_avversario_storico = classifica_stagione_partita.get(avversario_storico, num_squadre_stag_partita // 2)
-            tier_avversario = get_tier_squadra(pos_avversario_storico, num_squadre_stag_partita)
+    tensore = calcola_tensore_statistiche(dati['df_storico_completo'], dati['squadre_stagione_corrente'], dati['stagione_corrente'],
+                                          dati['stagione_precedente'], dati['stat_campionato_generali'])
+    lista_record_squadre = record_squadre_da_tensore(tensore, dati['df_storico_completo'], dati['stagione_corrente'],
+                                                     dati['df_classifica_corrente'], dati['num_squadre_campionato_attuale'])
 
-            partita_df_temp = pd.DataFrame([partita_storica]) # Per concat
+    df_finale_campionato = pd.DataFrame(lista_record_squadre)
+    return df_finale_campionato, dati['stat_campionato_generali']
 
-            if tier_avversario == "Top": partite_vs_top = pd.concat([partite_vs_top, partita_df_temp])
-            elif tier_avversario == "Mid": partite_vs_mid = pd.concat([partite_vs_mid, partita_df_temp])
-            elif tier_avversario == "Bottom": partite_vs_bottom = pd.concat([partite_vs_bottom, partita_df_temp])
-            
-            # Per Rango Simile
-            pos_squadra_analisi_storica = classifica_stagione_partita.get(squadra_analisi, num_squadre_stag_partita // 2)
-            if abs(pos_squadra_analisi_storica - pos_avversario_storico) <= POSIZIONI_RANGO_SIMILE and pos_squadra_analisi_storica != pos_avversario_storico:
-                partite_vs_simile = pd.concat([partite_vs_simile, partita_df_temp])
-
-        # Calcola e aggiungi stats condizionali se ci sono abbastanza partite
-        for tier_nome, df_tier_partite in [("Top", partite_vs_top), ("Mid", partite_vs_mid), ("Bottom", partite_vs_bottom), ("Simile", partite_vs_simile)]:
-            if len(df_tier_partite) >= MIN_PARTITE_PER_STAT_COND:
-                for nome_base, col_casa, col_trasferta in STATISTICHE_DA_ANALIZZARE:
-                    record_squadra.update(calcola_medie_forza_da_df(df_tier_partite, squadra_analisi, stat_campionato_generali, nome_base, col_casa, col_trasferta, f"_VS_{tier_nome}"))
-            else: # Popola con NaN o 0/1 per default se non ci sono abbastanza dati
-                 for nome_base, _, _ in STATISTICHE_DA_ANALIZZARE:
-                    for tipo_val in ['media', 'forza_attacco', 'forza_difesa']:
-                        for ruolo in ['fatti_casa', 'subiti_casa', 'fatti_trasferta', 'subiti_trasferta']:
-                            if tipo_val == 'media':
-                                record_squadra[f'{tipo_val}_{nome_base}_{ruolo}_VS_{tier_nome}'] = 0.0
-                            else: # Forza
-                                record_squadra[f'{tipo_val}_{nome_base}_{ruolo.split("_")[1]}_VS_{tier_nome}'] = 1.0 # Forza neutra
-                    record_squadra[f'num_partite_casa_VS_{tier_nome}'] = 0
-                    record_squadra[f'num_partite_trasferta_VS_{tier_nome}'] = 0
 
+def salva_store_statistiche_v2(df_statistiche: pd.DataFrame, percorso_file: str):
+    """
+    Salva le statistiche di un campionato in un .npz non compresso: una matrice colonne x squadre per tipo
+    ('valori_float32' per le colonne decimali, 'valori_int32' per quelle intere), l'indice delle squadre ('squadre')
+    e lo schema JSON ('schema': versione e, per ogni colonna, tipo e riga nella matrice del suo tipo).
+    Un lettore seleziona le righe delle colonne che gli servono senza fare il parsing di testo.
+    """
+    colonne_per_tipo, colonne_schema = {'float32': [], 'int32': []}, []
+    for colonna in df_statistiche.columns:
+        if colonna == 'squadra':
+            continue
+        tipo = 'int32' if pd.api.types.is_integer_dtype(df_statistiche[colonna]) else 'float32'
+        colonne_schema.append({'nome': colonna, 'tipo': tipo, 'riga': len(colonne_per_tipo[tipo])})
+        colonne_per_tipo[tipo].append(colonna)
+    schema = {'versione': VERSIONE_SCHEMA_STORE_V2, 'colonne': colonne_schema}
+    matrici = {f'valori_{tipo}': df_statistiche[colonne].to_numpy(dtype=tipo).T.reshape(len(colonne), len(df_statistiche))
+               for tipo, colonne in colonne_per_tipo.items()}
+    percorso_temp = percorso_file + ".tmp.npz"
+    np.savez(percorso_temp, squadre=df_statistiche['squadra'].to_numpy(dtype=str),
+             schema=np.array(json.dumps(schema)), **matrici)
+    os.replace(percorso_temp, percorso_file)
+
+def salva_statistiche_campionato(df_statistiche_v2: pd.DataFrame, nome_campionato: str, cartella_output=CARTELLA_MEDIE_OUTPUT_V2):
+    nome_file_output = f"{nome_campionato}_statistiche_avanzate_V2.csv"
+    df_statistiche_v2.to_csv(os.path.join(cartella_output, nome_file_output), index=False)
+    salva_store_statistiche_v2(df_statistiche_v2, os.path.join(cartella_output, f"{nome_campionato}_statistiche_avanzate_V2.npz"))
+    print(f"✅ File V2 salvati: {nome_file_output} (+ store .npz)")
+
+def elabora_e_salva_campionato(nome_campionato: str, cartella_output=CARTELLA_MEDIE_OUTPUT_V2) -> dict:
+    """
+    Lavoro di un singolo processo: statistiche V2 di un campionato, salvate in
+    *_statistiche_avanzate_V2.csv e nello store *_statistiche_avanzate_V2.npz (il JSON delle medie generali lo scrive elabora_statistiche_campionato_V2).
+    Ogni processo ha la sua cache: i campionati non condividono file stagione.
+    """
+    inizio = time.perf_counter()
+    cache = CacheStagioni()
+    df_statistiche_v2 = elabora_statistiche_campionato_V2(nome_campionato, cache=cache)
+    esito = "vuoto"
+    if not df_statistiche_v2.empty:
+        salva_statistiche_campionato(df_statistiche_v2, nome_campionato, cartella_output)
+        esito = "ok"
+    return {'campionato': nome_campionato, 'esito': esito, 'squadre': len(df_statistiche_v2),
+            'secondi': time.perf_counter() - inizio, 'letture': cache.letture, 'hit': cache.hit}
+
+def elabora_tutti_i_campionati(campionati, jobs=None, cartella_output=CARTELLA_MEDIE_OUTPUT_V2) -> list:
+    """
+    Un campionato per processo (jobs=1: tutto nel processo corrente). I file prodotti non dipendono
+    dall'ordine di completamento; il riepilogo dei tempi è stampato nell'ordine dei campionati.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    inizio = time.perf_counter()
+    if jobs == 1:
+        risultati = [elabora_e_salva_campionato(nome, cartella_output) for nome in campionati]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(elabora_e_salva_campionato, nome, cartella_output) for nome in campionati]
+            risultati = [future.result() for future in as_completed(futures)]
+    tempo_totale = time.perf_counter() - inizio
+
+    ordine = {nome: i for i, nome in enumerate(campionati)}
+    risultati.sort(key=lambda r: ordine[r['campionato']])
+    print(f"\n--- Tempi per campionato ({len(risultati)} campionati, {jobs} processi) ---")
+    for r in risultati:
+        print(f"⏱️  {r['campionato']}: {r['secondi']:.2f}s, {r['squadre']} squadre, esito {r['esito']} "
+              f"(cache: {r['letture']} file, {r['hit']} hit)")
+    print(f"⏱️  Totale: {tempo_totale:.2f}s reali, {sum(r['secondi'] for r in risultati):.2f}s sommati sui campionati")
+    return risultati
 
-        lista_record_squadre.append(record_squadra)
+# === STIMATORE DI FORZA CON DECADIMENTO ESPONENZIALE (STATO PERSISTENTE) ===
+# Per ogni squadra e ruolo (casa/trasferta) lo stato tiene, per ogni statistica, somme decadute di fatti e subiti
+# e il peso decaduto delle partite. Il decadimento è "pigro": si applica solo quando la squadra gioca (o quando
+# si legge), moltiplicando tutto per 0.5 ** (giorni trascorsi / emivita), quindi ogni nuova partita costa O(1).
+
+def _nuovo_accumulatore() -> dict:
+    num_stat = len(STATISTICHE_DA_ANALIZZARE)
+    return {'data_riferimento': None,
+            'casa': {'peso': [0.0] * num_stat, 'fatti': [0.0] * num_stat, 'subiti': [0.0] * num_stat},
+            'trasferta': {'peso': [0.0] * num_stat, 'fatti': [0.0] * num_stat, 'subiti': [0.0] * num_stat}}
+
+def _decadi_accumulatore(accumulatore: dict, data: str, emivita_giorni: float):
+    """Porta l'accumulatore alla data indicata (ISO), applicando il decadimento dal suo riferimento."""
+    if accumulatore['data_riferimento'] is not None:
+        giorni = (pd.Timestamp(data) - pd.Timestamp(accumulatore['data_riferimento'])).days
+        if giorni > 0:
+            fattore = 0.5 ** (giorni / emivita_giorni)
+            for ruolo in ('casa', 'trasferta'):
+                for chiave in ('peso', 'fatti', 'subiti'):
+                    accumulatore[ruolo][chiave] = [v * fattore for v in accumulatore[ruolo][chiave]]
+    if accumulatore['data_riferimento'] is None or data > accumulatore['data_riferimento']:
+        accumulatore['data_riferimento'] = data
+
+def _aggiungi_partita(accumulatore: dict, ruolo: str, fatti: list, subiti: list):
+    for i, (f, s) in enumerate(zip(fatti, subiti)):
+        if pd.isna(f) or pd.isna(s):
+            continue # Statistica mancante: non entra né nelle somme né nel peso
+        accumulatore[ruolo]['peso'][i] += 1.0
+        accumulatore[ruolo]['fatti'][i] += float(f)
+        accumulatore[ruolo]['subiti'][i] += float(s)
+
+def carica_stato_forza_esponenziale(percorso=FILE_STATO_FORZA_ESPONENZIALE, emivita_giorni=EMIVITA_GIORNI_FORZA) -> dict:
+    """Legge lo stato salvato; se manca, è illeggibile o ha un'altra emivita si riparte da zero."""
+    stato_vuoto = {'versione': 1, 'emivita_giorni': emivita_giorni, 'campionati': {}}
+    if not os.path.exists(percorso):
+        return stato_vuoto
+    try:
+        with open(percorso, 'r', encoding='utf-8') as f:
+            stato = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Stato forza esponenziale illeggibile ({e}): ricalcolo completo.")
+        return stato_vuoto
+    if stato.get('emivita_giorni') != emivita_giorni:
+        print(f"ℹ️  Emivita cambiata ({stato.get('emivita_giorni')} -> {emivita_giorni} giorni): ricalcolo completo.")
+        return stato_vuoto
+    return stato
+
+def salva_stato_forza_esponenziale(stato: dict, percorso=FILE_STATO_FORZA_ESPONENZIALE):
+    percorso_temp = percorso + ".tmp"
+    with open(percorso_temp, 'w', encoding='utf-8') as f:
+        json.dump(stato, f, ensure_ascii=False)
+    os.replace(percorso_temp, percorso) # Scrittura atomica
+
+def aggiorna_stato_campionato_esponenziale(stato: dict, nome_campionato: str, df_partite: pd.DataFrame) -> int:
+    """
+    Incorpora nello stato le partite non ancora viste (data successiva all'ultima elaborata, o stessa data
+    ma chiave nuova), in ordine di data. Restituisce quante partite sono state aggiunte.
+    """
+    emivita = stato['emivita_giorni']
+    stato_campionato = stato['campionati'].setdefault(nome_campionato, {
+        'ultima_data': None, 'chiavi_ultima_data': [], 'squadre': {}, 'campionato': _nuovo_accumulatore()})
+    ultima_data = stato_campionato['ultima_data']
+    chiavi_ultima_data = set(stato_campionato['chiavi_ultima_data'])
+
+    df = df_partite.dropna(subset=['data', 'squadra_casa', 'squadra_trasferta'])
+    date = pd.to_datetime(df['data'], errors='coerce').dt.strftime('%Y-%m-%d')
+    df = df.assign(_data=date).dropna(subset=['_data']).sort_values(by='_data', kind='mergesort')
+    chiavi = df['_data'] + "|" + df['squadra_casa'].astype(str) + "|" + df['squadra_trasferta'].astype(str)
+    if ultima_data is not None:
+        nuove = (df['_data'] > ultima_data) | ((df['_data'] == ultima_data) & ~chiavi.isin(chiavi_ultima_data))
+        df, chiavi = df[nuove], chiavi[nuove]
+
+    colonne_casa = [col_casa for _, col_casa, _ in STATISTICHE_DA_ANALIZZARE]
+    colonne_trasferta = [col_trasferta for _, _, col_trasferta in STATISTICHE_DA_ANALIZZARE]
+    valori_casa = df.reindex(columns=colonne_casa).apply(pd.to_numeric, errors='coerce').to_numpy()
+    valori_trasferta = df.reindex(columns=colonne_trasferta).apply(pd.to_numeric, errors='coerce').to_numpy()
+    squadre = stato_campionato['squadre']
+    for i, (data, casa, trasferta, chiave) in enumerate(zip(df['_data'], df['squadra_casa'], df['squadra_trasferta'], chiavi)):
+        acc_casa = squadre.setdefault(casa, _nuovo_accumulatore())
+        acc_trasferta = squadre.setdefault(trasferta, _nuovo_accumulatore())
+        acc_lega = stato_campionato['campionato']
+        for acc in (acc_casa, acc_trasferta, acc_lega):
+            _decadi_accumulatore(acc, data, emivita)
+        _aggiungi_partita(acc_casa, 'casa', valori_casa[i], valori_trasferta[i])
+        _aggiungi_partita(acc_trasferta, 'trasferta', valori_trasferta[i], valori_casa[i])
+        _aggiungi_partita(acc_lega, 'casa', valori_casa[i], valori_trasferta[i]) # medie di lega: casa vs trasferta
+
+        if data != stato_campionato['ultima_data']:
+            stato_campionato['ultima_data'], chiavi_ultima_data = data, set()
+        chiavi_ultima_data.add(chiave)
+    stato_campionato['chiavi_ultima_data'] = sorted(chiavi_ultima_data)
+    return len(df)
+
+def medie_forza_esponenziali(stato: dict, nome_campionato: str, squadre=None, data=None) -> pd.DataFrame:
+    """
+    Medie decadute fatti/subiti casa/trasferta e indici di forza (rispetto alle medie decadute di lega)
+    alla data indicata (default: ultima partita elaborata). Una riga per squadra.
+    """
+    stato_campionato = stato['campionati'].get(nome_campionato)
+    if not stato_campionato or stato_campionato['ultima_data'] is None:
+        return pd.DataFrame()
+    data = data or stato_campionato['ultima_data']
+    emivita = stato['emivita_giorni']
+    # Copie: la lettura non deve spostare il riferimento dello stato salvato
+    lega = json.loads(json.dumps(stato_campionato['campionato']))
+    _decadi_accumulatore(lega, data, emivita)
+    medie_lega_casa = [f / p if p > 0 else 1.0 for f, p in zip(lega['casa']['fatti'], lega['casa']['peso'])]
+    medie_lega_trasferta = [s / p if p > 0 else 1.0 for s, p in zip(lega['casa']['subiti'], lega['casa']['peso'])]
+
+    righe = []
+    for squadra in sorted(squadre if squadre is not None else stato_campionato['squadre']):
+        acc = stato_campionato['squadre'].get(squadra)
+        if acc is None:
+            continue
+        acc = json.loads(json.dumps(acc))
+        _decadi_accumulatore(acc, data, emivita)
+        riga = {'squadra': squadra, 'peso_casa_esp': round(max(acc['casa']['peso']), 3),
+                'peso_trasferta_esp': round(max(acc['trasferta']['peso']), 3)}
+        for i, (nome_base, _, _) in enumerate(STATISTICHE_DA_ANALIZZARE):
+            medie = {}
+            for ruolo in ('casa', 'trasferta'):
+                peso = acc[ruolo]['peso'][i]
+                medie[f'fatti_{ruolo}'] = acc[ruolo]['fatti'][i] / peso if peso > 0 else 0.0
+                medie[f'subiti_{ruolo}'] = acc[ruolo]['subiti'][i] / peso if peso > 0 else 0.0
+                riga[f'media_{nome_base}_fatti_{ruolo}_esp'] = round(medie[f'fatti_{ruolo}'], 2)
+                riga[f'media_{nome_base}_subiti_{ruolo}_esp'] = round(medie[f'subiti_{ruolo}'], 2)
+            den_casa, den_trasf = medie_lega_casa[i], medie_lega_trasferta[i]
+            riga[f'forza_attacco_{nome_base}_casa_esp'] = round(medie['fatti_casa'] / den_casa, 3) if den_casa > 0.01 else 1.0
+            riga[f'forza_difesa_{nome_base}_casa_esp'] = round(medie['subiti_casa'] / den_trasf, 3) if den_trasf > 0.01 else 1.0
+            riga[f'forza_attacco_{nome_base}_trasferta_esp'] = round(medie['fatti_trasferta'] / den_trasf, 3) if den_trasf > 0.01 else 1.0
+            riga[f'forza_difesa_{nome_base}_trasferta_esp'] = round(medie['subiti_trasferta'] / den_casa, 3) if den_casa > 0.01 else 1.0
+        righe.append(riga)
+    return pd.DataFrame(righe)
+
+def aggiorna_forza_esponenziale(campionati, cartella_output=CARTELLA_MEDIE_OUTPUT_V2, emivita_giorni=EMIVITA_GIORNI_FORZA,
+                                percorso_stato=FILE_STATO_FORZA_ESPONENZIALE, cache: CacheStagioni = None):
+    """
+    Aggiorna lo stato persistente e scrive {campionato}_forza_esponenziale_V2.csv per le squadre della stagione corrente.
+    Un campionato già presente nello stato legge la stagione corrente e quelle precedenti che finiscono dopo l'ultima
+    data elaborata (al cambio di stagione, le ultime giornate della vecchia); uno nuovo (o dopo un cambio di emivita)
+    viene costruito da tutte le stagioni disponibili, dalla più vecchia.
+    """
+    inizio = time.perf_counter()
+    stato = carica_stato_forza_esponenziale(percorso_stato, emivita_giorni)
+    cache = cache or CacheStagioni()
+    for nome_campionato in campionati:
+        files_stagioni = sorted(glob.glob(os.path.join(CARTELLA_DATI_CSV, f"{nome_campionato}_*.csv")))
+        if not files_stagioni:
+            continue
+        gia_presente = nome_campionato in stato['campionati']
+        da_leggere = files_stagioni
+        ultima_data = stato['campionati'][nome_campionato]['ultima_data'] if gia_presente else None
+        if ultima_data is not None:
+            # Dalla stagione più recente all'indietro, fino alla prima già elaborata per intero; le partite
+            # già viste vengono scartate da data e chiavi dell'ultima giornata
+            inizio_lettura = len(files_stagioni) - 1
+            while inizio_lettura > 0 and cache.leggi(files_stagioni[inizio_lettura - 1])['data'].max() >= pd.Timestamp(ultima_data):
+                inizio_lettura -= 1
+            da_leggere = files_stagioni[inizio_lettura:]
+        aggiunte = sum(aggiorna_stato_campionato_esponenziale(stato, nome_campionato, cache.leggi(f)) for f in da_leggere)
+        df_corrente = cache.leggi(files_stagioni[-1])
+        squadre_correnti = set(df_corrente['squadra_casa'].dropna()) | set(df_corrente['squadra_trasferta'].dropna())
+        df_forza = medie_forza_esponenziali(stato, nome_campionato, squadre_correnti)
+        if not df_forza.empty:
+            df_forza.to_csv(os.path.join(cartella_output, f"{nome_campionato}_forza_esponenziale_V2.csv"), index=False)
+        print(f"📈 Forza esponenziale {nome_campionato}: {aggiunte} nuove partite "
+              f"({'incrementale' if gia_presente else 'costruzione completa'}, {len(da_leggere)} file)")
+    salva_stato_forza_esponenziale(stato, percorso_stato)
+    print(f"⏱️  Forza esponenziale aggiornata in {time.perf_counter() - inizio:.2f}s (emivita {emivita_giorni} giorni)")
+    return stato
+
+# === FEATURE WALK-FORWARD (statistiche as-of per ogni partita storica) ===
+
+def aggiungi_posizioni_as_of(df_partite: pd.DataFrame, nome_campionato: str, cartella=CARTELLA_CLASSIFICHE_PROGRESSIVE) -> pd.DataFrame:
+    """
+    Come aggiungi_posizioni_storiche, ma con la classifica prima del giorno di ogni partita (classifiche progressive
+    di CREA_CLASSIFICA.py) invece di quella finale della stagione, quindi senza informazioni future.
+    Alla prima giornata, o senza il file progressivo della stagione, 'classifica_disponibile' è False
+    e le posizioni valgono num_squadre // 2.
+    """
+    df = df_partite.copy()
+    num_righe = len(df)
+    num_squadre = np.full(num_righe, 20)
+    disponibile = np.zeros(num_righe, dtype=bool)
+    posizioni = {lato: np.zeros(num_righe, dtype=int) for lato in ['casa', 'trasferta']}
+    giorni = df['data'].to_numpy().astype('datetime64[D]')
+    for stagione, righe in df.groupby('stagione_file', sort=False).indices.items():
+        percorso = os.path.join(cartella, f"progressiva_{nome_campionato}_{stagione}.npz")
+        if not os.path.exists(percorso):
+            print(f"ATTENZIONE: Classifiche progressive non trovate: {percorso}. Tier non disponibili per {stagione}.")
+            continue
+        with np.load(percorso) as progressive:
+            date, squadre, pos = progressive['date'], progressive['squadre'], progressive['pos']
+        indice_squadra = {nome: i for i, nome in enumerate(squadre)}
+        riga = np.searchsorted(date, giorni[righe], side='left') - 1 # Ultima giornata strettamente prima della partita
+        colonne = {lato: df[f'squadra_{lato}'].iloc[righe].map(indice_squadra).to_numpy(dtype=float) for lato in posizioni}
+        valide = (riga >= 0) & ~np.isnan(colonne['casa']) & ~np.isnan(colonne['trasferta'])
+        num_squadre[righe] = len(squadre)
+        disponibile[righe[valide]] = True
+        for lato in posizioni:
+            posizioni[lato][righe[valide]] = pos[riga[valide], colonne[lato][valide].astype(int)]
+    df['num_squadre_stagione'] = num_squadre
+    df['classifica_disponibile'] = disponibile
+    for lato in posizioni:
+        df[f'pos_{lato}'] = np.where(disponibile, posizioni[lato], num_squadre // 2)
+        df[f'tier_{lato}'] = get_tier_squadre_array(df[f'pos_{lato}'].to_numpy(), num_squadre)
+    return df
+
+def carica_partite_walk_forward(nome_campionato: str, cache: CacheStagioni = None) -> pd.DataFrame:
+    """Tutte le stagioni di un campionato in ordine di data, con 'indice_stagione' (0 = la più vecchia) e posizioni as-of."""
+    cache = cache or CacheStagioni()
+    stagioni = []
+    for f_path in sorted(glob.glob(os.path.join(CARTELLA_DATI_CSV, f"{nome_campionato}_*.csv"))):
+        stagione_file = os.path.basename(f_path)[len(nome_campionato) + 1:-len(".csv")]
+        if not (stagione_file.isdigit() and len(stagione_file) == 4):
+            continue # Evita che un prefisso catturi i file di un altro campionato
+        df_s = cache.leggi(f_path).dropna(subset=['data', 'squadra_casa', 'squadra_trasferta'])
+        if not df_s.empty:
+            stagioni.append(df_s.assign(stagione_file=stagione_file, indice_stagione=len(stagioni)))
+    if not stagioni:
+        return pd.DataFrame()
+    df = pd.concat(stagioni, ignore_index=True).sort_values(by='data', kind='mergesort').reset_index(drop=True)
+    return aggiungi_posizioni_as_of(df, nome_campionato)
 
-    df_finale_campionato = pd.DataFrame(lista_record_squadre)
-    return df_finale_campionato
+def _cumulate(valori: np.ndarray) -> np.ndarray:
+    """Somme cumulative lungo le righe con una riga di zeri in testa: la somma delle righe [i, j) è C[j] - C[i]."""
+    return np.concatenate([np.zeros((1,) + valori.shape[1:]), np.cumsum(valori, axis=0)])
 
+def _colonne_contesto_walk_forward(somme: np.ndarray, den_casa: np.ndarray, den_trasf: np.ndarray, contesto: str) -> dict:
+    """
+    Da somme per riga (ruolo x [valori, validi, partite]) alle colonne del modello per un contesto, con le regole
+    del tensore: media = somma / valori validi (0 senza partite), forza = media / media di campionato arrotondata a 3.
+    Sotto MIN_PARTITE_PER_STAT_COND il generale recente resta NaN (colonne assenti nel CSV) e i contesti VS_*
+    prendono i valori di record_contesto_default.
+    """
+    num_stat = len(STATISTICHE_DA_ANALIZZARE)
+    somme = somme.reshape(len(somme), 2, 4 * num_stat + 1)
+    num = somme[:, :, -1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = somme[:, :, :2 * num_stat] / somme[:, :, 2 * num_stat:4 * num_stat]
+    media = np.where(num[:, :, None] == 0, 0.0, media).reshape(len(somme), 2, num_stat, 2) # riga x ruolo x stat x fatti/subiti
+    sufficienti = num.sum(axis=1) >= MIN_PARTITE_PER_STAT_COND
+    generale = contesto == CONTESTI_TENSORE[0]
+
+    def forza(valori, den):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            valori = np.where(den > 0.01, np.round(valori / den, 3), 1.0)
+        return np.where(sufficienti, valori, np.nan if generale else 1.0)
+
+    colonne = {}
+    for lato, i_ruolo in [('casa', 0), ('trasferta', 1)]:
+        colonne[f'num_partite_{lato}{contesto}'] = np.where(sufficienti, num[:, i_ruolo], np.nan if generale else 0)
+    for i_stat, (nome_base, _, _) in enumerate(STATISTICHE_DA_ANALIZZARE):
+        colonne[f'forza_attacco_{nome_base}_casa{contesto}'] = forza(media[:, 0, i_stat, 0], den_casa[:, i_stat])
+        colonne[f'forza_difesa_{nome_base}_casa{contesto}'] = forza(media[:, 0, i_stat, 1], den_trasf[:, i_stat])
+        colonne[f'forza_attacco_{nome_base}_trasferta{contesto}'] = forza(media[:, 1, i_stat, 0], den_trasf[:, i_stat])
+        colonne[f'forza_difesa_{nome_base}_trasferta{contesto}'] = forza(media[:, 1, i_stat, 1], den_casa[:, i_stat])
+    return colonne
+
+def calcola_feature_walk_forward(nome_campionato: str, cache: CacheStagioni = None) -> pd.DataFrame:
+    """
+    Per ogni partita storica del campionato, le feature che il modello legge da medie_csv_V2 (indici di forza e
+    conteggi per generale recente e contesti VS_*, posizione, forma) come sarebbero state calcolate per ciascuna
+    squadra il giorno prima della partita. Le regole sono quelle del calcolo "attuale", spostate nel tempo:
+      - generale recente: ultime 38 partite della stagione prima della data, completate dalla stagione precedente sotto le 19;
+      - contesti VS_*: partite prima della data nelle ultime NUM_STAGIONI_STORICHE_PER_COND + 1 stagioni, con tier e
+        rango simile dalla classifica as-of al giorno di ciascuna partita (non da quella finale);
+      - medie di campionato: partite prima della data nella stagione corrente e nella precedente;
+      - forma: ultime 7 partite della stagione, difficoltà dalla posizione dell'avversario prima di ogni partita.
+    Tutto in un passaggio in ordine di data: somme cumulative per (squadra, stagione) o per squadra e, per ogni partita,
+    differenze tra due posizioni trovate con ricerca binaria. Nessun ricalcolo per data.
+    """
+    df = carica_partite_walk_forward(nome_campionato, cache)
+    if df.empty:
+        print(f"ERRORE: Nessun file CSV di partite trovato per {nome_campionato}")
+        return pd.DataFrame()
+    num_partite = len(df)
+    vista = costruisci_vista_squadre(df) # Righe 0..n-1 = squadra di casa, n..2n-1 = squadra in trasferta
+    stagione = np.tile(df['indice_stagione'].to_numpy(), 2)
+    giorno = vista['data'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    codice = pd.factorize(vista['squadra'])[0].astype(np.int64)
+    num_stagioni = int(stagione.max()) + 1
+    giorni_partite = giorno[:num_partite]
+    inizio_stagione = np.array([giorni_partite[df['indice_stagione'].to_numpy() == s].min() for s in range(num_stagioni)])
+    K = np.int64(1 << 24) # Più dei giorni possibili: chiave composta (gruppo, giorno) ordinabile
+
+    colonne_valori = [f'{nome_base}_{tipo}' for nome_base, _, _ in STATISTICHE_DA_ANALIZZARE for tipo in ('fatti', 'subiti')]
+    valori = vista[colonne_valori].to_numpy()
+    presenti = ~np.isnan(valori)
+    valori = np.where(presenti, valori, 0.0)
+    ruolo = vista['ruolo'].to_numpy()
+
+    def blocco(maschera):
+        # Per ruolo (casa, trasferta): valori, valori validi e numero di partite delle righe nella maschera
+        return np.concatenate([np.concatenate([valori * m[:, None], presenti * m[:, None], m[:, None]], axis=1)
+                               for m in (maschera & (ruolo == 0), maschera & (ruolo == 1))], axis=1).astype(float)
+
+    # Medie di campionato (denominatori degli indici di forza): stagione corrente prima della data + precedente
+    colonne_casa = [col_casa for _, col_casa, _ in STATISTICHE_DA_ANALIZZARE]
+    colonne_trasf = [col_trasferta for _, _, col_trasferta in STATISTICHE_DA_ANALIZZARE]
+    cumulate_campionato = _cumulate(df.reindex(columns=colonne_casa + colonne_trasf).apply(pd.to_numeric, errors='coerce').fillna(0).to_numpy(dtype=float))
+    fine = np.searchsorted(giorni_partite, giorni_partite, side='left')
+    inizio = np.searchsorted(giorni_partite, inizio_stagione[np.maximum(df['indice_stagione'].to_numpy() - 1, 0)], side='left')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        den = (cumulate_campionato[fine] - cumulate_campionato[inizio]) / (fine - inizio)[:, None]
+    den = np.where((fine == inizio)[:, None], 1.0, den) # Nessuna partita: default di calcola_statistiche_medie_campionato
+    den = np.tile(den, (2, 1))
+    den_casa, den_trasf = den[:, :len(colonne_casa)], den[:, len(colonne_casa):]
+
+    feature = {}
+    # Generale recente: sequenze (squadra, stagione) in ordine di data
+    gruppo = codice * num_stagioni + stagione
+    chiave = gruppo * K + giorno
+    ordine = np.argsort(chiave, kind='mergesort')
+    chiavi_ordinate = chiave[ordine]
+    cumulate = _cumulate(blocco(np.ones(len(vista), dtype=bool))[ordine])
+    fine = np.searchsorted(chiavi_ordinate, chiave, side='left')
+    inizio_corrente = np.searchsorted(chiavi_ordinate, gruppo * K, side='left')
+    partite_correnti = fine - inizio_corrente
+    somme = cumulate[fine] - cumulate[np.maximum(inizio_corrente, fine - FINESTRA_MOBILE_PARTITE_GENERALE)]
+    usa_precedente = (stagione > 0) & (partite_correnti < SOGLIA_PARTITE_STAGIONE_CORRENTE_GENERALE)
+    inizio_precedente = np.searchsorted(chiavi_ordinate, (gruppo - 1) * K, side='left') # Il gruppo precedente finisce dove inizia il corrente
+    inizio_precedente = np.where(usa_precedente, np.maximum(inizio_precedente, inizio_corrente - (FINESTRA_MOBILE_PARTITE_GENERALE - partite_correnti)), inizio_corrente)
+    somme += cumulate[inizio_corrente] - cumulate[inizio_precedente]
+    feature.update(_colonne_contesto_walk_forward(somme, den_casa, den_trasf, CONTESTI_TENSORE[0]))
+
+    # Contesti VS_*: sequenze per squadra in ordine di data, finestra dalle ultime NUM_STAGIONI_STORICHE_PER_COND stagioni
+    chiave = codice * K + giorno
+    ordine = np.argsort(chiave, kind='mergesort')
+    chiavi_ordinate = chiave[ordine]
+    fine = np.searchsorted(chiavi_ordinate, chiave, side='left')
+    inizio = np.searchsorted(chiavi_ordinate, codice * K + inizio_stagione[np.maximum(stagione - NUM_STAGIONI_STORICHE_PER_COND, 0)], side='left')
+    valide = vista['classifica_disponibile'].to_numpy()
+    tier_avversario = vista['tier_avversario'].to_numpy()
+    differenza_pos = np.abs(vista['pos_squadra'].to_numpy() - vista['pos_avversario'].to_numpy())
+    maschere = [
+        valide & (tier_avversario == "Top"),
+        valide & (tier_avversario == "Mid"),
+        valide & (tier_avversario == "Bottom"),
+        valide & (differenza_pos <= POSIZIONI_RANGO_SIMILE) & (differenza_pos != 0),
+    ]
+    for contesto, maschera in zip(CONTESTI_TENSORE[1:], maschere):
+        cumulate = _cumulate(blocco(maschera)[ordine])
+        feature.update(_colonne_contesto_walk_forward(cumulate[fine] - cumulate[inizio], den_casa, den_trasf, contesto))
+
+    feature['posizione_classifica_attuale'] = vista['pos_squadra'].to_numpy()
+    # Forma prima della partita, stagione per stagione come nel calcolo attuale
+    forma = pd.concat([calcola_forma_campionato(df_stagione, pd.DataFrame(), storico=True, difficolta_as_of=True).assign(stagione_file=stagione_file)
+                       for stagione_file, df_stagione in df.groupby('stagione_file', sort=False)], ignore_index=True)
+    forma = forma.drop_duplicates(subset=['stagione_file', 'squadra', 'data'])
+    feature['forma_avanzata_totale'] = vista[['stagione_file', 'squadra', 'data']].merge(
+        forma, on=['stagione_file', 'squadra', 'data'], how='left', validate='many_to_one')['forma_pre_partita'].fillna(0.0).to_numpy()
+
+    df_feature = pd.DataFrame(feature)
+    risultato = df[['data', 'stagione_file', 'squadra_casa', 'squadra_trasferta', 'gol_casa', 'gol_trasferta']].rename(columns={'stagione_file': 'stagione'})
+    risultato.insert(0, 'campionato', nome_campionato)
+    return pd.concat([risultato,
+                      df_feature.iloc[:num_partite].add_prefix('casa_').reset_index(drop=True),
+                      df_feature.iloc[num_partite:].add_prefix('trasferta_').reset_index(drop=True)], axis=1)
+
+def salva_feature_walk_forward(df_feature: pd.DataFrame, percorso_file=FILE_FEATURE_WALK_FORWARD) -> str:
+    """Scrive il file colonnare (parquet); senza un motore parquet installato ripiega su un CSV accanto."""
+    try:
+        df_feature.to_parquet(percorso_file, index=False)
+    except ImportError:
+        percorso_file = os.path.splitext(percorso_file)[0] + ".csv"
+        print(f"ATTENZIONE: Nessun motore parquet (pyarrow/fastparquet) installato. Salvo in {percorso_file}")
+        df_feature.to_csv(percorso_file, index=False)
+    return percorso_file
+
+def genera_feature_walk_forward(campionati, percorso_file=FILE_FEATURE_WALK_FORWARD) -> pd.DataFrame:
+    inizio = time.perf_counter()
+    cache = CacheStagioni()
+    parti = []
+    for nome_campionato in campionati:
+        inizio_campionato = time.perf_counter()
+        df_campionato = calcola_feature_walk_forward(nome_campionato, cache)
+        if not df_campionato.empty:
+            parti.append(df_campionato)
+            print(f"✅ Feature walk-forward {nome_campionato}: {len(df_campionato)} partite in {time.perf_counter() - inizio_campionato:.2f}s")
+    if not parti:
+        print("ERRORE: Nessuna feature walk-forward generata.")
+        return pd.DataFrame()
+    df_feature = pd.concat(parti, ignore_index=True)
+    percorso_file = salva_feature_walk_forward(df_feature, percorso_file)
+    print(f"✅ Salvate {len(df_feature)} partite x {df_feature.shape[1]} colonne in {percorso_file} "
+          f"({time.perf_counter() - inizio:.2f}s)")
+    print(cache.riepilogo())
+    return df_feature
+
+def benchmark_statistiche_v2(campionati) -> dict:
+    """Tempo del calcolo delle statistiche V2 (senza scritture) per campionato, con una cache condivisa."""
+    cache = CacheStagioni()
+    tempi = {}
+    for nome_campionato in campionati:
+        inizio = time.perf_counter()
+        calcola_statistiche_campionato_V2(nome_campionato, cache)
+        tempi[nome_campionato] = time.perf_counter() - inizio
+    for nome_campionato, secondi in tempi.items():
+        print(f"⏱️  {nome_campionato}: {secondi * 1000:.0f}ms")
+    print(f"⏱️  Totale: {sum(tempi.values()):.2f}s su {len(tempi)} campionati")
+    print(cache.riepilogo())
+    return tempi
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calcola le statistiche avanzate V2 per squadra e campionato")
+    parser.add_argument("--benchmark", action="store_true", help="Misura i tempi di calcolo delle statistiche V2 per campionato, senza salvare")
+    parser.add_argument("--jobs", type=int, default=None, help="Numero di processi paralleli, un campionato per processo (default: numero di core; 1 = nessun pool)")
+    parser.add_argument("--emivita", type=float, default=EMIVITA_GIORNI_FORZA, help="Emivita in giorni dello stimatore di forza esponenziale (se cambia, lo stato viene ricostruito)")
+    parser.add_argument("--walk-forward", action="store_true", help=f"Genera solo le feature as-of di ogni partita storica in {FILE_FEATURE_WALK_FORWARD} (medie_csv_V2 non viene toccata)")
+    args = parser.parse_args()
+    if args.walk_forward:
+        genera_feature_walk_forward(list(CAMPIONATI_NOMI_FILE.values()))
+        raise SystemExit(0)
+    if args.benchmark:
+        benchmark_statistiche_v2(list(CAMPIONATI_NOMI_FILE.values())); raise SystemExit(0)
+
     svuota_e_crea_cartella(CARTELLA_MEDIE_OUTPUT_V2)
 
-    for nome_file_campionato_attuale in CAMPIONATI_NOMI_FILE.values(): # Iteriamo sui prefissi dei file come "serie_a"
-        # Questo nome_file_campionato_attuale (es. "serie_a") sarà usato per cercare
-        # i file CSV (serie_a_2324.csv, serie_a_2223.csv ...) e le classifiche storiche.
-        df_statistiche_v2 = elabora_statistiche_campionato_V2(nome_file_campionato_attuale)
-        
-        if not df_statistiche_v2.empty:
-            # Riordina colonne per leggibilità se necessario
-            # ... (logica di ordinamento colonne, se vuoi) ...
-            
-            nome_file_output = f"{nome_file_campionato_attuale}_statistiche_avanzate_V2.csv"
-            percorso_file_output = os.path.join(CARTELLA_MEDIE_OUTPUT_V2, nome_file_output)
-            df_statistiche_v2.to_csv(percorso_file_output, index=False)
-            print(f"✅ File V2 salvato: {nome_file_output}")
-            
+    # Ogni campionato (es. "serie_a") usa i propri CSV (serie_a_2324.csv, ...) e le proprie classifiche storiche
+    elabora_tutti_i_campionati(list(CAMPIONATI_NOMI_FILE.values()), jobs=args.jobs)
+    aggiorna_forza_esponenziale(list(CAMPIONATI_NOMI_FILE.values()), emivita_giorni=args.emivita)
+
     git_push_medie_v2()
\ No newline at end of file
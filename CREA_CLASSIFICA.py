@@ -1,13 +1,19 @@
 import os
 import glob
+import time
+import argparse
 import pandas as pd
+import numpy as np
 import shutil
+import bisect
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # === CONFIGURAZIONE ===
 CARTELLA_DATI_CSV = "./dati_csv" # Da dove leggere i file delle partite scaricati
 CARTELLA_CLASSIFICHE_CORRENTI = "./classifiche_csv" # Dove salvare le classifiche "attuali" (ultima stagione disponibile)
 CARTELLA_CLASSIFICHE_STORICHE = "./classifiche_storiche_csv" # NUOVA: Dove salvare le classifiche finali storiche
+CARTELLA_CLASSIFICHE_PROGRESSIVE = "./classifiche_progressive" # Classifica dopo ogni giornata (un .npz per campionato-stagione)
 
 # CAMPIONATI è definito in CSV.py, ma qui ci serve per iterare sui nomi dei file.
 # Potremmo importarlo o ridefinire i nomi base se necessario.
@@ -26,7 +32,7 @@ def svuota_e_crea_cartella(path):
 def git_push_classifiche(commit_msg="Aggiornamento classifiche correnti e storiche"):
     """Aggiunge le cartelle delle classifiche, committa e pusha su Git."""
     try:
-        subprocess.run(["git", "add", CARTELLA_CLASSIFICHE_CORRENTI, CARTELLA_CLASSIFICHE_STORICHE], check=True)
+        subprocess.run(["git", "add", CARTELLA_CLASSIFICHE_CORRENTI, CARTELLA_CLASSIFICHE_STORICHE, CARTELLA_CLASSIFICHE_PROGRESSIVE], check=True)
         result = subprocess.run(["git", "diff", "--staged", "--quiet"])
         if result.returncode == 1:
             subprocess.run(["git", "commit", "-m", commit_msg], check=True)
@@ -42,22 +48,73 @@ def git_push_classifiche(commit_msg="Aggiornamento classifiche correnti e storic
 
 # === LOGICA PRINCIPALE PER LA CLASSIFICA (MODIFICATA) ===
 
-def calcola_e_salva_classifica_da_file(percorso_file_csv: str, cartella_output: str, nome_file_output: str):
+COLONNE_CLASSIFICA = ['Pos', 'Squadra', 'Punti', 'Giocate', 'Vinte', 'Nulle', 'Perse', 'GF', 'GS', 'DR']
+
+def _ordina_e_formatta_classifica(df_classifica: pd.DataFrame) -> pd.DataFrame:
+    df_classifica['Squadra'] = df_classifica.index
+    df_classifica['DR'] = df_classifica['GF'] - df_classifica['GS']
+    df_classifica.sort_values(by=['Punti', 'DR', 'GF'], ascending=[False, False, False], inplace=True)
+    df_classifica.insert(0, 'Pos', range(1, len(df_classifica) + 1))
+    return df_classifica[COLONNE_CLASSIFICA]
+
+def calcola_classifica(df_stagione: pd.DataFrame) -> pd.DataFrame:
     """
-    Calcola la classifica da un singolo file CSV di una stagione e la salva.
+    Classifica di una stagione in forma colonnare: ogni partita diventa due righe
+    (vista casa e vista trasferta) e le statistiche si ottengono con riduzioni per squadra (bincount).
+    A parità di Punti, DR e GF l'ordine resta quello di prima apparizione delle squadre,
+    come nella versione iterativa.
     """
+    squadre = pd.unique(df_stagione[['squadra_casa', 'squadra_trasferta']].values.ravel('K'))
+    squadre = [s for s in squadre if pd.notna(s)] # Rimuovi eventuali NaN se presenti nei nomi squadra
+
+    partite = df_stagione.dropna(subset=['squadra_casa', 'squadra_trasferta']) # Salta righe con squadre mancanti
+    gol_casa = partite['gol_casa'].to_numpy()
+    gol_trasferta = partite['gol_trasferta'].to_numpy()
+    gf = np.concatenate([gol_casa, gol_trasferta])
+    gs = np.concatenate([gol_trasferta, gol_casa])
+    codici, nomi = pd.factorize(np.concatenate([partite['squadra_casa'].to_numpy(), partite['squadra_trasferta'].to_numpy()]))
+
+    # Riduzioni raggruppate per squadra sulla vista impilata casa+trasferta
+    def somma_per_squadra(valori):
+        return np.bincount(codici, weights=valori, minlength=len(nomi)).astype(int)
+    vinte = somma_per_squadra(gf > gs)
+    nulle = somma_per_squadra(gf == gs)
+    df_classifica = pd.DataFrame({
+        'Punti': 3 * vinte + nulle,
+        'Giocate': np.bincount(codici, minlength=len(nomi)),
+        'Vinte': vinte,
+        'Nulle': nulle,
+        'Perse': somma_per_squadra(gf < gs),
+        'GF': somma_per_squadra(gf),
+        'GS': somma_per_squadra(gs),
+    }, index=pd.Index(nomi)).reindex(squadre, fill_value=0)
+    return _ordina_e_formatta_classifica(df_classifica)
+
+def leggi_stagione_per_classifica(percorso_file_csv: str):
+    """Legge e valida il CSV di una stagione; None se il file non è utilizzabile."""
     try:
         df_stagione = pd.read_csv(percorso_file_csv)
+    except Exception as e:
+        print(f"ERRORE: Impossibile leggere o processare il file {percorso_file_csv}: {e}. Salto.")
+        return None
+    return prepara_stagione_per_classifica(df_stagione, percorso_file_csv)
+
+def prepara_stagione_per_classifica(df_stagione: pd.DataFrame, percorso_file_csv: str):
+    """
+    Valida un DataFrame di stagione già letto (anche passato in memoria dalla pipeline) e converte i gol in interi,
+    sul posto. None se non è utilizzabile; `percorso_file_csv` serve solo per i messaggi.
+    """
+    try:
         if df_stagione.empty:
             print(f"⚠️ File CSV vuoto: {percorso_file_csv}. Salto.")
-            return
+            return None
             
         # Assicurati che le colonne necessarie esistano e siano del tipo corretto
         colonne_richieste = ['squadra_casa', 'squadra_trasferta', 'gol_casa', 'gol_trasferta']
         for col in colonne_richieste:
             if col not in df_stagione.columns:
                 print(f"ERRORE: Colonna '{col}' mancante in {percorso_file_csv}. Salto.")
-                return
+                return None
         
         # Conversione sicura a numerico, gestendo eventuali stringhe vuote o non numeriche
         for col in ['gol_casa', 'gol_trasferta']:
@@ -65,106 +122,292 @@ def calcola_e_salva_classifica_da_file(percorso_file_csv: str, cartella_output:
 
     except Exception as e:
         print(f"ERRORE: Impossibile leggere o processare il file {percorso_file_csv}: {e}. Salto.")
-        return
-
-    squadre = pd.unique(df_stagione[['squadra_casa', 'squadra_trasferta']].values.ravel('K'))
-    squadre = [s for s in squadre if pd.notna(s)] # Rimuovi eventuali NaN se presenti nei nomi squadra
-
-    classifica = {squadra: {
-        'Punti': 0, 'Giocate': 0, 'Vinte': 0, 'Nulle': 0, 'Perse': 0,
-        'GF': 0, 'GS': 0, 'DR': 0
-    } for squadra in squadre}
-
-    for _, partita in df_stagione.iterrows():
-        casa = partita['squadra_casa']
-        trasferta = partita['squadra_trasferta']
-        gol_casa = partita['gol_casa']
-        gol_trasferta = partita['gol_trasferta']
+        return None
+    return df_stagione
 
-        if pd.isna(casa) or pd.isna(trasferta): # Salta righe con squadre mancanti
-            continue
+def calcola_e_salva_classifica_da_file(percorso_file_csv: str, cartella_output: str, nome_file_output: str):
+    """
+    Calcola la classifica da un singolo file CSV di una stagione e la salva.
+    Restituisce la classifica calcolata (None se il file non è utilizzabile).
+    """
+    df_stagione = leggi_stagione_per_classifica(percorso_file_csv)
+    if df_stagione is None:
+        return None
 
-        classifica[casa]['Giocate'] += 1
-        classifica[trasferta]['Giocate'] += 1
-        classifica[casa]['GF'] += gol_casa
-        classifica[trasferta]['GF'] += gol_trasferta
-        classifica[casa]['GS'] += gol_trasferta
-        classifica[trasferta]['GS'] += gol_casa
-
-        if gol_casa > gol_trasferta:
-            classifica[casa]['Punti'] += 3
-            classifica[casa]['Vinte'] += 1
-            classifica[trasferta]['Perse'] += 1
-        elif gol_trasferta > gol_casa:
-            classifica[trasferta]['Punti'] += 3
-            classifica[trasferta]['Vinte'] += 1
-            classifica[casa]['Perse'] += 1
-        else: # Pareggio (anche 0-0)
-            classifica[casa]['Punti'] += 1
-            classifica[trasferta]['Punti'] += 1
-            classifica[casa]['Nulle'] += 1
-            classifica[trasferta]['Nulle'] += 1
-            
-    df_classifica = pd.DataFrame.from_dict(classifica, orient='index')
+    df_classifica = calcola_classifica(df_stagione)
     if df_classifica.empty:
         print(f"⚠️  Classifica vuota generata per {percorso_file_csv}. Salto salvataggio.")
-        return
-        
-    df_classifica['Squadra'] = df_classifica.index
-    df_classifica['DR'] = df_classifica['GF'] - df_classifica['GS']
-    df_classifica.sort_values(by=['Punti', 'DR', 'GF'], ascending=[False, False, False], inplace=True)
-    df_classifica.insert(0, 'Pos', range(1, len(df_classifica) + 1))
-    df_classifica = df_classifica[['Pos', 'Squadra', 'Punti', 'Giocate', 'Vinte', 'Nulle', 'Perse', 'GF', 'GS', 'DR']]
-    
+        return None
+    salva_classifica(df_classifica, cartella_output, nome_file_output)
+    return df_classifica
+
+def salva_classifica(df_classifica: pd.DataFrame, cartella_output: str, nome_file_output: str):
     os.makedirs(cartella_output, exist_ok=True) # Assicura che la cartella esista
     percorso_salvataggio = os.path.join(cartella_output, nome_file_output)
     df_classifica.to_csv(percorso_salvataggio, index=False)
     print(f"✅ Classifica salvata: {percorso_salvataggio}")
 
+# === CLASSIFICHE PROGRESSIVE (classifica dopo ogni giornata) ===
 
-if __name__ == "__main__":
-    svuota_e_crea_cartella(CARTELLA_CLASSIFICHE_CORRENTI)
-    svuota_e_crea_cartella(CARTELLA_CLASSIFICHE_STORICHE)
+def calcola_classifiche_progressive(df_stagione: pd.DataFrame) -> dict:
+    """
+    In un'unica passata cumulativa calcola la classifica dopo ogni data di gioco della stagione.
+    Restituisce array compatti: 'date' (datetime64[D], crescenti), 'squadre' (ordine di prima apparizione)
+    e le matrici data x squadra 'pos', 'punti', 'dr', 'gf', 'giocate' (int16).
+    Ordinamento e spareggi sono gli stessi di calcola_classifica, quindi l'ultima riga coincide con la classifica finale.
+    """
+    squadre = pd.unique(df_stagione[['squadra_casa', 'squadra_trasferta']].values.ravel('K'))
+    squadre = np.array([s for s in squadre if pd.notna(s)], dtype=str)
 
-    # Trova tutti i file CSV nella cartella dei dati grezzi
-    tutti_i_file_csv_stagionali = glob.glob(os.path.join(CARTELLA_DATI_CSV, "*.csv"))
+    partite = df_stagione.dropna(subset=['squadra_casa', 'squadra_trasferta'])
+    date_partite = pd.to_datetime(partite['data'], errors='coerce').to_numpy().astype('datetime64[D]')
+    validi = ~np.isnat(date_partite)
+    partite, date_partite = partite[validi], date_partite[validi]
 
-    campionati_elaborati = {} # Per tenere traccia dell'ultima stagione per la classifica "corrente"
+    date, indice_data = np.unique(date_partite, return_inverse=True)
+    indice_squadra = {nome: i for i, nome in enumerate(squadre)}
+    cod_casa = partite['squadra_casa'].map(indice_squadra).to_numpy()
+    cod_trasferta = partite['squadra_trasferta'].map(indice_squadra).to_numpy()
+    gol_casa = partite['gol_casa'].to_numpy()
+    gol_trasferta = partite['gol_trasferta'].to_numpy()
+    punti_casa = np.where(gol_casa > gol_trasferta, 3, np.where(gol_casa == gol_trasferta, 1, 0))
+    punti_trasferta = np.where(gol_trasferta > gol_casa, 3, np.where(gol_casa == gol_trasferta, 1, 0))
 
-    for percorso_file_csv in tutti_i_file_csv_stagionali:
-        nome_file_con_estensione = os.path.basename(percorso_file_csv)
-        nome_file_senza_estensione = os.path.splitext(nome_file_con_estensione)[0]
-        
-        # Estrai nome base campionato e stagione dal nome file
-        # Es. "serie_a_2324" -> nome_base = "serie_a", stagione_str = "2324"
-        parti_nome_file = nome_file_senza_estensione.split('_')
-        if len(parti_nome_file) < 2:
-            print(f"⚠️ Nome file non standard, impossibile estrarre stagione: {nome_file_con_estensione}. Salto.")
-            continue
-        
-        stagione_str = parti_nome_file[-1] # Ultima parte è la stagione
-        nome_base_campionato = "_".join(parti_nome_file[:-1]) # Tutto il resto è il nome base
+    # Incrementi per (data, squadra) sulla vista impilata casa+trasferta, poi somma cumulativa lungo le date
+    righe = np.concatenate([indice_data, indice_data])
+    colonne = np.concatenate([cod_casa, cod_trasferta])
+    forma = (len(date), len(squadre))
+    def cumulata(valori):
+        incrementi = np.zeros(forma, dtype=np.int32)
+        np.add.at(incrementi, (righe, colonne), valori)
+        return np.cumsum(incrementi, axis=0)
+    punti = cumulata(np.concatenate([punti_casa, punti_trasferta]))
+    gf = cumulata(np.concatenate([gol_casa, gol_trasferta]))
+    gs = cumulata(np.concatenate([gol_trasferta, gol_casa]))
+    giocate = cumulata(np.ones(len(righe), dtype=np.int32))
+    dr = gf - gs
+
+    # Posizioni: ordinamento per Punti, DR, GF decrescenti; a parità vale l'ordine di prima apparizione
+    pos = np.empty(forma, dtype=np.int16)
+    ordine_apparizione = np.arange(len(squadre))
+    for r in range(len(date)):
+        ordine = np.lexsort((ordine_apparizione, -gf[r], -dr[r], -punti[r]))
+        pos[r, ordine] = np.arange(1, len(squadre) + 1)
+
+    return {
+        'date': date, 'squadre': squadre, 'pos': pos,
+        'punti': punti.astype(np.int16), 'dr': dr.astype(np.int16),
+        'gf': gf.astype(np.int16), 'giocate': giocate.astype(np.int16),
+    }
+
+def salva_classifiche_progressive(df_stagione: pd.DataFrame, cartella_output: str, nome_file_output: str):
+    """Calcola le classifiche progressive di una stagione e le salva in un .npz compresso."""
+    scrivi_classifiche_progressive(calcola_classifiche_progressive(df_stagione), cartella_output, nome_file_output)
 
-        # Controlla se la stagione_str è numerica e di lunghezza 4 (es. 2324)
+def scrivi_classifiche_progressive(progressive: dict, cartella_output: str, nome_file_output: str):
+    if len(progressive['date']) == 0:
+        print(f"⚠️  Nessuna data valida per le classifiche progressive di {nome_file_output}. Salto.")
+        return
+    os.makedirs(cartella_output, exist_ok=True)
+    percorso_salvataggio = os.path.join(cartella_output, nome_file_output)
+    np.savez_compressed(percorso_salvataggio, **progressive)
+    print(f"✅ Classifiche progressive salvate: {percorso_salvataggio} ({len(progressive['date'])} giornate)")
+
+_CACHE_PROGRESSIVE = {} # (campionato, cartella) -> (firma dei file, stagioni ordinate per data di inizio, date di inizio)
+
+def _carica_progressive_campionato(campionato: str, cartella=CARTELLA_CLASSIFICHE_PROGRESSIVE):
+    """
+    Stagioni del campionato ordinate per data di inizio e le loro date di inizio (per la ricerca binaria).
+    Restano in cache finché percorso, mtime e dimensione dei file .npz non cambiano.
+    """
+    file_stagioni = []
+    for percorso in sorted(glob.glob(os.path.join(cartella, f"progressiva_{campionato}_*.npz"))):
+        stagione_str = os.path.splitext(os.path.basename(percorso))[0][len(f"progressiva_{campionato}_"):]
         if not (stagione_str.isdigit() and len(stagione_str) == 4):
-            print(f"⚠️ Formato stagione non riconosciuto in {nome_file_con_estensione}. Salto.")
+            continue # Evita che "serie_a" catturi anche i file di "serie_a_xxx"
+        try:
+            st = os.stat(percorso)
+        except OSError:
             continue
+        file_stagioni.append((percorso, stagione_str, st.st_mtime_ns, st.st_size))
+    firma = tuple((percorso, mtime, dimensione) for percorso, _, mtime, dimensione in file_stagioni)
+    chiave = (campionato, cartella)
+    aperto = _CACHE_PROGRESSIVE.get(chiave)
+    if aperto is None or aperto[0] != firma:
+        stagioni = []
+        for percorso, stagione_str, _, _ in file_stagioni:
+            with np.load(percorso) as dati:
+                stagione = {k: dati[k] for k in dati.files}
+            stagione['stagione'] = stagione_str
+            stagione['indice_squadra'] = {nome: i for i, nome in enumerate(stagione['squadre'])}
+            stagioni.append(stagione)
+        stagioni.sort(key=lambda st: st['date'][0])
+        aperto = (firma, stagioni, [st['date'][0] for st in stagioni])
+        _CACHE_PROGRESSIVE[chiave] = aperto
+    return aperto[1], aperto[2]
+
+def stato_squadra_as_of(campionato: str, squadra: str, data, cartella=CARTELLA_CLASSIFICHE_PROGRESSIVE):
+    """
+    Situazione in classifica di una squadra prima delle partite del giorno `data` (esclusa, quindi senza
+    informazioni future): dict con Pos, Punti, DR, GF, Giocate e Stagione, oppure None se la squadra
+    non ha ancora una classifica in quella stagione. Ricerca binaria sulle date: O(log n).
+    """
+    data = np.datetime64(pd.Timestamp(data).date(), 'D')
+    stagioni, inizi_stagione = _carica_progressive_campionato(campionato, cartella)
+    i_stagione = bisect.bisect_right(inizi_stagione, data) - 1
+    if i_stagione < 0:
+        return None
+    stagione = stagioni[i_stagione]
+    riga = int(np.searchsorted(stagione['date'], data, side='left')) - 1
+    colonna = stagione['indice_squadra'].get(squadra)
+    if riga < 0 or colonna is None:
+        return None # Prima giornata della stagione o squadra non presente
+    return {
+        'Stagione': stagione['stagione'],
+        'Pos': int(stagione['pos'][riga, colonna]),
+        'Punti': int(stagione['punti'][riga, colonna]),
+        'DR': int(stagione['dr'][riga, colonna]),
+        'GF': int(stagione['gf'][riga, colonna]),
+        'Giocate': int(stagione['giocate'][riga, colonna]),
+    }
+
+def position_as_of(campionato: str, squadra: str, data, cartella=CARTELLA_CLASSIFICHE_PROGRESSIVE):
+    """Posizione in classifica di `squadra` prima della data indicata (None se non disponibile)."""
+    stato = stato_squadra_as_of(campionato, squadra, data, cartella)
+    return stato['Pos'] if stato else None
+
+def benchmark_classifiche(cartella_dati=CARTELLA_DATI_CSV):
+    """Misura il tempo di calcolo di classifiche finali e progressive su tutti i file della cartella, senza salvare."""
+    tempo_classifiche, tempo_progressive, stagioni = 0.0, 0.0, 0
+    for percorso_file_csv in sorted(glob.glob(os.path.join(cartella_dati, "*.csv"))):
+        df_stagione = leggi_stagione_per_classifica(percorso_file_csv)
+        if df_stagione is None:
+            continue
+        stagioni += 1
+        inizio = time.perf_counter()
+        calcola_classifica(df_stagione)
+        tempo_classifiche += time.perf_counter() - inizio
+        inizio = time.perf_counter()
+        calcola_classifiche_progressive(df_stagione)
+        tempo_progressive += time.perf_counter() - inizio
+    print(f"⏱️  {stagioni} stagioni: classifiche finali {tempo_classifiche:.3f}s "
+          f"({tempo_classifiche / max(stagioni, 1) * 1000:.2f}ms per stagione), progressive {tempo_progressive:.3f}s "
+          f"({tempo_progressive / max(stagioni, 1) * 1000:.2f}ms per stagione)")
+
+
+# === DRIVER PARALLELO (un processo per file campionato-stagione) ===
+
+def analizza_nome_file_stagione(percorso_file_csv: str):
+    """
+    Estrae nome base campionato e stagione dal nome file.
+    Es. "serie_a_2324.csv" -> ("serie_a", "2324"); None se il nome non è standard.
+    """
+    nome_file_con_estensione = os.path.basename(percorso_file_csv)
+    parti_nome_file = os.path.splitext(nome_file_con_estensione)[0].split('_')
+    if len(parti_nome_file) < 2:
+        print(f"⚠️ Nome file non standard, impossibile estrarre stagione: {nome_file_con_estensione}. Salto.")
+        return None
+
+    stagione_str = parti_nome_file[-1] # Ultima parte è la stagione
+    nome_base_campionato = "_".join(parti_nome_file[:-1]) # Tutto il resto è il nome base
+
+    # Controlla se la stagione_str è numerica e di lunghezza 4 (es. 2324)
+    if not (stagione_str.isdigit() and len(stagione_str) == 4):
+        print(f"⚠️ Formato stagione non riconosciuto in {nome_file_con_estensione}. Salto.")
+        return None
+    return nome_base_campionato, stagione_str
+
+def elabora_file_stagione(percorso_file_csv: str, nome_base_campionato: str, stagione_str: str,
+                          cartella_storiche=CARTELLA_CLASSIFICHE_STORICHE,
+                          cartella_progressive=CARTELLA_CLASSIFICHE_PROGRESSIVE) -> dict:
+    """
+    Lavoro di un singolo processo: legge il file una volta sola, calcola e salva classifica finale
+    e classifiche progressive. Restituisce la classifica (riusata dal chiamante per quella corrente) e i tempi.
+    """
+    tempi = {}
+    inizio = time.perf_counter()
+    df_stagione = leggi_stagione_per_classifica(percorso_file_csv)
+    tempi['lettura'] = time.perf_counter() - inizio
+    risultato = {'file': os.path.basename(percorso_file_csv), 'campionato': nome_base_campionato,
+                 'stagione': stagione_str, 'classifica': None, 'tempi': tempi}
+    if df_stagione is None:
+        return risultato
+
+    inizio = time.perf_counter()
+    df_classifica = calcola_classifica(df_stagione)
+    tempi['classifica'] = time.perf_counter() - inizio
+    if df_classifica.empty:
+        print(f"⚠️  Classifica vuota generata per {percorso_file_csv}. Salto salvataggio.")
+        return risultato
+    inizio = time.perf_counter()
+    salva_classifica(df_classifica, cartella_storiche, f"classifica_{nome_base_campionato}_{stagione_str}_finale.csv")
+    tempi['salvataggio'] = time.perf_counter() - inizio
+
+    # Classifiche progressive (dopo ogni giornata) per le ricerche "as of"
+    inizio = time.perf_counter()
+    salva_classifiche_progressive(df_stagione, cartella_progressive, f"progressiva_{nome_base_campionato}_{stagione_str}.npz")
+    tempi['progressive'] = time.perf_counter() - inizio
+    risultato['classifica'] = df_classifica
+    return risultato
+
+def genera_classifiche(cartella_dati=CARTELLA_DATI_CSV, jobs=None):
+    """
+    Elabora tutti i file stagione con un pool di processi (jobs=1: nello stesso processo).
+    Ogni campionato-stagione viene calcolato una sola volta; per la classifica corrente si riusa
+    il risultato della stagione più recente di ciascun campionato.
+    """
+    file_da_elaborare = []
+    for percorso_file_csv in sorted(glob.glob(os.path.join(cartella_dati, "*.csv"))):
+        analisi = analizza_nome_file_stagione(percorso_file_csv)
+        if analisi:
+            file_da_elaborare.append((percorso_file_csv, *analisi))
 
-        # 1. Salva la classifica storica
-        nome_file_classifica_storica = f"classifica_{nome_base_campionato}_{stagione_str}_finale.csv"
-        calcola_e_salva_classifica_da_file(percorso_file_csv, CARTELLA_CLASSIFICHE_STORICHE, nome_file_classifica_storica)
+    jobs = jobs or os.cpu_count() or 1
+    inizio_totale = time.perf_counter()
+    risultati = []
+    if jobs == 1:
+        risultati = [elabora_file_stagione(*argomenti) for argomenti in file_da_elaborare]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(elabora_file_stagione, *argomenti) for argomenti in file_da_elaborare]
+            for future in as_completed(futures):
+                risultati.append(future.result())
+    tempo_totale = time.perf_counter() - inizio_totale
 
-        # 2. Determina se è il file più recente per questo campionato per la classifica "corrente"
-        if nome_base_campionato not in campionati_elaborati or stagione_str > campionati_elaborati[nome_base_campionato]['stagione']:
-            campionati_elaborati[nome_base_campionato] = {
-                'stagione': stagione_str,
-                'percorso_file': percorso_file_csv
-            }
+    # Tempi per file (ordinati per nome, indipendentemente dall'ordine di completamento)
+    print(f"\n--- Tempi per file ({len(risultati)} file, {jobs} processi) ---")
+    for risultato in sorted(risultati, key=lambda r: r['file']):
+        tempi = risultato['tempi']
+        dettaglio = ", ".join(f"{fase} {secondi * 1000:.1f}ms" for fase, secondi in tempi.items())
+        print(f"⏱️  {risultato['file']}: {sum(tempi.values()) * 1000:.1f}ms ({dettaglio})")
+    somma_per_file = sum(sum(r['tempi'].values()) for r in risultati)
+    print(f"⏱️  Totale: {tempo_totale:.2f}s reali, {somma_per_file:.2f}s di lavoro sommato sui file")
 
-    # 3. Genera le classifiche "correnti" usando i file più recenti identificati
+    # Classifiche "correnti": stagione più recente di ogni campionato, senza ricalcolarla
     print("\n--- Genero Classifiche Correnti (basate sulla stagione più recente disponibile) ---")
-    for nome_base_campionato, info in campionati_elaborati.items():
-        nome_file_classifica_corrente = f"classifica_{nome_base_campionato}_corrente.csv"
-        calcola_e_salva_classifica_da_file(info['percorso_file'], CARTELLA_CLASSIFICHE_CORRENTI, nome_file_classifica_corrente)
-        
-    git_push_classifiche()
\ No newline at end of file
+    piu_recenti = {}
+    for risultato in risultati:
+        campionato = risultato['campionato']
+        if campionato not in piu_recenti or risultato['stagione'] > piu_recenti[campionato]['stagione']:
+            piu_recenti[campionato] = risultato
+    for campionato, risultato in sorted(piu_recenti.items()):
+        if risultato['classifica'] is not None:
+            salva_classifica(risultato['classifica'], CARTELLA_CLASSIFICHE_CORRENTI, f"classifica_{campionato}_corrente.csv")
+    return risultati
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera le classifiche correnti e storiche dai CSV delle partite")
+    parser.add_argument("--benchmark", action="store_true", help="Misura i tempi di calcolo delle classifiche su tutti i file, senza salvare")
+    parser.add_argument("--jobs", type=int, default=None, help="Numero di processi paralleli (default: numero di core; 1 = nessun pool)")
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark_classifiche(); raise SystemExit(0)
+
+    svuota_e_crea_cartella(CARTELLA_CLASSIFICHE_CORRENTI)
+    svuota_e_crea_cartella(CARTELLA_CLASSIFICHE_STORICHE)
+    svuota_e_crea_cartella(CARTELLA_CLASSIFICHE_PROGRESSIVE)
+
+    genera_classifiche(CARTELLA_DATI_CSV, jobs=args.jobs)
+
+    git_push_classifiche()
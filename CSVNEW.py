@@ -1,10 +1,30 @@
 import os
+import glob
+import numpy as np
 import pandas as pd
 import requests
 from io import StringIO
 from datetime import datetime
 import subprocess
 import shutil # Aggiunto per svuota_cartella_git più robusta
+import argparse
+import threading
+import time
+import json
+import hashlib
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError: # Lo store colonnare è opzionale: senza pyarrow si lavora solo con i CSV
+    pa = None
+try:
+    import resource # Solo per il benchmark (picco RSS), non disponibile su Windows
+except ImportError:
+    resource = None
 
 # === CONFIGURAZIONE (invariata) ===
 CAMPIONATI = {
@@ -15,6 +35,10 @@ CAMPIONATI = {
 }
 URL_BASE = "https://www.football-data.co.uk/mmz4281"
 CARTELLA_CSV = "./dati_csv" # I file CSV grezzi verranno salvati qui
+NOME_FILE_MANIFEST = "manifest_dati_csv.json" # ETag/Last-Modified/hash per campionato-stagione, salvato in CARTELLA_CSV
+CARTELLA_STORE_COLONNARE = "./dati_parquet" # Store Parquet partizionato campionato=.../stagione=.../partite.parquet
+NOME_FILE_CHANGESET = "changeset_dati_csv.json" # Squadre e campionati toccati dall'ultimo aggiornamento dei dati, salvato in CARTELLA_CSV
+CHIAVE_PARTITA = ['stagione_calc', 'squadra_casa', 'squadra_trasferta'] # Senza data: una partita rinviata resta la stessa partita
 
 MAPPA_COLONNE = { # Come l'avevamo definita per la pulizia dei nomi
     'Date': 'data', 'HomeTeam': 'squadra_casa', 'AwayTeam': 'squadra_trasferta',
@@ -25,6 +49,24 @@ MAPPA_COLONNE = { # Come l'avevamo definita per la pulizia dei nomi
     'HY': 'gialli_casa', 'AY': 'gialli_trasferta', 'HR': 'rossi_casa', 'AR': 'rossi_trasferta'
 }
 COLONNE_DA_TENERE_ORIGINALI = list(MAPPA_COLONNE.keys()) # Nomi originali da football-data.co.uk
+COLONNE_NUMERICHE = [ # Le 16 statistiche di conteggio dopo la ridenominazione
+    'gol_casa', 'gol_trasferta', 'gol_casa_1T', 'gol_trasferta_1T', 'tiri_casa', 
+    'tiri_trasferta', 'tiri_porta_casa', 'tiri_porta_trasferta', 'corner_casa', 
+    'corner_trasferta', 'falli_casa', 'falli_trasferta', 'gialli_casa', 
+    'gialli_trasferta', 'rossi_casa', 'rossi_trasferta'
+]
+TIPI_STORE_STATISTICHE = { # Interi nullable: un dato mancante resta mancante. Int16 dove un conteggio può superare 127
+    col: "Int8" if col.startswith(("gol_", "gialli_", "rossi_")) else "Int16" for col in COLONNE_NUMERICHE
+}
+
+# === PARAMETRI DOWNLOAD CONCORRENTE ===
+MAX_DOWNLOAD_PARALLELI = 8 # Thread di rete che condividono una sola sessione keep-alive
+MAX_CONNESSIONI_PER_HOST = 4 # Richieste contemporanee massime verso lo stesso host
+MAX_PARSER_PARALLELI = 2 # Thread per il parsing pandas, separati da quelli di rete
+MAX_TENTATIVI_DOWNLOAD = 3
+BACKOFF_BASE_SECONDI = 1.0 # Attesa tra i tentativi: 1s, 2s, 4s...
+STATUS_DA_RIPROVARE = {429, 500, 502, 503, 504}
+TIMEOUT_RICHIESTA = 20
 
 # === FUNZIONI DI UTILITÀ GIT E PULIZIA CARTELLA ===
 def svuota_cartella_git(cartella):
@@ -61,10 +103,10 @@ def svuota_cartella_git(cartella):
         print(f"✅ Cartella '{cartella}' creata perché non esisteva.")
 
 
-def git_push(messaggio="Aggiornati file CSV storici (ultime 5 stagioni)"):
+def git_push(messaggio="Aggiornati file CSV storici (ultime 5 stagioni)", cartella=CARTELLA_CSV, cartella_store=CARTELLA_STORE_COLONNARE):
     try:
-        # Aggiungo specificamente la cartella dei dati CSV
-        subprocess.run(["git", "add", CARTELLA_CSV], check=True)
+        # Aggiungo specificamente la cartella dei dati CSV e lo store colonnare che ne deriva
+        subprocess.run(["git", "add"] + [c for c in (cartella, cartella_store) if os.path.exists(c)], check=True)
         
         # Controllo se ci sono modifiche da committare prima di tentare il commit
         # 'git diff --staged --quiet' esce con 1 se ci sono modifiche staged, 0 altrimenti
@@ -76,21 +118,294 @@ def git_push(messaggio="Aggiornati file CSV storici (ultime 5 stagioni)"):
             subprocess.run(["git", "push"], check=True)
             print("✅ Push su GitHub completato.")
         else:
-            print("✅ Nessuna nuova modifica ai file CSV da committare.")
+            print("✅ Nessuna nuova modifica ai file CSV o allo store da committare.")
             
     except subprocess.CalledProcessError as e:
         print(f"❌ Errore durante il processo Git: {e.output.decode() if e.output else e.stderr.decode() if e.stderr else str(e)}")
     except Exception as e:
         print(f"❌ Errore imprevisto durante il push Git: {e}")
 
+# === STORE COLONNARE (PARQUET) ===
+def tipizza_dataframe_partite(df):
+    """
+    Tipi compatti per lo store: Int8/Int16 nullable per le 16 statistiche di conteggio (i valori mancanti
+    restano NA, quelli non validi o fuori intervallo diventano NA con un avviso), squadre come categorie,
+    data come datetime64. La stagione va nella partizione.
+    """
+    df = df.drop(columns=["stagione_calc"], errors="ignore").copy()
+    for col, tipo in TIPI_STORE_STATISTICHE.items():
+        if col in df.columns:
+            valori = pd.to_numeric(df[col], errors='coerce')
+            non_validi = valori.notna() & ((valori < 0) | (valori > np.iinfo(tipo.lower()).max) | (valori % 1 != 0))
+            if non_validi.any():
+                print(f"⚠️  {col}: {int(non_validi.sum())} valori non validi per {tipo} (es. {valori[non_validi].iloc[0]}), salvati come mancanti.")
+                valori = valori.mask(non_validi)
+            df[col] = valori.astype(tipo)
+    for col in ["squadra_casa", "squadra_trasferta"]:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    if "data" in df.columns:
+        df["data"] = pd.to_datetime(df["data"], errors='coerce')
+    return df.reset_index(drop=True)
+
+def _partizionamento_store():
+    # Schema esplicito: senza, pyarrow leggerebbe "0910" come intero 910
+    return ds.partitioning(pa.schema([("campionato", pa.string()), ("stagione", pa.string())]), flavor="hive")
+
+def percorso_partizione_store(nome_campionato_file, stagione_calc, cartella_store=CARTELLA_STORE_COLONNARE):
+    return os.path.join(cartella_store, f"campionato={nome_campionato_file}", f"stagione={stagione_calc}", "partite.parquet")
+
+def salva_partizione_store(df, nome_campionato_file, stagione_calc, cartella_store=CARTELLA_STORE_COLONNARE):
+    """Scrive (o sostituisce) la partizione campionato/stagione dello store colonnare."""
+    if pa is None:
+        return False
+    percorso = percorso_partizione_store(nome_campionato_file, stagione_calc, cartella_store)
+    os.makedirs(os.path.dirname(percorso), exist_ok=True)
+    tabella = pa.Table.from_pandas(tipizza_dataframe_partite(df), preserve_index=False)
+    # Indici dei dizionari a int32: con int8 (codici pandas) le partizioni non si possono unire in lettura
+    tabella = tabella.cast(pa.schema([
+        pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type)) if pa.types.is_dictionary(f.type) else f
+        for f in tabella.schema
+    ], metadata=tabella.schema.metadata))
+    pq.write_table(tabella, percorso + ".tmp")
+    os.replace(percorso + ".tmp", percorso)
+    return True
+
+def ricostruisci_store_da_csv(cartella_csv=CARTELLA_CSV, cartella_store=CARTELLA_STORE_COLONNARE, solo_mancanti=False):
+    """Popola lo store a partire dai CSV già presenti (es. dopo il primo aggiornamento del codice)."""
+    if pa is None:
+        print("⚠️ pyarrow non installato: store colonnare non disponibile.")
+        return 0
+    scritte = 0
+    for percorso_csv in sorted(glob.glob(os.path.join(cartella_csv, "*.csv"))):
+        nome_campionato_file, stagione_calc = os.path.splitext(os.path.basename(percorso_csv))[0].rsplit("_", 1)
+        if solo_mancanti and os.path.exists(percorso_partizione_store(nome_campionato_file, stagione_calc, cartella_store)):
+            continue
+        salva_partizione_store(pd.read_csv(percorso_csv), nome_campionato_file, stagione_calc, cartella_store)
+        scritte += 1
+    print(f"🧱 Store colonnare: {scritte} partizioni scritte in '{cartella_store}'.")
+    return scritte
+
+def carica_store_partite(campionati=None, stagioni=None, colonne=None, cartella_store=CARTELLA_STORE_COLONNARE):
+    """
+    Carica le partite dallo store colonnare.
+    campionati/stagioni filtrano sulle partizioni (le altre non vengono nemmeno aperte),
+    colonne limita le colonne lette; 'campionato' e 'stagione' (dalle partizioni) si possono richiedere come le altre.
+    """
+    if pa is None:
+        raise ImportError("pyarrow è necessario per leggere lo store colonnare")
+    dataset = ds.dataset(cartella_store, format="parquet", partitioning=_partizionamento_store())
+    filtro = None
+    if campionati is not None:
+        filtro = ds.field("campionato").isin(list(campionati))
+    if stagioni is not None:
+        filtro_stagioni = ds.field("stagione").isin([str(s) for s in stagioni])
+        filtro = filtro_stagioni if filtro is None else filtro & filtro_stagioni
+    tabella = dataset.to_table(columns=list(colonne) if colonne is not None else None, filter=filtro)
+    df = tabella.unify_dictionaries().to_pandas()
+    for col in ["squadra_casa", "squadra_trasferta"]:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+def _misura_caricamento(funzione, coda):
+    rss_prima = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    inizio = time.perf_counter()
+    df = funzione()
+    secondi = time.perf_counter() - inizio
+    rss_dopo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    coda.put({"secondi": secondi, "righe": len(df), "memoria_df_mb": df.memory_usage(deep=True).sum() / 2**20,
+              "picco_rss_mb": (rss_dopo - rss_prima) / 1024 if resource else None}) # ru_maxrss è in KB su Linux
+
+def _carica_tutto_csv(cartella_csv=CARTELLA_CSV):
+    # Come fanno oggi gli stadi successivi: read_csv di ogni stagione e conversione date
+    df = pd.concat([pd.read_csv(f) for f in sorted(glob.glob(os.path.join(cartella_csv, "*.csv")))], ignore_index=True)
+    df["data"] = pd.to_datetime(df["data"], errors="coerce")
+    return df
+
+def _carica_serie_a_gol_csv(cartella_csv=CARTELLA_CSV):
+    colonne = ["data", "squadra_casa", "squadra_trasferta", "gol_casa", "gol_trasferta"]
+    df = pd.concat([pd.read_csv(f, usecols=colonne) for f in sorted(glob.glob(os.path.join(cartella_csv, "serie_a_*.csv")))], ignore_index=True)
+    df["data"] = pd.to_datetime(df["data"], errors="coerce")
+    return df
+
+def _carica_serie_a_gol_store(cartella_store=CARTELLA_STORE_COLONNARE):
+    return carica_store_partite(["serie_a"], colonne=["data", "squadra_casa", "squadra_trasferta", "gol_casa", "gol_trasferta"],
+                                cartella_store=cartella_store)
+
+def benchmark_store_vs_csv(cartella_csv=CARTELLA_CSV, cartella_store=CARTELLA_STORE_COLONNARE, ripetizioni=3):
+    """
+    Confronta tempo di caricamento e memoria tra i CSV e lo store colonnare.
+    Ogni misura gira in un processo nuovo, così il picco RSS non è falsato dai caricamenti precedenti.
+    """
+    import multiprocessing
+    from functools import partial
+    ctx = multiprocessing.get_context("spawn")
+    casi = [
+        ("CSV, tutte le partite", partial(_carica_tutto_csv, cartella_csv)),
+        ("Store, tutte le partite", partial(carica_store_partite, cartella_store=cartella_store)),
+        ("CSV, serie_a 5 colonne", partial(_carica_serie_a_gol_csv, cartella_csv)),
+        ("Store, serie_a 5 colonne", partial(_carica_serie_a_gol_store, cartella_store)),
+    ]
+    risultati = {}
+    for nome_caso, funzione in casi:
+        misure = []
+        for _ in range(ripetizioni):
+            coda = ctx.Queue()
+            processo = ctx.Process(target=_misura_caricamento, args=(funzione, coda))
+            processo.start()
+            processo.join()
+            if processo.exitcode != 0:
+                raise RuntimeError(f"Benchmark '{nome_caso}' fallito (exit code {processo.exitcode})")
+            misure.append(coda.get())
+        migliore = min(misure, key=lambda m: m["secondi"])
+        risultati[nome_caso] = migliore
+        rss = f"{migliore['picco_rss_mb']:.1f} MB" if migliore["picco_rss_mb"] is not None else "n/d"
+        print(f"⏱️  {nome_caso:<26} {migliore['secondi']*1000:8.1f} ms  {migliore['righe']:6d} righe  "
+              f"DataFrame {migliore['memoria_df_mb']:6.2f} MB  picco RSS +{rss}")
+    return risultati
+
+# === UNIONE INCREMENTALE DELLE STAGIONI E CHANGE-SET ===
+def _come_testo_csv(df):
+    """Valori come stringhe, identici a quelli che to_csv scrive su disco: così righe vecchie e nuove sono confrontabili."""
+    df = df.copy()
+    if 'data' in df.columns and pd.api.types.is_datetime64_any_dtype(df['data']):
+        df['data'] = df['data'].dt.strftime('%Y-%m-%d')
+    return df.astype(str)
+
+def _indicizza_per_partita(df):
+    """
+    Indice stagione + casa + trasferta + numero dell'incontro tra le due squadre (in ordine di data):
+    nei playoff (es. jupiler_league) la stessa coppia gioca più volte in casa della stessa squadra.
+    """
+    df = df.sort_values(by='data', kind='stable')
+    incontro = df.groupby(CHIAVE_PARTITA, sort=False).cumcount().astype(str)
+    return df.assign(incontro=incontro).set_index(CHIAVE_PARTITA + ['incontro'])
+
+def unisci_in_stagione_esistente(df_nuovo, percorso_file):
+    """
+    Confronta le partite scaricate con quelle già salvate (chiave stagione + casa + trasferta, senza la data:
+    una partita rinviata sostituisce la riga con la data vecchia invece di duplicarla).
+    Le partite nuove vengono aggiunte in coda al file; il file viene riscritto per intero solo
+    se una partita già salvata è stata corretta (o spostata) o se una nuova ha data precedente all'ultima salvata.
+    Restituisce le modifiche: numero di partite nuove/corrette, se il file è stato riscritto e squadre coinvolte.
+    """
+    df_salvato = pd.read_csv(percorso_file, dtype=str, keep_default_na=False)
+    df_testo = _come_testo_csv(df_nuovo)
+    if list(df_salvato.columns) != list(df_testo.columns):
+        # Schema diverso (es. colonne aggiunte alla sorgente): impossibile confrontare riga per riga
+        df_testo.to_csv(percorso_file, index=False)
+        squadre = set(df_testo['squadra_casa']) | set(df_testo['squadra_trasferta'])
+        return {"nuove": len(df_testo), "corrette": 0, "riscritto": True, "squadre": sorted(squadre)}
+
+    salvato_per_chiave = _indicizza_per_partita(df_salvato)
+    nuovo_per_chiave = _indicizza_per_partita(df_testo)
+    gia_presenti = nuovo_per_chiave.index.isin(salvato_per_chiave.index)
+
+    righe_nuove = nuovo_per_chiave[~gia_presenti]
+    confronto = nuovo_per_chiave[gia_presenti]
+    diverse = (confronto != salvato_per_chiave.loc[confronto.index]).any(axis=1)
+    righe_corrette = confronto[diverse]
+
+    squadre = set()
+    for righe in (righe_nuove, righe_corrette):
+        squadre.update(righe.index.get_level_values('squadra_casa'))
+        squadre.update(righe.index.get_level_values('squadra_trasferta'))
+    modifiche = {"nuove": len(righe_nuove), "corrette": len(righe_corrette), "riscritto": False, "squadre": sorted(squadre)}
+    if righe_nuove.empty and righe_corrette.empty:
+        return modifiche
+
+    ultima_data_salvata = df_salvato['data'].max() if not df_salvato.empty else ""
+    if righe_corrette.empty and righe_nuove['data'].min() >= ultima_data_salvata:
+        righe_nuove.reset_index()[df_salvato.columns].to_csv(percorso_file, mode='a', header=False, index=False)
+    else:
+        salvato_per_chiave.update(righe_corrette)
+        df_unito = pd.concat([salvato_per_chiave, righe_nuove]).reset_index()[df_salvato.columns]
+        df_unito.sort_values(by='data', kind='stable').to_csv(percorso_file, index=False) # Date ISO: l'ordine testuale è quello cronologico
+        modifiche["riscritto"] = True
+    return modifiche
+
+def salva_changeset(tempi, cartella=CARTELLA_CSV):
+    """
+    Scrive il change-set dell'aggiornamento: per ogni campionato i file toccati e le squadre
+    che hanno giocato (o le cui partite sono state corrette). Gli stadi successivi possono
+    ricalcolare solo quelle squadre. Un'esecuzione che non salva nulla lascia il change-set
+    dell'ultimo aggiornamento dei dati, così la cartella non cambia senza nuove partite.
+    """
+    changeset = {"generato_il": datetime.now().isoformat(timespec="seconds"), "campionati": {}}
+    for record in sorted(tempi, key=lambda r: r["file"]):
+        modifiche = record.get("modifiche")
+        if record["esito"] != "salvato" or not modifiche:
+            continue
+        nome_campionato_file = os.path.splitext(record["file"])[0].rsplit("_", 1)[0]
+        voce = changeset["campionati"].setdefault(nome_campionato_file, {"squadre": [], "file": {}})
+        voce["file"][record["file"]] = {k: v for k, v in modifiche.items() if k != "squadre"}
+        voce["squadre"] = sorted(set(voce["squadre"]) | set(modifiche["squadre"]))
+    if not changeset["campionati"]:
+        return None
+    with open(os.path.join(cartella, NOME_FILE_CHANGESET), "w", encoding="utf-8") as f:
+        json.dump(changeset, f, ensure_ascii=False, indent=2)
+    return changeset
+
+def leggi_changeset(cartella=CARTELLA_CSV):
+    """Campionato -> insieme delle squadre toccate dall'ultimo aggiornamento dei dati (vuoto se non c'è change-set)."""
+    try:
+        with open(os.path.join(cartella, NOME_FILE_CHANGESET), "r", encoding="utf-8") as f:
+            changeset = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {campionato: set(voce["squadre"]) for campionato, voce in changeset.get("campionati", {}).items()}
+
+# === MANIFEST PER L'AGGIORNAMENTO INCREMENTALE ===
+def percorso_manifest(cartella=CARTELLA_CSV):
+    return os.path.join(cartella, NOME_FILE_MANIFEST)
+
+def carica_manifest(cartella=CARTELLA_CSV):
+    """Legge il manifest della cartella CSV; se manca o è illeggibile ne restituisce uno vuoto."""
+    try:
+        with open(percorso_manifest(cartella), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        manifest.setdefault("file", {})
+        return manifest
+    except FileNotFoundError:
+        return {"file": {}}
+    except Exception as e:
+        print(f"⚠️ Manifest illeggibile in '{cartella}', riparto da zero: {e}")
+        return {"file": {}}
+
+def salva_manifest(manifest, cartella=CARTELLA_CSV):
+    percorso = percorso_manifest(cartella)
+    percorso_tmp = percorso + ".tmp"
+    with open(percorso_tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(percorso_tmp, percorso) # Scrittura atomica: chi legge non vede mai un manifest a metà
+
+def leggi_campionati_modificati(cartella=CARTELLA_CSV):
+    """
+    Per gli stadi successivi: campionati i cui file sono cambiati nell'ultimo aggiornamento dei dati.
+    Senza manifest non sappiamo nulla, quindi consideriamo tutti i campionati da rielaborare.
+    """
+    manifest = carica_manifest(cartella)
+    if "campionati_modificati" not in manifest:
+        return set(CAMPIONATI.keys())
+    return set(manifest["campionati_modificati"])
+
+def header_condizionali(voce_manifest, percorso_file):
+    """Header per la GET condizionale, solo se il file locale esiste ancora."""
+    if not voce_manifest or not os.path.exists(percorso_file):
+        return None
+    header = {}
+    if voce_manifest.get("etag"):
+        header["If-None-Match"] = voce_manifest["etag"]
+    if voce_manifest.get("last_modified"):
+        header["If-Modified-Since"] = voce_manifest["last_modified"]
+    return header or None
+
 # === LOGICA PRINCIPALE DI SCARICAMENTO ===
-def scarica_csv(numero_stagioni_passate=4): # Scarica attuale + 4 passate = 5 totali
+def calcola_stagioni_da_processare(numero_stagioni_passate=4):
     """
-    Scarica i file CSV per i campionati specificati, considerando la stagione attuale
-    e un numero definito di stagioni precedenti.
+    Restituisce le tuple (YY inizio, YY fine) della stagione corrente e delle N precedenti.
     """
-    os.makedirs(CARTELLA_CSV, exist_ok=True)
-    
     stagioni_da_processare = []
     anno_corrente_intero = datetime.now().year
     mese_corrente = datetime.now().month
@@ -106,82 +421,302 @@ def scarica_csv(numero_stagioni_passate=4): # Scarica attuale + 4 passate = 5 to
         start_year_short = anno_inizio_stagione_corrente_short - i
         end_year_short = start_year_short + 1
         stagioni_da_processare.append((start_year_short, end_year_short))
+    return stagioni_da_processare
+
+def crea_sessione_http(max_connessioni=MAX_DOWNLOAD_PARALLELI):
+    """Sessione unica (keep-alive) condivisa da tutti i thread di rete."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_connessioni, pool_maxsize=max_connessioni)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_semafori_host = {}
+_lock_semafori_host = threading.Lock()
+
+def semaforo_per_host(url, limite_per_host=MAX_CONNESSIONI_PER_HOST):
+    """Un semaforo per host: limita le richieste contemporanee verso lo stesso server."""
+    chiave = (urlparse(url).netloc, limite_per_host)
+    with _lock_semafori_host:
+        if chiave not in _semafori_host:
+            _semafori_host[chiave] = threading.BoundedSemaphore(limite_per_host)
+        return _semafori_host[chiave]
+
+def scarica_contenuto_url(session, url, limite_per_host=MAX_CONNESSIONI_PER_HOST,
+                          max_tentativi=MAX_TENTATIVI_DOWNLOAD, backoff_base=BACKOFF_BASE_SECONDI, header_extra=None):
+    """
+    Esegue la GET rispettando il limite per host e riprova con backoff esponenziale
+    su errori di rete e status transitori (429/5xx). Gli altri errori HTTP (es. 404) non vengono ripetuti.
+    Con header condizionali (If-None-Match/If-Modified-Since) la risposta può essere un 304.
+    """
+    semaforo = semaforo_per_host(url, limite_per_host)
+    errore = None
+    for tentativo in range(1, max_tentativi + 1):
+        try:
+            with semaforo:
+                response = session.get(url, timeout=TIMEOUT_RICHIESTA, headers=header_extra)
+            if response.status_code not in STATUS_DA_RIPROVARE:
+                response.raise_for_status()  # Controlla errori HTTP (4xx, 5xx)
+                return response
+            errore = requests.exceptions.HTTPError(f"{response.status_code} per {url}", response=response)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            errore = e
+        if tentativo < max_tentativi:
+            attesa = backoff_base * (2 ** (tentativo - 1))
+            print(f"🔁 Tentativo {tentativo}/{max_tentativi} fallito per {url} ({errore}). Riprovo tra {attesa:.1f}s.")
+            time.sleep(attesa)
+    raise errore
+
+def pulisci_dataframe_stagione(contenuto_csv, stagione_calc, url=""):
+    """
+    Applica filtro colonne, ridenominazione e conversione tipi al CSV grezzo di una stagione.
+    Restituisce None se il file non contiene dati utilizzabili.
+    """
+    df = pd.read_csv(StringIO(contenuto_csv))
+
+    # Seleziona solo le colonne che ci interessano (basate sui nomi originali)
+    colonne_effettive_da_tenere = [col for col in COLONNE_DA_TENERE_ORIGINALI if col in df.columns]
+    if not colonne_effettive_da_tenere:
+        print(f"⚠️  Nessuna colonna rilevante trovata in {url} dopo il filtro. Salto.")
+        return None
+    df = df[colonne_effettive_da_tenere]
+
+    # Ridenomina le colonne
+    df = df.rename(columns=MAPPA_COLONNE)
+    
+    # Conversione tipi di dato e gestione errori
+    for col in COLONNE_NUMERICHE:
+        if col in df.columns: # Applica solo se la colonna esiste dopo la ridenominazione
+            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+    
+    if 'data' in df.columns:
+        df['data'] = pd.to_datetime(df['data'], format='%d/%m/%Y', errors='coerce') # Modificato format in %y per date tipo 23/08/23
+        df.dropna(subset=['data'], inplace=True) # Rimuove righe con data non valida
+        df.sort_values(by='data', ascending=True, inplace=True) # Ordina per data
+    else:
+        print(f"⚠️  Colonna 'data' non trovata in {url}. Impossibile ordinare o validare le date.")
+
+    df["stagione_calc"] = stagione_calc # Per riferimento futuro
+    return df
+
+def elabora_e_salva_stagione(contenuto_grezzo, nome_campionato_file, start_yy, end_yy, url,
+                             secondi_download=0.0, cartella_output=CARTELLA_CSV, voce_manifest=None,
+                             cartella_store=CARTELLA_STORE_COLONNARE):
+    """
+    Parsing e salvataggio di una stagione scaricata. Gira nel pool di parsing, così i thread
+    di rete restano liberi per le altre richieste. Restituisce il record dei tempi.
+    Se l'hash del contenuto coincide con quello del manifest il file locale non viene riscritto.
+    Se il file della stagione esiste già vi vengono unite solo le partite nuove o corrette.
+    Oltre al CSV aggiorna la partizione corrispondente dello store colonnare.
+    """
+    inizio = time.perf_counter()
+    stagione_calc = f"{start_yy:02d}{end_yy:02d}"
+    nome_file_output = f"{nome_campionato_file}_{stagione_calc}.csv"
+    percorso_file_output = os.path.join(cartella_output, nome_file_output)
+    record = {"file": nome_file_output, "url": url, "esito": "saltato", "partite": 0,
+              "secondi_download": secondi_download, "secondi_parsing": 0.0,
+              "sha256": hashlib.sha256(contenuto_grezzo).hexdigest()}
+    try:
+        if voce_manifest and voce_manifest.get("sha256") == record["sha256"] and os.path.exists(percorso_file_output):
+            record["esito"] = "invariato"
+            record["partite"] = voce_manifest.get("partite", 0)
+            print(f"⏸️  Contenuto invariato: {nome_file_output}")
+            if pa is not None and not os.path.exists(percorso_partizione_store(nome_campionato_file, stagione_calc, cartella_store)):
+                salva_partizione_store(pd.read_csv(percorso_file_output), nome_campionato_file, stagione_calc, cartella_store)
+            return record
+
+        contenuto_csv = contenuto_grezzo.decode('utf-8-sig', errors='replace') # Gestisce il BOM (Byte Order Mark) a volte presente
+        contenuto_csv = contenuto_csv.strip()
+
+        # Controllo se il contenuto è vuoto o ha solo l'header
+        if not contenuto_csv or len(contenuto_csv.splitlines()) < 2:
+            print(f"⚠️  File vuoto o solo header per {url}. Salto.")
+            return record
 
+        df = pulisci_dataframe_stagione(contenuto_csv, stagione_calc, url)
+        if df is None:
+            return record
+
+        if os.path.exists(percorso_file_output):
+            modifiche = unisci_in_stagione_esistente(df, percorso_file_output)
+            if not (modifiche["nuove"] or modifiche["corrette"]):
+                record["esito"] = "invariato"
+                record["partite"] = voce_manifest.get("partite", len(df)) if voce_manifest else len(df)
+                print(f"⏸️  Nessuna partita nuova o corretta: {nome_file_output}")
+                return record
+            df = pd.read_csv(percorso_file_output) # Stagione completa, per lo store
+            modo = "riscritto" if modifiche["riscritto"] else "aggiunte in coda"
+            print(f"✅ Aggiornato: {nome_file_output} (+{modifiche['nuove']} nuove, {modifiche['corrette']} corrette, {modo})")
+        else:
+            df.to_csv(percorso_file_output, index=False)
+            squadre = set(df['squadra_casa'].dropna()) | set(df['squadra_trasferta'].dropna()) if 'squadra_casa' in df.columns else set()
+            modifiche = {"nuove": len(df), "corrette": 0, "riscritto": True, "squadre": sorted(squadre)}
+            print(f"✅ Salvato e pulito: {nome_file_output} ({len(df)} partite)")
+        salva_partizione_store(df, nome_campionato_file, stagione_calc, cartella_store)
+        record["esito"] = "salvato"
+        record["partite"] = len(df)
+        record["modifiche"] = modifiche
+    except pd.errors.EmptyDataError:
+        print(f"⚠️  Dati vuoti o illeggibili in {url} dopo il download. Salto.")
+    except Exception as e:
+        record["esito"] = "errore"
+        print(f"❌ Errore generico durante l'elaborazione di {url}: {e}")
+    finally:
+        record["secondi_parsing"] = time.perf_counter() - inizio
+    return record
+
+def _scarica_cronometrato(session, url, limite_per_host, header_extra=None):
+    inizio = time.perf_counter()
+    response = scarica_contenuto_url(session, url, limite_per_host, header_extra=header_extra)
+    return response, time.perf_counter() - inizio
+
+def aggiorna_manifest(manifest, lavori, tempi, risposte):
+    """
+    Aggiorna le voci del manifest con l'esito dell'esecuzione e marca i campionati modificati.
+    Gli orari cambiano solo per i file riscritti: se nessun file è cambiato il manifest resta
+    identico (elenco e orario dell'ultimo aggiornamento dei dati), così git non vede modifiche.
+    """
+    adesso = datetime.now().isoformat(timespec="seconds")
+    campionati_per_file = {f"{nome}_{sy:02d}{ey:02d}.csv": (nome, f"{sy:02d}{ey:02d}") for nome, sy, ey, _ in lavori}
+    campionati_modificati = set()
+    for record in tempi:
+        if record["esito"] not in ("salvato", "invariato"):
+            continue
+        nome_campionato_file, stagione = campionati_per_file[record["file"]]
+        voce = manifest["file"].get(record["file"], {})
+        risposta = risposte.get(record["file"])
+        if risposta is not None and risposta.status_code == 200:
+            voce["etag"] = risposta.headers.get("ETag")
+            voce["last_modified"] = risposta.headers.get("Last-Modified")
+        if record.get("sha256"):
+            voce["sha256"] = record["sha256"]
+        voce.update({"campionato": nome_campionato_file, "stagione": stagione, "url": record["url"],
+                     "partite": record["partite"]})
+        if record["esito"] == "salvato":
+            voce["ultima_modifica"] = adesso
+            campionati_modificati.add(nome_campionato_file)
+        manifest["file"][record["file"]] = voce
+    if campionati_modificati:
+        manifest["aggiornato_il"] = adesso
+        manifest["campionati_modificati"] = sorted(campionati_modificati)
+    return manifest
+
+def stampa_report_tempi(tempi, durata_totale):
+    print(f"\n⏱️  Tempi per file ({len(tempi)} URL):")
+    for r in sorted(tempi, key=lambda r: r["file"]):
+        print(f"   {r['file']:<28} {r['esito']:<8} download {r['secondi_download']:6.2f}s  parsing {r['secondi_parsing']:6.2f}s  ({r['partite']} partite)")
+    somma_download = sum(r["secondi_download"] for r in tempi)
+    print(f"⏱️  Tempo totale: {durata_totale:.2f}s (somma dei download: {somma_download:.2f}s)")
+
+def scarica_csv(numero_stagioni_passate=4, url_base=URL_BASE, cartella_output=CARTELLA_CSV,
+                max_download_paralleli=MAX_DOWNLOAD_PARALLELI, limite_per_host=MAX_CONNESSIONI_PER_HOST,
+                incrementale=True, cartella_store=CARTELLA_STORE_COLONNARE): # Scarica attuale + 4 passate = 5 totali
+    """
+    Scarica i file CSV per i campionati specificati, considerando la stagione attuale
+    e un numero definito di stagioni precedenti.
+    I download girano in un pool di thread che condividono una sessione keep-alive,
+    il parsing pandas in un pool separato. Restituisce la lista dei tempi per file.
+    In modalità incrementale usa il manifest per inviare richieste condizionali e
+    riscrive solo i file il cui contenuto è davvero cambiato.
+    """
+    os.makedirs(cartella_output, exist_ok=True)
+    manifest = carica_manifest(cartella_output) if incrementale else {"file": {}}
+    
+    stagioni_da_processare = calcola_stagioni_da_processare(numero_stagioni_passate)
     print(f"🗓️  Stagioni che verranno scaricate (formato YY, YY+1): {stagioni_da_processare}")
 
+    lavori = []
     for nome_campionato_file, codice_campionato_data in CAMPIONATI.items():
-        print(f"\n--- Elaboro Campionato: {nome_campionato_file.replace('_', ' ').title()} ---")
         for start_yy, end_yy in stagioni_da_processare:
             # Formatta gli anni per l'URL (es. 2324, 0910)
             stagione_url_format = f"{start_yy:02d}{end_yy:02d}"
-            url = f"{URL_BASE}/{stagione_url_format}/{codice_campionato_data}.csv"
-            
-            print(f"➡️  Scarico: {url}")
-            try:
-                response = requests.get(url, timeout=20)
-                response.raise_for_status()  # Controlla errori HTTP (4xx, 5xx)
-                response.encoding = 'utf-8-sig' # Gestisce il BOM (Byte Order Mark) a volte presente
-                
-                # Controllo se il contenuto è vuoto o ha solo l'header
-                contenuto_csv = response.text.strip()
-                if not contenuto_csv or len(contenuto_csv.splitlines()) < 2:
-                    print(f"⚠️  File vuoto o solo header per {url}. Salto.")
-                    continue
-
-                df = pd.read_csv(StringIO(contenuto_csv))
-
-                # Seleziona solo le colonne che ci interessano (basate sui nomi originali)
-                colonne_effettive_da_tenere = [col for col in COLONNE_DA_TENERE_ORIGINALI if col in df.columns]
-                if not colonne_effettive_da_tenere:
-                    print(f"⚠️  Nessuna colonna rilevante trovata in {url} dopo il filtro. Salto.")
-                    continue
-                df = df[colonne_effettive_da_tenere]
-
-                # Ridenomina le colonne
-                df.rename(columns=MAPPA_COLONNE, inplace=True)
-                
-                # Conversione tipi di dato e gestione errori
-                colonne_numeriche_da_convertire = [
-                    'gol_casa', 'gol_trasferta', 'gol_casa_1T', 'gol_trasferta_1T', 'tiri_casa', 
-                    'tiri_trasferta', 'tiri_porta_casa', 'tiri_porta_trasferta', 'corner_casa', 
-                    'corner_trasferta', 'falli_casa', 'falli_trasferta', 'gialli_casa', 
-                    'gialli_trasferta', 'rossi_casa', 'rossi_trasferta'
-                ]
-                for col in colonne_numeriche_da_convertire:
-                    if col in df.columns: # Applica solo se la colonna esiste dopo la ridenominazione
-                        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
-                
-                if 'data' in df.columns:
-                    df['data'] = pd.to_datetime(df['data'], format='%d/%m/%Y', errors='coerce') # Modificato format in %y per date tipo 23/08/23
-                    df.dropna(subset=['data'], inplace=True) # Rimuove righe con data non valida
-                    df.sort_values(by='data', ascending=True, inplace=True) # Ordina per data
-                else:
-                    print(f"⚠️  Colonna 'data' non trovata in {url}. Impossibile ordinare o validare le date.")
-
-
-                df["stagione_calc"] = f"{start_yy:02d}{end_yy:02d}" # Per riferimento futuro
-                
-                nome_file_output = f"{nome_campionato_file}_{start_yy:02d}{end_yy:02d}.csv"
-                percorso_file_output = os.path.join(CARTELLA_CSV, nome_file_output)
-                df.to_csv(percorso_file_output, index=False)
-                print(f"✅ Salvato e pulito: {nome_file_output} ({len(df)} partite)")
+            url = f"{url_base}/{stagione_url_format}/{codice_campionato_data}.csv"
+            lavori.append((nome_campionato_file, start_yy, end_yy, url))
+
+    tempi = []
+    risposte = {}
+    inizio_totale = time.perf_counter()
+    with crea_sessione_http(max_download_paralleli) as session, \
+         ThreadPoolExecutor(max_workers=max_download_paralleli, thread_name_prefix="rete") as pool_rete, \
+         ThreadPoolExecutor(max_workers=MAX_PARSER_PARALLELI, thread_name_prefix="parsing") as pool_parsing:
+        futures_download = {}
+        for lavoro in lavori:
+            nome_campionato_file, start_yy, end_yy, url = lavoro
+            nome_file = f"{nome_campionato_file}_{start_yy:02d}{end_yy:02d}.csv"
+            header = header_condizionali(manifest["file"].get(nome_file), os.path.join(cartella_output, nome_file))
+            print(f"➡️  Scarico: {url}{' (condizionale)' if header else ''}")
+            futures_download[pool_rete.submit(_scarica_cronometrato, session, url, limite_per_host, header)] = lavoro
 
+        futures_parsing = []
+        for future in as_completed(futures_download):
+            nome_campionato_file, start_yy, end_yy, url = futures_download[future]
+            nome_file = f"{nome_campionato_file}_{start_yy:02d}{end_yy:02d}.csv"
+            record_errore = {"file": nome_file, "url": url, "esito": "errore", "partite": 0,
+                             "secondi_download": 0.0, "secondi_parsing": 0.0}
+            try:
+                response, secondi_download = future.result()
             except requests.exceptions.HTTPError as e:
-                print(f"❌ Errore HTTP scaricando {url}: {e.response.status_code}. File non trovato o errore server. Salto.")
+                status = e.response.status_code if e.response is not None else "?"
+                print(f"❌ Errore HTTP scaricando {url}: {status}. File non trovato o errore server. Salto.")
+                tempi.append(record_errore)
+                continue
             except requests.exceptions.RequestException as e:
                 print(f"❌ Errore di rete con {url}: {e}. Salto.")
-            except pd.errors.EmptyDataError:
-                print(f"⚠️  Dati vuoti o illeggibili in {url} dopo il download. Salto.")
-            except Exception as e:
-                print(f"❌ Errore generico durante l'elaborazione di {url}: {e}")
+                tempi.append(record_errore)
+                continue
+            risposte[nome_file] = response
+            voce_manifest = manifest["file"].get(nome_file)
+            if response.status_code == 304:
+                print(f"⏸️  Non modificato sul server (304): {nome_file}")
+                tempi.append(dict(record_errore, esito="invariato", partite=voce_manifest.get("partite", 0),
+                                  secondi_download=secondi_download))
+                continue
+            futures_parsing.append(pool_parsing.submit(
+                elabora_e_salva_stagione, response.content, nome_campionato_file, start_yy, end_yy, url,
+                secondi_download, cartella_output, voce_manifest, cartella_store))
+
+        for future in futures_parsing:
+            tempi.append(future.result())
+
+    salva_manifest(aggiorna_manifest(manifest, lavori, tempi, risposte), cartella_output)
+    salva_changeset(tempi, cartella_output)
+    stampa_report_tempi(tempi, time.perf_counter() - inizio_totale)
+    campionati_modificati = sorted({r["file"].rsplit("_", 1)[0] for r in tempi if r["esito"] == "salvato"})
+    print(f"🏷️  Campionati modificati: {campionati_modificati or 'nessuno'}")
+    return tempi
 
 if __name__ == "__main__":
-    # Svuota la cartella CSV e la ricrea, rimuovendo anche i file da Git
-    svuota_cartella_git(CARTELLA_CSV)
+    parser = argparse.ArgumentParser(description="Scarica i CSV delle ultime stagioni da football-data.co.uk")
+    parser.add_argument("--url-base", default=URL_BASE, help="Server da cui scaricare (es. http://localhost:8000 per un server locale di prova)")
+    parser.add_argument("--cartella", default=CARTELLA_CSV, help="Cartella di destinazione dei CSV")
+    parser.add_argument("--paralleli", type=int, default=MAX_DOWNLOAD_PARALLELI, help="Numero di download contemporanei")
+    parser.add_argument("--per-host", type=int, default=MAX_CONNESSIONI_PER_HOST, help="Richieste contemporanee massime verso lo stesso host")
+    parser.add_argument("--senza-git", action="store_true", help="Non esegue commit e push al termine")
+    parser.add_argument("--completo", action="store_true", help="Svuota la cartella e riscarica tutto invece dell'aggiornamento incrementale")
+    parser.add_argument("--store", default=CARTELLA_STORE_COLONNARE, help="Cartella dello store colonnare Parquet")
+    parser.add_argument("--ricostruisci-store", action="store_true", help="Rigenera lo store colonnare dai CSV esistenti, senza scaricare")
+    parser.add_argument("--benchmark-store", action="store_true", help="Confronta tempi e memoria di caricamento CSV vs store, senza scaricare")
+    args = parser.parse_args()
+
+    if args.ricostruisci_store or args.benchmark_store:
+        if args.ricostruisci_store:
+            ricostruisci_store_da_csv(args.cartella, args.store)
+        if args.benchmark_store:
+            ricostruisci_store_da_csv(args.cartella, args.store, solo_mancanti=True)
+            benchmark_store_vs_csv(args.cartella, args.store)
+        raise SystemExit(0)
+
+    if args.completo:
+        # Svuota la cartella CSV e lo store colonnare e li ricrea, rimuovendo anche i file da Git
+        svuota_cartella_git(args.cartella)
+        svuota_cartella_git(args.store)
     
     # Scarica i nuovi CSV (stagione attuale + 4 precedenti)
     # Se vuoi 5 stagioni passate (per un totale di 6 con quella attuale), metti numero_stagioni_passate=5
-    scarica_csv(numero_stagioni_passate=4) 
+    scarica_csv(numero_stagioni_passate=4, url_base=args.url_base, cartella_output=args.cartella,
+                max_download_paralleli=args.paralleli, limite_per_host=args.per_host,
+                incrementale=not args.completo, cartella_store=args.store)
     
     # Esegui commit e push su GitHub
-    git_push()
\ No newline at end of file
+    if not args.senza_git:
+        git_push(cartella=args.cartella, cartella_store=args.store)
@@ -0,0 +1,534 @@
+import os
+import re
+import glob
+import json
+import time
+import queue
+import hashlib
+import argparse
+import threading
+import subprocess
+from datetime import datetime
+
+import pandas as pd
+
+import CREA_CLASSIFICA
+import CALCOLO_MEDIE_NEW
+import PRONOSTICI_GENERATI
+
+# === CONFIGURAZIONE ===
+# Gli stadi CSVNEW -> CREA_CLASSIFICA -> CALCOLO_MEDIE_NEW -> PRONOSTICI_GENERATI come grafo di nodi (stadio, campionato):
+# ogni nodo dipende solo dai file del proprio campionato e viene ricalcolato solo se l'impronta (hash del contenuto)
+# dei suoi input è cambiata rispetto all'ultima esecuzione riuscita, o se mancano i suoi output.
+FILE_STATO_PIPELINE = "./stato_pipeline.json" # Impronte degli input e output prodotti per ogni nodo
+VERSIONE_STATO_PIPELINE = 1
+CAMPIONATI = list(CALCOLO_MEDIE_NEW.CAMPIONATI_NOMI_FILE.values())
+STADI = ["classifiche", "medie", "pronostici"] # Ordine topologico: ogni stadio legge gli output del precedente
+SCRIPT_STADIO = { # Il codice fa parte degli input: se cambia lo script, lo stadio va ricalcolato per tutti i campionati
+    "classifiche": "./CREA_CLASSIFICA.py",
+    "medie": "./CALCOLO_MEDIE_NEW.py",
+    "pronostici": "./PRONOSTICI_GENERATI.py",
+}
+CARTELLA_STORE_COLONNARE = "./dati_parquet" # Come CSVNEW.CARTELLA_STORE_COLONNARE: CSVNEW si importa solo per scaricare
+SEPARATORE_VOCE = "#" # "file.json#campionato": input che è solo la voce di un campionato in un file di stato condiviso
+
+# === FUNZIONI DI UTILITÀ ===
+def hash_file(percorso: str):
+    """SHA-256 del contenuto (None se il file non esiste). Il contenuto, non l'mtime: un checkout nuovo non invalida nulla."""
+    try:
+        h = hashlib.sha256()
+        with open(percorso, 'rb') as f:
+            for blocco in iter(lambda: f.read(1 << 20), b''):
+                h.update(blocco)
+        return h.hexdigest()
+    except FileNotFoundError:
+        return None
+
+def hash_voce_stato_forza(percorso_voce: str):
+    """
+    Hash della voce di un campionato nello stato della forza esponenziale (None se manca). Lo stato è condiviso:
+    ogni nodo medie lo riscrive, ma cambia solo la voce del proprio campionato, quindi gli altri non si invalidano.
+    """
+    percorso, nome_campionato = percorso_voce.split(SEPARATORE_VOCE, 1)
+    try:
+        with open(percorso, 'r', encoding='utf-8') as f:
+            stato = json.load(f)
+    except (OSError, ValueError):
+        return None # Assente o illeggibile: CALCOLO_MEDIE_NEW lo ricostruisce da zero
+    voce = stato.get('campionati', {}).get(nome_campionato)
+    if voce is None:
+        return None
+    contenuto = json.dumps({'emivita_giorni': stato.get('emivita_giorni'), 'voce': voce}, sort_keys=True)
+    return hashlib.sha256(contenuto.encode('utf-8')).hexdigest()
+
+def hash_input_nodo(percorso: str):
+    return hash_voce_stato_forza(percorso) if SEPARATORE_VOCE in percorso else hash_file(percorso)
+
+def file_per_modello(cartella: str, modello: str) -> list:
+    """File della cartella il cui nome corrisponde per intero all'espressione regolare (evita che "serie_a" prenda altro)."""
+    if not os.path.isdir(cartella):
+        return []
+    regex = re.compile(modello)
+    return sorted(os.path.join(cartella, f) for f in os.listdir(cartella) if regex.fullmatch(f))
+
+def file_stagioni(nome_campionato: str) -> list:
+    return file_per_modello(CALCOLO_MEDIE_NEW.CARTELLA_DATI_CSV, rf"{re.escape(nome_campionato)}_\d{{4}}\.csv")
+
+def partite_per_campionato(percorso_partite=PRONOSTICI_GENERATI.PATH_PARTITE_INPUT) -> dict:
+    """Campionato -> lista di (file JSON della partita, nome arbitro) in dati_flashscore."""
+    partite = {nome: [] for nome in CAMPIONATI}
+    if not os.path.isdir(percorso_partite):
+        return partite
+    for file_partita_json in sorted(os.listdir(percorso_partite)):
+        if not file_partita_json.endswith(".json"): continue
+        try:
+            with open(os.path.join(percorso_partite, file_partita_json), 'r', encoding='utf-8') as f:
+                info_partita = json.load(f)
+        except Exception as e:
+            print(f"ATTENZIONE: Partita illeggibile {file_partita_json}: {e}. Salto.")
+            continue
+        prefix = PRONOSTICI_GENERATI.MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.get(info_partita.get("competizione"))
+        if prefix in partite:
+            partite[prefix].append((file_partita_json, info_partita.get("arbitro")))
+    return partite
+
+def voce_stato_forza(nome_campionato: str) -> str:
+    return os.path.normpath(CALCOLO_MEDIE_NEW.FILE_STATO_FORZA_ESPONENZIALE) + SEPARATORE_VOCE + nome_campionato
+
+def input_riscritti(stadio: str, nome_campionato: str) -> list:
+    """Input che il nodo stesso aggiorna: la forza esponenziale parte dallo stato salvato e lo fa avanzare."""
+    return [voce_stato_forza(nome_campionato)] if stadio == "medie" else []
+
+def input_nodo(stadio: str, nome_campionato: str, partite: dict) -> list:
+    """File letti dal nodo (stadio, campionato). Quelli assenti contano con hash None."""
+    input_file = [SCRIPT_STADIO[stadio]] + file_stagioni(nome_campionato)
+    classifica_corrente = os.path.join(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_CORRENTI, f"classifica_{nome_campionato}_corrente.csv")
+    if stadio == "medie":
+        input_file += file_per_modello(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_STORICHE, rf"classifica_{re.escape(nome_campionato)}_\d{{4}}_finale\.csv")
+        input_file.append(classifica_corrente)
+        input_file += input_riscritti(stadio, nome_campionato)
+    elif stadio == "pronostici":
+        input_file += [PRONOSTICI_GENERATI.PATH_ALIAS_SQUADRE, classifica_corrente] + output_medie(nome_campionato)
+        for file_partita_json, arbitro in partite[nome_campionato]:
+            input_file.append(os.path.join(PRONOSTICI_GENERATI.PATH_PARTITE_INPUT, file_partita_json))
+            # Pianificare non scrive nulla: il registro arbitri lo salva lo stadio pronostici, se serve
+            file_arbitro = PRONOSTICI_GENERATI.trova_file_arbitro(arbitro, PRONOSTICI_GENERATI.PATH_DATI_ARBITRI, salva_registro=False) \
+                           if os.path.isdir(PRONOSTICI_GENERATI.PATH_DATI_ARBITRI) else None
+            if file_arbitro:
+                input_file.append(os.path.join(PRONOSTICI_GENERATI.PATH_DATI_ARBITRI, file_arbitro))
+    return sorted(set(os.path.normpath(p) for p in input_file))
+
+def impronta_input(input_file: list, hash_noti: dict = None):
+    """(impronta complessiva, {file: hash}) degli input di un nodo. hash_noti: hash già calcolati di file non riscritti da allora."""
+    hash_noti = hash_noti or {}
+    hash_input = {percorso: hash_noti[percorso] if percorso in hash_noti else hash_input_nodo(percorso) for percorso in input_file}
+    return impronta_da_hash(hash_input), hash_input
+
+def impronta_da_hash(hash_input: dict) -> str:
+    return hashlib.sha256(json.dumps(hash_input, sort_keys=True).encode('utf-8')).hexdigest()
+
+def output_medie(nome_campionato: str) -> list:
+    cartella = CALCOLO_MEDIE_NEW.CARTELLA_MEDIE_OUTPUT_V2
+    return [os.path.join(cartella, f"{nome_campionato}_statistiche_avanzate_V2.csv"),
+            os.path.join(cartella, f"{nome_campionato}_statistiche_avanzate_V2.npz"),
+            os.path.join(cartella, f"{nome_campionato}_medie_campionato_V2.json")]
+
+# === STATO DELLA PIPELINE ===
+def carica_stato_pipeline(percorso=FILE_STATO_PIPELINE) -> dict:
+    try:
+        with open(percorso, 'r', encoding='utf-8') as f:
+            stato = json.load(f)
+        if stato.get('versione') == VERSIONE_STATO_PIPELINE:
+            return stato
+        print(f"ATTENZIONE: Versione dello stato pipeline diversa in {percorso}. Ricalcolo tutto.")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"ATTENZIONE: Stato pipeline illeggibile ({e}). Ricalcolo tutto.")
+    return {'versione': VERSIONE_STATO_PIPELINE, 'nodi': {}}
+
+def salva_stato_pipeline(stato: dict, percorso=FILE_STATO_PIPELINE):
+    percorso_tmp = percorso + ".tmp"
+    with open(percorso_tmp, 'w', encoding='utf-8') as f:
+        json.dump(stato, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(percorso_tmp, percorso) # Scrittura atomica: un'interruzione non lascia uno stato a metà
+
+def _elenco_breve(percorsi, massimo=3) -> str:
+    nomi = [os.path.basename(p) for p in sorted(percorsi)]
+    return ", ".join(nomi[:massimo]) + (f" (+{len(nomi) - massimo})" if len(nomi) > massimo else "")
+
+def motivi_ricalcolo(voce: dict, impronta: str, hash_input: dict) -> list:
+    """Perché un nodo va ricalcolato (lista vuota se è aggiornato)."""
+    if voce is None:
+        return ["mai eseguito"]
+    motivi = []
+    if voce['impronta'] != impronta:
+        precedenti = voce.get('input', {})
+        cambiati = [p for p in hash_input if p in precedenti and precedenti[p] != hash_input[p]]
+        nuovi = [p for p in hash_input if p not in precedenti]
+        rimossi = [p for p in precedenti if p not in hash_input]
+        for etichetta, percorsi in [("input cambiati", cambiati), ("input nuovi", nuovi), ("input rimossi", rimossi)]:
+            if percorsi:
+                motivi.append(f"{etichetta}: {_elenco_breve(percorsi)}")
+    mancanti = [p for p in voce.get('output', []) if not os.path.exists(p)]
+    if mancanti:
+        motivi.append(f"output mancanti: {_elenco_breve(mancanti)}")
+    return motivi
+
+# === ESECUZIONE DEI NODI ===
+def esegui_classifiche(nome_campionato: str, partite: dict) -> list:
+    """Classifiche finali e progressive di ogni stagione del campionato, più quella corrente (stagione più recente)."""
+    output, piu_recente = [], None
+    for percorso_file_csv in file_stagioni(nome_campionato):
+        stagione_str = os.path.splitext(os.path.basename(percorso_file_csv))[0][len(nome_campionato) + 1:]
+        risultato = CREA_CLASSIFICA.elabora_file_stagione(percorso_file_csv, nome_campionato, stagione_str)
+        if risultato['classifica'] is None:
+            continue
+        output += [os.path.join(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_STORICHE, f"classifica_{nome_campionato}_{stagione_str}_finale.csv"),
+                   os.path.join(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_PROGRESSIVE, f"progressiva_{nome_campionato}_{stagione_str}.npz")]
+        piu_recente = risultato
+    if piu_recente is not None:
+        nome_file = f"classifica_{nome_campionato}_corrente.csv"
+        CREA_CLASSIFICA.salva_classifica(piu_recente['classifica'], CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_CORRENTI, nome_file)
+        output.append(os.path.join(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_CORRENTI, nome_file))
+    return output
+
+def esegui_medie(nome_campionato: str, partite: dict) -> list:
+    """Statistiche V2 (CSV, store, medie generali) e forza esponenziale del campionato."""
+    os.makedirs(CALCOLO_MEDIE_NEW.CARTELLA_MEDIE_OUTPUT_V2, exist_ok=True)
+    CALCOLO_MEDIE_NEW.elabora_e_salva_campionato(nome_campionato)
+    CALCOLO_MEDIE_NEW.aggiorna_forza_esponenziale([nome_campionato])
+    output = output_medie(nome_campionato) + \
+             [os.path.join(CALCOLO_MEDIE_NEW.CARTELLA_MEDIE_OUTPUT_V2, f"{nome_campionato}_forza_esponenziale_V2.csv")]
+    return [p for p in output if os.path.exists(p)]
+
+_ALIAS_SQUADRE = {}
+
+def esegui_pronostici(nome_campionato: str, partite: dict) -> list:
+    """Pronostici delle partite del campionato presenti in dati_flashscore."""
+    if not _ALIAS_SQUADRE:
+        _ALIAS_SQUADRE.update(PRONOSTICI_GENERATI.carica_alias_squadre(PRONOSTICI_GENERATI.PATH_ALIAS_SQUADRE))
+    os.makedirs(PRONOSTICI_GENERATI.PATH_OUTPUT_PRONOSTICI_V2, exist_ok=True)
+    output = PRONOSTICI_GENERATI.genera_pronostici_partite([file_partita_json for file_partita_json, _ in partite[nome_campionato]], _ALIAS_SQUADRE)
+    return [os.path.normpath(p) for p in output if p]
+
+ESECUTORI_STADIO = {"classifiche": esegui_classifiche, "medie": esegui_medie, "pronostici": esegui_pronostici}
+
+def esegui_nodo(stato: dict, stadio: str, nome_campionato: str, partite: dict, impronta: str, hash_input: dict) -> float:
+    """Ricalcola un nodo, elimina gli output della volta precedente non più prodotti e registra la nuova impronta."""
+    chiave = f"{stadio}:{nome_campionato}"
+    inizio = time.perf_counter()
+    output = sorted(set(os.path.normpath(p) for p in ESECUTORI_STADIO[stadio](nome_campionato, partite)))
+    for percorso in set(stato['nodi'].get(chiave, {}).get('output', [])) - set(output):
+        if os.path.exists(percorso):
+            os.remove(percorso)
+            print(f"🧹 Rimosso output non più prodotto: {percorso}")
+    # L'impronta registrata è quella degli input letti: se il nodo li ha cambiati (non dovrebbe), al prossimo giro riparte.
+    # Fanno eccezione gli input che il nodo aggiorna di proposito, registrati come li ha lasciati.
+    riscritti = input_riscritti(stadio, nome_campionato)
+    if riscritti:
+        hash_input = dict(hash_input, **{percorso: hash_input_nodo(percorso) for percorso in riscritti})
+        impronta = impronta_da_hash(hash_input)
+    stato['nodi'][chiave] = {'impronta': impronta, 'input': hash_input, 'output': output,
+                             'eseguito_il': datetime.now().isoformat(timespec='seconds')}
+    salva_stato_pipeline(stato)
+    return time.perf_counter() - inizio
+
+# === MODALITÀ IN MEMORIA ===
+class ScrittoreAsincrono:
+    """
+    Thread che esegue in ordine le scritture accodate con scrittore(funzione, *argomenti), mentre il thread
+    principale calcola. chiudi() attende che la coda sia vuota; gli errori sono stampati e contati, non rilanciati.
+    """
+    def __init__(self):
+        self._coda = queue.Queue()
+        self.scritture = 0
+        self.errori = 0
+        self._thread = threading.Thread(target=self._lavora, name="scrittore_pipeline", daemon=True)
+        self._thread.start()
+
+    def __call__(self, funzione, *argomenti):
+        self._coda.put((funzione, argomenti))
+
+    def _lavora(self):
+        while True:
+            lavoro = self._coda.get()
+            if lavoro is None:
+                return
+            funzione, argomenti = lavoro
+            try:
+                funzione(*argomenti)
+                self.scritture += 1
+            except Exception as e:
+                self.errori += 1
+                print(f"❌ Errore nella scrittura ({getattr(funzione, '__name__', funzione)}): {e}")
+
+    def chiudi(self) -> bool:
+        self._coda.put(None)
+        self._thread.join()
+        return self.errori == 0
+
+def esegui_campionato_in_memoria(nome_campionato: str, partite: dict, stadi_da_scrivere: set, scrittore) -> dict:
+    """
+    I tre stadi di un campionato in un solo passaggio: ogni file stagione è letto e parsato una volta (CacheStagioni),
+    classifiche e statistiche passano agli stadi successivi come DataFrame invece che tramite CSV.
+    Solo gli stadi in stadi_da_scrivere accodano i propri file allo scrittore (gli altri sono già aggiornati su disco).
+    Restituisce stadio -> output attesi; la forza esponenziale (stato condiviso tra campionati) è scritta subito.
+    """
+    cache = CALCOLO_MEDIE_NEW.CacheStagioni()
+    output = {stadio: [] for stadio in STADI}
+    classifiche_storiche, df_classifica_corrente = {}, pd.DataFrame()
+    for percorso_file_csv in file_stagioni(nome_campionato):
+        stagione_str = os.path.splitext(os.path.basename(percorso_file_csv))[0][len(nome_campionato) + 1:]
+        # copy(): la conversione dei gol è sul posto e i DataFrame della cache sono condivisi
+        df_stagione = CREA_CLASSIFICA.prepara_stagione_per_classifica(cache.leggi(percorso_file_csv).copy(), percorso_file_csv)
+        if df_stagione is None:
+            continue
+        df_classifica = CREA_CLASSIFICA.calcola_classifica(df_stagione)
+        if df_classifica.empty:
+            print(f"⚠️  Classifica vuota generata per {percorso_file_csv}. Salto salvataggio.")
+            continue
+        nome_finale, nome_progressiva = f"classifica_{nome_campionato}_{stagione_str}_finale.csv", f"progressiva_{nome_campionato}_{stagione_str}.npz"
+        if "classifiche" in stadi_da_scrivere:
+            scrittore(CREA_CLASSIFICA.salva_classifica, df_classifica, CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_STORICHE, nome_finale)
+            scrittore(CREA_CLASSIFICA.scrivi_classifiche_progressive, CREA_CLASSIFICA.calcola_classifiche_progressive(df_stagione),
+                      CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_PROGRESSIVE, nome_progressiva)
+        output["classifiche"] += [os.path.join(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_STORICHE, nome_finale),
+                                  os.path.join(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_PROGRESSIVE, nome_progressiva)]
+        classifiche_storiche[stagione_str] = df_classifica
+        df_classifica_corrente = df_classifica # file_stagioni è ordinato: l'ultima è la stagione più recente
+    if classifiche_storiche:
+        nome_file = f"classifica_{nome_campionato}_corrente.csv"
+        if "classifiche" in stadi_da_scrivere:
+            scrittore(CREA_CLASSIFICA.salva_classifica, df_classifica_corrente, CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_CORRENTI, nome_file)
+        output["classifiche"].append(os.path.join(CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_CORRENTI, nome_file))
+
+    df_statistiche_v2, stat_campionato_generali = CALCOLO_MEDIE_NEW.calcola_statistiche_campionato_V2(
+        nome_campionato, cache=cache, classifiche_storiche=classifiche_storiche, df_classifica_corrente=df_classifica_corrente)
+    output["medie"] = output_medie(nome_campionato) + \
+                      [os.path.join(CALCOLO_MEDIE_NEW.CARTELLA_MEDIE_OUTPUT_V2, f"{nome_campionato}_forza_esponenziale_V2.csv")]
+    if "medie" in stadi_da_scrivere:
+        os.makedirs(CALCOLO_MEDIE_NEW.CARTELLA_MEDIE_OUTPUT_V2, exist_ok=True)
+        if stat_campionato_generali is not None:
+            scrittore(CALCOLO_MEDIE_NEW.salva_medie_campionato_V2, stat_campionato_generali, nome_campionato)
+        if not df_statistiche_v2.empty:
+            scrittore(CALCOLO_MEDIE_NEW.salva_statistiche_campionato, df_statistiche_v2, nome_campionato)
+        CALCOLO_MEDIE_NEW.aggiorna_forza_esponenziale([nome_campionato], cache=cache)
+
+    if not _ALIAS_SQUADRE:
+        _ALIAS_SQUADRE.update(PRONOSTICI_GENERATI.carica_alias_squadre(PRONOSTICI_GENERATI.PATH_ALIAS_SQUADRE))
+    dati_campionato = {
+        'statistiche': df_statistiche_v2,
+        'medie': CALCOLO_MEDIE_NEW.medie_campionato_serializzabili(stat_campionato_generali) if stat_campionato_generali is not None else {},
+        'classifica': df_classifica_corrente,
+        'h2h': PRONOSTICI_GENERATI.IndiceH2H([cache.leggi(p) for p in sorted(glob.glob(os.path.join(
+            PRONOSTICI_GENERATI.PATH_DATI_CSV_STORICI, f"{nome_campionato}_*.csv")), reverse=True)]),
+    }
+    if "pronostici" in stadi_da_scrivere:
+        os.makedirs(PRONOSTICI_GENERATI.PATH_OUTPUT_PRONOSTICI_V2, exist_ok=True)
+        salvati = PRONOSTICI_GENERATI.genera_pronostici_partite([file_partita_json for file_partita_json, _ in partite[nome_campionato]],
+                                                                _ALIAS_SQUADRE, dati_campionati={nome_campionato: dati_campionato}, scrittore=scrittore)
+        output["pronostici"].extend(percorso for percorso in salvati if percorso)
+    return output
+
+def esegui_in_memoria(stato: dict, partite: dict, forza: bool = False) -> tuple:
+    """
+    Ricalcola in memoria i campionati con almeno un nodo da ricalcolare (a valle compresi), con le scritture
+    su un thread dedicato. Le impronte sono registrate alla fine, sui file effettivamente scritti.
+    Restituisce (nodi ricalcolati, {campionato: secondi}).
+    """
+    hash_letti = {}
+    piano = pianifica(stato, partite, forza, hash_letti)
+    for chiave, motivi in piano:
+        print(f"🔁 {chiave}: {'; '.join(motivi)}")
+    nodi = [chiave for chiave, _ in piano]
+    scrittore = ScrittoreAsincrono()
+    output_campionato, tempi = {}, {}
+    for nome_campionato in CAMPIONATI:
+        stadi_da_scrivere = {stadio for stadio in STADI if f"{stadio}:{nome_campionato}" in nodi}
+        if not stadi_da_scrivere:
+            continue
+        inizio = time.perf_counter()
+        output_campionato[nome_campionato] = esegui_campionato_in_memoria(nome_campionato, partite, stadi_da_scrivere, scrittore)
+        tempi[nome_campionato] = time.perf_counter() - inizio
+    inizio = time.perf_counter()
+    if not scrittore.chiudi():
+        print(f"❌ {scrittore.errori} scritture fallite: le impronte non vengono aggiornate, il prossimo giro ricalcola.")
+        return nodi, tempi
+    tempi['(attesa scritture)'] = time.perf_counter() - inizio
+
+    # Stesse impronte del percorso su file: gli input sono letti dopo che gli stadi a monte li hanno scritti.
+    # Solo gli output degli stadi riscritti (e gli input che aggiornano) vanno ri-hashati, gli altri input hanno l'hash del piano.
+    for nome_campionato, output in output_campionato.items():
+        for stadio in STADI:
+            if f"{stadio}:{nome_campionato}" in nodi:
+                for percorso in output[stadio] + input_riscritti(stadio, nome_campionato):
+                    hash_letti.pop(os.path.normpath(percorso), None)
+    for stadio in STADI:
+        for nome_campionato, output in output_campionato.items():
+            chiave = f"{stadio}:{nome_campionato}"
+            if chiave not in nodi:
+                continue
+            impronta, hash_input = impronta_input(input_nodo(stadio, nome_campionato, partite), hash_letti)
+            prodotti = sorted(set(os.path.normpath(p) for p in output[stadio] if os.path.exists(p)))
+            for percorso in set(stato['nodi'].get(chiave, {}).get('output', [])) - set(prodotti):
+                if os.path.exists(percorso):
+                    os.remove(percorso)
+                    print(f"🧹 Rimosso output non più prodotto: {percorso}")
+            stato['nodi'][chiave] = {'impronta': impronta, 'input': hash_input, 'output': prodotti,
+                                     'eseguito_il': datetime.now().isoformat(timespec='seconds')}
+    salva_stato_pipeline(stato)
+    return nodi, tempi
+
+# === PIANO ED ESECUZIONE ===
+def pianifica(stato: dict, partite: dict, forza: bool = False, hash_letti: dict = None) -> list:
+    """
+    [(nodo, motivi)] da ricalcolare sui file attuali; un nodo a valle di uno da ricalcolare lo è anch'esso.
+    hash_letti, se passato, raccoglie gli hash calcolati (riusati dopo l'esecuzione per i file non riscritti).
+    """
+    piano = []
+    for i_stadio, stadio in enumerate(STADI):
+        for nome_campionato in CAMPIONATI:
+            chiave = f"{stadio}:{nome_campionato}"
+            impronta, hash_input = impronta_input(input_nodo(stadio, nome_campionato, partite), hash_letti)
+            if hash_letti is not None:
+                hash_letti.update(hash_input)
+            motivi = ["--forza"] if forza else motivi_ricalcolo(stato['nodi'].get(chiave), impronta, hash_input)
+            monte = f"{STADI[i_stadio - 1]}:{nome_campionato}"
+            if not motivi and i_stadio > 0 and any(nodo == monte for nodo, _ in piano):
+                motivi = [f"a valle di {monte}"]
+            if motivi:
+                piano.append((chiave, motivi))
+    return piano
+
+def esegui_pipeline(dry_run=False, forza=False, scarica=True, push=True, in_memoria=False) -> list:
+    """
+    Percorre il grafo stadio per stadio. Le impronte di uno stadio sono calcolate dopo l'esecuzione di quello
+    precedente, quindi se un nodo a monte riscrive file identici i nodi a valle restano fermi.
+    In dry-run nulla viene eseguito: un nodo a valle di uno da ricalcolare è dato per ricalcolato anch'esso.
+    Restituisce la lista dei nodi (ricalcolati o, in dry-run, da ricalcolare).
+    """
+    inizio_totale = time.perf_counter()
+    if scarica:
+        if dry_run:
+            print("ℹ️  download: sempre eseguito (richieste condizionali); il piano sotto è calcolato sui file locali attuali.")
+        else:
+            import CSVNEW # Solo qui: richiede la rete e le dipendenze di download
+            CSVNEW.scarica_csv(numero_stagioni_passate=4)
+
+    stato = carica_stato_pipeline()
+    partite = partite_per_campionato()
+    da_ricalcolare, tempi = [], {}
+    if dry_run:
+        for chiave, motivi in pianifica(stato, partite, forza):
+            da_ricalcolare.append(chiave)
+            print(f"🔁 {chiave}: {'; '.join(motivi)}")
+    elif in_memoria:
+        da_ricalcolare, tempi = esegui_in_memoria(stato, partite, forza)
+    else:
+        for stadio in STADI:
+            for nome_campionato in CAMPIONATI:
+                chiave = f"{stadio}:{nome_campionato}"
+                impronta, hash_input = impronta_input(input_nodo(stadio, nome_campionato, partite))
+                motivi = ["--forza"] if forza else motivi_ricalcolo(stato['nodi'].get(chiave), impronta, hash_input)
+                if not motivi:
+                    continue
+                da_ricalcolare.append(chiave)
+                print(f"🔁 {chiave}: {'; '.join(motivi)}")
+                tempi[chiave] = esegui_nodo(stato, stadio, nome_campionato, partite, impronta, hash_input)
+
+    totale_nodi = len(STADI) * len(CAMPIONATI)
+    campionati_toccati = sorted({chiave.split(':', 1)[1] for chiave in da_ricalcolare})
+    if dry_run:
+        print(f"\n📋 Piano: {len(da_ricalcolare)} nodi su {totale_nodi} da ricalcolare, campionati: {campionati_toccati or 'nessuno'}")
+        return da_ricalcolare
+
+    print(f"\n--- Nodi ricalcolati ({len(da_ricalcolare)} su {totale_nodi}{', in memoria' if in_memoria else ''}) ---")
+    for chiave, secondi in tempi.items():
+        print(f"⏱️  {chiave}: {secondi:.2f}s")
+    print(f"⏱️  Totale: {time.perf_counter() - inizio_totale:.2f}s, campionati toccati: {campionati_toccati or 'nessuno'}")
+    if push and (da_ricalcolare or scarica):
+        git_push_pipeline(campionati_toccati, includi_dati_csv=scarica)
+    return da_ricalcolare
+
+def contatori_io():
+    """Byte letti e scritti dal processo (rchar/wchar di /proc/self/io, thread compresi). None se non disponibile."""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            contatori = dict(riga.split(':', 1) for riga in f.read().splitlines() if ':' in riga)
+        return int(contatori['rchar']), int(contatori['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def output_pipeline() -> dict:
+    """Hash di tutti i file prodotti dagli stadi (non lo stato della pipeline, che contiene orari)."""
+    cartelle = [CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_CORRENTI, CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_STORICHE,
+                CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_PROGRESSIVE, CALCOLO_MEDIE_NEW.CARTELLA_MEDIE_OUTPUT_V2,
+                PRONOSTICI_GENERATI.PATH_OUTPUT_PRONOSTICI_V2]
+    return {os.path.join(c, f): hash_file(os.path.join(c, f)) for c in cartelle if os.path.isdir(c) for f in sorted(os.listdir(c))}
+
+def confronta_in_memoria():
+    """
+    Ricalcolo completo (--forza, senza download né git) prima stadio per stadio tramite file, poi in memoria:
+    tempo, byte letti/scritti dal processo e confronto degli output byte per byte.
+    """
+    risultati = {}
+    for modalita in ["file", "memoria"]:
+        print(f"\n=== Ricalcolo completo: {modalita} ===")
+        io_prima = contatori_io()
+        inizio = time.perf_counter()
+        esegui_pipeline(forza=True, scarica=False, push=False, in_memoria=(modalita == "memoria"))
+        secondi = time.perf_counter() - inizio
+        io_dopo = contatori_io()
+        byte = (io_dopo[0] - io_prima[0], io_dopo[1] - io_prima[1]) if io_prima and io_dopo else None
+        risultati[modalita] = {'secondi': secondi, 'byte': byte, 'output': output_pipeline()}
+
+    print("\n--- Confronto file / memoria ---")
+    for modalita, r in risultati.items():
+        letti_scritti = f"letti {r['byte'][0] / 1e6:.1f} MB, scritti {r['byte'][1] / 1e6:.1f} MB" if r['byte'] else "byte non disponibili (/proc/self/io)"
+        print(f"⏱️  {modalita:8s}: {r['secondi']:.2f}s, {letti_scritti}")
+    output_file, output_memoria = risultati['file']['output'], risultati['memoria']['output']
+    diversi = sorted(p for p in set(output_file) | set(output_memoria) if output_file.get(p) != output_memoria.get(p))
+    if diversi:
+        print(f"❌ {len(diversi)} output diversi tra le due modalità: {_elenco_breve(diversi, massimo=10)}")
+    else:
+        print(f"✅ Output identici byte per byte ({len(output_file)} file).")
+    return not diversi
+
+def git_push_pipeline(campionati_toccati: list, includi_dati_csv: bool = False):
+    """Un solo commit con gli output di tutti gli stadi e lo stato della pipeline."""
+    cartelle = [CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_CORRENTI, CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_STORICHE,
+                CREA_CLASSIFICA.CARTELLA_CLASSIFICHE_PROGRESSIVE, CALCOLO_MEDIE_NEW.CARTELLA_MEDIE_OUTPUT_V2,
+                CALCOLO_MEDIE_NEW.FILE_STATO_FORZA_ESPONENZIALE, PRONOSTICI_GENERATI.PATH_OUTPUT_PRONOSTICI_V2, FILE_STATO_PIPELINE]
+    if includi_dati_csv:
+        cartelle += [CALCOLO_MEDIE_NEW.CARTELLA_DATI_CSV, CARTELLA_STORE_COLONNARE]
+    try:
+        # -A: registra anche gli output rimossi; si aggiunge solo ciò che esiste
+        subprocess.run(["git", "add", "-A"] + [c for c in cartelle if os.path.exists(c)], check=True)
+        result = subprocess.run(["git", "diff", "--staged", "--quiet"])
+        if result.returncode == 1:
+            subprocess.run(["git", "commit", "-m", f"Aggiornamento pipeline: {', '.join(campionati_toccati) or 'dati'}"], check=True)
+            subprocess.run(["git", "push"], check=True)
+            print("✅ Commit e push della pipeline completati.")
+        else:
+            print("✅ Nessuna modifica da committare.")
+    except subprocess.CalledProcessError as e:
+        print(f"❌ Errore durante il processo Git per la pipeline: {e}")
+    except Exception as e:
+        print(f"❌ Errore imprevisto durante il push Git della pipeline: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Esegue CSVNEW -> CREA_CLASSIFICA -> CALCOLO_MEDIE_NEW -> PRONOSTICI_GENERATI ricalcolando solo i campionati con input cambiati")
+    parser.add_argument("--dry-run", action="store_true", help="Stampa il piano (nodi da ricalcolare e perché) senza eseguire nulla")
+    parser.add_argument("--forza", action="store_true", help="Ricalcola tutti i nodi ignorando le impronte")
+    parser.add_argument("--senza-download", action="store_true", help="Non esegue CSVNEW: lavora sui CSV già presenti in dati_csv")
+    parser.add_argument("--senza-git", action="store_true", help="Non esegue commit e push al termine")
+    parser.add_argument("--in-memoria", action="store_true", help="Passa partite, classifiche e statistiche tra gli stadi in memoria; scritture su un thread dedicato")
+    parser.add_argument("--confronta-in-memoria", action="store_true", help="Ricalcola tutto tramite file e poi in memoria, confronta tempi, byte e output")
+    args = parser.parse_args()
+    if args.confronta_in_memoria:
+        confronta_in_memoria()
+    else:
+        esegui_pipeline(dry_run=args.dry_run, forza=args.forza, scarica=not args.senza_download, push=not args.senza_git,
+                        in_memoria=args.in_memoria)
@@ -7,6 +7,11 @@ import math
 from scipy.stats import poisson
 import subprocess
 import shutil # Aggiunto per svuota_cartella
+import time
+import hashlib
+import argparse
+import contextlib
+import io
 
 # === CONFIGURAZIONE GLOBALE ===
 PATH_PARTITE_INPUT = "./dati_flashscore"
@@ -125,39 +130,365 @@ def carica_alias_squadre(percorso: str) -> dict:
         df = pd.read_csv(percorso); return dict(zip(df['nome_flashscore'], df['nome_csv']))
     except FileNotFoundError: print(f"ERRORE: File alias squadre non trovato: {percorso}"); return {}
 
+# === REGISTRO ARBITRI ===
+PATH_REGISTRO_ARBITRI = "./registro_arbitri.json" # Registro serializzato di dati_arbitri, ricostruito se la cartella cambia (cache locale, in .gitignore)
+VERSIONE_REGISTRO_ARBITRI = 1
+STATISTICHE_DEFAULT_ARBITRO = {"falli_pg": 22.0, "gialli_pg": 4.0, "rossi_pg": 0.15, "rigori_pg": 0.20,
+                               "presenze": 0, "falli_per_contrasto": 0.0, "gialli_tot":0, "rossi_tot":0}
+
+def normalizza_nome_arbitro(nome_arbitro: str) -> str:
+    """Come il nome del file scritto da REFEREE.cerca_su_swisscows (arbitro_{nome senza spazi e punti}.json), in minuscolo."""
+    return nome_arbitro.replace(' ', '').replace('.', '').lower()
+
+def converti_statistiche_arbitro(dati_json: dict) -> dict:
+    """Statistiche del JSON convertite al tipo del valore di default (default se mancanti o non convertibili)."""
+    out = {}
+    for chiave, default_val in STATISTICHE_DEFAULT_ARBITRO.items():
+        try:
+            val_json = dati_json.get(chiave)
+            if val_json is None: out[chiave] = default_val
+            elif isinstance(default_val, float): out[chiave] = float(val_json)
+            elif isinstance(default_val, int): out[chiave] = int(val_json)
+            else: out[chiave] = val_json
+        except (ValueError, TypeError): out[chiave] = default_val
+    return out
+
+def firma_cartella_arbitri(percorso_dati_arbitri: str) -> list:
+    """[nome file, mtime_ns, dimensione] di ogni file della cartella: se cambia, il registro serializzato non vale più."""
+    firma = []
+    for file_name in sorted(os.listdir(percorso_dati_arbitri)):
+        st = os.stat(os.path.join(percorso_dati_arbitri, file_name))
+        firma.append([file_name, st.st_mtime_ns, st.st_size])
+    return firma
+
+class RegistroArbitri:
+    """
+    Tutti i file di dati_arbitri letti e convertiti una volta, indicizzati per nome normalizzato
+    (arbitro_{chiave}.json). Una ricerca è un accesso al dizionario; se il nome non è una chiave esatta si ripiega
+    sul confronto per sottostringa sul nome del file (quello originale), memorizzato per nome. Se la sottostringa
+    corrisponde a più file si usa il primo in ordine alfabetico e il caso finisce in `ambiguita`.
+    """
+    def __init__(self, voci: dict, firma: list):
+        self.voci = voci # nome file -> {'statistiche', 'nome_arbitro'} oppure {'errore'}
+        self.firma = firma
+        self.salvato = False # True se su disco c'è già questo registro (letto da file o salvato)
+        self.ambiguita = {} # nome cercato -> file corrispondenti (il primo è quello usato)
+        self._per_chiave = {}
+        for file_name in sorted(voci):
+            if file_name.startswith("arbitro_") and file_name.endswith(".json"):
+                chiave = file_name[len("arbitro_"):-len(".json")].lower().replace('_', '')
+                self._per_chiave.setdefault(chiave, file_name)
+        # Per ogni chiave, gli altri file in cui compare come sottostringa (la ricerca originale li avrebbe potuti prendere)
+        nomi_confronto = {f: f.lower().replace('_','') for f in sorted(voci)}
+        self._collisioni = {chiave: [f for f, nome in nomi_confronto.items() if f != file_name and chiave in nome]
+                            for chiave, file_name in self._per_chiave.items()}
+        self._ricerche = {}
+
+    @classmethod
+    def da_cartella(cls, percorso_dati_arbitri: str, firma: list):
+        voci = {}
+        for file_name, _, _ in firma:
+            try:
+                with open(os.path.join(percorso_dati_arbitri, file_name), 'r', encoding='utf-8') as f:
+                    dati_json = json.load(f)
+                voce = {'statistiche': converti_statistiche_arbitro(dati_json)}
+                if 'nome_arbitro' in dati_json: voce['nome_arbitro'] = dati_json['nome_arbitro']
+            except Exception as e:
+                voce = {'errore': str(e)}
+            voci[file_name] = voce
+        return cls(voci, firma)
+
+    @classmethod
+    def da_file(cls, percorso_registro: str, firma: list):
+        """Registro serializzato, se esiste ed è stato costruito dalla stessa cartella (stessa firma); altrimenti None."""
+        try:
+            with open(percorso_registro, 'r', encoding='utf-8') as f:
+                dati = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"ATTENZIONE: Registro arbitri illeggibile {percorso_registro}: {e}. Lo ricostruisco.")
+            return None
+        if dati.get('versione') != VERSIONE_REGISTRO_ARBITRI or dati.get('firma') != firma:
+            return None
+        registro = cls(dati['voci'], firma)
+        registro.salvato = True
+        return registro
+
+    def salva(self, percorso_registro: str):
+        percorso_tmp = percorso_registro + ".tmp"
+        with open(percorso_tmp, 'w', encoding='utf-8') as f:
+            json.dump({'versione': VERSIONE_REGISTRO_ARBITRI, 'firma': self.firma, 'voci': self.voci}, f, ensure_ascii=False, indent=1)
+        os.replace(percorso_tmp, percorso_registro)
+        self.salvato = True
+
+    def trova_file(self, nome_arbitro: str):
+        """File dell'arbitro (None se non trovato)."""
+        nome_arbitro_normalizzato = normalizza_nome_arbitro(nome_arbitro)
+        if not nome_arbitro_normalizzato: return None
+        esatto = self._per_chiave.get(nome_arbitro_normalizzato)
+        if esatto is not None:
+            if self._collisioni[nome_arbitro_normalizzato]:
+                self.ambiguita.setdefault(nome_arbitro, [esatto] + self._collisioni[nome_arbitro_normalizzato])
+            return esatto
+        if nome_arbitro_normalizzato in self._ricerche:
+            return self._ricerche[nome_arbitro_normalizzato]
+        corrispondenze = [f for f in sorted(self.voci) if nome_arbitro_normalizzato in f.lower().replace('_','')]
+        if len(corrispondenze) > 1:
+            self.ambiguita[nome_arbitro] = corrispondenze
+            print(f"ATTENZIONE: Arbitro '{nome_arbitro}' ambiguo: corrisponde a {', '.join(corrispondenze)}. Uso {corrispondenze[0]}.")
+        file_name = corrispondenze[0] if corrispondenze else None
+        self._ricerche[nome_arbitro_normalizzato] = file_name
+        return file_name
+
+    def report(self, nomi_arbitri) -> dict:
+        """Esito della ricerca per ogni nome: 'esatto', 'sottostringa', 'ambiguo' (più file, nessuna chiave esatta) o 'non trovato'."""
+        esiti = {}
+        for nome in nomi_arbitri:
+            file_name = self.trova_file(nome)
+            if file_name is None: esiti[nome] = ('non trovato', None)
+            elif normalizza_nome_arbitro(nome) in self._per_chiave: esiti[nome] = ('esatto', file_name)
+            elif nome in self.ambiguita: esiti[nome] = ('ambiguo', file_name)
+            else: esiti[nome] = ('sottostringa', file_name)
+        return esiti
+
+_REGISTRI_ARBITRI = {} # cartella -> (mtime della cartella, registro)
+
+def registro_arbitri(percorso_dati_arbitri: str, percorso_registro: str = PATH_REGISTRO_ARBITRI, salva: bool = True):
+    """
+    Registro della cartella, una volta per processo (di nuovo solo se nella cartella si aggiungono o tolgono file).
+    Si parte dal registro serializzato se la cartella non è cambiata, altrimenti lo si ricostruisce e lo si salva.
+    Con salva=False (es. per pianificare la pipeline) non scrive nulla: il salvataggio avviene alla prima richiesta con salva=True.
+    None se la cartella non esiste.
+    """
+    try:
+        mtime_cartella = os.stat(percorso_dati_arbitri).st_mtime_ns
+    except OSError:
+        return None
+    aperto = _REGISTRI_ARBITRI.get(percorso_dati_arbitri)
+    if aperto is not None and aperto[0] == mtime_cartella:
+        registro = aperto[1]
+    else:
+        firma = firma_cartella_arbitri(percorso_dati_arbitri)
+        registro = RegistroArbitri.da_file(percorso_registro, firma)
+        if registro is None:
+            registro = RegistroArbitri.da_cartella(percorso_dati_arbitri, firma)
+        _REGISTRI_ARBITRI[percorso_dati_arbitri] = (mtime_cartella, registro)
+    if salva and not registro.salvato:
+        try:
+            registro.salva(percorso_registro)
+        except OSError as e:
+            print(f"ATTENZIONE: Impossibile salvare il registro arbitri {percorso_registro}: {e}")
+    return registro
+
+def trova_file_arbitro(nome_arbitro: str, percorso_dati_arbitri: str, salva_registro: bool = True):
+    """File di dati_arbitri dell'arbitro (None se non trovato): chiave esatta, altrimenti il nome normalizzato contenuto nel nome del file."""
+    if not nome_arbitro or not isinstance(nome_arbitro, str): return None
+    registro = registro_arbitri(percorso_dati_arbitri, salva=salva_registro)
+    return registro.trova_file(nome_arbitro) if registro is not None else None
+
 def carica_dati_arbitro_safe(nome_arbitro: str, percorso_dati_arbitri: str) -> dict:
-    # (Identica alla versione precedente, con fallback e conversione tipi)
+    # Fallback ai valori di default se l'arbitro non è nel registro o il suo file è illeggibile
     dati_default_arbitro = {
-        "falli_pg": 22.0, "gialli_pg": 4.0, "rossi_pg": 0.15, "rigori_pg": 0.20,
-        "presenze": 0, "falli_per_contrasto": 0.0, "gialli_tot":0, "rossi_tot":0,
+        **STATISTICHE_DEFAULT_ARBITRO,
         "nome_arbitro_originale": nome_arbitro if nome_arbitro else "Non Trovato",
         'statistiche_trovate': False
     }
     if not nome_arbitro or not isinstance(nome_arbitro, str): return dati_default_arbitro
-    nome_arbitro_normalizzato = nome_arbitro.replace(' ', '').replace('.', '').lower()
-    if not nome_arbitro_normalizzato: return dati_default_arbitro
+    registro = registro_arbitri(percorso_dati_arbitri)
+    if registro is None:
+        print(f"ATTENZIONE: Cartella dati arbitri non trovata: {percorso_dati_arbitri}."); return dati_default_arbitro
+    file_name = registro.trova_file(nome_arbitro)
+    if file_name is None: return dati_default_arbitro
+    voce = registro.voci[file_name]
+    if 'errore' in voce:
+        print(f"ATTENZIONE: Errore caricamento dati arbitro {nome_arbitro}: {voce['errore']}."); return dati_default_arbitro
+    out = dict(voce['statistiche'])
+    out['statistiche_trovate'] = True
+    out['nome_arbitro_originale'] = voce.get('nome_arbitro', nome_arbitro)
+    return out
+
+def report_arbitri(percorso_partite=PATH_PARTITE_INPUT, percorso_dati_arbitri=PATH_DATI_ARBITRI):
+    """Come vengono risolti gli arbitri delle partite in dati_flashscore, con i casi ambigui."""
+    registro = registro_arbitri(percorso_dati_arbitri)
+    if registro is None:
+        print(f"ATTENZIONE: Cartella dati arbitri non trovata: {percorso_dati_arbitri}."); return
+    nomi = []
+    for file_partita_json in sorted(os.listdir(percorso_partite)):
+        if not file_partita_json.endswith(".json"): continue
+        with open(os.path.join(percorso_partite, file_partita_json), 'r', encoding='utf-8') as f:
+            arbitro = json.load(f).get("arbitro")
+        if arbitro and isinstance(arbitro, str) and arbitro not in nomi: nomi.append(arbitro)
+    esiti = registro.report(nomi)
+    for nome, (esito, file_name) in esiti.items():
+        print(f"   {esito:12s} {nome} -> {file_name or '-'}")
+        if nome in registro.ambiguita:
+            print(f"                ⚠️  la sottostringa corrisponde anche a: {', '.join(registro.ambiguita[nome][1:])}")
+    conteggi = {e: sum(1 for v, _ in esiti.values() if v == e) for e in ('esatto', 'sottostringa', 'ambiguo', 'non trovato')}
+    print(f"📋 {len(registro.voci)} file nel registro, {len(nomi)} arbitri nelle partite: {conteggi}")
+    return esiti
+
+# Colonne delle statistiche V2 effettivamente usate dal modello (tutte le altre sono solo esportazione)
+PREFISSI_COLONNE_STATISTICHE_USATE = ('forza_attacco_', 'forza_difesa_', 'num_partite_')
+COLONNE_STATISTICHE_USATE = ('posizione_classifica_attuale', 'forma_avanzata_totale')
+VERSIONE_SCHEMA_STORE_V2 = 1 # Deve coincidere con quella scritta da CALCOLO_MEDIE_NEW.py
+
+_STORE_STATISTICHE_APERTI = {} # percorso -> (mtime, matrici per tipo, indice squadre, colonne dello schema)
+
+def _apri_store_statistiche_V2(file_prefix_campionato: str, percorso_base: str):
+    """Apre (una volta per processo, o se il file cambia) lo store .npz scritto da CALCOLO_MEDIE_NEW.py; None se assente."""
+    file_path = os.path.join(percorso_base, f"{file_prefix_campionato}_statistiche_avanzate_V2.npz")
     try:
-        for file_name in os.listdir(percorso_dati_arbitri):
-            if nome_arbitro_normalizzato in file_name.lower().replace('_',''):
-                with open(os.path.join(percorso_dati_arbitri, file_name), 'r', encoding='utf-8') as f:
-                    dati_json = json.load(f); out = {}
-                    for chiave, default_val in dati_default_arbitro.items():
-                        if chiave == "nome_arbitro_originale": continue
-                        try:
-                            val_json = dati_json.get(chiave)
-                            if val_json is None: out[chiave] = default_val
-                            elif isinstance(default_val, float): out[chiave] = float(val_json)
-                            elif isinstance(default_val, int): out[chiave] = int(val_json)
-                            else: out[chiave] = val_json
-                        except (ValueError, TypeError): out[chiave] = default_val
-                    out['nome_arbitro_originale'] = dati_json.get('nome_arbitro', nome_arbitro)
-                    out['statistiche_trovate'] = True
-                    return out
-    except FileNotFoundError: print(f"ATTENZIONE: Cartella dati arbitri non trovata: {percorso_dati_arbitri}.")
-    except Exception as e: print(f"ATTENZIONE: Errore caricamento dati arbitro {nome_arbitro}: {e}.")
-    return dati_default_arbitro
+        mtime = os.path.getmtime(file_path)
+    except OSError:
+        return None
+    aperto = _STORE_STATISTICHE_APERTI.get(file_path)
+    if aperto is None or aperto[0] != mtime:
+        try:
+            with np.load(file_path) as npz:
+                schema = json.loads(str(npz['schema']))
+                if schema.get('versione') != VERSIONE_SCHEMA_STORE_V2:
+                    print(f"ATTENZIONE: Versione schema store non supportata in {file_path}. Uso il CSV.")
+                    return None
+                matrici = {'float32': npz['valori_float32'], 'int32': npz['valori_int32']}
+                indice_squadre = {nome: i for i, nome in enumerate(npz['squadre'].tolist())}
+            colonne = {c['nome']: (c['tipo'], c['riga']) for c in schema['colonne']}
+        except Exception as e:
+            print(f"ATTENZIONE: Store statistiche illeggibile {file_path}: {e}. Uso il CSV.")
+            return None
+        aperto = (mtime, matrici, indice_squadre, colonne)
+        _STORE_STATISTICHE_APERTI[file_path] = aperto
+    return aperto
+
+def colonne_statistiche_usate(tutte_le_colonne) -> list:
+    return [c for c in tutte_le_colonne if c.startswith(PREFISSI_COLONNE_STATISTICHE_USATE) or c in COLONNE_STATISTICHE_USATE]
+
+def carica_statistiche_squadre_store_V2(nomi_squadre_std: list, file_prefix_campionato: str, percorso_base: str, colonne=None):
+    """
+    Legge dallo store binario solo le colonne richieste (default: quelle usate dal modello) per le squadre richieste.
+    Restituisce {squadra: dict} con gli stessi valori del CSV: float32 riportati a 4 decimali (il CSV ne ha al più 3),
+    interi come int, NaN come 0. None se lo store non è disponibile; le squadre non presenti mancano dal risultato.
+    """
+    aperto = _apri_store_statistiche_V2(file_prefix_campionato, percorso_base)
+    if aperto is None:
+        return None
+    _, matrici, indice_squadre, colonne_store = aperto
+    colonne = colonne_statistiche_usate(colonne_store) if colonne is None else [c for c in colonne if c in colonne_store]
+    risultato = {}
+    for nome in nomi_squadre_std:
+        if nome not in indice_squadre:
+            continue
+        j = indice_squadre[nome]
+        record = {'squadra': nome}
+        for colonna in colonne:
+            tipo, riga = colonne_store[colonna]
+            v = matrici[tipo][riga, j]
+            if tipo == 'int32':
+                record[colonna] = int(v)
+            else:
+                record[colonna] = 0 if np.isnan(v) else round(float(v), 4)
+        risultato[nome] = record
+    return risultato
+
+# === CACHE PER CAMPIONATO DEI FILE LETTI A OGNI PARTITA ===
+FINESTRA_MTIME_INCERTO = 2.0 # Secondi: un file scritto così a ridosso della lettura potrebbe cambiare senza che mtime/dimensione lo mostrino
+
+def _hash_contenuto(percorso: str) -> str:
+    h = hashlib.sha256()
+    with open(percorso, 'rb') as f:
+        for blocco in iter(lambda: f.read(1 << 20), b''):
+            h.update(blocco)
+    return h.hexdigest()
+
+class CacheCampionati:
+    """
+    Cache per processo dei file di campionato usati da ogni partita: tabella delle statistiche V2 indicizzata
+    per squadra, medie generali, classifica corrente. Ogni file è caricato una volta; a ogni accesso un os.stat
+    confronta mtime e dimensione e, se sono cambiati (o il file è stato scritto a ridosso dell'ultima verifica),
+    l'hash del contenuto: si ricarica solo se il contenuto è cambiato davvero.
+    I valori restituiti sono condivisi: chi li usa non deve modificarli sul posto.
+    """
+    def __init__(self):
+        self._voci = {} # percorso -> {'firma': (mtime_ns, dimensione), 'hash', 'verificato_il', 'valore'}
+        self.hit = 0
+        self.miss = 0
+        self.verifiche_hash = 0
+
+    def ottieni(self, percorso: str, caricatore):
+        """Valore di caricatore(percorso), dalla cache se il file non è cambiato. File assente: caricatore ogni volta, nulla in cache."""
+        try:
+            st = os.stat(percorso)
+        except OSError:
+            self._voci.pop(percorso, None)
+            self.miss += 1
+            return caricatore(percorso) # Stampa lui l'errore e restituisce il valore vuoto
+        firma = (st.st_mtime_ns, st.st_size)
+        voce = self._voci.get(percorso)
+        if voce is not None:
+            incerto = st.st_mtime_ns / 1e9 >= voce['verificato_il'] - FINESTRA_MTIME_INCERTO
+            if voce['firma'] == firma and not incerto:
+                self.hit += 1
+                return voce['valore']
+            self.verifiche_hash += 1
+            verificato_il = time.time()
+            if _hash_contenuto(percorso) == voce['hash']:
+                voce['firma'], voce['verificato_il'] = firma, verificato_il
+                self.hit += 1
+                return voce['valore']
+        self.miss += 1
+        # Hash prima della lettura: se il file cambia nel mezzo, al prossimo accesso l'hash non coincide e si ricarica
+        verificato_il = time.time()
+        contenuto_hash = _hash_contenuto(percorso)
+        valore = caricatore(percorso)
+        self._voci[percorso] = {'firma': firma, 'hash': contenuto_hash, 'verificato_il': verificato_il, 'valore': valore}
+        return valore
+
+    def svuota(self):
+        self._voci.clear()
+
+_CACHE_CAMPIONATI = CacheCampionati()
+
+def _righe_statistiche_store(file_path: str):
+    """{squadra: statistiche} di tutte le squadre dello store .npz; None se lo store non è utilizzabile."""
+    percorso_base, nome_file = os.path.split(file_path)
+    file_prefix_campionato = nome_file[:-len("_statistiche_avanzate_V2.npz")]
+    _STORE_STATISTICHE_APERTI.pop(file_path, None) # La cache ha già stabilito che il contenuto è nuovo
+    aperto = _apri_store_statistiche_V2(file_prefix_campionato, percorso_base)
+    if aperto is None:
+        return None
+    return carica_statistiche_squadre_store_V2(list(aperto[2]), file_prefix_campionato, percorso_base)
+
+def _righe_statistiche_csv(file_path: str):
+    """{squadra: statistiche} dal CSV, con gli stessi valori di carica_statistiche_squadra_V2_csv; None se illeggibile."""
+    try:
+        df = pd.read_csv(file_path)
+    except FileNotFoundError:
+        print(f"ERRORE CRITICO: File V2 statistiche squadre non trovato: {file_path}."); return None
+    except Exception as e:
+        print(f"Errore caricamento V2 statistiche da {file_path}: {e}"); return None
+    righe = {}
+    for i, nome in enumerate(df['squadra']):
+        if nome not in righe: # Come il filtro originale: vale la prima riga della squadra
+            righe[nome] = df.iloc[i].fillna(0).to_dict()
+    return righe
 
 def carica_statistiche_squadra_V2(nome_squadra_std: str, file_prefix_campionato: str, percorso_base: str) -> dict:
+    """Statistiche V2 di una squadra: dallo store binario se presente, altrimenti dal CSV. Tabella del campionato in cache."""
+    file_path_store = os.path.join(percorso_base, f"{file_prefix_campionato}_statistiche_avanzate_V2.npz")
+    righe = _CACHE_CAMPIONATI.ottieni(file_path_store, _righe_statistiche_store)
+    if righe is not None:
+        if nome_squadra_std in righe: return righe[nome_squadra_std]
+        print(f"ATTENZIONE: Squadra '{nome_squadra_std}' non trovata nello store di {file_prefix_campionato}")
+        return {}
+    file_path = os.path.join(percorso_base, f"{file_prefix_campionato}_statistiche_avanzate_V2.csv")
+    righe = _CACHE_CAMPIONATI.ottieni(file_path, _righe_statistiche_csv)
+    if righe is None:
+        return {}
+    if nome_squadra_std in righe: return righe[nome_squadra_std]
+    print(f"ATTENZIONE: Squadra '{nome_squadra_std}' non trovata in {file_path}")
+    return {}
+
+def carica_statistiche_squadra_V2_csv(nome_squadra_std: str, file_prefix_campionato: str, percorso_base: str) -> dict:
     file_path = os.path.join(percorso_base, f"{file_prefix_campionato}_statistiche_avanzate_V2.csv")
     try:
         df = pd.read_csv(file_path)
@@ -170,6 +501,9 @@ def carica_statistiche_squadra_V2(nome_squadra_std: str, file_prefix_campionato:
 
 def carica_medie_generali_campionato_V2(file_prefix_campionato: str, percorso_base: str) -> dict:
     file_path = os.path.join(percorso_base, f"{file_prefix_campionato}_medie_campionato_V2.json")
+    return _CACHE_CAMPIONATI.ottieni(file_path, _leggi_medie_generali)
+
+def _leggi_medie_generali(file_path: str) -> dict:
     try:
         with open(file_path, 'r', encoding='utf-8') as f: return json.load(f)
     except FileNotFoundError: print(f"ERRORE CRITICO: File V2 medie campionato non trovato: {file_path}.")
@@ -178,56 +512,89 @@ def carica_medie_generali_campionato_V2(file_prefix_campionato: str, percorso_ba
 
 def carica_classifica_corrente(file_prefix_campionato: str, percorso_base_classifiche: str) -> pd.DataFrame:
     file_path = os.path.join(percorso_base_classifiche, f"classifica_{file_prefix_campionato}_corrente.csv")
+    return _CACHE_CAMPIONATI.ottieni(file_path, _leggi_classifica_corrente)
+
+def _leggi_classifica_corrente(file_path: str) -> pd.DataFrame:
     try:
         return pd.read_csv(file_path)
     except FileNotFoundError: print(f"ATTENZIONE: File classifica corrente non trovato: {file_path}")
     except Exception as e: print(f"Errore caricamento classifica corrente da {file_path}: {e}")
     return pd.DataFrame()
 
-def get_h2h_stats(squadra_casa_std: str, squadra_trasf_std: str, num_partite_h2h: int,
-                  nome_file_campionato_attuale:str, alias_dict: dict) -> dict:
-    """Estrae statistiche H2H dalle ultime N partite tra le due squadre."""
-    h2h_summary = {"partite_analizzate": 0, "vittorie_casa": 0, "pareggi": 0, "vittorie_trasferta": 0,
-                   "media_gol_casa": 0, "media_gol_trasferta": 0, "media_gol_totali": 0}
-    partite_considerate = []
-    
-    # Cerca nei file CSV storici (assumendo che CSV.py li abbia scaricati)
-    # Dovrebbe cercare solo nei file del campionato corretto.
-    # Per semplicità, iteriamo su tutti i file CSV nella cartella dati_csv
-    # e filtriamo quelli che appartengono allo stesso campionato delle squadre
-    # (Questa parte potrebbe essere ottimizzata se sapessimo il campionato storico degli H2H)
-
-    all_csv_files = sorted(glob.glob(os.path.join(PATH_DATI_CSV_STORICI, f"{nome_file_campionato_attuale}_*.csv")), reverse=True)
+# === INDICE DEGLI SCONTRI DIRETTI (H2H) ===
+COLONNE_H2H = ['squadra_casa', 'squadra_trasferta', 'gol_casa', 'gol_trasferta']
+H2H_DIVISIONI_COLLEGATE = {} # Es. {"serie_a": ["serie_b"]}: cerca gli H2H anche nelle stagioni di altre divisioni (vuoto = solo il campionato)
 
-    for file_csv in all_csv_files: # Considera più stagioni per H2H
-        try:
-            df_match = pd.read_csv(file_csv)
-            # Assicurati che le colonne dei nomi squadra e gol esistano
-            if not all(col in df_match.columns for col in ['squadra_casa', 'squadra_trasferta', 'gol_casa', 'gol_trasferta']):
-                continue
-            
-            # Filtra partite H2H
-            h2h_matches = df_match[
-                ((df_match['squadra_casa'] == squadra_casa_std) & (df_match['squadra_trasferta'] == squadra_trasf_std)) |
-                ((df_match['squadra_casa'] == squadra_trasf_std) & (df_match['squadra_trasferta'] == squadra_casa_std))
-            ]
-            partite_considerate.extend(h2h_matches.to_dict('records'))
-        except Exception as e:
-            print(f"    Errore lettura H2H da {file_csv}: {e}")
-            continue
-            
-    if not partite_considerate: return h2h_summary
-    
-    # Ordina per data (se la colonna 'data' è presente e formattata correttamente)
+class IndiceH2H:
+    """
+    Scontri diretti indicizzati per coppia non ordinata di squadre, dal più recente: data mancante in fondo e,
+    a parità di data, nell'ordine di lettura (stagioni dalla più recente, righe del file), come l'ordinamento
+    della scansione originale. Le ultime N partite di una coppia sono un accesso al dizionario più una fetta.
+    """
+    def __init__(self, partite_stagioni: list):
+        """partite_stagioni: DataFrame delle stagioni nell'ordine di ricerca (dalla più recente); None e file senza colonne sono saltati."""
+        self._coppie = {}
+        blocchi = [df[[c for c in COLONNE_H2H + ['data'] if c in df.columns]] for df in partite_stagioni
+                   if df is not None and all(c in df.columns for c in COLONNE_H2H)]
+        if not blocchi:
+            return
+        df = pd.concat(blocchi, ignore_index=True)
+        date = pd.to_datetime(df['data'], errors='coerce') if 'data' in df.columns else pd.Series(pd.NaT, index=df.index)
+        nat = date.isna().to_numpy()
+        valori_data = date.to_numpy(dtype='datetime64[ns]').view('i8')
+        chiave_data = np.where(nat, np.iinfo(np.int64).max, -np.where(nat, 0, valori_data)) # Crescente = più recente, NaT in fondo
+        ordine = np.lexsort((np.arange(len(df)), chiave_data))
+        casa, trasferta = df['squadra_casa'].tolist(), df['squadra_trasferta'].tolist()
+        gol_casa, gol_trasferta = df['gol_casa'].tolist(), df['gol_trasferta'].tolist()
+        for i in ordine.tolist():
+            c, t = casa[i], trasferta[i]
+            if not (isinstance(c, str) and isinstance(t, str)): continue # Come il confronto di stringhe originale: nomi mancanti non corrispondono mai
+            self._coppie.setdefault((c, t) if c <= t else (t, c), []).append(
+                {'squadra_casa': c, 'squadra_trasferta': t, 'gol_casa': gol_casa[i], 'gol_trasferta': gol_trasferta[i]})
+
+    def ultime(self, squadra_a: str, squadra_b: str, num_partite: int) -> list:
+        """Ultime num_partite tra le due squadre, in qualunque campo, dalla più recente."""
+        return self._coppie.get((squadra_a, squadra_b) if squadra_a <= squadra_b else (squadra_b, squadra_a), [])[:num_partite]
+
+    def coppie(self) -> list:
+        return list(self._coppie)
+
+def _leggi_partite_h2h(file_csv: str):
     try:
-        df_partite_considerate = pd.DataFrame(partite_considerate)
-        df_partite_considerate['data'] = pd.to_datetime(df_partite_considerate['data'], errors='coerce')
-        df_partite_considerate.sort_values(by='data', ascending=False, inplace=True)
-        partite_considerate = df_partite_considerate.head(num_partite_h2h).to_dict('records')
-    except KeyError: # Colonna 'data' mancante o formato errato
-        partite_considerate = partite_considerate[:num_partite_h2h] # Prendi le più recenti trovate
+        return pd.read_csv(file_csv)
+    except Exception as e:
+        print(f"    Errore lettura H2H da {file_csv}: {e}")
+        return None
+
+_INDICI_H2H = {} # campionato -> (DataFrame delle stagioni da cui è costruito, indice)
 
+def indice_h2h_campionato(nome_file_campionato_attuale: str, percorso: str = PATH_DATI_CSV_STORICI) -> IndiceH2H:
+    """
+    Indice H2H del campionato (più le divisioni collegate) dai file di dati_csv, costruito una volta per processo.
+    I file passano per _CACHE_CAMPIONATI: se uno cambia viene riletto e l'indice ricostruito.
+    """
+    file_csv = [f for prefisso in [nome_file_campionato_attuale] + H2H_DIVISIONI_COLLEGATE.get(nome_file_campionato_attuale, [])
+                for f in sorted(glob.glob(os.path.join(percorso, f"{prefisso}_*.csv")), reverse=True)]
+    partite_stagioni = [_CACHE_CAMPIONATI.ottieni(f, _leggi_partite_h2h) for f in file_csv]
+    costruito = _INDICI_H2H.get(nome_file_campionato_attuale)
+    if costruito is None or len(costruito[0]) != len(partite_stagioni) or any(a is not b for a, b in zip(costruito[0], partite_stagioni)):
+        costruito = (partite_stagioni, IndiceH2H(partite_stagioni))
+        _INDICI_H2H[nome_file_campionato_attuale] = costruito
+    return costruito[1]
+
+def get_h2h_stats(squadra_casa_std: str, squadra_trasf_std: str, num_partite_h2h: int,
+                  nome_file_campionato_attuale:str, alias_dict: dict, indice_h2h: IndiceH2H = None) -> dict:
+    """
+    Estrae statistiche H2H dalle ultime N partite tra le due squadre.
+    indice_h2h (es. costruito in memoria dalla pipeline), se passato, sostituisce quello dei file di dati_csv.
+    """
+    if indice_h2h is None:
+        indice_h2h = indice_h2h_campionato(nome_file_campionato_attuale)
+    return riepilogo_h2h(indice_h2h.ultime(squadra_casa_std, squadra_trasf_std, num_partite_h2h), squadra_casa_std)
 
+def riepilogo_h2h(partite_considerate: list, squadra_casa_std: str) -> dict:
+    h2h_summary = {"partite_analizzate": 0, "vittorie_casa": 0, "pareggi": 0, "vittorie_trasferta": 0,
+                   "media_gol_casa": 0, "media_gol_trasferta": 0, "media_gol_totali": 0}
     if not partite_considerate: return h2h_summary
 
     h2h_summary["partite_analizzate"] = len(partite_considerate)
@@ -256,88 +623,36 @@ def get_h2h_stats(squadra_casa_std: str, squadra_trasf_std: str, num_partite_h2h
     
     return h2h_summary
 
+def _tempo_medio(funzione, ripetizioni=200) -> float:
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        funzione()
+    return (time.perf_counter() - inizio) / ripetizioni
+
+def benchmark_h2h(campionati=None, num_partite=(1, 6, 50)) -> bool:
+    """Tempo di costruzione dell'indice H2H per campionato e tempo per ricerca su tutte le coppie, nei due versi."""
+    campionati = campionati or sorted(set(MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.values()))
+    ricerche, tempo_indice = 0, 0.0
+    for prefix in campionati:
+        inizio = time.perf_counter()
+        indice = indice_h2h_campionato(prefix)
+        tempo_costruzione = time.perf_counter() - inizio
+        coppie = sorted(indice.coppie())
+        inizio = time.perf_counter()
+        for squadra_a, squadra_b in coppie:
+            for casa, trasferta in ((squadra_a, squadra_b), (squadra_b, squadra_a)):
+                for n in num_partite:
+                    get_h2h_stats(casa, trasferta, n, prefix, {}, indice)
+        tempo_indice += time.perf_counter() - inizio
+        ricerche += 2 * len(coppie) * len(num_partite)
+        print(f"   {prefix}: {len(coppie)} coppie, indice costruito in {tempo_costruzione * 1e3:.1f} ms")
+    print(f"🔎 Controllo di aggiornamento dell'indice (glob + stat dei file): "
+          f"{_tempo_medio(lambda: indice_h2h_campionato(campionati[-1])) * 1e6:.0f} µs per partita")
+    print(f"⏱️  Indice: {tempo_indice / max(ricerche, 1) * 1e6:.1f} µs per ricerca ({ricerche} ricerche)")
+    return True
 
-# === MOTORE POISSON E FUNZIONI DI CALCOLO V2 ===
-
-def get_tier_squadra(posizione: int, num_squadre: int) -> str:
-    if num_squadre == 0: return "Mid" 
-    num_top = math.ceil(PERC_TIER_TOP * num_squadre)
-    num_bottom = math.ceil(PERC_TIER_BOTTOM * num_squadre)
-    if posizione <= num_top: return "Top"
-    elif posizione > (num_squadre - num_bottom): return "Bottom"
-    else: return "Mid"
-
-def calcola_expected_goals_v2(stats_team: dict, stats_opponent: dict,
-                              media_fatti_ruolo_campionato: float,
-                              ruolo_team: str, # "casa" o "trasferta"
-                              tier_opponent: str, # "Top", "Mid", "Bottom"
-                              rank_simile_opponent: bool, # True se l'avversario è di rango simile
-                              stat_base_name: str = "gol") -> float:
-    if not all([stats_team, stats_opponent]): return 0.5 
-
-    # 1. Forza Generale Recente (fallback primario)
-    forza_att_generale = stats_team.get(f'forza_attacco_{stat_base_name}_{ruolo_team}_generale_recente', 1.0)
-    ruolo_opponent = "trasferta" if ruolo_team == "casa" else "casa"
-    forza_dif_generale_opp = stats_opponent.get(f'forza_difesa_{stat_base_name}_{ruolo_opponent}_generale_recente', 1.0)
-    
-    xg = forza_att_generale * forza_dif_generale_opp * media_fatti_ruolo_campionato
-
-    # 2. Aggiustamento Tier Opponent (se dati condizionali validi)
-    num_partite_vs_tier = stats_team.get(f'num_partite_{ruolo_team}_VS_{tier_opponent}', 0)
-    if num_partite_vs_tier >= MIN_PARTITE_PER_STAT_COND:
-        forza_att_vs_tier = stats_team.get(f'forza_attacco_{stat_base_name}_{ruolo_team}_VS_{tier_opponent}', forza_att_generale)
-        # Usiamo la forza difesa generale dell'avversario come base, perché non abbiamo forza_dif_opponent_VS_mio_tier
-        xg_tier_adj = forza_att_vs_tier * forza_dif_generale_opp * media_fatti_ruolo_campionato
-        # Media ponderata tra xG generale e xG vs Tier (più peso a vs Tier se più partite)
-        peso_tier = min(1.0, num_partite_vs_tier / 10.0) * PESO_CLASSIFICA_TIER_XG # Es. max 10% di aggiustamento
-        xg = xg * (1 - peso_tier) + xg_tier_adj * peso_tier
-
-
-    # 3. Aggiustamento Rango Simile (se dati condizionali validi e non sovrapposto a tier)
-    # Questo aggiustamento è più specifico, applichiamolo dopo quello del tier
-    if rank_simile_opponent:
-        num_partite_vs_simile = stats_team.get(f'num_partite_{ruolo_team}_VS_Simile', 0)
-        if num_partite_vs_simile >= MIN_PARTITE_PER_STAT_COND:
-            forza_att_vs_simile = stats_team.get(f'forza_attacco_{stat_base_name}_{ruolo_team}_VS_Simile', forza_att_generale)
-            xg_simile_adj = forza_att_vs_simile * forza_dif_generale_opp * media_fatti_ruolo_campionato
-            peso_simile = min(1.0, num_partite_vs_simile / 10.0) * PESO_CLASSIFICA_SIMILAR_XG
-            xg = xg * (1 - peso_simile) + xg_simile_adj * peso_simile
-            
-    return max(0.05, xg)
-
-
-def aggiusta_xg_h2h_forma_arbitro(xg_casa: float, xg_trasferta: float,
-                                  stats_casa: dict, stats_trasferta: dict,
-                                  h2h_stats: dict, dati_arbitro: dict) -> tuple[float, float]:
-    xg_c, xg_t = xg_casa, xg_trasferta
-
-    # Aggiustamento H2H (se ci sono partite analizzate)
-    if h2h_stats.get("partite_analizzate", 0) >= 2: # Almeno 2 partite H2H
-        diff_gol_h2h = h2h_stats["media_gol_casa"] - h2h_stats["media_gol_trasferta"]
-        # Se la squadra di casa ha dominato H2H, aumenta un po' il suo xG e viceversa
-        xg_c += diff_gol_h2h * PESO_H2H_XG
-        xg_t -= diff_gol_h2h * PESO_H2H_XG # Aggiustamento simmetrico
-
-    # Aggiustamento Forma
-    forma_casa = stats_casa.get('forma_avanzata_totale', 0.5)
-    forma_trasferta = stats_trasferta.get('forma_avanzata_totale', 0.5)
-    xg_c = xg_c * (1 + (forma_casa - 0.5) * PESO_FORMA_XG)
-    xg_t = xg_t * (1 + (forma_trasferta - 0.5) * PESO_FORMA_XG)
-
-    # Aggiustamento Arbitro
-    falli_pg_arbitro = dati_arbitro.get("falli_pg", 21.5) 
-    if falli_pg_arbitro > 24.5:
-        adj_factor = 1.0 + PESO_ARBITRO_FALLI_XG_NEG 
-        xg_c *= adj_factor; xg_t *= adj_factor
-    elif falli_pg_arbitro < 18.5: 
-        adj_factor = 1.0 + PESO_ARBITRO_FALLI_XG_POS
-        xg_c *= adj_factor; xg_t *= adj_factor
-        
-    rigori_pg_arbitro = dati_arbitro.get("rigori_pg", 0.20)
-    xg_c += rigori_pg_arbitro * PESO_ARBITRO_RIGORI_XG
-    xg_t += rigori_pg_arbitro * PESO_ARBITRO_RIGORI_XG
 
-    return max(0.05, xg_c), max(0.05, xg_t)
+# === MOTORE POISSON E FUNZIONI DI CALCOLO V2 ===
 
 # Le funzioni genera_matrice_probabilita_poisson, get_pronostico_secco..., estrai_pronostici_da_matrice
 # calcola_expected_valore_stat, normalizza_linea_stat, formatta_pronostico_uo_stat,
@@ -346,13 +661,73 @@ def aggiusta_xg_h2h_forma_arbitro(xg_casa: float, xg_trasferta: float,
 # (con piccoli aggiustamenti se necessari, come il TOP_N_RISULTATI_ESATTI a 4)
 # Le includo qui per completezza, assicurandomi che usino le costanti corrette.
 
+def marginali_poisson(xg, max_gol: int) -> np.ndarray:
+    """
+    P(gol = 0..max_gol) per ogni xg (qualsiasi forma), ultima cella = coda P(gol >= max_gol).
+    Ricorrenza p(i) = p(i-1) * xg / i: il ciclo è sui gol, non sulle partite.
+    """
+    xg = np.asarray(xg, dtype=float)
+    prob = np.empty(xg.shape + (max_gol + 1,))
+    prob[..., 0] = np.exp(-xg)
+    for i in range(1, max_gol + 1):
+        prob[..., i] = prob[..., i - 1] * xg / i
+    prob[..., -1] = np.maximum(0, 1 - np.sum(prob[..., :-1], axis=-1))
+    return prob
+
+def genera_matrici_probabilita_poisson(xg_casa, xg_trasferta, max_gol: int) -> np.ndarray:
+    """
+    Matrici dei risultati di N partite in un colpo: tensore N x (max_gol+1) x (max_gol+1) con [n, i, j] = P(casa i, trasferta j),
+    prodotto esterno delle marginali (gol indipendenti, coda ripiegata nell'ultima riga/colonna).
+    """
+    prob_casa = marginali_poisson(np.atleast_1d(xg_casa), max_gol)
+    prob_trasferta = marginali_poisson(np.atleast_1d(xg_trasferta), max_gol)
+    return prob_casa[:, :, None] * prob_trasferta[:, None, :]
+
 def genera_matrice_probabilita_poisson(xg_casa: float, xg_trasferta: float, max_gol: int) -> np.array:
-    prob_casa = np.array([poisson.pmf(i, xg_casa) for i in range(max_gol + 1)])
-    prob_trasferta = np.array([poisson.pmf(i, xg_trasferta) for i in range(max_gol + 1)])
-    prob_casa[-1] = max(0, 1 - np.sum(prob_casa[:-1]))
-    prob_trasferta[-1] = max(0, 1 - np.sum(prob_trasferta[:-1]))
-    matrice = np.outer(prob_casa, prob_trasferta)
-    return matrice
+    return genera_matrici_probabilita_poisson(xg_casa, xg_trasferta, max_gol)[0]
+
+_MASCHERE_MATRICE = {} # dimensione -> indici dei risultati, calcolati una volta per dimensione
+
+def maschere_matrice(dimensione: int) -> dict:
+    """
+    Indici delle celle (i, j) di una matrice dei risultati dimensione x dimensione: 'gol_casa', 'gol_trasferta',
+    'totale' (i+j), 'segno' (+1 vince casa, 0 pari, -1 vince trasferta), 'gg' (entrambe segnano).
+    """
+    if dimensione not in _MASCHERE_MATRICE:
+        gol_casa, gol_trasferta = np.indices((dimensione, dimensione))
+        _MASCHERE_MATRICE[dimensione] = {'gol_casa': gol_casa, 'gol_trasferta': gol_trasferta, 'totale': gol_casa + gol_trasferta,
+                                         'segno': np.sign(gol_casa - gol_trasferta), 'gg': (gol_casa > 0) & (gol_trasferta > 0)}
+    return _MASCHERE_MATRICE[dimensione]
+
+def probabilita_esiti_tensore(tensore: np.ndarray, soglie_over_under=SOGLIE_OVER_UNDER_FT) -> dict:
+    """
+    Probabilità dei mercati base per tutte le partite di un tensore N x k x k (anche una sola matrice k x k):
+    riduzioni con maschere, nessun ciclo sulle partite. Valori non arrotondati, somma su tutte le celle.
+    """
+    k = tensore.shape[-1]
+    maschere = maschere_matrice(k)
+    esiti = {'P(1)': maschere['segno'] > 0, 'P(X)': maschere['segno'] == 0, 'P(2)': maschere['segno'] < 0,
+             'P(GG)': maschere['gg'], 'P(NG)': ~maschere['gg'],
+             'P(casa_segna)': maschere['gol_casa'] > 0, 'P(trasferta_segna)': maschere['gol_trasferta'] > 0}
+    for soglia in soglie_over_under:
+        esiti[f'P(Over_{soglia})'] = maschere['totale'] > soglia
+    # Tutte le maschere come colonne di una matrice: un solo prodotto matriciale per tutta la lista di partite
+    colonne = np.stack([maschera.ravel() for maschera in esiti.values()], axis=1).astype(float)
+    valori = tensore.reshape(tensore.shape[:-2] + (k * k,)) @ colonne
+    return {nome: valori[..., c] for c, nome in enumerate(esiti)}
+
+def benchmark_poisson(dimensioni=(10, 1000, 100000), max_gol=MAX_GOL_POISSON_FT) -> bool:
+    """Tempo per partita del motore a tensore: matrici di tutta la lista, poi matrici + mercati base."""
+    rng = np.random.default_rng(0)
+    for n in dimensioni:
+        xg_casa, xg_trasferta = rng.uniform(0.05, 4.0, n), rng.uniform(0.05, 4.0, n)
+        inizio = time.perf_counter()
+        tensore = genera_matrici_probabilita_poisson(xg_casa, xg_trasferta, max_gol)
+        t_tensore = (time.perf_counter() - inizio) / n
+        probabilita_esiti_tensore(tensore)
+        t_mercati = (time.perf_counter() - inizio) / n
+        print(f"⏱️  {n:>7} partite: tensore {t_tensore * 1e6:6.2f} µs/partita, tensore + mercati base {t_mercati * 1e6:6.2f} µs/partita")
+    return True
 
 def get_pronostico_secco_1x2(p1, px, p2, soglia_no_bet_diff=NO_BET_THRESHOLD_DIFFERENCE, soglia_dominanza=0.15, min_prob_valida=NO_BET_THRESHOLD_SINGLE_PROB_1X2):
     if max(p1,px,p2) < min_prob_valida: return "No bet"
@@ -376,80 +751,161 @@ def get_pronostico_secco_ggng(p_gg, p_ng, soglia_no_bet_diff=NO_BET_THRESHOLD_DI
     if abs(p_gg - p_ng) < soglia_no_bet_diff : return "NoBet"
     return "Gol" if p_gg > p_ng else "NoGol"
 
-def estrai_pronostici_da_matrice(matrice: np.array, max_gol_matrice: int, xg_casa: float, xg_trasf:float, per_primo_tempo:bool = False) -> dict:
-    pronostici = {}
-    p_1, p_x, p_2 = 0.0, 0.0, 0.0
-    p_gg, p_ng = 0.0, 0.0
-    prob_risultati_esatti_list = []
-
-    for i in range(max_gol_matrice + 1): 
-        for j in range(max_gol_matrice + 1): 
-            prob = matrice[i, j]
-            if prob < 0.00001 and not (i==max_gol_matrice or j==max_gol_matrice): continue 
-            if i > j: p_1 += prob
-            elif i < j: p_2 += prob
-            else: p_x += prob
-            if i > 0 and j > 0: p_gg += prob
-            else: p_ng += prob
-            prob_risultati_esatti_list.append({'risultato': f"{i}-{j}", 'prob': round(prob, 4)})
-
-    pronostici['1X2'] = get_pronostico_secco_1x2(p_1, p_x, p_2)
-    pronostici['P(1)'] = round(p_1, 3); pronostici['P(X)'] = round(p_x, 3); pronostici['P(2)'] = round(p_2, 3)
-    pronostici['GolNoGol'] = get_pronostico_secco_ggng(p_gg, p_ng)
-    pronostici['P(GG)'] = round(p_gg, 3); pronostici['P(NG)'] = round(p_ng, 3)
-
-    soglie_ou_correnti = SOGLIE_OVER_UNDER_HT if per_primo_tempo else SOGLIE_OVER_UNDER_FT
-    for soglia in soglie_ou_correnti:
-        p_over_s, p_under_s = 0.0, 0.0
-        for r_info in prob_risultati_esatti_list: # Ottimizzabile iterando matrice
-            g_c, g_t = map(int, r_info['risultato'].split('-'))
-            if (g_c + g_t) > soglia: p_over_s += r_info['prob']
-            else: p_under_s += r_info['prob']
-        pronostici[f'U/O_{soglia}'] = get_pronostico_secco_uo(p_over_s, p_under_s)
-        pronostici[f'P(Over_{soglia})'] = round(p_over_s, 3)
-        
+SOGLIA_PROB_CELLA_ESTRAZIONE = 0.00001 # Celle sotto soglia ignorate, salvo l'ultima riga/colonna (che contengono la coda)
+BLOCCO_ESTRAZIONE = 2048 # Partite per blocco nell'estrazione a tensore (limita la memoria dei tensori intermedi)
+
+def _tabelle_estrazione(dimensione: int, per_primo_tempo: bool) -> dict:
+    """Maschere piatte (celle in ordine riga per riga) per l'estrazione dei mercati da matrici dimensione x dimensione."""
+    chiave = (dimensione, 'estrazione', per_primo_tempo)
+    if chiave not in _MASCHERE_MATRICE:
+        maschere = maschere_matrice(dimensione)
+        segno, gg, totale = maschere['segno'].ravel(), maschere['gg'].ravel(), maschere['totale'].ravel()
+        soglie = SOGLIE_OVER_UNDER_HT if per_primo_tempo else SOGLIE_OVER_UNDER_FT
+        _MASCHERE_MATRICE[chiave] = {
+            'esiti': np.stack([segno > 0, segno == 0, segno < 0, gg, ~gg]).astype(float), # 1, X, 2, GG, NG
+            'over_under': np.stack([totale > soglia for soglia in soglie] + [totale <= soglia for soglia in soglie]).astype(float),
+            'soglie': soglie,
+            'bordo': ((maschere['gol_casa'] == dimensione - 1) | (maschere['gol_trasferta'] == dimensione - 1)).ravel(),
+            'totale': totale,
+            'valori_gol_totali': np.arange(2 * (dimensione - 1) + 1),
+            'etichette': [f"{i}-{j}" for i in range(dimensione) for j in range(dimensione)],
+            # Somme su tutte le celle (senza soglia) per i tempi specifici: casa segna, trasferta segna, 1, X, 2
+            'segna_ed_esiti': np.stack([maschere['gol_casa'].ravel() > 0, maschere['gol_trasferta'].ravel() > 0,
+                                        segno > 0, segno == 0, segno < 0]).astype(float),
+        }
+    return _MASCHERE_MATRICE[chiave]
+
+def _somma_in_ordine(contributi: np.ndarray) -> np.ndarray:
+    """Somma lungo l'ultimo asse strettamente in sequenza (cumsum), come l'accumulo cella per cella della versione a cicli."""
+    return contributi.cumsum(axis=-1)[..., -1] if contributi.shape[-1] else np.zeros(contributi.shape[:-1])
+
+def probabilita_mercati_tensore(tensore: np.ndarray, per_primo_tempo: bool = False) -> dict:
+    """
+    Probabilità (non arrotondate) dei mercati di estrai_pronostici_da_matrice per un tensore N x k x k, con le stesse
+    regole e lo stesso ordine di somma: stessi valori bit per bit. 'ordine' è l'ordine dei risultati esatti inclusi
+    (probabilità arrotondata decrescente, a parità l'ordine delle celle), -1 in coda per quelli esclusi;
+    'P(MG_<intervallo>)' sono le probabilità degli intervalli multigol (solo FT).
+    """
+    n, k = tensore.shape[0], tensore.shape[-1]
+    tab = _tabelle_estrazione(k, per_primo_tempo)
+    celle = tensore.reshape(n, k * k)
+    incluse = (celle >= SOGLIA_PROB_CELLA_ESTRAZIONE) | tab['bordo']
+    valori = np.where(incluse, celle, 0.0) # Le celle escluse sommano 0.0: il risultato non cambia
+    arrotondati = np.where(incluse, np.round(celle, 4), 0.0)
+    esiti = _somma_in_ordine(valori[:, None, :] * tab['esiti'][None])
+    over_under = _somma_in_ordine(arrotondati[:, None, :] * tab['over_under'][None])
+    risultato = {'P(1)': esiti[:, 0], 'P(X)': esiti[:, 1], 'P(2)': esiti[:, 2], 'P(GG)': esiti[:, 3], 'P(NG)': esiti[:, 4]}
+    numero_soglie = len(tab['soglie'])
+    for s_idx, soglia in enumerate(tab['soglie']):
+        risultato[f'P(Over_{soglia})'] = over_under[:, s_idx]
+        risultato[f'P(Under_{soglia})'] = over_under[:, numero_soglie + s_idx]
     if not per_primo_tempo:
-        p_1x = p_1 + p_x; p_x2 = p_2 + p_x
-        if pronostici['1X2'] == "1": dc_secco = "1X"
-        elif pronostici['1X2'] == "2": dc_secco = "X2"
-        elif pronostici['1X2'] == "X": dc_secco = "1X" if p_1x > p_x2 else "X2"
-        else: 
-            if p_1x > 0.68 and p_1x > p_x2 : dc_secco = "1X"
-            elif p_x2 > 0.68 and p_x2 > p_1x : dc_secco = "X2"
-            else: dc_secco = "NoBet"
-        pronostici['DC'] = dc_secco
-        pronostici['P(DC_1X)'] = round(p_1x, 3); pronostici['P(DC_X2)'] = round(p_x2, 3)
-
-        prob_risultati_esatti_list = sorted(prob_risultati_esatti_list, key=lambda x: x['prob'], reverse=True)
-        pronostici['RisultatoEsatto'] = prob_risultati_esatti_list[0]['risultato'] if prob_risultati_esatti_list else "N/A"
-        pronostici['RisultatoEsattoMultiesiti'] = [item['risultato'] for item in prob_risultati_esatti_list[:TOP_N_RISULTATI_ESATTI]]
-
-        # MultiGol FT secco Poisson-driven
-        gol_totali_prob_ft = [0.0] * ((max_gol_matrice * 2) + 1)
-        for r_info in prob_risultati_esatti_list:
-            g_c,g_t = map(int, r_info['risultato'].split('-'))
-            idx = g_c+g_t
-            if idx < len(gol_totali_prob_ft): gol_totali_prob_ft[idx] += r_info['prob']
-
-        best_mg_ft_range = "NoBet"; max_p_mg_ft = 0.15 # Soglia minima per considerarlo
+        ordine = np.argsort(np.where(incluse, -arrotondati, np.inf), axis=1, kind='stable')
+        ordinati = np.take_along_axis(arrotondati, ordine, axis=1)
+        # Gol totali accumulati nell'ordine dei risultati esatti ordinati, come la lista ordinata della versione a cicli
+        gol_per_posizione = tab['totale'][ordine]
+        gol_totali = _somma_in_ordine(ordinati[:, None, :] * (gol_per_posizione[:, None, :] == tab['valori_gol_totali'][None, :, None]))
+        # Intervalli multigol: per ogni gol minimo una somma cumulativa da lì in avanti, così ogni intervallo è sommato in sequenza
+        lunghezza = gol_totali.shape[1]
+        da_minimo = np.zeros((n, lunghezza, lunghezza))
+        for min_g in range(lunghezza):
+            da_minimo[:, min_g, :lunghezza - min_g] = gol_totali[:, min_g:]
+        da_minimo = da_minimo.cumsum(axis=-1)
         for nome_range, limiti in RANGES_MULTIGOL_FT.items():
-            if isinstance(limiti, tuple):
-                min_g, max_g_range = limiti
-                current_p_mg = 0
-                if max_g_range is None: # Caso OverX.5
-                    if min_g < len(gol_totali_prob_ft):
-                        current_p_mg = sum(gol_totali_prob_ft[min_g:])
-                else:
-                    if min_g < len(gol_totali_prob_ft) and max_g_range < len(gol_totali_prob_ft):
-                         current_p_mg = sum(gol_totali_prob_ft[min_g : max_g_range+1])
-                    elif min_g < len(gol_totali_prob_ft): # Se max_g_range è fuori, somma fino alla fine
-                         current_p_mg = sum(gol_totali_prob_ft[min_g:])
+            if not isinstance(limiti, tuple): continue
+            min_g, max_g_range = limiti
+            if min_g >= lunghezza:
+                risultato[f'P(MG_{nome_range})'] = np.zeros(n); continue
+            fine = lunghezza if max_g_range is None or max_g_range >= lunghezza else max_g_range + 1
+            risultato[f'P(MG_{nome_range})'] = da_minimo[:, min_g, fine - min_g - 1]
+        risultato['ordine'] = np.where(np.take_along_axis(incluse, ordine, axis=1), ordine, -1)
+    return risultato
+
+def risultati_esatti_piu_probabili(ordine: np.ndarray, dimensione: int) -> list:
+    """Etichette dei TOP_N_RISULTATI_ESATTI risultati esatti di ogni partita dall'ordine di probabilita_mercati_tensore."""
+    etichette = _tabelle_estrazione(dimensione, False)['etichette']
+    return [[etichette[c] for c in riga if c >= 0] for riga in ordine[:, :TOP_N_RISULTATI_ESATTI].tolist()]
+
+def pronostici_da_probabilita(prob: dict, per_primo_tempo: bool = False) -> list:
+    """
+    Dizionari di estrai_pronostici_da_matrice da probabilità già calcolate: array di N partite con le chiavi di
+    probabilita_mercati_tensore (non arrotondate) e, per il FT, 'risultati_esatti' (etichette dei più probabili).
+    Restano solo pronostici secchi e arrotondamenti.
+    """
+    soglie = SOGLIE_OVER_UNDER_HT if per_primo_tempo else SOGLIE_OVER_UNDER_FT
+    numero_partite = len(prob['P(1)'])
+    # Arrotondamenti di tutte le partite in una volta (np.round dà gli stessi valori di round() sui float64 di numpy)
+    arrotondati = {chiave: np.round(valori, 3) for chiave, valori in prob.items() if chiave.startswith('P(')}
+    valori = {chiave: np.asarray(valori).tolist() for chiave, valori in prob.items() if chiave.startswith('P(')}
+    if not per_primo_tempo:
+        p_1x, p_x2 = prob['P(1)'] + prob['P(X)'], prob['P(2)'] + prob['P(X)']
+        arrotondati_dc, valori_dc = (np.round(p_1x, 3), np.round(p_x2, 3)), (p_1x.tolist(), p_x2.tolist())
+        # MultiGol: il primo intervallo che supera strettamente il massimo corrente (partendo dalla soglia minima 0.15)
+        migliore, max_p_mg = np.full(numero_partite, -1), np.full(numero_partite, 0.15)
+        nomi_range = list(RANGES_MULTIGOL_FT)
+        for r_idx, nome_range in enumerate(nomi_range):
+            if f'P(MG_{nome_range})' not in prob: continue
+            p_mg = prob[f'P(MG_{nome_range})']
+            migliore = np.where(p_mg > max_p_mg, r_idx, migliore)
+            max_p_mg = np.where(p_mg > max_p_mg, p_mg, max_p_mg)
+    pronostici_tutte = []
+    for n in range(numero_partite):
+        pronostici = {}
+        pronostici['1X2'] = get_pronostico_secco_1x2(valori['P(1)'][n], valori['P(X)'][n], valori['P(2)'][n])
+        pronostici['P(1)'] = arrotondati['P(1)'][n]; pronostici['P(X)'] = arrotondati['P(X)'][n]; pronostici['P(2)'] = arrotondati['P(2)'][n]
+        pronostici['GolNoGol'] = get_pronostico_secco_ggng(valori['P(GG)'][n], valori['P(NG)'][n])
+        pronostici['P(GG)'] = arrotondati['P(GG)'][n]; pronostici['P(NG)'] = arrotondati['P(NG)'][n]
+        for soglia in soglie:
+            pronostici[f'U/O_{soglia}'] = get_pronostico_secco_uo(valori[f'P(Over_{soglia})'][n], valori[f'P(Under_{soglia})'][n])
+            pronostici[f'P(Over_{soglia})'] = arrotondati[f'P(Over_{soglia})'][n]
+        if not per_primo_tempo:
+            p_1x_n, p_x2_n = valori_dc[0][n], valori_dc[1][n]
+            if pronostici['1X2'] == "1": dc_secco = "1X"
+            elif pronostici['1X2'] == "2": dc_secco = "X2"
+            elif pronostici['1X2'] == "X": dc_secco = "1X" if p_1x_n > p_x2_n else "X2"
+            else:
+                if p_1x_n > 0.68 and p_1x_n > p_x2_n : dc_secco = "1X"
+                elif p_x2_n > 0.68 and p_x2_n > p_1x_n : dc_secco = "X2"
+                else: dc_secco = "NoBet"
+            pronostici['DC'] = dc_secco
+            pronostici['P(DC_1X)'] = arrotondati_dc[0][n]; pronostici['P(DC_X2)'] = arrotondati_dc[1][n]
+            risultati = prob['risultati_esatti'][n]
+            pronostici['RisultatoEsatto'] = risultati[0] if risultati else "N/A"
+            pronostici['RisultatoEsattoMultiesiti'] = list(risultati)
+            pronostici['multigol_totale'] = nomi_range[migliore[n]] if migliore[n] >= 0 else "NoBet"
+        pronostici_tutte.append(pronostici)
+    return pronostici_tutte
+
+def estrai_pronostici_da_tensore(tensore: np.ndarray, per_primo_tempo: bool = False) -> list:
+    """estrai_pronostici_da_matrice per N matrici in blocco: le probabilità vengono da riduzioni con maschere, per partita resta solo la formattazione."""
+    pronostici_tutte = []
+    for inizio in range(0, tensore.shape[0], BLOCCO_ESTRAZIONE):
+        blocco = tensore[inizio:inizio + BLOCCO_ESTRAZIONE]
+        prob = probabilita_mercati_tensore(blocco, per_primo_tempo)
+        if not per_primo_tempo:
+            prob['risultati_esatti'] = risultati_esatti_piu_probabili(prob['ordine'], blocco.shape[-1])
+        pronostici_tutte.extend(pronostici_da_probabilita(prob, per_primo_tempo))
+    return pronostici_tutte
 
-                if current_p_mg > max_p_mg_ft:
-                    max_p_mg_ft = current_p_mg
-                    best_mg_ft_range = nome_range
-        pronostici['multigol_totale'] = best_mg_ft_range 
-    return pronostici
+def estrai_pronostici_da_matrice(matrice: np.array, max_gol_matrice: int, xg_casa: float, xg_trasf:float, per_primo_tempo:bool = False) -> dict:
+    return estrai_pronostici_da_tensore(matrice[None, :max_gol_matrice + 1, :max_gol_matrice + 1], per_primo_tempo)[0]
+
+def benchmark_estrazione_mercati(numero_partite=5000) -> bool:
+    """Tempo per matrice dell'estrazione dei mercati, una matrice alla volta e in blocco, su matrici FT e 1T casuali."""
+    rng = np.random.default_rng(0)
+    for max_gol, per_primo_tempo in ((MAX_GOL_POISSON_FT, False), (MAX_GOL_POISSON_HT, True)):
+        xg = np.concatenate([rng.uniform(0.01, 5.0, numero_partite), rng.uniform(0.01, 0.2, numero_partite // 5)])
+        tensore = genera_matrici_probabilita_poisson(xg, rng.permutation(xg), max_gol)
+        inizio = time.perf_counter()
+        for m in tensore[:500]:
+            estrai_pronostici_da_matrice(m, max_gol, 0, 0, per_primo_tempo)
+        t_singola = (time.perf_counter() - inizio) / 500
+        inizio = time.perf_counter()
+        estrai_pronostici_da_tensore(tensore, per_primo_tempo)
+        t_tensore = (time.perf_counter() - inizio) / len(tensore)
+        print(f"⏱️  {'1T' if per_primo_tempo else 'FT'} ({len(tensore)} matrici): "
+              f"una matrice {t_singola * 1e6:.1f} µs, in blocco {t_tensore * 1e6:.1f} µs per matrice")
+    return True
 
 def intervallo_multigol_da_xg_team(xg_squadra: float, tipo:str="casa") -> str: # tipo è casa o trasferta
     # Questa funzione è ora solo per team, per 'totale' usiamo il Poisson-driven
@@ -463,171 +919,18 @@ def intervallo_multigol_da_xg_team(xg_squadra: float, tipo:str="casa") -> str: #
     else: return "3+" # Semplificato
     return "N/A"
 
-def formatta_pronostico_uo_stat_v2(exp_val: float, tipo_stat_label: str, linee_specifiche_stat: list) -> tuple[str, str]:
-    """Genera stringhe Over/Under per statistiche, cercando la linea più vicina."""
-    if not linee_specifiche_stat: return f"N/A (media: {exp_val:.2f})", f"N/A (media: {exp_val:.2f})"
-    
-    # Trova la linea più vicina a exp_val dalla lista di linee predefinite per quella statistica
-    linea_piu_vicina = min(linee_specifiche_stat, key=lambda x:abs(x-exp_val))
-    
-    # Decidi se Over o Under è più probabile rispetto a questa linea
-    # Per semplicità, se exp_val è > linea_piu_vicina -> Over, altrimenti Under
-    # Si potrebbe aggiungere una dead-zone qui se l'exp_val è troppo vicino alla linea
-    
-    # Per l'output come da tuo esempio: "Over X.Y (media: Z.ZZ)"
-    # La linea X.Y sarà la linea_piu_vicina +/- 0.5 o 1.0 a seconda della statistica.
-    # Qui usiamo un approccio semplificato: linea_over e linea_under attorno a exp_val
-    offset_dinamico = max(0.5, exp_val * 0.1) if exp_val > 0 else 0.5
-    
-    linea_over_calc = normalizza_linea_stat(exp_val - offset_dinamico)
-    linea_under_calc = normalizza_linea_stat(exp_val + offset_dinamico)
-    if linea_over_calc < 0: linea_over_calc = min(linee_specifiche_stat) if linee_specifiche_stat else 0.5
-    if linea_under_calc <= linea_over_calc: linea_under_calc = linea_over_calc + (linee_specifiche_stat[1] - linee_specifiche_stat[0] if len(linee_specifiche_stat)>1 else 1.0)
+def formatta_segna_1t_2t(p1, p2):
+    if p1 > 0.60 and p2 > 0.60 : return "SI" 
+    if p1 > 0.40 and p2 > 0.40 : return "PROBABILE" 
+    return "NO"
 
 
-    prono_over = f"Over {linea_over_calc:.1f} (media: {exp_val:.2f})"
-    prono_under = f"Under {linea_under_calc:.1f} (media: {exp_val:.2f})"
-    return prono_over, prono_under
-
-
-def genera_pronostici_tempi_specifici_v2(xg_casa_1t_adj, xg_trasf_1t_adj, xg_casa_ft_adj, xg_trasf_ft_adj,
-                                      pron_1x2_1t_secco, pron_1x2_ft_secco,
-                                      matrice_1t, matrice_ft, max_gol_1t, max_gol_ft,
-                                      pron_base_1t, pron_ft_principali) -> dict:
-    out = {}
-    xg_casa_2t = max(0.01, xg_casa_ft_adj - xg_casa_1t_adj)
-    xg_trasf_2t = max(0.01, xg_trasf_ft_adj - xg_trasf_1t_adj)
-    matrice_2t = genera_matrice_probabilita_poisson(xg_casa_2t, xg_trasf_2t, max_gol_1t)
-
-    # --- CHIAMATA CORRETTA QUI ---
-    pron_base_2t = estrai_pronostici_da_matrice(matrice_2t, max_gol_1t, xg_casa_2t, xg_trasf_2t, True) 
-    # --- FINE CHIAMATA CORRETTA ---
-
-    for s_ht in SOGLIE_OVER_UNDER_HT: 
-        out[f"over_2T_{s_ht}"] = pron_base_2t.get(f"U/O_{s_ht}", "NoBet")
-
-    # ... (resto della funzione come prima) ...
-    out["over_1T_0.5_over_2T_0.5"] = "Over" if pron_base_1t.get("U/O_0.5") == "Over" and out.get("over_2T_0.5") == "Over" else "Under"
-    out["over_1T_1.5_over_2T_1.5"] = "Over" if pron_base_1t.get("U/O_1.5") == "Over" and out.get("over_2T_1.5") == "Over" else "Under"
-    out["over_1T_1.5_over_2T_0.5"] = "Over" if pron_base_1t.get("U/O_1.5") == "Over" and out.get("over_2T_0.5") == "Over" else "Under"
-    out["over_1T_0.5_over_2T_1.5"] = "Over" if pron_base_1t.get("U/O_0.5") == "Over" and out.get("over_2T_1.5") == "Over" else "Under"
-    
-    out["multigol_1T"] = pron_base_1t.get("multigol_totale", intervallo_multigol_da_xg_team(xg_casa_1t_adj + xg_trasf_1t_adj)) 
-    out["multigol_2T"] = pron_base_2t.get("multigol_totale", intervallo_multigol_da_xg_team(xg_casa_2t + xg_trasf_2t))
-    out["multigol_1T_2T"] = f"{out['multigol_1T']} + {out['multigol_2T']}"
-
-    out["PrimoTempoFinale"] = f"{pron_1x2_1t_secco}/{pron_1x2_ft_secco}"
-    
-    re_1t_list = []
-    # Nota: max_gol_1t è il limite per la matrice_1t
-    for i_re in range(min(max_gol_1t + 1, matrice_1t.shape[0])):
-        for j_re in range(min(max_gol_1t + 1, matrice_1t.shape[1])):
-            re_1t_list.append({'risultato':f"{i_re}-{j_re}", 'prob': matrice_1t[i_re,j_re]})
-    re_1t_list = sorted(re_1t_list, key=lambda x: x['prob'], reverse=True)
-    re_1t_secco = re_1t_list[0]['risultato'] if re_1t_list else "0-0"
-    
-    re_ft_secco = pron_ft_principali.get('RisultatoEsatto', "0-0")
-    out["RisultatoEsattoParzialeFinale"] = f"{re_1t_secco}/{re_ft_secco}"
-    
-    def p_squadra_segna_tempo(matrice_tempo, max_g, per_casa=True):
-        p_s = 0.0
-        if not isinstance(matrice_tempo, np.ndarray): return 0.0 
-        # Assicurati che max_g non superi le dimensioni della matrice
-        rows, cols = matrice_tempo.shape
-        for r_idx in range(min(max_g + 1, rows)):
-            for c_idx in range(min(max_g + 1, cols)):
-                if per_casa and r_idx > 0: p_s += matrice_tempo[r_idx,c_idx]
-                elif not per_casa and c_idx > 0: p_s += matrice_tempo[r_idx,c_idx]
-        return p_s
-
-    p_casa_segna_1t = p_squadra_segna_tempo(matrice_1t, max_gol_1t, True)
-    p_casa_segna_2t = p_squadra_segna_tempo(matrice_2t, max_gol_1t, True) 
-    p_trasf_segna_1t = p_squadra_segna_tempo(matrice_1t, max_gol_1t, False)
-    p_trasf_segna_2t = p_squadra_segna_tempo(matrice_2t, max_gol_1t, False)
-
-    def formatta_segna_1t_2t(p1, p2): 
-        if p1 > 0.60 and p2 > 0.60 : return "SI" 
-        if p1 > 0.40 and p2 > 0.40 : return "PROBABILE" 
-        return "NO"
-        
-    out["casa_segna_1T/2T"] = formatta_segna_1t_2t(p_casa_segna_1t, p_casa_segna_2t)
-    out["trasferta_segna_1T/2T"] = formatta_segna_1t_2t(p_trasf_segna_1t, p_trasf_segna_2t)
-
-    vince_casa_1t = pron_base_1t.get("1X2") == "1" 
-    # Calcolo P(1), P(X), P(2) per matrice_2t per il secco
-    p1_2t, px_2t, p2_2t = 0,0,0
-    for r_idx_2t in range(min(max_gol_1t + 1, matrice_2t.shape[0])):
-        for c_idx_2t in range(min(max_gol_1t + 1, matrice_2t.shape[1])):
-            if r_idx_2t > c_idx_2t: p1_2t += matrice_2t[r_idx_2t, c_idx_2t]
-            elif c_idx_2t > r_idx_2t: p2_2t += matrice_2t[r_idx_2t, c_idx_2t]
-            else: px_2t += matrice_2t[r_idx_2t, c_idx_2t]
-    vince_casa_2t = get_pronostico_secco_1x2(p1_2t, px_2t, p2_2t) == "1"
-    out["casa_vince_almeno_un_tempo"] = "SI" if vince_casa_1t or vince_casa_2t else "NO"
-    
-    vince_trasf_1t = pron_base_1t.get("1X2") == "2"
-    vince_trasf_2t = get_pronostico_secco_1x2(p1_2t, px_2t, p2_2t) == "2"
-    out["trasferta_vince_almeno_un_tempo"] = "SI" if vince_trasf_1t or vince_trasf_2t else "NO"
-    return out
-
-def calcola_prob_standard_uo_squadra(xg_squadra: float, etichetta_linea_float: float, max_gol_poisson_ft: int) -> tuple[float, float]:
-    """
-    Calcola P(Squadra Gol > etichetta_linea_float) e P(Squadra Gol <= etichetta_linea_float)
-    in modo standard. Es: per etichetta_linea_float = 1.5, calcola P(Gol >= 2) e P(Gol <= 1).
-    """
-    # Per P(Over X.5), la soglia k per la CDF è floor(X.5).
-    # P(Over 1.5) -> P(Gol > 1.5) -> P(Gol >= 2) -> 1 - CDF(1)
-    k_per_cdf = math.floor(etichetta_linea_float)
-    
-    p_under_linea_o_uguale_k = poisson.cdf(k_per_cdf, xg_squadra)
-    p_over_linea_k = 1.0 - p_under_linea_o_uguale_k
-    
-    return round(p_over_linea_k, 3), round(p_under_linea_o_uguale_k, 3)
-
-# ... (dopo calcola_prob_standard_uo_squadra e prima di === MAIN ===)
-
 # === MOTORE PER ALTRE STATISTICHE (Corner, Tiri, Falli, Gialli) V2 ===
-def calcola_expected_valore_stat(stat_base_name: str, 
-                                 stats_casa: dict, stats_trasferta: dict, 
-                                 medie_campionato: dict) -> tuple[float, float, float]:
-    if not all([stats_casa, stats_trasferta, medie_campionato]): 
-        # Fallback se mancano dati cruciali
-        if stat_base_name == 'corner': return (5.0, 4.0, 9.0)
-        if stat_base_name == 'tiri': return (12.0, 10.0, 22.0)
-        if stat_base_name == 'tiri_porta': return (4.0, 3.0, 7.0)
-        if stat_base_name == 'falli': return (11.0, 11.0, 22.0)
-        if stat_base_name == 'gialli': return (2.0, 2.0, 4.0)
-        return (1.0, 1.0, 2.0) # Default generico
-
-    # Nomi delle colonne Forza e Medie Campionato
-    # Assumiamo che _generale_recente sia il contesto da usare per queste medie "base"
-    forza_att_casa_col = f'forza_attacco_{stat_base_name}_casa_generale_recente'
-    forza_dif_trasf_col = f'forza_difesa_{stat_base_name}_trasferta_generale_recente'
-    media_stat_casa_camp_col = f'media_{stat_base_name}_casa_campionato'
-
-    forza_att_trasf_col = f'forza_attacco_{stat_base_name}_trasferta_generale_recente'
-    forza_dif_casa_col = f'forza_difesa_{stat_base_name}_casa_generale_recente'
-    media_stat_trasf_camp_col = f'media_{stat_base_name}_trasferta_campionato'
-
-    # Valori di default per Forza (neutra) e Medie (basati su statistiche tipiche)
-    default_forza = 1.0
+def medie_default_stat(stat_base_name: str) -> tuple[float, float]:
+    """Medie di campionato (casa, trasferta) da usare se mancano nel file delle medie."""
     default_media_casa = 5.0 if 'corner' in stat_base_name else 12.0 if 'tiri' in stat_base_name else 4.0 if 'tiri_porta' in stat_base_name else 2.0 if 'gialli' in stat_base_name else 11.0
     default_media_trasf = 4.0 if 'corner' in stat_base_name else 10.0 if 'tiri' in stat_base_name else 3.0 if 'tiri_porta' in stat_base_name else 2.0 if 'gialli' in stat_base_name else 11.0
-
-
-    forza_att_casa = stats_casa.get(forza_att_casa_col, default_forza)
-    forza_dif_trasf = stats_trasferta.get(forza_dif_trasf_col, default_forza)
-    media_stat_casa_camp = medie_campionato.get(media_stat_casa_camp_col, default_media_casa)
-
-    exp_casa = forza_att_casa * forza_dif_trasf * media_stat_casa_camp
-    
-    forza_att_trasf = stats_trasferta.get(forza_att_trasf_col, default_forza)
-    forza_dif_casa = stats_casa.get(forza_dif_casa_col, default_forza)
-    media_stat_trasf_camp = medie_campionato.get(media_stat_trasf_camp_col, default_media_trasf)
-                
-    exp_trasf = forza_att_trasf * forza_dif_casa * media_stat_trasf_camp
-                
-    exp_totale = exp_casa + exp_trasf
-    return round(max(0.1, exp_casa), 2), round(max(0.1, exp_trasf), 2), round(max(0.2, exp_totale), 2)
+    return default_media_casa, default_media_trasf
 
 def normalizza_linea_stat(media: float, step: float = 1.0) -> float: # Già presente, per completezza
     # Arrotonda al più vicino .5, es. 9.7 -> 9.5, 9.8 -> 10.5 (se step=1)
@@ -662,11 +965,9 @@ def formatta_pronostico_uo_stat_v2(exp_val: float, tipo_stat_label: str, linee_s
     prono_under = f"Under {linea_under_calc:.1f} (media: {exp_val:.2f})"
     return prono_over, prono_under
 
-def genera_pronostici_altre_stat_v2(stat_base_name: str, label_output: str,
-                                 stats_casa: dict, stats_trasferta: dict, medie_campionato: dict,
-                                 dati_arbitro: dict = None) -> dict:
-    exp_casa, exp_trasf, exp_tot = calcola_expected_valore_stat(stat_base_name, stats_casa, stats_trasferta, medie_campionato)
-    
+def genera_pronostici_altre_stat_da_attesi(stat_base_name: str, label_output: str,
+                                           exp_casa: float, exp_trasf: float, exp_tot: float, dati_arbitro: dict = None) -> dict:
+    """Pronostici di una statistica dai valori attesi (casa, trasferta, totale) già arrotondati a 2 decimali."""
     # Influenza arbitro per falli e gialli sugli expected values
     # (Questa logica può essere affinata ulteriormente)
     if stat_base_name == 'falli' and dati_arbitro and dati_arbitro.get('statistiche_trovate'):
@@ -713,179 +1014,682 @@ def genera_pronostici_altre_stat_v2(stat_base_name: str, label_output: str,
         f"{label_output}_away_under": under_away_str,
     }
 
-# ... (Il resto dello script, inclusa la funzione main() che chiama genera_pronostici_altre_stat_v2)
 
-# === MAIN ===
-def main():
-    svuota_cartella(PATH_OUTPUT_PRONOSTICI_V2) # Uso nuova cartella
-    alias_dict = carica_alias_squadre(PATH_ALIAS_SQUADRE)
-    if not alias_dict:
-        print("ERRORE CRITICO: alias_squadre.csv non caricato. Termino."); return
-
-    for file_partita_json in os.listdir(PATH_PARTITE_INPUT):
-        if not file_partita_json.endswith(".json"): continue
-        print(f"\n▶️  Elaboro: {file_partita_json}...")
-        
-        with open(os.path.join(PATH_PARTITE_INPUT, file_partita_json), 'r', encoding='utf-8') as f:
-            info_partita = json.load(f)
-
-        home_team_fs = info_partita.get("home_team")
-        away_team_fs = info_partita.get("away_team")
-        arbitro_nome = info_partita.get("arbitro")
-        competizione_input = info_partita.get("competizione") # Es. "Italia" o "Serie A"
-
-        if not all([home_team_fs, away_team_fs, competizione_input]):
-            print(f"ERRORE: Info partita incomplete in {file_partita_json}. Salto."); continue
-
-        # Determina il prefisso del file per le statistiche
-        # Se competizione_input è già un prefisso (es. "serie_a"), usa quello.
-        # Altrimenti, prova a mapparlo da nazione.
-        # Dentro la funzione main() di PRONOSTICO_V2.py:
+# === COMBO: PROBABILITÀ CONGIUNTE ESATTE DALLA MATRICE FT ===
+COMBO_V2 = { # Chiave della combo nel JSON -> mercati dei pronostici secchi combinati
+    "combo_1X2_over_1.5": ("1X2", "U/O_1.5"), "combo_1X2_over_2.5": ("1X2", "U/O_2.5"),
+    "combo_1X2_gol_nogol": ("1X2", "GolNoGol"), "combo_1X2_multigol": ("1X2", "multigol_totale"),
+    "doppia_chance_gol_nogol": ("DC", "GolNoGol"), "doppia_chance_over_1.5": ("DC", "U/O_1.5"),
+    "doppia_chance_over_2.5": ("DC", "U/O_2.5"), "doppia_chance_multigol": ("DC", "multigol_totale"),
+}
+COMBO_PERSONALIZZATE = {} # Es. {"casa_over_2.5_gol": ["1", "Over_2.5", "GG"]}: combo fisse (almeno 2 selezioni), P(<nome>) in ogni JSON
+BLOCCO_COMBO = 256 # Partite per blocco nel calcolo delle combo (tensore intermedio partite x combinazioni x celle)
 
-    # ... (dopo aver caricato info_partita)
-        competizione_display_input = info_partita.get("competizione") # Es. "Serie B"
+def maschera_selezione(selezione: str, dimensione: int):
+    """
+    Maschera booleana dimensione x dimensione dei risultati in cui una selezione è vincente: '1', 'X', '2', 'DC_1X',
+    'DC_X2', 'DC_12', 'GG', 'NG', 'Over_<soglia>', 'Under_<soglia>', 'MG_<intervallo di RANGES_MULTIGOL_FT>'. None se sconosciuta.
+    """
+    maschere = maschere_matrice(dimensione)
+    segno, totale, gg = maschere['segno'], maschere['totale'], maschere['gg']
+    semplici = {'1': segno > 0, 'X': segno == 0, '2': segno < 0, 'DC_1X': segno >= 0, 'DC_X2': segno <= 0, 'DC_12': segno != 0,
+                'GG': gg, 'NG': ~gg}
+    if selezione in semplici: return semplici[selezione]
+    mercato, _, valore = selezione.partition('_')
+    if mercato in ('Over', 'Under'):
+        try: soglia = float(valore)
+        except ValueError: return None
+        return totale > soglia if mercato == 'Over' else totale <= soglia
+    if mercato == 'MG' and valore in RANGES_MULTIGOL_FT:
+        limiti = RANGES_MULTIGOL_FT[valore]
+        if limiti == "Pari": return totale % 2 == 0
+        if limiti == "Dispari": return totale % 2 == 1
+        min_g, max_g = limiti
+        return (totale >= min_g) & (totale <= max_g) if max_g is not None else totale >= min_g
+    return None
+
+def chiave_combinazione(selezioni) -> str:
+    """Nome della colonna di una combinazione di selezioni: ['1', 'Over_2.5'] -> 'P(1 & Over_2.5)'."""
+    return f"P({' & '.join(selezioni)})"
+
+def selezioni_mercato(mercato: str) -> list:
+    """Selezioni possibili del pronostico secco di un mercato (chiave dei pronostici: '1X2', 'DC', 'GolNoGol', 'U/O_<soglia>', 'multigol_totale')."""
+    if mercato == "1X2": return ["1", "X", "2"]
+    if mercato == "DC": return ["DC_1X", "DC_X2", "DC_12"]
+    if mercato == "GolNoGol": return ["GG", "NG"]
+    if mercato.startswith("U/O_"): return [f"Over_{mercato[4:]}", f"Under_{mercato[4:]}"]
+    if mercato == "multigol_totale": return [f"MG_{nome_range}" for nome_range in RANGES_MULTIGOL_FT]
+    return []
+
+def selezione_da_pronostico(mercato: str, pronostico: str):
+    """Selezione di maschera_selezione corrispondente al pronostico secco di un mercato; None se non è una giocata (NoBet)."""
+    if pronostico in (None, "NoBet", "No bet", "N/A"): return None
+    if mercato == "1X2": return pronostico
+    if mercato == "DC": return f"DC_{pronostico}"
+    if mercato == "GolNoGol": return {"Gol": "GG", "NoGol": "NG"}.get(pronostico)
+    if mercato.startswith("U/O_"): return f"{pronostico}_{mercato[4:]}"
+    if mercato == "multigol_totale": return f"MG_{pronostico}"
+    return None
+
+def combinazioni_combo_v2() -> list:
+    """Tutte le combinazioni di selezioni delle combo di COMBO_V2 (per qualunque pronostico secco), più COMBO_PERSONALIZZATE."""
+    combinazioni = []
+    for mercato_a, mercato_b in COMBO_V2.values():
+        for selezione_a in selezioni_mercato(mercato_a):
+            for selezione_b in selezioni_mercato(mercato_b):
+                if [selezione_a, selezione_b] not in combinazioni: combinazioni.append([selezione_a, selezione_b])
+    return combinazioni + [list(selezioni) for selezioni in COMBO_PERSONALIZZATE.values()]
+
+def probabilita_combo_tensore(tensore: np.ndarray, combinazioni: list) -> dict:
+    """
+    Probabilità congiunta esatta di ogni combinazione (lista di selezioni di maschera_selezione) per N matrici N x k x k:
+    somma delle celle sul prodotto delle maschere, senza soglie né arrotondamenti delle celle. Stesso valore per una
+    partita sola o in blocco. Combinazioni con selezioni sconosciute o meno di 2 selezioni: saltate con un avviso.
+    Restituisce {chiave_combinazione: array di N probabilità}.
+    """
+    k = tensore.shape[-1]
+    chiave = (k, 'combo', tuple(tuple(selezioni) for selezioni in combinazioni))
+    if chiave not in _MASCHERE_MATRICE:
+        nomi, maschere = [], []
+        for selezioni in combinazioni:
+            singole = [maschera_selezione(selezione, k) for selezione in selezioni]
+            if len(singole) < 2 or any(m is None for m in singole):
+                print(f"ATTENZIONE: Combo {selezioni} non valida (selezioni sconosciute o meno di 2), saltata."); continue
+            if chiave_combinazione(selezioni) not in nomi:
+                nomi.append(chiave_combinazione(selezioni)); maschere.append(np.logical_and.reduce(singole).ravel())
+        _MASCHERE_MATRICE[chiave] = (nomi, np.array(maschere, dtype=float).reshape(len(maschere), k * k))
+    nomi, maschere = _MASCHERE_MATRICE[chiave]
+    celle = tensore.reshape(-1, k * k)
+    valori = np.empty((len(celle), len(nomi)))
+    for inizio in range(0, len(celle), BLOCCO_COMBO):
+        # Prodotto e somma lungo le celle (non un prodotto matriciale, che somma in ordine diverso a seconda del numero di partite)
+        valori[inizio:inizio + BLOCCO_COMBO] = (celle[inizio:inizio + BLOCCO_COMBO, None, :] * maschere[None]).sum(axis=-1)
+    return {nome: valori[:, c] for c, nome in enumerate(nomi)}
+
+def genera_combo_v2(pronostici: dict, probabilita_combinazione=None) -> dict:
+    """
+    Combo dei pronostici secchi già calcolati di una partita. probabilita_combinazione(chiave_combinazione), se passata,
+    dà la probabilità congiunta esatta (probabilita_combo_tensore, None se non calcolata): scritta accanto a ogni combo
+    come P(<combo>) (None per le combo NoBet), seguita dalle COMBO_PERSONALIZZATE.
+    """
+    combo = {}
+    _1x2 = pronostici.get("1X2", "NoBet")
+    _uo15 = pronostici.get("U/O_1.5", "No bet")
+    _uo25 = pronostici.get("U/O_2.5", "No bet")
+    _ggng = pronostici.get("GolNoGol", "NoBet")
+    _mgft_secco = pronostici.get("multigol_totale", "NoBet")
+    _dc = pronostici.get("DC", "NoBet")
+
+    combo["combo_1X2_over_1.5"] = f"{_1x2} + {_uo15}" if "NoBet" not in [_1x2, _uo15] and "No bet" not in [_1x2, _uo15] else "NoBet"
+    combo["combo_1X2_over_2.5"] = f"{_1x2} + {_uo25}" if "NoBet" not in [_1x2, _uo25] and "No bet" not in [_1x2, _uo25] else "NoBet"
+    combo["combo_1X2_gol_nogol"] = f"{_1x2} + {_ggng}" if "NoBet" not in [_1x2, _ggng] else "NoBet"
+    combo["combo_1X2_multigol"] = f"{_1x2} + {_mgft_secco}" if "NoBet" not in [_1x2, _mgft_secco] else "NoBet"
+    combo["doppia_chance_gol_nogol"] = f"{_dc} + {_ggng}" if "NoBet" not in [_dc, _ggng] else "NoBet"
+    combo["doppia_chance_over_1.5"] = f"{_dc} + {_uo15}" if "NoBet" not in [_dc, _uo15] and "No bet" not in [_dc, _uo15] else "NoBet"
+    combo["doppia_chance_over_2.5"] = f"{_dc} + {_uo25}" if "NoBet" not in [_dc, _uo25] and "No bet" not in [_dc, _uo25] else "NoBet"
+    combo["doppia_chance_multigol"] = f"{_dc} + {_mgft_secco}" if "NoBet" not in [_dc, _mgft_secco] else "NoBet"
+    if probabilita_combinazione is None: return combo
+
+    con_probabilita = {}
+    for nome_combo, pronostico_combo in combo.items():
+        con_probabilita[nome_combo] = pronostico_combo
+        selezioni = [selezione_da_pronostico(mercato, pronostici.get(mercato)) for mercato in COMBO_V2[nome_combo]]
+        p = None if pronostico_combo == "NoBet" or None in selezioni else probabilita_combinazione(chiave_combinazione(selezioni))
+        con_probabilita[f"P({nome_combo})"] = round(p, 3) if p is not None else None
+    for nome_combo, selezioni in COMBO_PERSONALIZZATE.items():
+        p = probabilita_combinazione(chiave_combinazione(selezioni))
+        con_probabilita[f"P({nome_combo})"] = round(p, 3) if p is not None else None
+    return con_probabilita
+
+# === MERCATI ESTESI: HANDICAP ASIATICO, MARGINE DI VITTORIA, GOL ESATTI DI SQUADRA, PARZIALE/FINALE ===
+LINEE_HANDICAP_ASIATICO = [-2.5, -2.25, -2.0, -1.75, -1.5, -1.25, -1.0, -0.75, -0.5, -0.25, 0.0,
+                           0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0, 2.25, 2.5] # Handicap sulla squadra di casa
+MARGINE_VITTORIA_MAX = 3 # Margini 1, 2, 3+ per squadra
+ESITI_PARZIALE_FINALE = [f"{esito_1t}/{esito_ft}" for esito_1t in ("1", "X", "2") for esito_ft in ("1", "X", "2")]
+
+def distribuzione_margini(tensore: np.ndarray) -> np.ndarray:
+    """P(gol casa - gol trasferta = m), m da -(k-1) a k-1, per N matrici k x k: somme lungo le diagonali (N x 2k-1)."""
+    k = tensore.shape[-1]
+    return np.stack([np.diagonal(tensore, offset=-m, axis1=-2, axis2=-1).sum(axis=-1) for m in range(-(k - 1), k)], axis=-1)
+
+def _cumulata_margini(margini: np.ndarray):
+    """Funzione t -> P(margine <= t) (t intero qualsiasi) dalle somme cumulative della distribuzione dei margini."""
+    k = (margini.shape[-1] + 1) // 2
+    cumulata = np.concatenate([np.zeros(margini.shape[:-1] + (1,)), np.cumsum(margini, axis=-1)], axis=-1)
+    return lambda t: cumulata[..., min(max(t + k, 0), 2 * k - 1)]
+
+def _margine_esatto(margini: np.ndarray, m: int) -> np.ndarray:
+    k = (margini.shape[-1] + 1) // 2
+    return margini[..., m + k - 1] if -k < m < k else np.zeros(margini.shape[:-1])
+
+def esiti_handicap_asiatico(margini: np.ndarray, linea: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (vinta, rimborsata, persa): quota della puntata sulla casa con handicap `linea` per ogni partita. Linee intere:
+    rimborso se margine + linea = 0; linee .25/.75: puntata divisa a metà sulle due linee vicine.
+    """
+    if (linea * 4) % 2 == 1: # Quarto di linea
+        esiti_bassa, esiti_alta = esiti_handicap_asiatico(margini, linea - 0.25), esiti_handicap_asiatico(margini, linea + 0.25)
+        return tuple((a + b) / 2 for a, b in zip(esiti_bassa, esiti_alta))
+    cumulata = _cumulata_margini(margini)
+    totale = cumulata(margini.shape[-1])
+    soglia = -linea # Vince se margine > soglia
+    if soglia == math.floor(soglia):
+        soglia = int(soglia)
+        return totale - cumulata(soglia), _margine_esatto(margini, soglia), cumulata(soglia - 1)
+    persa = cumulata(math.floor(soglia))
+    return totale - persa, np.zeros(margini.shape[:-1]), persa
+
+def probabilita_parziale_finale(tensore_1t: np.ndarray, tensore_2t: np.ndarray) -> np.ndarray:
+    """
+    P(esito 1T / esito finale) nell'ordine di ESITI_PARZIALE_FINALE (N x 9), con i gol del secondo tempo indipendenti
+    dal primo: margine finale = margine 1T + margine 2T, dalle somme cumulative della distribuzione dei margini del 2T.
+    """
+    margini_1t, margini_2t = distribuzione_margini(tensore_1t), distribuzione_margini(tensore_2t)
+    k_1t = (margini_1t.shape[-1] + 1) // 2
+    cumulata_2t = _cumulata_margini(margini_2t)
+    totale_2t = cumulata_2t(margini_2t.shape[-1])
+    valori_1t = range(-(k_1t - 1), k_1t)
+    # Esito finale (1, X, 2) per ogni margine a del 1T: il 2T deve finire con margine > -a, = -a, < -a
+    condizionate = np.stack([np.stack([totale_2t - cumulata_2t(-a), _margine_esatto(margini_2t, -a), cumulata_2t(-a - 1)], axis=-1)
+                             for a in valori_1t], axis=-2)
+    congiunte = margini_1t[..., :, None] * condizionate
+    per_esito_1t = [np.array([a > 0 for a in valori_1t]), np.array([a == 0 for a in valori_1t]), np.array([a < 0 for a in valori_1t])]
+    return np.concatenate([congiunte[..., maschera, :].sum(axis=-2) for maschera in per_esito_1t], axis=-1)
+
+def mercati_estesi_tensore(tensore_ft: np.ndarray, tensore_1t: np.ndarray, tensore_2t: np.ndarray) -> dict:
+    """
+    Mercati estesi (probabilità non arrotondate, array di N partite) dalle matrici FT, 1T e 2T di N partite:
+    'P(AH_<linea>_vinta|rimborsata|persa)', 'P(Margine_casa_1)' ... 'P(Margine_pareggio)' ... 'P(Margine_trasferta_3+)',
+    'P(Gol_casa_0)' ... 'P(Gol_casa_<max>+)', idem per la trasferta, 'P(1T/FT_1/1)' ... 'P(1T/FT_2/2)'.
+    Stessi valori per una partita sola o in blocco (somme in ordine fisso, nessun prodotto matriciale).
+    """
+    prob = {}
+    margini = distribuzione_margini(tensore_ft)
+    for linea in LINEE_HANDICAP_ASIATICO:
+        vinta, rimborsata, persa = esiti_handicap_asiatico(margini, linea)
+        prob[f'P(AH_{linea:+g}_vinta)'], prob[f'P(AH_{linea:+g}_rimborsata)'], prob[f'P(AH_{linea:+g}_persa)'] = vinta, rimborsata, persa
+    cumulata = _cumulata_margini(margini)
+    totale = cumulata(margini.shape[-1])
+    for squadra, segno in (("casa", 1), ("trasferta", -1)):
+        for m in range(1, MARGINE_VITTORIA_MAX):
+            prob[f'P(Margine_{squadra}_{m})'] = _margine_esatto(margini, segno * m)
+        prob[f'P(Margine_{squadra}_{MARGINE_VITTORIA_MAX}+)'] = totale - cumulata(MARGINE_VITTORIA_MAX - 1) if segno > 0 else cumulata(-MARGINE_VITTORIA_MAX)
+        if segno > 0: prob['P(Margine_pareggio)'] = _margine_esatto(margini, 0)
+    k = tensore_ft.shape[-1]
+    for squadra, gol in (("casa", tensore_ft.sum(axis=-1)), ("trasferta", tensore_ft.sum(axis=-2))): # Righe e colonne: marginali di squadra
+        for g in range(k):
+            prob[f'P(Gol_{squadra}_{g}{"+" if g == k - 1 else ""})'] = gol[..., g]
+    parziale_finale = probabilita_parziale_finale(tensore_1t, tensore_2t)
+    for c, esito in enumerate(ESITI_PARZIALE_FINALE):
+        prob[f'P(1T/FT_{esito})'] = parziale_finale[..., c]
+    return prob
+
+BLOCCHI_MERCATI_ESTESI = {"handicap_asiatico_casa": 'P(AH_', "margine_vittoria": 'P(Margine_', "gol_esatti_casa": 'P(Gol_casa_',
+                          "gol_esatti_trasferta": 'P(Gol_trasferta_', "parziale_finale": 'P(1T/FT_'} # Blocco del JSON -> prefisso delle colonne
+
+def formatta_mercati_estesi(prob: dict) -> list:
+    """Blocchi 'mercati_estesi' dei JSON (uno per partita) dalle probabilità di mercati_estesi_tensore, arrotondate a 3 decimali."""
+    arrotondate = {c: np.round(valori, 3).tolist() for c, valori in prob.items() if c.startswith(tuple(BLOCCHI_MERCATI_ESTESI.values()))}
+    blocchi = []
+    for n in range(len(next(iter(arrotondate.values()), []))):
+        blocco = {nome: {} for nome in BLOCCHI_MERCATI_ESTESI}
+        for nome, prefisso in BLOCCHI_MERCATI_ESTESI.items():
+            for c in (c for c in arrotondate if c.startswith(prefisso)):
+                etichetta = c[len(prefisso):-1]
+                if nome == "handicap_asiatico_casa": # 'P(AH_-0.25_vinta)' -> {'-0.25': {'vinta': ...}}
+                    linea, esito = etichetta.rsplit('_', 1)
+                    blocco[nome].setdefault(linea, {})[esito] = arrotondate[c][n]
+                else:
+                    blocco[nome][etichetta] = arrotondate[c][n]
+        blocchi.append(blocco)
+    return blocchi
 
-        if not competizione_display_input:
-            print(f"ERRORE: Campo 'competizione' mancante in {file_partita_json}. Salto.")
-            continue
+# === PREVISIONI A LOTTI: DATAFRAME DI PARTITE -> DATAFRAME DI PREVISIONI ===
+COLONNE_PARTITA = ("home_team", "away_team", "competizione", "arbitro") # Chiavi dei JSON di dati_flashscore usate dal modello
+TIER_CLASSIFICA = ("Top", "Mid", "Bottom")
 
-        file_prefix_campionato = MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.get(competizione_display_input)
+_TABELLE_SQUADRE = {} # campionato -> (sorgente da cui è costruita, DataFrame delle statistiche per squadra)
 
-        if not file_prefix_campionato:
-            print(f"ATTENZIONE: Nessuna mappatura trovata per la competizione '{competizione_display_input}' in MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX. Salto la partita.")
-            continue
+def _valore_partita(valore):
+    """Valore di una colonna del DataFrame di partite, None se mancante (None, NaN, stringa vuota)."""
+    if valore is None or valore == "" or (isinstance(valore, float) and math.isnan(valore)): return None
+    return valore
 
-        print(f"    Lega identificata per le stats: '{competizione_display_input}' -> Prefisso file: '{file_prefix_campionato}'")
-    # ... il resto del caricamento dati userà file_prefix_campionato ...
+def _chiave_tempo(chiave: str, tempo: str) -> str:
+    """Nome della colonna di un mercato per un tempo, come nei JSON: 'P(Over_0.5)' -> 'P(Over_1T_0.5)', 'P(1)' -> 'P(1_1T)'."""
+    mercato, _, resto = chiave[2:-1].partition('_')
+    return f"P({mercato}_{tempo}{'_' + resto if resto else ''})"
 
-        home_team_std = alias_dict.get(home_team_fs, home_team_fs)
-        away_team_std = alias_dict.get(away_team_fs, away_team_fs)
+def tabella_squadre_campionato(file_prefix_campionato: str, dati_campionato: dict = None):
+    """
+    Statistiche V2 del campionato come DataFrame indicizzato per squadra, solo colonne del modello, con gli stessi
+    valori di carica_statistiche_squadra_V2 (prima riga per squadra, NaN a 0). None se non disponibili.
+    dati_campionato (pipeline in memoria): usa la sua tabella 'statistiche' invece dei file di medie_csv_V2.
+    """
+    if dati_campionato is not None:
+        sorgente = dati_campionato['statistiche']
+    else:
+        sorgente = _CACHE_CAMPIONATI.ottieni(os.path.join(PATH_STATISTICHE_V2_BASE, f"{file_prefix_campionato}_statistiche_avanzate_V2.npz"),
+                                             _righe_statistiche_store)
+        if sorgente is None:
+            sorgente = _CACHE_CAMPIONATI.ottieni(os.path.join(PATH_STATISTICHE_V2_BASE, f"{file_prefix_campionato}_statistiche_avanzate_V2.csv"),
+                                                 _righe_statistiche_csv)
+        if sorgente is None:
+            return None
+    costruita = _TABELLE_SQUADRE.get(file_prefix_campionato)
+    if costruita is None or costruita[0] is not sorgente:
+        if isinstance(sorgente, pd.DataFrame):
+            righe = sorgente.drop_duplicates('squadra').set_index('squadra') if 'squadra' in sorgente.columns else pd.DataFrame()
+            tabella = righe[colonne_statistiche_usate(righe.columns)].fillna(0)
+        else:
+            righe = pd.DataFrame.from_dict(sorgente, orient='index')
+            tabella = righe[colonne_statistiche_usate(righe.columns)]
+        costruita = (sorgente, tabella)
+        _TABELLE_SQUADRE[file_prefix_campionato] = costruita
+    return costruita[1]
+
+def _colonna_squadre(statistiche: pd.DataFrame, colonna: str, default) -> np.ndarray:
+    """Colonna delle statistiche allineate alle partite, con default (scalare o array) dove il campionato non ha la colonna."""
+    if colonna not in statistiche.columns:
+        return np.broadcast_to(np.asarray(default, dtype=float), (len(statistiche),))
+    valori = statistiche[colonna].to_numpy(dtype=float)
+    return np.where(np.isnan(valori), default, valori)
+
+def _colonna_medie(medie_campionati: dict, gruppi: dict, numero_partite: int, chiave: str, default) -> np.ndarray:
+    """Valore delle medie di campionato per ogni partita (default se la chiave manca)."""
+    valori = np.full(numero_partite, np.nan)
+    for file_prefix_campionato, indici in gruppi.items():
+        valori[indici] = medie_campionati[file_prefix_campionato].get(chiave, default)
+    return valori
+
+def tier_squadre(posizioni: np.ndarray, num_squadre: np.ndarray) -> np.ndarray:
+    """Tier in classifica per array di posizioni: Top i primi PERC_TIER_TOP, Bottom gli ultimi PERC_TIER_BOTTOM, Mid il resto."""
+    num_top = np.ceil(PERC_TIER_TOP * num_squadre)
+    num_bottom = np.ceil(PERC_TIER_BOTTOM * num_squadre)
+    tier = np.where(posizioni <= num_top, "Top", np.where(posizioni > (num_squadre - num_bottom), "Bottom", "Mid"))
+    return np.where(num_squadre == 0, "Mid", tier)
+
+def calcola_expected_goals_partite(stats_team: pd.DataFrame, stats_opponent: pd.DataFrame, media_fatti_ruolo_campionato: np.ndarray,
+                                   ruolo_team: str, tier_opponent: np.ndarray, rank_simile_opponent: np.ndarray,
+                                   stat_base_name: str = "gol") -> np.ndarray:
+    """
+    xG di tutte le partite (statistiche allineate alle partite): forza di attacco generale recente per forza di difesa
+    dell'avversario per media del campionato, poi media pesata con la forza contro il tier dell'avversario e contro le
+    squadre di rango simile se ci sono almeno MIN_PARTITE_PER_STAT_COND partite. Minimo 0.05.
+    """
+    ruolo_opponent = "trasferta" if ruolo_team == "casa" else "casa"
+    forza_att_generale = _colonna_squadre(stats_team, f'forza_attacco_{stat_base_name}_{ruolo_team}_generale_recente', 1.0)
+    forza_dif_generale_opp = _colonna_squadre(stats_opponent, f'forza_difesa_{stat_base_name}_{ruolo_opponent}_generale_recente', 1.0)
+    xg = forza_att_generale * forza_dif_generale_opp * media_fatti_ruolo_campionato
 
-        stats_casa = carica_statistiche_squadra_V2(home_team_std, file_prefix_campionato, PATH_STATISTICHE_V2_BASE)
-        stats_trasf = carica_statistiche_squadra_V2(away_team_std, file_prefix_campionato, PATH_STATISTICHE_V2_BASE)
-        medie_campionato = carica_medie_generali_campionato_V2(file_prefix_campionato, PATH_STATISTICHE_V2_BASE)
-        dati_arbitro = carica_dati_arbitro_safe(arbitro_nome, PATH_DATI_ARBITRI)
-        df_classifica_corrente = carica_classifica_corrente(file_prefix_campionato, PATH_CLASSIFICHE_CORRENTI)
+    per_tier = [tier_opponent == tier for tier in TIER_CLASSIFICA]
+    num_partite_vs_tier = np.select(per_tier, [_colonna_squadre(stats_team, f'num_partite_{ruolo_team}_VS_{tier}', 0) for tier in TIER_CLASSIFICA])
+    forza_att_vs_tier = np.select(per_tier, [_colonna_squadre(stats_team, f'forza_attacco_{stat_base_name}_{ruolo_team}_VS_{tier}', forza_att_generale)
+                                             for tier in TIER_CLASSIFICA])
+    xg_tier_adj = forza_att_vs_tier * forza_dif_generale_opp * media_fatti_ruolo_campionato
+    peso_tier = np.minimum(1.0, num_partite_vs_tier / 10.0) * PESO_CLASSIFICA_TIER_XG
+    xg = np.where(num_partite_vs_tier >= MIN_PARTITE_PER_STAT_COND, xg * (1 - peso_tier) + xg_tier_adj * peso_tier, xg)
+
+    num_partite_vs_simile = _colonna_squadre(stats_team, f'num_partite_{ruolo_team}_VS_Simile', 0)
+    forza_att_vs_simile = _colonna_squadre(stats_team, f'forza_attacco_{stat_base_name}_{ruolo_team}_VS_Simile', forza_att_generale)
+    xg_simile_adj = forza_att_vs_simile * forza_dif_generale_opp * media_fatti_ruolo_campionato
+    peso_simile = np.minimum(1.0, num_partite_vs_simile / 10.0) * PESO_CLASSIFICA_SIMILAR_XG
+    xg = np.where(rank_simile_opponent & (num_partite_vs_simile >= MIN_PARTITE_PER_STAT_COND), xg * (1 - peso_simile) + xg_simile_adj * peso_simile, xg)
+    return np.maximum(0.05, xg)
+
+def aggiusta_xg_partite(xg_casa: np.ndarray, xg_trasferta: np.ndarray, forma_casa: np.ndarray, forma_trasferta: np.ndarray,
+                        h2h_partite: np.ndarray, h2h_media_gol_casa: np.ndarray, h2h_media_gol_trasferta: np.ndarray,
+                        falli_pg_arbitro: np.ndarray, rigori_pg_arbitro: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Aggiustamenti finali degli xG FT di tutte le partite: H2H (almeno 2 partite), forma, falli e rigori dell'arbitro. Minimo 0.05."""
+    diff_gol_h2h = h2h_media_gol_casa - h2h_media_gol_trasferta
+    con_h2h = h2h_partite >= 2
+    xg_c = np.where(con_h2h, xg_casa + diff_gol_h2h * PESO_H2H_XG, xg_casa)
+    xg_t = np.where(con_h2h, xg_trasferta - diff_gol_h2h * PESO_H2H_XG, xg_trasferta)
+    xg_c = xg_c * (1 + (forma_casa - 0.5) * PESO_FORMA_XG)
+    xg_t = xg_t * (1 + (forma_trasferta - 0.5) * PESO_FORMA_XG)
+    adj_factor = np.where(falli_pg_arbitro > 24.5, 1.0 + PESO_ARBITRO_FALLI_XG_NEG, np.where(falli_pg_arbitro < 18.5, 1.0 + PESO_ARBITRO_FALLI_XG_POS, 1.0))
+    xg_c = xg_c * adj_factor; xg_t = xg_t * adj_factor
+    xg_c = xg_c + rigori_pg_arbitro * PESO_ARBITRO_RIGORI_XG
+    xg_t = xg_t + rigori_pg_arbitro * PESO_ARBITRO_RIGORI_XG
+    return np.maximum(0.05, xg_c), np.maximum(0.05, xg_t)
 
+def probabilita_mercati_partite(xg_casa_ft: np.ndarray, xg_trasf_ft: np.ndarray, xg_casa_1t: np.ndarray, xg_trasf_1t: np.ndarray) -> dict:
+    """
+    Probabilità (non arrotondate) di tutti i mercati di N partite dai loro xG, a blocchi di BLOCCO_ESTRAZIONE:
+    FT, 1T e 2T con le regole di estrai_pronostici_da_matrice, le somme su tutte le celle dei tempi specifici
+    (segna nel tempo, 1X2 del 2T), gli U/O di squadra, i risultati esatti più probabili e le probabilità
+    congiunte delle combo (probabilita_combo_tensore, colonne 'P(1 & Over_2.5)', ...) e i mercati estesi
+    (mercati_estesi_tensore: handicap asiatico, margine di vittoria, gol esatti di squadra, parziale/finale).
+    """
+    blocchi = []
+    for inizio in range(0, len(xg_casa_ft), BLOCCO_ESTRAZIONE):
+        fine = inizio + BLOCCO_ESTRAZIONE
+        c_ft, t_ft, c_1t, t_1t = xg_casa_ft[inizio:fine], xg_trasf_ft[inizio:fine], xg_casa_1t[inizio:fine], xg_trasf_1t[inizio:fine]
+        c_2t, t_2t = np.maximum(0.01, c_ft - c_1t), np.maximum(0.01, t_ft - t_1t)
+        blocco = {}
+        tensore_ft = genera_matrici_probabilita_poisson(c_ft, t_ft, MAX_GOL_POISSON_FT)
+        prob_ft = probabilita_mercati_tensore(tensore_ft, False)
+        blocco['risultati_esatti'] = risultati_esatti_piu_probabili(prob_ft.pop('ordine'), MAX_GOL_POISSON_FT + 1)
+        blocco.update(prob_ft)
+        blocco['P(DC_1X)'], blocco['P(DC_X2)'] = prob_ft['P(1)'] + prob_ft['P(X)'], prob_ft['P(2)'] + prob_ft['P(X)']
+        blocco.update(probabilita_combo_tensore(tensore_ft, combinazioni_combo_v2()))
+        tab_ht = _tabelle_estrazione(MAX_GOL_POISSON_HT + 1, True)
+        tensori_tempi = {}
+        for tempo, xg_c, xg_t in (("1T", c_1t, t_1t), ("2T", c_2t, t_2t)):
+            tensore = tensori_tempi[tempo] = genera_matrici_probabilita_poisson(xg_c, xg_t, MAX_GOL_POISSON_HT)
+            celle = tensore.reshape(len(tensore), -1)
+            complete = _somma_in_ordine(celle[:, None, :] * tab_ht['segna_ed_esiti'][None])
+            blocco[f'P(Casa_segna_{tempo})'], blocco[f'P(Trasferta_segna_{tempo})'] = complete[:, 0], complete[:, 1]
+            if tempo == "1T":
+                blocco.update({_chiave_tempo(chiave, tempo): valori for chiave, valori in probabilita_mercati_tensore(tensore, True).items()})
+                blocco['risultato_esatto_1T'] = [tab_ht['etichette'][c] for c in np.argmax(celle, axis=1).tolist()]
+            else:
+                # Per il 2T servono solo gli U/O dell'estrazione; l'1X2 è sommato su tutte le celle, come nei tempi specifici
+                blocco.update({_chiave_tempo(chiave, tempo): valori for chiave, valori in probabilita_mercati_tensore(tensore, True).items()
+                               if chiave.startswith(('P(Over', 'P(Under'))})
+                blocco['P(1_2T)'], blocco['P(X_2T)'], blocco['P(2_2T)'] = complete[:, 2], complete[:, 3], complete[:, 4]
+        blocco.update(mercati_estesi_tensore(tensore_ft, tensori_tempi["1T"], tensori_tempi["2T"]))
+        for team_label, xg_team in (("Casa", c_ft), ("Trasferta", t_ft)):
+            for soglia in SOGLIE_UO_SQUADRA_STANDARD:
+                blocco[f'P({team_label} Over {soglia})'] = 1.0 - poisson.cdf(math.floor(soglia), xg_team)
+        blocchi.append(blocco)
+    if not blocchi:
+        return {}
+    return {chiave: (sum((b[chiave] for b in blocchi), []) if isinstance(blocchi[0][chiave], list) else np.concatenate([b[chiave] for b in blocchi]))
+            for chiave in blocchi[0]}
+
+def prevedi_partite(partite: pd.DataFrame, alias_dict: dict = None, dati_campionati: dict = None) -> pd.DataFrame:
+    """
+    Previsioni di una lista di partite in blocco: DataFrame con le colonne dei JSON di dati_flashscore (COLONNE_PARTITA)
+    in ingresso, DataFrame con una riga per partita in uscita (colonne di ingresso, nomi risolti, xG, probabilità di tutti
+    i mercati e delle combo non arrotondate, valori attesi delle altre statistiche). Alias, statistiche delle squadre e medie sono
+    uniti per campionato su tutta la lista, xG e mercati calcolati su array.
+    Le partite senza dati hanno 'valido' False, il motivo in 'errore' e NaN al posto delle previsioni.
+    dati_campionati (pipeline in memoria): {campionato: {'statistiche', 'medie', 'h2h'}} al posto dei file.
+    """
+    if alias_dict is None: alias_dict = carica_alias_squadre(PATH_ALIAS_SQUADRE)
+    dati_campionati = dati_campionati or {}
+    partite = partite.reset_index(drop=True)
+    numero_partite = len(partite)
+    ingresso = {c: [_valore_partita(v) for v in partite[c].tolist()] if c in partite.columns else [None] * numero_partite for c in COLONNE_PARTITA}
+    casa_std = [alias_dict.get(sq, sq) for sq in ingresso['home_team']]
+    trasf_std = [alias_dict.get(sq, sq) for sq in ingresso['away_team']]
+    campionati = [MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.get(c) if c is not None else None for c in ingresso['competizione']]
+    errori = [None] * numero_partite
+    gruppi = {}
+    for i in range(numero_partite):
+        if not all([ingresso['home_team'][i], ingresso['away_team'][i], ingresso['competizione'][i]]):
+            errori[i] = "Info partita incomplete"
+        elif campionati[i] is None:
+            errori[i] = f"Nessuna mappatura trovata per la competizione '{ingresso['competizione'][i]}' in MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX"
+        else:
+            gruppi.setdefault(campionati[i], []).append(i)
+
+    # Statistiche delle squadre e medie unite per campionato su tutta la lista
+    medie_campionati, blocchi_casa, blocchi_trasf = {}, [], []
+    presenti = np.zeros(numero_partite, dtype=bool)
+    for file_prefix_campionato, indici in gruppi.items():
+        dati = dati_campionati.get(file_prefix_campionato)
+        medie_campionati[file_prefix_campionato] = dati['medie'] if dati is not None else \
+            carica_medie_generali_campionato_V2(file_prefix_campionato, PATH_STATISTICHE_V2_BASE)
+        tabella = tabella_squadre_campionato(file_prefix_campionato, dati)
+        if tabella is None: tabella = pd.DataFrame()
+        for nomi, blocchi in (([casa_std[i] for i in indici], blocchi_casa), ([trasf_std[i] for i in indici], blocchi_trasf)):
+            mancanti = sorted(set(nomi) - set(tabella.index), key=str)
+            for nome in mancanti:
+                print(f"ATTENZIONE: Squadra '{nome}' non trovata nelle statistiche di {file_prefix_campionato}")
+            allineate = tabella.reindex(nomi)
+            allineate.index = indici
+            blocchi.append(allineate)
+        con_medie = bool(medie_campionati[file_prefix_campionato])
+        presenti[indici] = [con_medie and casa_std[i] in tabella.index and trasf_std[i] in tabella.index for i in indici]
+    for file_prefix_campionato, indici in gruppi.items():
+        for i in indici:
+            if not presenti[i]:
+                errori[i] = f"Dati V2 (squadre o medie campionato) mancanti per {casa_std[i]} vs {trasf_std[i]}"
+    stats_casa = pd.concat(blocchi_casa).reindex(range(numero_partite)) if blocchi_casa else pd.DataFrame(index=range(numero_partite))
+    stats_trasf = pd.concat(blocchi_trasf).reindex(range(numero_partite)) if blocchi_trasf else pd.DataFrame(index=range(numero_partite))
+
+    # H2H e arbitro per le partite valide (accessi a indice e registro, un arbitro caricato una volta per nome)
+    valide = np.flatnonzero(presenti)
+    h2h = [None] * numero_partite
+    dati_arbitri, arbitri_caricati = [None] * numero_partite, {}
+    for file_prefix_campionato, indici in gruppi.items():
+        dati = dati_campionati.get(file_prefix_campionato)
+        indice_h2h = dati['h2h'] if dati is not None else indice_h2h_campionato(file_prefix_campionato) # Controllo dei file una volta per campionato
+        for i in indici:
+            if not presenti[i]: continue
+            h2h[i] = get_h2h_stats(casa_std[i], trasf_std[i], 6, file_prefix_campionato, alias_dict, indice_h2h)
+            nome_arbitro = ingresso['arbitro'][i]
+            chiave_arbitro = nome_arbitro if isinstance(nome_arbitro, str) else None
+            if chiave_arbitro not in arbitri_caricati:
+                arbitri_caricati[chiave_arbitro] = carica_dati_arbitro_safe(nome_arbitro, PATH_DATI_ARBITRI)
+            dati_arbitri[i] = arbitri_caricati[chiave_arbitro]
+    stats_casa, stats_trasf = stats_casa.iloc[valide].reset_index(drop=True), stats_trasf.iloc[valide].reset_index(drop=True)
+    gruppi_valide = {}
+    for posizione, i in enumerate(valide.tolist()):
+        gruppi_valide.setdefault(campionati[i], []).append(posizione)
+    n_valide = len(valide)
+    media = lambda chiave, default: _colonna_medie(medie_campionati, gruppi_valide, n_valide, chiave, default)
+    h2h_valide = [h2h[i] for i in valide.tolist()]
+    arbitri_valide = [dati_arbitri[i] for i in valide.tolist()]
+
+    # xG FT e 1T su array
+    num_squadre = media('num_squadre_campionato', 20)
+    pos_casa = _colonna_squadre(stats_casa, 'posizione_classifica_attuale', num_squadre // 2)
+    pos_trasf = _colonna_squadre(stats_trasf, 'posizione_classifica_attuale', num_squadre // 2)
+    tier_casa, tier_trasf = tier_squadre(pos_casa, num_squadre), tier_squadre(pos_trasf, num_squadre)
+    rank_simile = np.abs(pos_casa - pos_trasf) <= POSIZIONI_RANGO_SIMILE
+    xg_casa_ft_base = calcola_expected_goals_partite(stats_casa, stats_trasf, media('media_gol_casa_campionato', 1.5), "casa", tier_trasf, rank_simile, "gol")
+    xg_trasf_ft_base = calcola_expected_goals_partite(stats_trasf, stats_casa, media('media_gol_trasferta_campionato', 1.2), "trasferta", tier_casa, rank_simile, "gol")
+    forma_casa = _colonna_squadre(stats_casa, 'forma_avanzata_totale', 0.5)
+    forma_trasf = _colonna_squadre(stats_trasf, 'forma_avanzata_totale', 0.5)
+    xg_casa_ft, xg_trasf_ft = aggiusta_xg_partite(
+        xg_casa_ft_base, xg_trasf_ft_base, forma_casa, forma_trasf,
+        np.array([h["partite_analizzate"] for h in h2h_valide], dtype=float),
+        np.array([h["media_gol_casa"] for h in h2h_valide], dtype=float), np.array([h["media_gol_trasferta"] for h in h2h_valide], dtype=float),
+        np.array([a.get("falli_pg", 21.5) for a in arbitri_valide], dtype=float), np.array([a.get("rigori_pg", 0.20) for a in arbitri_valide], dtype=float))
+    xg_casa_1t = calcola_expected_goals_partite(stats_casa, stats_trasf, media('media_gol_1T_casa_campionato', 0.7), "casa", tier_trasf, rank_simile, "gol_1T")
+    xg_trasf_1t = calcola_expected_goals_partite(stats_trasf, stats_casa, media('media_gol_1T_trasferta_campionato', 0.5), "trasferta", tier_casa, rank_simile, "gol_1T")
+    xg_casa_1t = np.maximum(0.05, np.minimum(xg_casa_1t * (1 + (forma_casa - 0.5) * PESO_FORMA_XG * 0.6), xg_casa_ft * 0.75))
+    xg_trasf_1t = np.maximum(0.05, np.minimum(xg_trasf_1t * (1 + (forma_trasf - 0.5) * PESO_FORMA_XG * 0.6), xg_trasf_ft * 0.75))
+
+    colonne = {
+        'squadra_casa_std': casa_std, 'squadra_trasferta_std': trasf_std, 'campionato': campionati,
+        'valido': presenti, 'errore': errori,
+        'arbitro_elaborato': [a.get('nome_arbitro_originale', ingresso['arbitro'][i]) if a is not None else None for i, a in enumerate(dati_arbitri)],
+        'h2h': h2h,
+    }
+    def in_tutte(valori):
+        """Valori delle partite valide riportati su tutte le partite (None o NaN per le altre)."""
+        if isinstance(valori, list):
+            completi = [None] * numero_partite
+            for posizione, i in enumerate(valide.tolist()): completi[i] = valori[posizione]
+            return completi
+        completi = np.full(numero_partite, np.nan)
+        completi[valide] = valori
+        return completi
+    for chiave in ('statistiche_trovate', 'falli_pg', 'gialli_pg', 'rigori_pg'):
+        colonne[f'arbitro_{chiave}'] = in_tutte([a.get(chiave) for a in arbitri_valide])
+    for nome, valori in (('xg_casa_ft_base', xg_casa_ft_base), ('xg_trasferta_ft_base', xg_trasf_ft_base), ('xg_casa_ft', xg_casa_ft),
+                         ('xg_trasferta_ft', xg_trasf_ft), ('xg_casa_1t', xg_casa_1t), ('xg_trasferta_1t', xg_trasf_1t),
+                         ('xg_casa_2t', np.maximum(0.01, xg_casa_ft - xg_casa_1t)), ('xg_trasferta_2t', np.maximum(0.01, xg_trasf_ft - xg_trasf_1t))):
+        colonne[nome] = in_tutte(valori)
+    for chiave, valori in probabilita_mercati_partite(xg_casa_ft, xg_trasf_ft, xg_casa_1t, xg_trasf_1t).items():
+        colonne[chiave] = in_tutte(valori)
+
+    # Valori attesi di corner, tiri, falli, gialli (arrotondati a 2 decimali, minimo 0.1 per squadra e 0.2 in totale)
+    for stat_base_name, _ in STAT_ALTRE_NOMI_BASE:
+        default_media_casa, default_media_trasf = medie_default_stat(stat_base_name)
+        exp_casa = _colonna_squadre(stats_casa, f'forza_attacco_{stat_base_name}_casa_generale_recente', 1.0) * \
+                   _colonna_squadre(stats_trasf, f'forza_difesa_{stat_base_name}_trasferta_generale_recente', 1.0) * \
+                   media(f'media_{stat_base_name}_casa_campionato', default_media_casa)
+        exp_trasf = _colonna_squadre(stats_trasf, f'forza_attacco_{stat_base_name}_trasferta_generale_recente', 1.0) * \
+                    _colonna_squadre(stats_casa, f'forza_difesa_{stat_base_name}_casa_generale_recente', 1.0) * \
+                    media(f'media_{stat_base_name}_trasferta_campionato', default_media_trasf)
+        exp_totale = exp_casa + exp_trasf
+        colonne[f'atteso_{stat_base_name}_casa'] = in_tutte(np.array([round(max(0.1, v), 2) for v in exp_casa.tolist()]))
+        colonne[f'atteso_{stat_base_name}_trasferta'] = in_tutte(np.array([round(max(0.1, v), 2) for v in exp_trasf.tolist()]))
+        colonne[f'atteso_{stat_base_name}_totale'] = in_tutte(np.array([round(max(0.2, v), 2) for v in exp_totale.tolist()]))
+    return pd.concat([partite, pd.DataFrame(colonne)], axis=1)
+
+predict_fixtures = prevedi_partite
+
+def formatta_pronostici_json(previsioni: pd.DataFrame) -> list:
+    """
+    Dizionari dei JSON di pronostici_V2 dalle righe di prevedi_partite, None per le righe non valide: pronostici secchi,
+    arrotondamenti ed etichette. Unico punto in cui sono definite le regole dei JSON (tempi specifici, multigol, U/O di
+    squadra, altre statistiche, combo); tests/test_pronostici_generati.py le confronta con JSON generati dalla versione originale.
+    """
+    risultato = [None] * len(previsioni)
+    valide = np.flatnonzero(previsioni['valido'].to_numpy(dtype=bool))
+    if not len(valide):
+        return risultato
+    righe = previsioni.iloc[valide]
+    colonna = lambda nome: righe[nome].to_numpy() if nome.startswith('P(') else righe[nome].tolist()
+    congiunte = {c: colonna(c) for c in (chiave_combinazione(selezioni) for selezioni in combinazioni_combo_v2() if len(selezioni) >= 2)
+                 if c in righe.columns}
+    prob_ft = {c: colonna(c) for c in righe.columns if c.startswith('P(') and not c.startswith(('P(DC_', 'P(Casa', 'P(Trasferta'))
+               and not c.startswith(tuple(BLOCCHI_MERCATI_ESTESI.values())) and '_1T' not in c and '_2T' not in c and c not in congiunte}
+    prob_ft['risultati_esatti'] = righe['risultati_esatti'].tolist()
+    pron_ft = pronostici_da_probabilita(prob_ft, False)
+    mercati_ht = ['P(1)', 'P(X)', 'P(2)', 'P(GG)', 'P(NG)'] + [f'P({lato}_{soglia})' for soglia in SOGLIE_OVER_UNDER_HT for lato in ('Over', 'Under')]
+    pron_1t = pronostici_da_probabilita({c: colonna(_chiave_tempo(c, "1T")) for c in mercati_ht}, True)
+    uo_2t = {c: colonna(_chiave_tempo(c, "2T")).tolist() for c in mercati_ht if c.startswith(('P(Over', 'P(Under'))}
+    esiti_2t = [colonna(c).tolist() for c in ('P(1_2T)', 'P(X_2T)', 'P(2_2T)')]
+    segna = {c: colonna(c).tolist() for c in ('P(Casa_segna_1T)', 'P(Casa_segna_2T)', 'P(Trasferta_segna_1T)', 'P(Trasferta_segna_2T)')}
+    over_squadra = {(team_label, soglia): np.round(colonna(f'P({team_label} Over {soglia})'), 3) # Come round() sui float64 di numpy
+                    for team_label in ("Casa", "Trasferta") for soglia in SOGLIE_UO_SQUADRA_STANDARD}
+    xg = {c: colonna(c) for c in ('xg_casa_ft_base', 'xg_trasferta_ft_base', 'xg_casa_ft', 'xg_trasferta_ft',
+                                  'xg_casa_1t', 'xg_trasferta_1t', 'xg_casa_2t', 'xg_trasferta_2t')}
+    attesi = {c: colonna(c) for c in righe.columns if c.startswith('atteso_')}
+    mercati_estesi = formatta_mercati_estesi({c: colonna(c) for c in righe.columns if c.startswith(tuple(BLOCCHI_MERCATI_ESTESI.values()))})
+    info = {c: colonna(c) for c in ('home_team', 'away_team', 'squadra_casa_std', 'squadra_trasferta_std', 'campionato',
+                                    'arbitro_elaborato', 'h2h', 'risultato_esatto_1T', 'arbitro_statistiche_trovate',
+                                    'arbitro_falli_pg', 'arbitro_gialli_pg')}
+
+    for n, i in enumerate(valide.tolist()):
+        pronostici = dict(pron_ft[n])
+        for soglia_ht in SOGLIE_OVER_UNDER_HT:
+            pronostici[f"over_1T_{soglia_ht}"] = pron_1t[n].get(f"U/O_{soglia_ht}", "NoBet")
+            pronostici[f"P(Over_1T_{soglia_ht})"] = pron_1t[n].get(f"P(Over_{soglia_ht})", 0.0)
+        pronostici["1X2_PrimoTempo"] = pron_1t[n].get('1X2', "NoBet")
+
+        # Tempi specifici
+        for s_ht in SOGLIE_OVER_UNDER_HT:
+            pronostici[f"over_2T_{s_ht}"] = get_pronostico_secco_uo(uo_2t[f'P(Over_{s_ht})'][n], uo_2t[f'P(Under_{s_ht})'][n])
+        pronostici["over_1T_0.5_over_2T_0.5"] = "Over" if pron_1t[n].get("U/O_0.5") == "Over" and pronostici["over_2T_0.5"] == "Over" else "Under"
+        pronostici["over_1T_1.5_over_2T_1.5"] = "Over" if pron_1t[n].get("U/O_1.5") == "Over" and pronostici["over_2T_1.5"] == "Over" else "Under"
+        pronostici["over_1T_1.5_over_2T_0.5"] = "Over" if pron_1t[n].get("U/O_1.5") == "Over" and pronostici["over_2T_0.5"] == "Over" else "Under"
+        pronostici["over_1T_0.5_over_2T_1.5"] = "Over" if pron_1t[n].get("U/O_0.5") == "Over" and pronostici["over_2T_1.5"] == "Over" else "Under"
+        pronostici["multigol_1T"] = intervallo_multigol_da_xg_team(xg['xg_casa_1t'][n] + xg['xg_trasferta_1t'][n])
+        pronostici["multigol_2T"] = intervallo_multigol_da_xg_team(xg['xg_casa_2t'][n] + xg['xg_trasferta_2t'][n])
+        pronostici["multigol_1T_2T"] = f"{pronostici['multigol_1T']} + {pronostici['multigol_2T']}"
+        pronostici["PrimoTempoFinale"] = f"{pron_1t[n]['1X2']}/{pron_ft[n]['1X2']}"
+        pronostici["RisultatoEsattoParzialeFinale"] = f"{info['risultato_esatto_1T'][n]}/{pron_ft[n].get('RisultatoEsatto', '0-0')}"
+        pronostici["casa_segna_1T/2T"] = formatta_segna_1t_2t(segna['P(Casa_segna_1T)'][n], segna['P(Casa_segna_2T)'][n])
+        pronostici["trasferta_segna_1T/2T"] = formatta_segna_1t_2t(segna['P(Trasferta_segna_1T)'][n], segna['P(Trasferta_segna_2T)'][n])
+        secco_2t = get_pronostico_secco_1x2(esiti_2t[0][n], esiti_2t[1][n], esiti_2t[2][n])
+        pronostici["casa_vince_almeno_un_tempo"] = "SI" if pron_1t[n].get("1X2") == "1" or secco_2t == "1" else "NO"
+        pronostici["trasferta_vince_almeno_un_tempo"] = "SI" if pron_1t[n].get("1X2") == "2" or secco_2t == "2" else "NO"
+
+        # Under/Over e multigol di squadra
+        for team_label, xg_team_ft in (("Casa", xg['xg_casa_ft'][n]), ("Trasferta", xg['xg_trasferta_ft'][n])):
+            for soglia_label_float in SOGLIE_UO_SQUADRA_STANDARD:
+                p_over_team = over_squadra[(team_label, soglia_label_float)][n]
+                pronostici[f"{team_label} Over/Under {soglia_label_float}"] = get_pronostico_secco_uo(p_over_team, 1.0 - p_over_team)
+                pronostici[f"P({team_label} Over {soglia_label_float})"] = p_over_team
+            pronostici[f"multigol_{team_label.lower()}"] = intervallo_multigol_da_xg_team(xg_team_ft, team_label.lower())
+        pronostici["multigol_casa_trasferta"] = f"{pronostici['multigol_casa']}/{pronostici['multigol_trasferta']}"
+
+        # Altre statistiche
+        dati_arbitro = {'statistiche_trovate': info['arbitro_statistiche_trovate'][n],
+                        'falli_pg': info['arbitro_falli_pg'][n], 'gialli_pg': info['arbitro_gialli_pg'][n]}
+        for stat_base, label_out in STAT_ALTRE_NOMI_BASE:
+            pronostici.update(genera_pronostici_altre_stat_da_attesi(
+                stat_base, label_out, attesi[f'atteso_{stat_base}_casa'][n], attesi[f'atteso_{stat_base}_trasferta'][n],
+                attesi[f'atteso_{stat_base}_totale'][n], dati_arbitro if stat_base in ['falli', 'gialli'] else None))
+        pronostici.update(genera_combo_v2(pronostici, lambda c: congiunte[c][n] if c in congiunte else None))
 
-        if not all([stats_casa, stats_trasf, medie_campionato]):
-            print(f"ERRORE: Dati V2 (squadre o medie campionato) mancanti per {home_team_std} vs {away_team_std}. Salto."); continue
-        
-        pronostici_output = {
+        risultato[i] = {
             "partita_info": {
-                "squadra_casa_flashscore": home_team_fs, "squadra_trasferta_flashscore": away_team_fs,
-                "squadra_casa_std": home_team_std, "squadra_trasferta_std": away_team_std,
-                "arbitro": dati_arbitro.get('nome_arbitro_originale', arbitro_nome),
-                "competizione_elaborata": file_prefix_campionato
+                "squadra_casa_flashscore": info['home_team'][n], "squadra_trasferta_flashscore": info['away_team'][n],
+                "squadra_casa_std": info['squadra_casa_std'][n], "squadra_trasferta_std": info['squadra_trasferta_std'][n],
+                "arbitro": info['arbitro_elaborato'][n], "competizione_elaborata": info['campionato'][n]
             },
-            "analisi_modello_V2": {},
-            "pronostici": {}
+            "analisi_modello_V2": {
+                "H2H_ultime_partite": info['h2h'][n],
+                "Expected_Goals_FT": {
+                    "home_base_vs_tier": round(xg['xg_casa_ft_base'][n], 2), "away_base_vs_tier": round(xg['xg_trasferta_ft_base'][n], 2),
+                    "home_final_adj": round(xg['xg_casa_ft'][n], 2), "away_final_adj": round(xg['xg_trasferta_ft'][n], 2),
+                    "total_final_adj": round(xg['xg_casa_ft'][n] + xg['xg_trasferta_ft'][n], 2)
+                },
+                "Expected_Goals_1T": {
+                    "home_adj": round(xg['xg_casa_1t'][n], 2), "away_adj": round(xg['xg_trasferta_1t'][n], 2),
+                    "total_adj": round(xg['xg_casa_1t'][n] + xg['xg_trasferta_1t'][n], 2)
+                }
+            },
+            "pronostici": pronostici,
+            "mercati_estesi": mercati_estesi[n]
         }
-        
-        # --- LOGICA V2 PER CALCOLO XG ---
-        num_squadre_attuali = medie_campionato.get('num_squadre_campionato', 20)
-        pos_casa = stats_casa.get('posizione_classifica_attuale', num_squadre_attuali // 2)
-        pos_trasf = stats_trasf.get('posizione_classifica_attuale', num_squadre_attuali // 2)
-        
-        tier_casa = get_tier_squadra(pos_casa, num_squadre_attuali) # Tier della squadra di casa
-        tier_trasf = get_tier_squadra(pos_trasf, num_squadre_attuali) # Tier della squadra trasferta
+    return risultato
 
-        rank_simile_casa_vs_trasf = abs(pos_casa - pos_trasf) <= POSIZIONI_RANGO_SIMILE
-        rank_simile_trasf_vs_casa = rank_simile_casa_vs_trasf # Simmetrico
+# === MAIN ===
+def salva_pronostico_json(output_file_name: str, pronostici_output: dict):
+    with open(output_file_name, "w", encoding='utf-8') as out_f:
+        json.dump(pronostici_output, out_f, indent=4, ensure_ascii=False)
+    print(f"✅ Pronostico V2 salvato: {output_file_name}")
+
+def leggi_partite(file_partite_json: list, percorso_partite: str = PATH_PARTITE_INPUT) -> pd.DataFrame:
+    """DataFrame di partite per prevedi_partite dai JSON di dati_flashscore (colonne COLONNE_PARTITA più 'file')."""
+    righe = []
+    for file_partita_json in file_partite_json:
+        with open(os.path.join(percorso_partite, file_partita_json), 'r', encoding='utf-8') as f:
+            info_partita = json.load(f)
+        righe.append({**{c: info_partita.get(c) for c in COLONNE_PARTITA}, 'file': file_partita_json})
+    return pd.DataFrame(righe, columns=list(COLONNE_PARTITA) + ['file'])
 
-        # xG FT Base (usando Forza VS Tier dell'avversario)
-        xg_casa_ft_base = calcola_expected_goals_v2(stats_casa, stats_trasf, medie_campionato.get('media_gol_casa_campionato',1.5), "casa", tier_trasf, rank_simile_trasf_vs_casa, "gol")
-        xg_trasf_ft_base = calcola_expected_goals_v2(stats_trasf, stats_casa, medie_campionato.get('media_gol_trasferta_campionato',1.2), "trasferta", tier_casa, rank_simile_casa_vs_trasf, "gol")
-        
-        # H2H Stats
-        h2h_stats = get_h2h_stats(home_team_std, away_team_std, 6, file_prefix_campionato, alias_dict)
-        pronostici_output["analisi_modello_V2"]["H2H_ultime_partite"] = h2h_stats
+def genera_pronostici_partite(file_partite_json: list, alias_dict: dict, percorso_partite: str = PATH_PARTITE_INPUT,
+                              cartella_output: str = PATH_OUTPUT_PRONOSTICI_V2, dati_campionati: dict = None, scrittore=None) -> list:
+    """
+    Pronostici di un elenco di partite di dati_flashscore: previsioni di tutte in blocco con prevedi_partite, poi un JSON
+    per partita (formatta_pronostici_json). Restituisce i percorsi salvati nell'ordine dei file, None per le partite saltate.
+    dati_campionati (pipeline in memoria): {campionato: {'statistiche', 'medie', 'classifica', 'h2h'}} al posto dei file.
+    scrittore(funzione, *argomenti), se passato, esegue i salvataggi (es. in un thread di scrittura) invece di farli subito.
+    """
+    partite = leggi_partite(file_partite_json, percorso_partite)
+    previsioni = prevedi_partite(partite, alias_dict, dati_campionati)
+    salvati = []
+    for file_partita_json, campionato, errore, pronostici_output in zip(
+            previsioni['file'], previsioni['campionato'], previsioni['errore'], formatta_pronostici_json(previsioni)):
+        print(f"\n▶️  Elaboro: {file_partita_json}...")
+        if pronostici_output is None:
+            print(f"ERRORE: {errore} ({file_partita_json}). Salto."); salvati.append(None); continue
+        print(f"    Lega identificata per le stats: -> Prefisso file: '{campionato}'")
+        output_file_name = os.path.join(cartella_output, file_partita_json)
+        if scrittore is None:
+            salva_pronostico_json(output_file_name, pronostici_output)
+        else:
+            scrittore(salva_pronostico_json, output_file_name, pronostici_output)
+        salvati.append(output_file_name)
+    return salvati
 
-        # Aggiustamenti finali H2H, Forma, Arbitro
-        xg_casa_ft_adj, xg_trasf_ft_adj = aggiusta_xg_h2h_forma_arbitro(xg_casa_ft_base, xg_trasf_ft_base, stats_casa, stats_trasf, h2h_stats, dati_arbitro)
-        
-        pronostici_output["analisi_modello_V2"]["Expected_Goals_FT"] = {
-            "home_base_vs_tier": round(xg_casa_ft_base,2), "away_base_vs_tier": round(xg_trasf_ft_base,2),
-            "home_final_adj": round(xg_casa_ft_adj,2), "away_final_adj": round(xg_trasf_ft_adj,2),
-            "total_final_adj": round(xg_casa_ft_adj + xg_trasf_ft_adj,2)
-        }
-        matrice_ft = genera_matrice_probabilita_poisson(xg_casa_ft_adj, xg_trasf_ft_adj, MAX_GOL_POISSON_FT)
-        pron_ft_principali = estrai_pronostici_da_matrice(matrice_ft, MAX_GOL_POISSON_FT, xg_casa_ft_adj, xg_trasf_ft_adj, False)
-        pronostici_output["pronostici"].update(pron_ft_principali)
-        # Il multigol_totale secco ora viene da estrai_pronostici_da_matrice
-
-        # --- Calcoli Primo Tempo (1T) ---
-        xg_casa_1t_base = calcola_expected_goals_v2(stats_casa, stats_trasf, medie_campionato.get('media_gol_1T_casa_campionato',0.7), "casa", tier_trasf, rank_simile_trasf_vs_casa, "gol_1T")
-        xg_trasf_1t_base = calcola_expected_goals_v2(stats_trasf, stats_casa, medie_campionato.get('media_gol_1T_trasferta_campionato',0.5), "trasferta", tier_casa, rank_simile_casa_vs_trasf, "gol_1T")
-        
-        # Aggiustamento 1T (solo forma, per semplicità, no H2H o arbitro su 1T xG specifici)
-        forma_casa = stats_casa.get('forma_avanzata_totale', 0.5); forma_trasf = stats_trasf.get('forma_avanzata_totale', 0.5)
-        xg_casa_1t_adj = xg_casa_1t_base * (1 + (forma_casa - 0.5) * PESO_FORMA_XG * 0.6) # Peso forma ridotto per 1T
-        xg_trasf_1t_adj = xg_trasf_1t_base * (1 + (forma_trasf - 0.5) * PESO_FORMA_XG * 0.6)
-        xg_casa_1t_adj = max(0.05, min(xg_casa_1t_adj, xg_casa_ft_adj * 0.75)) 
-        xg_trasf_1t_adj = max(0.05, min(xg_trasf_1t_adj, xg_trasf_ft_adj * 0.75))
-
-        pronostici_output["analisi_modello_V2"]["Expected_Goals_1T"] = {
-             "home_adj": round(xg_casa_1t_adj,2), "away_adj": round(xg_trasf_1t_adj,2), "total_adj": round(xg_casa_1t_adj + xg_trasf_1t_adj,2)
-        }
-        matrice_1t = genera_matrice_probabilita_poisson(xg_casa_1t_adj, xg_trasf_1t_adj, MAX_GOL_POISSON_HT)
-        pron_1t_principali = estrai_pronostici_da_matrice(matrice_1t, MAX_GOL_POISSON_HT, xg_casa_1t_adj, xg_trasf_1t_adj, True)
+def genera_pronostico_partita(file_partita_json: str, alias_dict: dict, percorso_partite: str = PATH_PARTITE_INPUT,
+                              cartella_output: str = PATH_OUTPUT_PRONOSTICI_V2, dati_campionato: dict = None, scrittore=None):
+    """genera_pronostici_partite per una sola partita; dati_campionato vale per il campionato della partita, qualunque sia."""
+    dati_campionati = None if dati_campionato is None else {p: dati_campionato for p in MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.values()}
+    return genera_pronostici_partite([file_partita_json], alias_dict, percorso_partite, cartella_output, dati_campionati, scrittore)[0]
 
-        for soglia_ht in SOGLIE_OVER_UNDER_HT:
-            pronostici_output["pronostici"][f"over_1T_{soglia_ht}"] = pron_1t_principali.get(f"U/O_{soglia_ht}", "NoBet")
-            pronostici_output["pronostici"][f"P(Over_1T_{soglia_ht})"] = pron_1t_principali.get(f"P(Over_{soglia_ht})", 0.0)
-        pronostici_output["pronostici"]["1X2_PrimoTempo"] = pron_1t_principali.get('1X2', "NoBet") # Aggiunto secco 1X2 1T
-
-
-        # --- Pronostici sui Tempi Specifici ---
-        pronostici_tempi = genera_pronostici_tempi_specifici_v2(
-            xg_casa_1t_adj, xg_trasf_1t_adj, xg_casa_ft_adj, xg_trasf_ft_adj,
-            pron_1t_principali.get('1X2', "X"), pron_ft_principali.get('1X2', "X"),
-            matrice_1t, matrice_ft, MAX_GOL_POISSON_HT, MAX_GOL_POISSON_FT,
-            pron_1t_principali, pron_ft_principali
-        )
-        pronostici_output["pronostici"].update(pronostici_tempi)
-        
-        # --- Under/Over Squadra e Multigol Squadra ---
-        for team_label, xg_team_ft, team_stats_dict in [("Casa", xg_casa_ft_adj, stats_casa), ("Trasferta", xg_trasf_ft_adj, stats_trasf)]:
-            for soglia_label_float in SOGLIE_UO_SQUADRA_STANDARD: # es. 0.5, 1.5, 2.5
-                p_over_team, _ = calcola_prob_standard_uo_squadra(xg_team_ft, soglia_label_float, MAX_GOL_POISSON_FT)
-                secco_team_uo = get_pronostico_secco_uo(p_over_team, 1.0 - p_over_team)
-                pronostici_output["pronostici"][f"{team_label} Over/Under {soglia_label_float}"] = secco_team_uo
-                pronostici_output["pronostici"][f"P({team_label} Over {soglia_label_float})"] = p_over_team # Aggiunta P% per U/O squadra
-            pronostici_output["pronostici"][f"multigol_{team_label.lower()}"] = intervallo_multigol_da_xg_team(xg_team_ft, team_label.lower())
-        
-        pronostici_output["pronostici"]["multigol_casa_trasferta"] = f"{pronostici_output['pronostici']['multigol_casa']}/{pronostici_output['pronostici']['multigol_trasferta']}"
+def main():
+    svuota_cartella(PATH_OUTPUT_PRONOSTICI_V2) # Uso nuova cartella
+    alias_dict = carica_alias_squadre(PATH_ALIAS_SQUADRE)
+    if not alias_dict:
+        print("ERRORE CRITICO: alias_squadre.csv non caricato. Termino."); return
 
-        # --- Altre Statistiche (Corner, Tiri, etc.) ---
-        for stat_base, label_out in STAT_ALTRE_NOMI_BASE:
-            prono_stat = genera_pronostici_altre_stat_v2(stat_base, label_out, stats_casa, stats_trasf, medie_campionato, dati_arbitro if stat_base in ['falli','gialli'] else None)
-            pronostici_output["pronostici"].update(prono_stat)
-
-        # --- Combo Bets ---
-        combo = {}
-        _1x2 = pronostici_output["pronostici"].get("1X2", "NoBet")
-        _uo15 = pronostici_output["pronostici"].get("U/O_1.5", "No bet")
-        _uo25 = pronostici_output["pronostici"].get("U/O_2.5", "No bet")
-        _ggng = pronostici_output["pronostici"].get("GolNoGol", "NoBet")
-        _mgft_secco = pronostici_output["pronostici"].get("multigol_totale", "NoBet")
-        _dc = pronostici_output["pronostici"].get("DC", "NoBet")
-
-        combo["combo_1X2_over_1.5"] = f"{_1x2} + {_uo15}" if "NoBet" not in [_1x2, _uo15] and "No bet" not in [_1x2, _uo15] else "NoBet"
-        combo["combo_1X2_over_2.5"] = f"{_1x2} + {_uo25}" if "NoBet" not in [_1x2, _uo25] and "No bet" not in [_1x2, _uo25] else "NoBet"
-        combo["combo_1X2_gol_nogol"] = f"{_1x2} + {_ggng}" if "NoBet" not in [_1x2, _ggng] else "NoBet"
-        combo["combo_1X2_multigol"] = f"{_1x2} + {_mgft_secco}" if "NoBet" not in [_1x2, _mgft_secco] else "NoBet"
-        combo["doppia_chance_gol_nogol"] = f"{_dc} + {_ggng}" if "NoBet" not in [_dc, _ggng] else "NoBet"
-        combo["doppia_chance_over_1.5"] = f"{_dc} + {_uo15}" if "NoBet" not in [_dc, _uo15] and "No bet" not in [_dc, _uo15] else "NoBet"
-        combo["doppia_chance_over_2.5"] = f"{_dc} + {_uo25}" if "NoBet" not in [_dc, _uo25] and "No bet" not in [_dc, _uo25] else "NoBet"
-        combo["doppia_chance_multigol"] = f"{_dc} + {_mgft_secco}" if "NoBet" not in [_dc, _mgft_secco] else "NoBet"
-        pronostici_output["pronostici"].update(combo)
-        
-        # Salva il JSON di output
-        output_file_name = os.path.join(PATH_OUTPUT_PRONOSTICI_V2, file_partita_json)
-        with open(output_file_name, "w", encoding='utf-8') as out_f:
-            json.dump(pronostici_output, out_f, indent=4, ensure_ascii=False)
-        print(f"✅ Pronostico V2 salvato: {output_file_name}")
+    file_partite_json = [f for f in os.listdir(PATH_PARTITE_INPUT) if f.endswith(".json")]
+    genera_pronostici_partite(file_partite_json, alias_dict)
+    print(f"\n📦 Cache campionati: {_CACHE_CAMPIONATI.miss} caricamenti, {_CACHE_CAMPIONATI.hit} hit, "
+          f"{_CACHE_CAMPIONATI.verifiche_hash} verifiche hash")
 
  # Esegui il push su GitHub solo se sono stati creati dei file di pronostico
     if os.path.exists(PATH_OUTPUT_PRONOSTICI_V2) and os.listdir(PATH_OUTPUT_PRONOSTICI_V2):
@@ -893,5 +1697,136 @@ def main():
         git_push_pronostici_v2(PATH_OUTPUT_PRONOSTICI_V2)
     else:
         print("\nℹ️ Nessun file di pronostico generato, push non necessario.")
+def benchmark_caricamento_statistiche(percorso_partite=PATH_PARTITE_INPUT, percorso_base=PATH_STATISTICHE_V2_BASE):
+    """
+    Latenza di caricamento delle statistiche delle due squadre per ogni partita in dati_flashscore:
+    CSV completo contro store binario (a freddo, con apertura del file, e a caldo) e cache di campionato.
+    """
+    alias_dict = carica_alias_squadre(PATH_ALIAS_SQUADRE)
+    partite = []
+    for file_partita_json in sorted(os.listdir(percorso_partite)):
+        if not file_partita_json.endswith(".json"): continue
+        with open(os.path.join(percorso_partite, file_partita_json), 'r', encoding='utf-8') as f:
+            info_partita = json.load(f)
+        prefix = MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.get(info_partita.get("competizione"))
+        if not prefix or not info_partita.get("home_team") or not info_partita.get("away_team"): continue
+        partite.append((prefix, alias_dict.get(info_partita["home_team"], info_partita["home_team"]),
+                        alias_dict.get(info_partita["away_team"], info_partita["away_team"])))
+    if not partite:
+        print("ℹ️ Nessuna partita da misurare."); return True
+
+    tempi = {'csv': [], 'store_freddo': [], 'store_caldo': [], 'cache_campionato': []}
+    for prefix, casa, trasferta in partite:
+        inizio = time.perf_counter()
+        for sq in (casa, trasferta): carica_statistiche_squadra_V2_csv(sq, prefix, percorso_base)
+        tempi['csv'].append(time.perf_counter() - inizio)
+        _STORE_STATISTICHE_APERTI.clear()
+        for chiave in ('store_freddo', 'store_caldo'):
+            inizio = time.perf_counter()
+            dallo_store = carica_statistiche_squadre_store_V2([casa, trasferta], prefix, percorso_base)
+            tempi[chiave].append(time.perf_counter() - inizio)
+        if dallo_store is None:
+            print(f"ATTENZIONE: Store non disponibile per {prefix}."); return False
+        carica_statistiche_squadra_V2(casa, prefix, percorso_base) # Riempie la cache del campionato
+        inizio = time.perf_counter()
+        for sq in (casa, trasferta): carica_statistiche_squadra_V2(sq, prefix, percorso_base)
+        tempi['cache_campionato'].append(time.perf_counter() - inizio)
+    for chiave, valori in tempi.items():
+        print(f"⏱️  {chiave}: media {np.mean(valori) * 1e3:.3f} ms, mediana {np.median(valori) * 1e3:.3f} ms per partita")
+    print(f"⏱️  {len(partite)} partite, store a caldo {np.mean(tempi['csv']) / np.mean(tempi['store_caldo']):.1f}x più veloce del CSV, "
+          f"cache di campionato {np.mean(tempi['csv']) / np.mean(tempi['cache_campionato']):.0f}x")
+    print(f"📦 Cache campionati: {_CACHE_CAMPIONATI.miss} caricamenti, {_CACHE_CAMPIONATI.hit} hit, {_CACHE_CAMPIONATI.verifiche_hash} verifiche hash")
+    return True
+
+def benchmark_mercati_estesi(dimensioni=(1000, 100000)) -> bool:
+    """Costo per partita dei mercati estesi rispetto all'estrazione dei mercati esistenti sulle stesse matrici FT, 1T e 2T."""
+    rng = np.random.default_rng(0)
+    for n in dimensioni:
+        xg_c, xg_t, quota = rng.uniform(0.05, 4.0, n), rng.uniform(0.05, 4.0, n), rng.uniform(0.3, 0.6, n)
+        t_esistenti = t_estesi = 0.0
+        for inizio_blocco in range(0, n, BLOCCO_ESTRAZIONE): # Blocchi come in probabilita_mercati_partite
+            fine = inizio_blocco + BLOCCO_ESTRAZIONE
+            c, t, q = xg_c[inizio_blocco:fine], xg_t[inizio_blocco:fine], quota[inizio_blocco:fine]
+            t_ft = genera_matrici_probabilita_poisson(c, t, MAX_GOL_POISSON_FT)
+            t_1t = genera_matrici_probabilita_poisson(c * q, t * q, MAX_GOL_POISSON_HT)
+            t_2t = genera_matrici_probabilita_poisson(c * (1 - q), t * (1 - q), MAX_GOL_POISSON_HT)
+            inizio = time.perf_counter()
+            probabilita_mercati_tensore(t_ft, False); probabilita_mercati_tensore(t_1t, True); probabilita_mercati_tensore(t_2t, True)
+            t_esistenti += time.perf_counter() - inizio
+            inizio = time.perf_counter()
+            mercati_estesi_tensore(t_ft, t_1t, t_2t)
+            t_estesi += time.perf_counter() - inizio
+        print(f"⏱️  {n:>6} partite: estrazione esistente (FT, 1T, 2T) {t_esistenti / n * 1e6:.1f} µs per partita, "
+              f"mercati estesi {t_estesi / n * 1e6:.1f} µs per partita (+{t_estesi / t_esistenti:.0%})")
+    return True
+
+def partite_sintetiche(numero_partite: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Lista di partite casuali per benchmark e verifiche: coppie di squadre dello stesso campionato (tra quelli con
+    statistiche V2) e arbitri presi dalle partite di dati_flashscore (più qualche arbitro mancante).
+    """
+    rng = np.random.default_rng(seed)
+    squadre = {}
+    for competizione, prefix in MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.items():
+        with contextlib.redirect_stdout(io.StringIO()):
+            tabella = tabella_squadre_campionato(prefix)
+        if tabella is not None and len(tabella) >= 2: squadre[competizione] = tabella.index.tolist()
+    arbitri = [None]
+    if os.path.isdir(PATH_PARTITE_INPUT):
+        arbitri += leggi_partite([f for f in sorted(os.listdir(PATH_PARTITE_INPUT)) if f.endswith(".json")])['arbitro'].tolist()
+    if not squadre:
+        return pd.DataFrame(columns=list(COLONNE_PARTITA))
+    competizioni = list(squadre)
+    righe = []
+    for _ in range(numero_partite):
+        competizione = competizioni[rng.integers(len(competizioni))]
+        casa, trasferta = rng.choice(len(squadre[competizione]), 2, replace=False)
+        righe.append({'home_team': squadre[competizione][casa], 'away_team': squadre[competizione][trasferta],
+                      'competizione': competizione, 'arbitro': arbitri[rng.integers(len(arbitri))]})
+    return pd.DataFrame(righe, columns=list(COLONNE_PARTITA))
+
+def benchmark_previsioni(dimensioni=(10, 1000, 100000)) -> bool:
+    """Latenza per partita di prevedi_partite e della formattazione JSON su liste di 10, 1000 e 100000 partite casuali (cache dei file già calde)."""
+    alias_dict = carica_alias_squadre(PATH_ALIAS_SQUADRE)
+    with contextlib.redirect_stdout(io.StringIO()):
+        prevedi_partite(partite_sintetiche(10, seed=1), alias_dict) # Riempie cache di file, indici H2H e registro arbitri
+    for n in dimensioni:
+        partite = partite_sintetiche(n)
+        if partite.empty:
+            print("ℹ️ Nessun campionato con statistiche V2: niente da misurare."); return False
+        with contextlib.redirect_stdout(io.StringIO()):
+            inizio = time.perf_counter()
+            previsioni = prevedi_partite(partite, alias_dict)
+            t_previsioni = (time.perf_counter() - inizio) / n
+            inizio = time.perf_counter()
+            formatta_pronostici_json(previsioni)
+            t_json = (time.perf_counter() - inizio) / n
+        print(f"⏱️  {n:>7} partite: prevedi_partite {t_previsioni * 1e3:7.3f} ms, "
+              f"+ formattazione JSON {(t_previsioni + t_json) * 1e3:7.3f} ms per partita")
+    return True
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera i pronostici V2 per le partite in dati_flashscore")
+    parser.add_argument("--benchmark-mercati-estesi", action="store_true", help="Misura il costo dei mercati estesi rispetto all'estrazione esistente e termina")
+    parser.add_argument("--benchmark-previsioni", action="store_true", help="Misura la latenza per partita di prevedi_partite su 10, 1000 e 100000 partite e termina")
+    parser.add_argument("--report-arbitri", action="store_true", help="Mostra come vengono risolti gli arbitri delle partite (esatti, per sottostringa, ambigui) e termina")
+    parser.add_argument("--benchmark-poisson", action="store_true", help="Misura il motore Poisson a tensore su 10, 1000 e 100000 partite e termina")
+    parser.add_argument("--benchmark-mercati", action="store_true", help="Misura l'estrazione dei mercati, una matrice alla volta e in blocco, e termina")
+    parser.add_argument("--benchmark-h2h", action="store_true", help="Misura costruzione e ricerche dell'indice H2H per campionato e termina")
+    parser.add_argument("--benchmark-store", action="store_true", help="Misura la latenza di caricamento statistiche per partita (CSV, store binario, cache di campionato) e termina")
+    args = parser.parse_args()
+    if args.benchmark_mercati_estesi:
+        raise SystemExit(0 if benchmark_mercati_estesi() else 1)
+    if args.benchmark_previsioni:
+        raise SystemExit(0 if benchmark_previsioni() else 1)
+    if args.report_arbitri:
+        report_arbitri(); raise SystemExit(0)
+    if args.benchmark_poisson:
+        raise SystemExit(0 if benchmark_poisson() else 1)
+    if args.benchmark_mercati:
+        raise SystemExit(0 if benchmark_estrazione_mercati() else 1)
+    if args.benchmark_h2h:
+        raise SystemExit(0 if benchmark_h2h() else 1)
+    if args.benchmark_store:
+        raise SystemExit(0 if benchmark_caricamento_statistiche() else 1)
     main()
\ No newline at end of file
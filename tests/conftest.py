@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# Gli script stanno nella radice del repository e usano percorsi relativi ("./dati_csv", ...)
+RADICE_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RADICE_REPO not in sys.path:
+    sys.path.insert(0, RADICE_REPO)
+
+
+@pytest.fixture(autouse=True)
+def cartella_repo(monkeypatch):
+    """Ogni test gira dalla radice del repository, come gli script."""
+    monkeypatch.chdir(RADICE_REPO)
+    return RADICE_REPO
+
+
+def richiede_cartella(percorso: str):
+    """Salta il test se mancano i dati del repository (es. checkout parziale)."""
+    if not os.path.isdir(os.path.join(RADICE_REPO, percorso)) or not os.listdir(os.path.join(RADICE_REPO, percorso)):
+        pytest.skip(f"Cartella '{percorso}' assente o vuota")
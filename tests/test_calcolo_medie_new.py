@@ -0,0 +1,447 @@
+import contextlib
+import glob
+import io
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import CALCOLO_MEDIE_NEW as medie
+import CREA_CLASSIFICA
+from conftest import RADICE_REPO, richiede_cartella
+
+CAMPIONATI = list(medie.CAMPIONATI_NOMI_FILE.values())
+
+
+def carica_dati(nome_campionato: str, cache: medie.CacheStagioni = None) -> dict:
+    richiede_cartella("dati_csv")
+    with contextlib.redirect_stdout(io.StringIO()):
+        dati = medie.carica_dati_campionato_V2(nome_campionato, cache)
+    if dati is None or not dati['squadre_stagione_corrente']:
+        pytest.skip(f"Nessun dato per {nome_campionato}")
+    return dati
+
+
+# === SUDDIVISIONE PER TIER (riferimento: iterrows + concat riga per riga) ===
+
+def classifiche_storiche_per_stagione(nome_campionato: str) -> dict:
+    """{stagione: {squadra: posizione}, "{stagione}_num_squadre": n} dalle classifiche finali, come le usava il calcolo originale."""
+    classifiche_storiche_dict = {}
+    for f_path in glob.glob(os.path.join(medie.CARTELLA_CLASSIFICHE_STORICHE, f"classifica_{nome_campionato}_*_finale.csv")):
+        stagione_class = os.path.basename(f_path).split('_')[-2]
+        df_c = pd.read_csv(f_path)
+        classifiche_storiche_dict[stagione_class] = df_c.set_index('Squadra')['Pos'].to_dict()
+        classifiche_storiche_dict[stagione_class + "_num_squadre"] = len(df_c)
+    return classifiche_storiche_dict
+
+
+def get_tier_squadra(posizione: int, num_squadre: int) -> str:
+    if num_squadre == 0: return "Mid" # Evita divisione per zero
+    num_top = math.ceil(medie.PERC_TIER_TOP * num_squadre)
+    num_bottom = math.ceil(medie.PERC_TIER_BOTTOM * num_squadre)
+
+    if posizione <= num_top:
+        return "Top"
+    elif posizione > (num_squadre - num_bottom):
+        return "Bottom"
+    else:
+        return "Mid"
+
+
+def test_tier_vettoriale_uguale_allo_scalare():
+    num_squadre = np.array([n for n in range(0, 25) for _ in range(max(n, 1))])
+    posizioni = np.array([p for n in range(0, 25) for p in range(1, max(n, 1) + 1)])
+    attesi = [get_tier_squadra(p, n) for p, n in zip(posizioni, num_squadre)]
+    assert medie.get_tier_squadre_array(posizioni, num_squadre).tolist() == attesi
+
+
+def suddividi_partite_per_contesto(df_storico_squadra: pd.DataFrame, squadra_analisi: str) -> dict:
+    """
+    Partite di una squadra (con le colonne di medie.aggiungi_posizioni_storiche) divise per tier
+    dell'avversario e rango simile, tramite maschere booleane. Riferimento per squadra dei calcoli a tensore.
+    """
+    df_valide = df_storico_squadra[df_storico_squadra['classifica_disponibile']]
+    in_casa = (df_valide['squadra_casa'] == squadra_analisi).to_numpy()
+    tier_avversario = np.where(in_casa, df_valide['tier_trasferta'], df_valide['tier_casa'])
+    pos_squadra = np.where(in_casa, df_valide['pos_casa'], df_valide['pos_trasferta'])
+    pos_avversario = np.where(in_casa, df_valide['pos_trasferta'], df_valide['pos_casa'])
+    simile = (np.abs(pos_squadra - pos_avversario) <= medie.POSIZIONI_RANGO_SIMILE) & (pos_squadra != pos_avversario)
+    return {
+        "Top": df_valide[tier_avversario == "Top"],
+        "Mid": df_valide[tier_avversario == "Mid"],
+        "Bottom": df_valide[tier_avversario == "Bottom"],
+        "Simile": df_valide[simile],
+    }
+
+
+def suddividi_partite_per_contesto_iterativa(df_storico_squadra: pd.DataFrame, squadra_analisi: str, classifiche_storiche_dict: dict) -> dict:
+    """Implementazione originale, riferimento per la suddivisione a maschere."""
+    partite_vs_top, partite_vs_mid, partite_vs_bottom, partite_vs_simile = pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    for _, partita_storica in df_storico_squadra.iterrows():
+        stagione_partita = partita_storica['stagione_file']
+        classifica_stagione_partita = classifiche_storiche_dict.get(stagione_partita)
+        num_squadre_stag_partita = classifiche_storiche_dict.get(stagione_partita + "_num_squadre", 20)
+
+        if not classifica_stagione_partita: continue
+
+        squadra_casa_storica = partita_storica['squadra_casa']
+        squadra_trasf_storica = partita_storica['squadra_trasferta']
+
+        avversario_storico = squadra_trasf_storica if squadra_casa_storica == squadra_analisi else squadra_casa_storica
+        pos_avversario_storico = classifica_stagione_partita.get(avversario_storico, num_squadre_stag_partita // 2)
+        tier_avversario = get_tier_squadra(pos_avversario_storico, num_squadre_stag_partita)
+
+        partita_df_temp = pd.DataFrame([partita_storica])
+
+        if tier_avversario == "Top": partite_vs_top = pd.concat([partite_vs_top, partita_df_temp])
+        elif tier_avversario == "Mid": partite_vs_mid = pd.concat([partite_vs_mid, partita_df_temp])
+        elif tier_avversario == "Bottom": partite_vs_bottom = pd.concat([partite_vs_bottom, partita_df_temp])
+
+        pos_squadra_analisi_storica = classifica_stagione_partita.get(squadra_analisi, num_squadre_stag_partita // 2)
+        if abs(pos_squadra_analisi_storica - pos_avversario_storico) <= medie.POSIZIONI_RANGO_SIMILE and pos_squadra_analisi_storica != pos_avversario_storico:
+            partite_vs_simile = pd.concat([partite_vs_simile, partita_df_temp])
+
+    return {"Top": partite_vs_top, "Mid": partite_vs_mid, "Bottom": partite_vs_bottom, "Simile": partite_vs_simile}
+
+
+@pytest.mark.parametrize("nome_campionato", CAMPIONATI)
+def test_suddivisione_per_contesto_uguale_a_iterativa(nome_campionato):
+    dati = carica_dati(nome_campionato)
+    classifiche_storiche = classifiche_storiche_per_stagione(nome_campionato)
+    df_storico = dati['df_storico_completo']
+    for squadra in dati['squadre_stagione_corrente']:
+        df_squadra = df_storico[(df_storico['squadra_casa'] == squadra) | (df_storico['squadra_trasferta'] == squadra)]
+        a_maschere = suddividi_partite_per_contesto(df_squadra, squadra)
+        iterativa = suddividi_partite_per_contesto_iterativa(df_squadra, squadra, classifiche_storiche)
+        for contesto in ("Top", "Mid", "Bottom", "Simile"):
+            # Stesse partite, nello stesso ordine
+            assert list(a_maschere[contesto].index) == list(iterativa[contesto].index), (squadra, contesto)
+
+
+# === STATISTICHE V2 (riferimento: calcolo squadra per squadra) ===
+
+def calcola_medie_forza_da_df(df_partite_target: pd.DataFrame, squadra_analisi: str, stat_campionato_generali: dict, nome_stat_base:str, col_casa:str, col_trasferta:str, contesto:str = ""):
+    """
+    Calcola medie e forza per una squadra da un DataFrame di partite filtrato.
+    Contesto può essere es. "_VS_Top", "_VS_Mid", "_VS_Bottom", "_VS_Simile"
+    """
+    risultati = {}
+    df_casa_squadra = df_partite_target[df_partite_target['squadra_casa'] == squadra_analisi]
+    df_trasf_squadra = df_partite_target[df_partite_target['squadra_trasferta'] == squadra_analisi]
+
+    # Medie Fatte/Subite dalla squadra nel contesto specifico
+    media_fatti_casa = df_casa_squadra[col_casa].mean() if not df_casa_squadra.empty else 0
+    media_subiti_casa = df_casa_squadra[col_trasferta].mean() if not df_casa_squadra.empty else 0 # Avversario era in trasferta
+    media_fatti_trasferta = df_trasf_squadra[col_trasferta].mean() if not df_trasf_squadra.empty else 0
+    media_subiti_trasferta = df_trasf_squadra[col_casa].mean() if not df_trasf_squadra.empty else 0 # Avversario era in casa
+
+    risultati[f'media_{nome_stat_base}_fatti_casa{contesto}'] = round(media_fatti_casa, 2)
+    risultati[f'media_{nome_stat_base}_subiti_casa{contesto}'] = round(media_subiti_casa, 2)
+    risultati[f'media_{nome_stat_base}_fatti_trasferta{contesto}'] = round(media_fatti_trasferta, 2)
+    risultati[f'media_{nome_stat_base}_subiti_trasferta{contesto}'] = round(media_subiti_trasferta, 2)
+    
+    # Numero di partite usate per queste medie condizionali
+    risultati[f'num_partite_casa{contesto}'] = len(df_casa_squadra)
+    risultati[f'num_partite_trasferta{contesto}'] = len(df_trasf_squadra)
+
+    # Indici di Forza (relativi alle medie GENERALI del campionato)
+    den_casa = stat_campionato_generali.get(f'media_{nome_stat_base}_casa_campionato', 1.0)
+    den_trasf = stat_campionato_generali.get(f'media_{nome_stat_base}_trasferta_campionato', 1.0)
+
+    risultati[f'forza_attacco_{nome_stat_base}_casa{contesto}'] = round(media_fatti_casa / den_casa, 3) if den_casa > 0.01 else 1.0
+    risultati[f'forza_difesa_{nome_stat_base}_casa{contesto}'] = round(media_subiti_casa / den_trasf, 3) if den_trasf > 0.01 else 1.0
+    risultati[f'forza_attacco_{nome_stat_base}_trasferta{contesto}'] = round(media_fatti_trasferta / den_trasf, 3) if den_trasf > 0.01 else 1.0
+    risultati[f'forza_difesa_{nome_stat_base}_trasferta{contesto}'] = round(media_subiti_trasferta / den_casa, 3) if den_casa > 0.01 else 1.0
+    return risultati
+
+
+def calcola_forma_avanzata(partite_squadra: pd.DataFrame, df_classifica: pd.DataFrame, max_partite: int = 7) -> float:
+    """
+    Calcola la forma tenendo conto di:
+    1. Punti (3, 1, 0)
+    2. Pesi per recenza (la partita più recente pesa di più)
+    3. Forza dell'avversario (pesata in base alla sua posizione in classifica)
+    """
+    if partite_squadra.empty or len(partite_squadra) < 1: # Modificato controllo per permettere calcolo anche con meno di 3 partite
+        return 0.0
+    
+    # Se df_classifica è vuoto o manca 'Squadra'/'Pos', non possiamo pesare per avversario.
+    # In tal caso, potremmo procedere senza quel peso o ritornare una forma neutra/default.
+    # Per ora, se manca la classifica, il .get(avversario, ...) userà il default.
+    classifica_valida = not df_classifica.empty and 'Squadra' in df_classifica.columns and 'Pos' in df_classifica.columns
+    
+    partite_recenti = partite_squadra.tail(max_partite)
+    if partite_recenti.empty: # Ulteriore controllo
+        return 0.0
+
+    punti_ottenuti = []
+    coefficienti_difficolta = []
+    
+    num_squadre = len(df_classifica) if classifica_valida else 20 # Default a 20 se classifica non disponibile
+    posizioni_classifica = df_classifica.set_index('Squadra')['Pos'].to_dict() if classifica_valida else {}
+
+    for _, row in partite_recenti.iterrows():
+        # Assicurati che 'squadra_in_analisi' sia presente nel DataFrame 'row'
+        # Questa colonna viene aggiunta prima di chiamare calcola_forma_avanzata nel main
+        if 'squadra_in_analisi' not in row:
+            # Fallback o errore se 'squadra_in_analisi' non è definita
+            # Per ora, assumiamo che sia sempre presente come da logica in elabora_statistiche_campionato_V2
+            print(f"ATTENZIONE: 'squadra_in_analisi' non trovata nella riga della partita durante calcolo forma. Salto partita.")
+            continue
+
+        squadra_in_analisi = row['squadra_in_analisi']
+        squadra_in_casa = row['squadra_casa'] == squadra_in_analisi
+        
+        avversario = row['squadra_trasferta'] if squadra_in_casa else row['squadra_casa']
+        
+        punti = 0
+        if squadra_in_casa:
+            if row['gol_casa'] > row['gol_trasferta']: punti = 3
+            elif row['gol_casa'] == row['gol_trasferta']: punti = 1
+        else: 
+            if row['gol_trasferta'] > row['gol_casa']: punti = 3
+            elif row['gol_trasferta'] == row['gol_casa']: punti = 1
+        punti_ottenuti.append(punti)
+
+        if classifica_valida:
+            pos_avversario = posizioni_classifica.get(avversario, num_squadre // 2) 
+            difficolta = (num_squadre - pos_avversario + 1) / float(num_squadre) if num_squadre > 0 else 0.5
+        else:
+            difficolta = 0.5 # Coefficiente di difficoltà neutro se la classifica non è disponibile
+        coefficienti_difficolta.append(difficolta)
+
+    if not punti_ottenuti: # Se non sono state processate partite (es. per 'squadra_in_analisi' mancante)
+        return 0.0
+
+    pesi_recenza = np.arange(1, len(punti_ottenuti) + 1)
+    
+    punteggio_ponderato = np.sum(np.array(punti_ottenuti) * pesi_recenza * np.array(coefficienti_difficolta))
+    massimo_punteggio_possibile = np.sum(3 * pesi_recenza) # Massimo teorico se si vincono tutte le partite con difficoltà 1 e peso massimo
+                                                        # Non considera il coeff. difficoltà nel massimo per normalizzare la forma tra 0 e ~1
+                                                        # dove 1 è vincere tutte le partite recenti. La difficoltà modula questo.
+    
+    forma = punteggio_ponderato / massimo_punteggio_possibile if massimo_punteggio_possibile > 0 else 0.0
+    return round(forma, 3)
+
+
+def record_squadre_per_squadra(files_partite_storiche, df_storico_completo, stagione_corrente,
+                               df_classifica_corrente, num_squadre_campionato_attuale, stat_campionato_generali,
+                               squadre_stagione_corrente, cache=None) -> list:
+    """
+    Calcolo originale squadra per squadra (un filtro e una chiamata a calcola_medie_forza_da_df
+    per ogni statistica e contesto), riferimento per il calcolo a tensore.
+    """
+    cache = cache or medie.CacheStagioni()
+    lista_record_squadre = []
+    for squadra_analisi in squadre_stagione_corrente:
+        record_squadra = {'squadra': squadra_analisi}
+        
+        # Posizione attuale
+        if not df_classifica_corrente.empty:
+            riga_class_corr = df_classifica_corrente[df_classifica_corrente['Squadra'] == squadra_analisi]
+            record_squadra['posizione_classifica_attuale'] = int(riga_class_corr['Pos'].iloc[0]) if not riga_class_corr.empty else num_squadre_campionato_attuale // 2
+        else:
+            record_squadra['posizione_classifica_attuale'] = num_squadre_campionato_attuale // 2
+
+        # A. Statistiche Generali Recenti (19/38 partite, solo lega attuale)
+        df_corrente_squadra = df_storico_completo[
+            ((df_storico_completo['squadra_casa'] == squadra_analisi) | (df_storico_completo['squadra_trasferta'] == squadra_analisi)) &
+            (df_storico_completo['stagione_file'] == stagione_corrente) # Solo stagione corrente
+        ].sort_values(by='data')
+        
+        df_precedente_squadra_stessa_lega = pd.DataFrame()
+        if len(files_partite_storiche) > 1:
+             # Cerco la squadra nella stagione precedente SOLO SE era nella stessa lega
+             # Questo richiede di sapere in che lega era la squadra l'anno prima, il che complica.
+             # Per ora, semplifichiamo: se era nel file della stagione precedente del *medesimo campionato*, la usiamo.
+            df_prec_temp = cache.leggi(files_partite_storiche[1]) # File della stagione precedente (dalla cache)
+            df_precedente_squadra_stessa_lega = df_prec_temp[
+                ((df_prec_temp['squadra_casa'] == squadra_analisi) | (df_prec_temp['squadra_trasferta'] == squadra_analisi))
+            ].sort_values(by='data')
+
+
+        df_analisi_generale = pd.DataFrame()
+        if len(df_corrente_squadra) >= medie.SOGLIA_PARTITE_STAGIONE_CORRENTE_GENERALE:
+            df_analisi_generale = df_corrente_squadra.tail(medie.FINESTRA_MOBILE_PARTITE_GENERALE) # Prendi fino a 38 partite se disponibili
+        else:
+            partite_da_prec = medie.FINESTRA_MOBILE_PARTITE_GENERALE - len(df_corrente_squadra)
+            if partite_da_prec > 0 and not df_precedente_squadra_stessa_lega.empty:
+                df_analisi_generale = pd.concat([df_precedente_squadra_stessa_lega.tail(partite_da_prec), df_corrente_squadra])
+            else:
+                df_analisi_generale = df_corrente_squadra
+        
+        if len(df_analisi_generale) >= medie.MIN_PARTITE_PER_STAT_COND: # Uso la stessa soglia minima
+            for nome_base, col_casa, col_trasferta in medie.STATISTICHE_DA_ANALIZZARE:
+                record_squadra.update(calcola_medie_forza_da_df(df_analisi_generale, squadra_analisi, stat_campionato_generali, nome_base, col_casa, col_trasferta, "_generale_recente"))
+        
+        # Calcolo forma avanzata generale (sulle ultime 7 partite della stagione corrente)
+        df_corrente_squadra_per_forma = df_corrente_squadra.copy()
+        df_corrente_squadra_per_forma['squadra_in_analisi'] = squadra_analisi
+        record_squadra['forma_avanzata_totale'] = calcola_forma_avanzata(df_corrente_squadra_per_forma, df_classifica_corrente)
+
+
+        # B. Statistiche Condizionali vs Tier e C. vs Rango Simile
+        # Usiamo df_storico_completo (ultime N stagioni della stessa lega)
+        df_storico_squadra_stessa_lega = df_storico_completo[
+            (df_storico_completo['squadra_casa'] == squadra_analisi) | (df_storico_completo['squadra_trasferta'] == squadra_analisi)
+        ]
+
+        partite_per_contesto = suddividi_partite_per_contesto(df_storico_squadra_stessa_lega, squadra_analisi)
+
+        # Calcola e aggiungi stats condizionali se ci sono abbastanza partite
+        for tier_nome, df_tier_partite in partite_per_contesto.items():
+            if len(df_tier_partite) >= medie.MIN_PARTITE_PER_STAT_COND:
+                for nome_base, col_casa, col_trasferta in medie.STATISTICHE_DA_ANALIZZARE:
+                    record_squadra.update(calcola_medie_forza_da_df(df_tier_partite, squadra_analisi, stat_campionato_generali, nome_base, col_casa, col_trasferta, f"_VS_{tier_nome}"))
+            else: # Popola con 0/1 per default se non ci sono abbastanza dati
+                record_squadra.update(medie.record_contesto_default(tier_nome))
+
+
+        lista_record_squadre.append(record_squadra)
+    return lista_record_squadre
+
+
+def _ordina_per_squadra(df: pd.DataFrame) -> pd.DataFrame:
+    # I record con valori di default hanno le chiavi in ordine diverso: si confronta per squadra e per nome colonna
+    return df.sort_values(by='squadra').reset_index(drop=True).sort_index(axis=1)
+
+
+@pytest.mark.parametrize("nome_campionato", CAMPIONATI)
+def test_statistiche_a_tensore_uguali_al_calcolo_per_squadra(nome_campionato):
+    cache = medie.CacheStagioni()
+    dati = carica_dati(nome_campionato, cache)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df_tensore, _ = medie.calcola_statistiche_campionato_V2(nome_campionato, cache)
+    df_per_squadra = pd.DataFrame(record_squadre_per_squadra(
+        dati['files_partite_storiche'], dati['df_storico_completo'], dati['stagione_corrente'],
+        dati['df_classifica_corrente'], dati['num_squadre_campionato_attuale'], dati['stat_campionato_generali'],
+        dati['squadre_stagione_corrente'], cache))
+    # Confronto sul testo CSV, cioè come verrebbero salvati
+    assert _ordina_per_squadra(df_tensore).to_csv(index=False) == _ordina_per_squadra(df_per_squadra).to_csv(index=False)
+
+
+# === FORZA ESPONENZIALE INCREMENTALE ===
+
+def _scrivi_stagioni(cartella, stagioni: dict):
+    for nome_file, df in stagioni.items():
+        df.to_csv(cartella / nome_file, index=False)
+
+
+def test_forza_esponenziale_al_cambio_di_stagione_uguale_a_ricostruzione(tmp_path, monkeypatch):
+    """Stato costruito a metà della stagione 2324, poi arrivano 2324 completa e 2425: nessuna partita persa."""
+    richiede_cartella("dati_csv")
+    stagioni = {nome: pd.read_csv(os.path.join("dati_csv", nome)) for nome in
+                ("serie_a_2223.csv", "serie_a_2324.csv", "serie_a_2425.csv")}
+    in_ordine = stagioni["serie_a_2324.csv"].assign(_data=pd.to_datetime(stagioni["serie_a_2324.csv"]['data']))
+    troncata = in_ordine.sort_values(by='_data', kind='mergesort').head(300).drop(columns='_data')
+    cartella_dati, cartella_output = tmp_path / "dati_csv", tmp_path / "output"
+    cartella_dati.mkdir(); cartella_output.mkdir()
+    monkeypatch.setattr(medie, "CARTELLA_DATI_CSV", str(cartella_dati))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _scrivi_stagioni(cartella_dati, {"serie_a_2223.csv": stagioni["serie_a_2223.csv"], "serie_a_2324.csv": troncata})
+        medie.aggiorna_forza_esponenziale(["serie_a"], str(cartella_output), percorso_stato=str(tmp_path / "stato_incrementale.json"))
+        _scrivi_stagioni(cartella_dati, stagioni)
+        incrementale = medie.aggiorna_forza_esponenziale(["serie_a"], str(cartella_output), percorso_stato=str(tmp_path / "stato_incrementale.json"))
+        completo = medie.aggiorna_forza_esponenziale(["serie_a"], str(cartella_output), percorso_stato=str(tmp_path / "stato_completo.json"))
+
+    assert incrementale['campionati']['serie_a'] == completo['campionati']['serie_a']
+    pd.testing.assert_frame_equal(medie.medie_forza_esponenziali(incrementale, "serie_a"), medie.medie_forza_esponenziali(completo, "serie_a"))
+
+
+# === FEATURE WALK-FORWARD (riferimento: filtro diretto delle partite precedenti) ===
+
+def feature_walk_forward_diretta(df: pd.DataFrame, i_partita: int, lato: str) -> dict:
+    """
+    Riferimento lento per le feature walk-forward: le feature di una squadra per una partita, filtrando le partite
+    precedenti e usando calcola_medie_forza_da_df e medie.calcola_statistiche_medie_campionato come nel calcolo per squadra.
+    `df` è l'output di medie.carica_partite_walk_forward.
+    """
+    partita = df.iloc[i_partita]
+    squadra, data, stagione = partita[f'squadra_{lato}'], partita['data'], partita['indice_stagione']
+    precedenti = df[df['data'] < data]
+    df_den = precedenti[precedenti['indice_stagione'].isin([stagione - 1, stagione])].copy()
+    for _, col_casa, col_trasferta in medie.STATISTICHE_DA_ANALIZZARE:
+        df_den[col_casa] = pd.to_numeric(df_den[col_casa], errors='coerce').fillna(0)
+        df_den[col_trasferta] = pd.to_numeric(df_den[col_trasferta], errors='coerce').fillna(0)
+    stat_campionato = medie.calcola_statistiche_medie_campionato(df_den)
+
+    della_squadra = precedenti[(precedenti['squadra_casa'] == squadra) | (precedenti['squadra_trasferta'] == squadra)]
+    corrente = della_squadra[della_squadra['indice_stagione'] == stagione]
+    if len(corrente) >= medie.SOGLIA_PARTITE_STAGIONE_CORRENTE_GENERALE:
+        generale = corrente.tail(medie.FINESTRA_MOBILE_PARTITE_GENERALE)
+    else:
+        precedente = della_squadra[della_squadra['indice_stagione'] == stagione - 1]
+        generale = pd.concat([precedente.tail(medie.FINESTRA_MOBILE_PARTITE_GENERALE - len(corrente)), corrente])
+    record = {}
+    if len(generale) >= medie.MIN_PARTITE_PER_STAT_COND:
+        for nome_base, col_casa, col_trasferta in medie.STATISTICHE_DA_ANALIZZARE:
+            record.update(calcola_medie_forza_da_df(generale, squadra, stat_campionato, nome_base, col_casa, col_trasferta, "_generale_recente"))
+    storico = della_squadra[della_squadra['indice_stagione'] >= stagione - medie.NUM_STAGIONI_STORICHE_PER_COND]
+    for tier_nome, df_tier_partite in suddividi_partite_per_contesto(storico, squadra).items():
+        if len(df_tier_partite) >= medie.MIN_PARTITE_PER_STAT_COND:
+            for nome_base, col_casa, col_trasferta in medie.STATISTICHE_DA_ANALIZZARE:
+                record.update(calcola_medie_forza_da_df(df_tier_partite, squadra, stat_campionato, nome_base, col_casa, col_trasferta, f"_VS_{tier_nome}"))
+        else:
+            record.update(medie.record_contesto_default(tier_nome))
+
+    # Forma: ultime 7 della stagione, pesi 1..n, difficoltà dalla posizione as-of dell'avversario
+    ultime = corrente.tail(7)
+    in_casa = (ultime['squadra_casa'] == squadra).to_numpy()
+    fatti = np.where(in_casa, ultime['gol_casa'], ultime['gol_trasferta'])
+    subiti = np.where(in_casa, ultime['gol_trasferta'], ultime['gol_casa'])
+    punti = np.where(fatti > subiti, 3.0, np.where(fatti == subiti, 1.0, 0.0))
+    num_squadre = ultime['num_squadre_stagione'].to_numpy(dtype=float)
+    pos_avversario = np.where(in_casa, ultime['pos_trasferta'], ultime['pos_casa'])
+    difficolta = np.where(ultime['classifica_disponibile'], (num_squadre - pos_avversario + 1) / num_squadre, 0.5)
+    pesi = np.arange(1, len(ultime) + 1, dtype=float)
+    record['forma_avanzata_totale'] = round(float((punti * pesi * difficolta).sum() / (3 * pesi.sum())), 3) if len(ultime) else 0.0
+    return {k: v for k, v in record.items() if k.startswith(('forza_', 'num_partite_')) or k == 'forma_avanzata_totale'}
+
+
+@pytest.fixture(scope="module")
+def cartella_con_progressive(tmp_path_factory):
+    """Cartella di lavoro con i dati del repository e le classifiche progressive generate da CREA_CLASSIFICA."""
+    richiede_cartella("dati_csv")
+    cartella = tmp_path_factory.mktemp("walk_forward")
+    for nome in ("dati_csv", "classifiche_csv", "classifiche_storiche_csv"):
+        if os.path.isdir(os.path.join(RADICE_REPO, nome)):
+            os.symlink(os.path.join(RADICE_REPO, nome), cartella / nome)
+    cartella_progressive = cartella / "classifiche_progressive"
+    cartella_progressive.mkdir()
+    for percorso_file_csv in sorted(glob.glob(os.path.join(RADICE_REPO, "dati_csv", "*.csv"))):
+        analisi = CREA_CLASSIFICA.analizza_nome_file_stagione(percorso_file_csv)
+        df_stagione = CREA_CLASSIFICA.leggi_stagione_per_classifica(percorso_file_csv) if analisi else None
+        if df_stagione is not None:
+            CREA_CLASSIFICA.salva_classifiche_progressive(df_stagione, str(cartella_progressive),
+                                                          f"progressiva_{analisi[0]}_{analisi[1]}.npz")
+    return cartella
+
+
+@pytest.mark.parametrize("nome_campionato", CAMPIONATI)
+def test_feature_walk_forward_uguali_al_calcolo_diretto(nome_campionato, cartella_con_progressive, monkeypatch):
+    monkeypatch.chdir(cartella_con_progressive)
+    cache = medie.CacheStagioni()
+    with contextlib.redirect_stdout(io.StringIO()):
+        df_feature = medie.calcola_feature_walk_forward(nome_campionato, cache)
+        df = medie.carica_partite_walk_forward(nome_campionato, cache)
+    if df_feature.empty:
+        pytest.skip(f"Nessuna feature per {nome_campionato}")
+    differenze = []
+    for i_partita in np.random.default_rng(0).choice(len(df), size=min(15, len(df)), replace=False):
+        riga = df_feature.iloc[i_partita]
+        for lato in ['casa', 'trasferta']:
+            atteso = feature_walk_forward_diretta(df, i_partita, lato)
+            colonne_generale = [c for c in df_feature.columns if c.startswith(f'{lato}_') and c.endswith('_generale_recente')]
+            if not any(k.endswith('_generale_recente') for k in atteso): # Sotto soglia: colonne assenti, quindi NaN
+                atteso.update({c[len(lato) + 1:]: np.nan for c in colonne_generale})
+            for colonna, valore in atteso.items():
+                calcolato = riga[f'{lato}_{colonna}']
+                # Forma: somme in ordine diverso possono spostare l'arrotondamento a 3 decimali di un'unità
+                tolleranza = 1.0001e-3 if colonna == 'forma_avanzata_totale' else 1e-9
+                if not (np.isclose(calcolato, valore, rtol=0, atol=tolleranza) or (pd.isna(calcolato) and pd.isna(valore))):
+                    differenze.append((i_partita, lato, colonna, valore, calcolato))
+    assert not differenze, differenze[:5]
@@ -0,0 +1,124 @@
+import glob
+import os
+
+import pandas as pd
+import pytest
+
+import CREA_CLASSIFICA
+from conftest import RADICE_REPO, richiede_cartella
+
+
+def calcola_classifica_iterativa(df_stagione: pd.DataFrame) -> pd.DataFrame:
+    """Implementazione originale con iterrows, riferimento per il calcolo colonnare."""
+    squadre = pd.unique(df_stagione[['squadra_casa', 'squadra_trasferta']].values.ravel('K'))
+    squadre = [s for s in squadre if pd.notna(s)]
+
+    classifica = {squadra: {
+        'Punti': 0, 'Giocate': 0, 'Vinte': 0, 'Nulle': 0, 'Perse': 0,
+        'GF': 0, 'GS': 0, 'DR': 0
+    } for squadra in squadre}
+
+    for _, partita in df_stagione.iterrows():
+        casa = partita['squadra_casa']
+        trasferta = partita['squadra_trasferta']
+        gol_casa = partita['gol_casa']
+        gol_trasferta = partita['gol_trasferta']
+
+        if pd.isna(casa) or pd.isna(trasferta):
+            continue
+
+        classifica[casa]['Giocate'] += 1
+        classifica[trasferta]['Giocate'] += 1
+        classifica[casa]['GF'] += gol_casa
+        classifica[trasferta]['GF'] += gol_trasferta
+        classifica[casa]['GS'] += gol_trasferta
+        classifica[trasferta]['GS'] += gol_casa
+
+        if gol_casa > gol_trasferta:
+            classifica[casa]['Punti'] += 3
+            classifica[casa]['Vinte'] += 1
+            classifica[trasferta]['Perse'] += 1
+        elif gol_trasferta > gol_casa:
+            classifica[trasferta]['Punti'] += 3
+            classifica[trasferta]['Vinte'] += 1
+            classifica[casa]['Perse'] += 1
+        else:
+            classifica[casa]['Punti'] += 1
+            classifica[trasferta]['Punti'] += 1
+            classifica[casa]['Nulle'] += 1
+            classifica[trasferta]['Nulle'] += 1
+
+    df_classifica = pd.DataFrame.from_dict(classifica, orient='index')
+    if df_classifica.empty:
+        return df_classifica
+    return CREA_CLASSIFICA._ordina_e_formatta_classifica(df_classifica)
+
+
+def file_stagioni():
+    return sorted(glob.glob(os.path.join(RADICE_REPO, "dati_csv", "*.csv")))
+
+
+@pytest.mark.parametrize("percorso_file_csv", file_stagioni(), ids=os.path.basename)
+def test_classifica_colonnare_uguale_a_iterativa(percorso_file_csv):
+    richiede_cartella("dati_csv")
+    df_stagione = CREA_CLASSIFICA.leggi_stagione_per_classifica(percorso_file_csv)
+    if df_stagione is None:
+        pytest.skip("File non utilizzabile")
+    df_colonnare = CREA_CLASSIFICA.calcola_classifica(df_stagione)
+    df_iterativo = calcola_classifica_iterativa(df_stagione)
+    pd.testing.assert_frame_equal(df_colonnare.reset_index(drop=True), df_iterativo.reset_index(drop=True))
+
+    # L'ultima giornata della serie progressiva deve coincidere con la classifica finale
+    progressive = CREA_CLASSIFICA.calcola_classifiche_progressive(df_stagione)
+    if len(progressive['date']):
+        finale = dict(zip(progressive['squadre'], progressive['pos'][-1]))
+        assert {sq: finale.get(sq) for sq in df_colonnare['Squadra']} == dict(zip(df_colonnare['Squadra'], df_colonnare['Pos']))
+
+
+def test_classifica_con_pareggi_e_righe_senza_squadra():
+    df_stagione = pd.DataFrame({
+        'squadra_casa': ['A', 'B', None, 'C', 'A'],
+        'squadra_trasferta': ['B', 'C', 'A', 'A', 'C'],
+        'gol_casa': [1, 0, 2, 2, 0],
+        'gol_trasferta': [1, 0, 0, 3, 1],
+    })
+    pd.testing.assert_frame_equal(CREA_CLASSIFICA.calcola_classifica(df_stagione).reset_index(drop=True),
+                                  calcola_classifica_iterativa(df_stagione).reset_index(drop=True))
+
+
+# === Classifica as-of dalle classifiche progressive ===
+
+def _stagione(partite):
+    return pd.DataFrame(partite, columns=['data', 'squadra_casa', 'squadra_trasferta', 'gol_casa', 'gol_trasferta'])
+
+
+GIORNATE = [('2024-08-17', 'A', 'B', 1, 0), ('2024-08-17', 'C', 'D', 0, 0),
+            ('2024-08-24', 'A', 'C', 2, 2), ('2024-08-24', 'B', 'D', 1, 0)]
+
+
+@pytest.fixture
+def cartella_progressive(tmp_path, monkeypatch):
+    monkeypatch.setattr(CREA_CLASSIFICA, "_CACHE_PROGRESSIVE", {})
+    CREA_CLASSIFICA.salva_classifiche_progressive(_stagione(GIORNATE), str(tmp_path), "progressiva_prova_2425.npz")
+    return str(tmp_path)
+
+
+def test_position_as_of_esclude_le_partite_del_giorno(cartella_progressive):
+    as_of = lambda squadra, data: CREA_CLASSIFICA.position_as_of("prova", squadra, data, cartella_progressive)
+    # Prima della prima giornata, e il giorno stesso della prima giornata, non c'è ancora classifica
+    assert as_of('A', '2024-08-01') is None
+    assert as_of('A', '2024-08-17') is None
+    # Il 24 agosto vale solo la prima giornata: B è ultima, non ancora seconda
+    assert [as_of(sq, '2024-08-24') for sq in 'ACDB'] == [1, 2, 3, 4]
+    assert [as_of(sq, '2024-08-25') for sq in 'ABCD'] == [1, 2, 3, 4]
+    stato = CREA_CLASSIFICA.stato_squadra_as_of("prova", 'B', '2024-08-24', cartella_progressive)
+    assert stato == {'Stagione': '2425', 'Pos': 4, 'Punti': 0, 'DR': -1, 'GF': 0, 'Giocate': 1}
+    assert as_of('Z', '2024-08-25') is None # Squadra non presente
+
+
+def test_position_as_of_ricarica_il_file_aggiornato(cartella_progressive):
+    assert CREA_CLASSIFICA.position_as_of("prova", 'B', '2024-09-01', cartella_progressive) == 2
+    # Nuova giornata: CREA_CLASSIFICA riscrive il file, la cache (stesso processo) se ne accorge
+    CREA_CLASSIFICA.salva_classifiche_progressive(_stagione(GIORNATE + [('2024-08-31', 'D', 'B', 3, 0)]),
+                                                  cartella_progressive, "progressiva_prova_2425.npz")
+    assert CREA_CLASSIFICA.position_as_of("prova", 'B', '2024-09-01', cartella_progressive) == 3
@@ -0,0 +1,305 @@
+import os
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+
+import CSVNEW
+
+INTESTAZIONE_GREZZA = "Div,Date,HomeTeam,AwayTeam,FTHG,FTAG\n"
+
+
+def _csv_grezzo(partite):
+    """CSV come lo serve football-data.co.uk: (data gg/mm/aaaa, casa, trasferta, gol casa, gol trasferta)."""
+    righe = [f"I1,{data},{casa},{trasferta},{gc},{gt}\n" for data, casa, trasferta, gc, gt in partite]
+    return (INTESTAZIONE_GREZZA + "".join(righe)).encode("utf-8")
+
+
+def _elabora(tmp_path, partite):
+    return CSVNEW.elabora_e_salva_stagione(_csv_grezzo(partite), "serie_a", 24, 25, "http://prova/2425/I1.csv",
+                                           cartella_output=str(tmp_path), cartella_store=str(tmp_path / "store"))
+
+
+def test_changeset_elenca_solo_squadre_e_campionati_toccati(tmp_path):
+    prima_giornata = [("17/08/2024", "Milan", "Torino", 2, 2), ("18/08/2024", "Inter", "Genoa", 2, 2)]
+    primo = _elabora(tmp_path, prima_giornata)
+    assert primo["esito"] == "salvato"
+    assert CSVNEW.salva_changeset([primo], str(tmp_path))["campionati"]["serie_a"]["squadre"] == ["Genoa", "Inter", "Milan", "Torino"]
+
+    secondo = _elabora(tmp_path, prima_giornata + [("24/08/2024", "Lazio", "Milan", 2, 1)])
+    changeset = CSVNEW.salva_changeset([secondo], str(tmp_path))
+    assert changeset["campionati"]["serie_a"]["file"]["serie_a_2425.csv"] == {"nuove": 1, "corrette": 0, "riscritto": False}
+    assert CSVNEW.leggi_changeset(str(tmp_path)) == {"serie_a": {"Lazio", "Milan"}}
+
+    # Un'esecuzione senza partite nuove non tocca il change-set dell'ultimo aggiornamento
+    terzo = _elabora(tmp_path, prima_giornata + [("24/08/2024", "Lazio", "Milan", 2, 1)])
+    assert terzo["esito"] == "invariato"
+    assert CSVNEW.salva_changeset([terzo], str(tmp_path)) is None
+    assert CSVNEW.leggi_changeset(str(tmp_path)) == {"serie_a": {"Lazio", "Milan"}}
+
+
+def _partite_salvate(tmp_path):
+    df = pd.read_csv(tmp_path / "serie_a_2425.csv")
+    return list(zip(df["data"], df["squadra_casa"], df["squadra_trasferta"], df["gol_casa"], df["gol_trasferta"]))
+
+
+GIORNATA_1 = [("17/08/2024", "Milan", "Torino", 2, 2), ("18/08/2024", "Inter", "Genoa", 2, 2)]
+
+
+def test_unione_aggiunge_in_coda_le_partite_nuove(tmp_path):
+    _elabora(tmp_path, GIORNATA_1)
+    record = _elabora(tmp_path, GIORNATA_1 + [("24/08/2024", "Lazio", "Milan", 2, 1)])
+    assert record["modifiche"] == {"nuove": 1, "corrette": 0, "riscritto": False, "squadre": ["Lazio", "Milan"]}
+    assert _partite_salvate(tmp_path) == [("2024-08-17", "Milan", "Torino", 2, 2), ("2024-08-18", "Inter", "Genoa", 2, 2),
+                                          ("2024-08-24", "Lazio", "Milan", 2, 1)]
+
+
+def test_unione_corregge_sul_posto(tmp_path):
+    _elabora(tmp_path, GIORNATA_1)
+    record = _elabora(tmp_path, [("17/08/2024", "Milan", "Torino", 2, 1), GIORNATA_1[1]])
+    assert record["modifiche"] == {"nuove": 0, "corrette": 1, "riscritto": True, "squadre": ["Milan", "Torino"]}
+    assert _partite_salvate(tmp_path) == [("2024-08-17", "Milan", "Torino", 2, 1), ("2024-08-18", "Inter", "Genoa", 2, 2)]
+
+
+def test_unione_riordina_una_partita_nuova_con_data_precedente(tmp_path):
+    _elabora(tmp_path, GIORNATA_1)
+    record = _elabora(tmp_path, GIORNATA_1 + [("16/08/2024", "Lazio", "Milan", 2, 1)])
+    assert record["modifiche"]["nuove"] == 1 and record["modifiche"]["riscritto"]
+    assert [p[0] for p in _partite_salvate(tmp_path)] == ["2024-08-16", "2024-08-17", "2024-08-18"]
+
+
+def test_unione_sostituisce_la_partita_rinviata(tmp_path):
+    # Salvata con la data prevista, poi giocata (e pubblicata) due settimane dopo
+    _elabora(tmp_path, GIORNATA_1 + [("24/08/2024", "Lazio", "Milan", 0, 0)])
+    record = _elabora(tmp_path, [("24/08/2024", "Roma", "Inter", 1, 1), ("17/08/2024", "Milan", "Torino", 2, 2),
+                                 ("18/08/2024", "Inter", "Genoa", 2, 2), ("07/09/2024", "Lazio", "Milan", 2, 1)])
+    assert record["modifiche"]["nuove"] == 1 and record["modifiche"]["corrette"] == 1
+    assert _partite_salvate(tmp_path) == [("2024-08-17", "Milan", "Torino", 2, 2), ("2024-08-18", "Inter", "Genoa", 2, 2),
+                                          ("2024-08-24", "Roma", "Inter", 1, 1), ("2024-09-07", "Lazio", "Milan", 2, 1)]
+
+
+def test_unione_tiene_gli_incontri_ripetuti_dei_playoff(tmp_path):
+    _elabora(tmp_path, GIORNATA_1)
+    record = _elabora(tmp_path, GIORNATA_1 + [("20/04/2025", "Milan", "Torino", 0, 1)])
+    assert record["modifiche"]["nuove"] == 1 and not record["modifiche"]["riscritto"]
+    assert len(_partite_salvate(tmp_path)) == 3
+
+
+def test_changeset_assente(tmp_path):
+    assert CSVNEW.leggi_changeset(str(tmp_path)) == {}
+    assert not os.path.exists(tmp_path / CSVNEW.NOME_FILE_CHANGESET)
+
+
+class _Orologio:
+    """Sostituto di datetime per CSVNEW: now() restituisce sempre lo stesso istante."""
+    def __init__(self, iso):
+        self.istante = datetime.fromisoformat(iso)
+
+    def now(self):
+        return self.istante
+
+
+def _lavori(*nomi_file):
+    return [(nome, 24, 25, f"http://prova/2425/{nome}.csv") for nome in nomi_file]
+
+
+def _record(nome_file, esito, partite=10, sha256="abc"):
+    return {"file": f"{nome_file}_2425.csv", "url": f"http://prova/2425/{nome_file}.csv", "esito": esito,
+            "partite": partite, "secondi_download": 0.0, "secondi_parsing": 0.0, "sha256": sha256}
+
+
+def test_manifest_salva_i_campionati_modificati(tmp_path):
+    cartella = str(tmp_path)
+    assert CSVNEW.leggi_campionati_modificati(cartella) == set(CSVNEW.CAMPIONATI) # Senza manifest: tutto da rielaborare
+
+    lavori = _lavori("serie_a", "premier")
+    manifest = CSVNEW.aggiorna_manifest({"file": {}}, lavori, [_record("serie_a", "salvato"), _record("premier", "invariato")], {})
+    CSVNEW.salva_manifest(manifest, cartella)
+    assert CSVNEW.leggi_campionati_modificati(cartella) == {"serie_a"}
+
+    # Nessun file cambiato: resta l'elenco dell'ultimo aggiornamento dei dati
+    manifest = CSVNEW.aggiorna_manifest(CSVNEW.carica_manifest(cartella), lavori,
+                                        [_record("serie_a", "invariato"), _record("premier", "errore")], {})
+    CSVNEW.salva_manifest(manifest, cartella)
+    assert CSVNEW.leggi_campionati_modificati(cartella) == {"serie_a"}
+
+
+def test_manifest_identico_se_nessun_file_cambia(tmp_path, monkeypatch):
+    cartella = str(tmp_path)
+    lavori = _lavori("serie_a", "premier")
+    monkeypatch.setattr(CSVNEW, "datetime", _Orologio("2025-05-01T10:00:00"))
+    CSVNEW.salva_manifest(CSVNEW.aggiorna_manifest({"file": {}}, lavori, [_record("serie_a", "salvato"), _record("premier", "salvato")], {}), cartella)
+    with open(CSVNEW.percorso_manifest(cartella), "rb") as f:
+        prima = f.read()
+
+    # Più tardi, un controllo senza novità: il file tracciato da git non deve cambiare
+    monkeypatch.setattr(CSVNEW, "datetime", _Orologio("2025-05-02T10:00:00"))
+    CSVNEW.salva_manifest(CSVNEW.aggiorna_manifest(CSVNEW.carica_manifest(cartella), lavori,
+                                                   [_record("serie_a", "invariato"), _record("premier", "invariato")], {}), cartella)
+    with open(CSVNEW.percorso_manifest(cartella), "rb") as f:
+        assert f.read() == prima
+
+    # Cambia solo serie_a: solo la sua voce prende il nuovo orario
+    CSVNEW.salva_manifest(CSVNEW.aggiorna_manifest(CSVNEW.carica_manifest(cartella), lavori,
+                                                   [_record("serie_a", "salvato", sha256="def"), _record("premier", "invariato")], {}), cartella)
+    manifest = CSVNEW.carica_manifest(cartella)
+    assert manifest["file"]["serie_a_2425.csv"]["ultima_modifica"] == "2025-05-02T10:00:00"
+    assert manifest["file"]["premier_2425.csv"]["ultima_modifica"] == "2025-05-01T10:00:00"
+    assert manifest["aggiornato_il"] == "2025-05-02T10:00:00"
+
+
+# === STORE COLONNARE ===
+def _stagione_store(casa, trasferta, **statistiche):
+    df = pd.DataFrame({"data": ["2024-08-17", "2024-08-18"], "squadra_casa": casa, "squadra_trasferta": trasferta})
+    for col in CSVNEW.COLONNE_NUMERICHE:
+        df[col] = statistiche.get(col, [1, 2])
+    return df
+
+
+def test_store_tiene_i_mancanti_e_non_va_in_overflow():
+    df = CSVNEW.tipizza_dataframe_partite(_stagione_store(["Milan", "Inter"], ["Torino", "Genoa"],
+                                                          gol_casa=[np.nan, 3], falli_casa=[200, 12], tiri_casa=[-1, 15]))
+    assert str(df["gol_casa"].dtype) == "Int8" and str(df["falli_casa"].dtype) == "Int16"
+    assert df["gol_casa"].isna().tolist() == [True, False] # Mancante, non 0
+    assert df["falli_casa"].tolist() == [200, 12] # Oltre 127: nessun overflow
+    assert df["tiri_casa"].isna().tolist() == [True, False] # Fuori intervallo: mancante, non un valore sbagliato
+
+
+@pytest.mark.skipif(CSVNEW.pa is None, reason="pyarrow non installato")
+def test_carica_store_partite_legge_solo_colonne_e_partizioni_richieste(tmp_path):
+    store = str(tmp_path)
+    CSVNEW.salva_partizione_store(_stagione_store(["Arsenal", "Chelsea"], ["Fulham", "Everton"]), "premier", "2324", store)
+    CSVNEW.salva_partizione_store(_stagione_store(["Milan", "Inter"], ["Torino", "Genoa"], gol_casa=[np.nan, 3]), "serie_a", "2324", store)
+    CSVNEW.salva_partizione_store(_stagione_store(["Lazio", "Roma"], ["Milan", "Inter"]), "serie_a", "2425", store)
+
+    df = CSVNEW.carica_store_partite(colonne=["squadra_casa", "gol_casa", "stagione"], cartella_store=store)
+    assert list(df.columns) == ["squadra_casa", "gol_casa", "stagione"]
+    assert len(df) == 6 and str(df["gol_casa"].dtype) == "Int8" and df["gol_casa"].isna().sum() == 1
+
+    # Partizione non richiesta illeggibile: il filtro non la apre nemmeno
+    with open(CSVNEW.percorso_partizione_store("serie_a", "2425", store), "wb") as f:
+        f.write(b"non parquet")
+    df = CSVNEW.carica_store_partite(campionati=["serie_a", "premier"], stagioni=["2324"],
+                                     colonne=["campionato", "squadra_casa"], cartella_store=store)
+    assert sorted(zip(df["campionato"], df["squadra_casa"])) == [("premier", "Arsenal"), ("premier", "Chelsea"),
+                                                                 ("serie_a", "Inter"), ("serie_a", "Milan")]
+    assert isinstance(df["squadra_casa"].dtype, pd.CategoricalDtype)
+
+# === DOWNLOAD DA UN SERVER HTTP LOCALE ===
+class _ServerProva:
+    """
+    Server HTTP su localhost che imita football-data.co.uk per i file di una stagione:
+    risposte per percorso, 5xx transitori, ETag con 304 e conteggio delle richieste contemporanee.
+    """
+    def __init__(self, file_serviti, errori_iniziali=None, etag=None, ritardo=0.1):
+        self.file_serviti = file_serviti # percorso -> contenuto; gli altri percorsi rispondono 404
+        self.errori_iniziali = dict(errori_iniziali or {}) # percorso -> quante volte rispondere 503 prima del file
+        self.etag = etag or {}
+        self.ritardo = ritardo
+        self.richieste = [] # (percorso, istante, header If-None-Match)
+        self.in_corso = self.massimo_in_corso = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Gestore(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.richieste.append((self.path, time.perf_counter(), self.headers.get("If-None-Match")))
+                    server.in_corso += 1
+                    server.massimo_in_corso = max(server.massimo_in_corso, server.in_corso)
+                try:
+                    time.sleep(server.ritardo)
+                    self._rispondi()
+                finally:
+                    with server._lock:
+                        server.in_corso -= 1
+
+            def _rispondi(self):
+                if server.errori_iniziali.get(self.path, 0) > 0:
+                    server.errori_iniziali[self.path] -= 1
+                    return self._invia(503, b"")
+                if self.path not in server.file_serviti:
+                    return self._invia(404, b"")
+                etag = server.etag.get(self.path)
+                if etag and self.headers.get("If-None-Match") == etag:
+                    return self._invia(304, None)
+                self._invia(200, server.file_serviti[self.path], {"ETag": etag} if etag else {})
+
+            def _invia(self, status, corpo, header=None):
+                self.send_response(status)
+                for nome, valore in (header or {}).items():
+                    self.send_header(nome, valore)
+                if corpo is not None:
+                    self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                if corpo:
+                    self.wfile.write(corpo)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Gestore)
+        self.url_base = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def richieste_per(self, percorso):
+        return [r for r in self.richieste if r[0] == percorso]
+
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _percorso_stagione(codice):
+    start_yy, end_yy = CSVNEW.calcola_stagioni_da_processare(0)[0]
+    return f"/{start_yy:02d}{end_yy:02d}/{codice}.csv", f"{start_yy:02d}{end_yy:02d}"
+
+
+def test_scarica_csv_da_server_locale(tmp_path):
+    """Download concorrenti, retry con backoff su 503, 404 saltati, poi 304 e contenuto invariato per hash."""
+    serie_a, stagione = _percorso_stagione(CSVNEW.CAMPIONATI["serie_a"])
+    premier, _ = _percorso_stagione(CSVNEW.CAMPIONATI["premier"])
+    file_serviti = {serie_a: _csv_grezzo([("17/08/2024", "Milan", "Torino", 2, 2)]),
+                    premier: _csv_grezzo([("16/08/2024", "Man United", "Fulham", 1, 0)])}
+    cartella, store = str(tmp_path / "csv"), str(tmp_path / "store")
+    with _ServerProva(file_serviti, errori_iniziali={premier: 1}, etag={serie_a: '"v1"'}) as server:
+        tempi = CSVNEW.scarica_csv(numero_stagioni_passate=0, url_base=server.url_base, cartella_output=cartella,
+                                   max_download_paralleli=8, limite_per_host=4, cartella_store=store)
+        esiti = {r["file"]: r["esito"] for r in tempi}
+        assert esiti.pop(f"serie_a_{stagione}.csv") == "salvato"
+        assert esiti.pop(f"premier_{stagione}.csv") == "salvato" # Salvato al secondo tentativo
+        assert set(esiti.values()) == {"errore"} and len(esiti) == len(CSVNEW.CAMPIONATI) - 2 # 404: saltati
+        assert len(server.richieste) == len(CSVNEW.CAMPIONATI) + 1 # Il 404 non viene ripetuto, il 503 sì
+        (_, primo, _), (_, secondo, _) = server.richieste_per(premier)
+        assert secondo - primo >= CSVNEW.BACKOFF_BASE_SECONDI
+        assert 1 < server.massimo_in_corso <= 4 # Download in parallelo, entro il limite per host
+
+        percorso_premier = os.path.join(cartella, f"premier_{stagione}.csv")
+        mtime_premier = os.stat(percorso_premier).st_mtime_ns
+        tempi = CSVNEW.scarica_csv(numero_stagioni_passate=0, url_base=server.url_base, cartella_output=cartella,
+                                   max_download_paralleli=8, limite_per_host=4, cartella_store=store)
+    esiti = {r["file"]: r["esito"] for r in tempi}
+    assert server.richieste_per(serie_a)[-1][2] == '"v1"' # GET condizionale con l'ETag del manifest -> 304
+    assert esiti[f"serie_a_{stagione}.csv"] == "invariato"
+    assert esiti[f"premier_{stagione}.csv"] == "invariato" # Nessun ETag: stesso sha256, file non riscritto
+    assert os.stat(percorso_premier).st_mtime_ns == mtime_premier
+    assert CSVNEW.leggi_campionati_modificati(cartella) == {"serie_a", "premier"} # Restano quelli dell'ultimo aggiornamento
+
+
+def test_scarica_contenuto_url_riprova_solo_gli_errori_transitori():
+    with _ServerProva({}, errori_iniziali={"/sempre_503.csv": 10}, ritardo=0) as server:
+        session = CSVNEW.crea_sessione_http()
+        with pytest.raises(requests.exceptions.HTTPError):
+            CSVNEW.scarica_contenuto_url(session, f"{server.url_base}/sempre_503.csv", max_tentativi=3, backoff_base=0.01)
+        assert len(server.richieste_per("/sempre_503.csv")) == 3
+        with pytest.raises(requests.exceptions.HTTPError):
+            CSVNEW.scarica_contenuto_url(session, f"{server.url_base}/mancante.csv", max_tentativi=3, backoff_base=0.01)
+        assert len(server.richieste_per("/mancante.csv")) == 1
@@ -0,0 +1,108 @@
+import json
+import os
+
+import pandas as pd
+
+import PIPELINE
+
+
+def _scrivi_stato(percorso, campionati, emivita_giorni=120):
+    with open(percorso, 'w', encoding='utf-8') as f:
+        json.dump({'versione': 1, 'emivita_giorni': emivita_giorni, 'campionati': campionati}, f)
+
+
+def test_voce_stato_forza_cambia_solo_con_il_proprio_campionato(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    voce = PIPELINE.voce_stato_forza("serie_a")
+    assert voce in PIPELINE.input_nodo("medie", "serie_a", {})
+    assert PIPELINE.hash_input_nodo(voce) is None # Stato assente: il nodo medie va ricalcolato
+
+    percorso = PIPELINE.CALCOLO_MEDIE_NEW.FILE_STATO_FORZA_ESPONENZIALE
+    _scrivi_stato(percorso, {'serie_a': {'ultima_data': '2025-05-25'}, 'premier': {'ultima_data': '2025-05-25'}})
+    iniziale = PIPELINE.hash_input_nodo(voce)
+    assert iniziale is not None
+
+    # Un altro campionato che avanza riscrive il file ma non la voce di serie_a
+    _scrivi_stato(percorso, {'serie_a': {'ultima_data': '2025-05-25'}, 'premier': {'ultima_data': '2025-06-01'}})
+    assert PIPELINE.hash_input_nodo(voce) == iniziale
+
+    _scrivi_stato(percorso, {'serie_a': {'ultima_data': '2025-06-01'}, 'premier': {'ultima_data': '2025-06-01'}})
+    assert PIPELINE.hash_input_nodo(voce) != iniziale
+    _scrivi_stato(percorso, {'serie_a': {'ultima_data': '2025-05-25'}, 'premier': {'ultima_data': '2025-06-01'}}, emivita_giorni=60)
+    assert PIPELINE.hash_input_nodo(voce) != iniziale
+
+
+def _file_della_cartella(cartella):
+    return sorted(os.path.relpath(os.path.join(radice, f), cartella) for radice, _, files in os.walk(cartella) for f in files)
+
+
+def _prepara_campionati(tmp_path, monkeypatch):
+    """Due campionati con una stagione ciascuno, una partita di serie_a con arbitro, e uno stato come dopo un giro completo."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(PIPELINE.PRONOSTICI_GENERATI, "_REGISTRI_ARBITRI", {})
+    os.makedirs("dati_csv")
+    for nome, casa, trasferta in [("serie_a", "Milan", "Torino"), ("premier", "Arsenal", "Fulham")]:
+        pd.DataFrame({"data": ["2024-08-17"], "squadra_casa": [casa], "squadra_trasferta": [trasferta],
+                      "gol_casa": [2], "gol_trasferta": [1]}).to_csv(f"dati_csv/{nome}_2425.csv", index=False)
+    os.makedirs("dati_flashscore")
+    with open("dati_flashscore/partita_1.json", "w", encoding="utf-8") as f:
+        json.dump({"competizione": "Serie A", "arbitro": "Mario Rossi"}, f)
+    os.makedirs("dati_arbitri")
+    with open("dati_arbitri/arbitro_mario_rossi.json", "w", encoding="utf-8") as f:
+        json.dump({"nome_arbitro": "Mario Rossi"}, f)
+
+    partite = PIPELINE.partite_per_campionato()
+    stato = {"versione": PIPELINE.VERSIONE_STATO_PIPELINE, "nodi": {}}
+    for stadio in PIPELINE.STADI:
+        for nome_campionato in PIPELINE.CAMPIONATI:
+            impronta, hash_input = PIPELINE.impronta_input(PIPELINE.input_nodo(stadio, nome_campionato, partite))
+            stato["nodi"][f"{stadio}:{nome_campionato}"] = {"impronta": impronta, "input": hash_input, "output": []}
+    PIPELINE.salva_stato_pipeline(stato)
+    return stato, partite
+
+
+def test_pianifica_ricalcola_solo_il_campionato_cambiato(tmp_path, monkeypatch):
+    stato, partite = _prepara_campionati(tmp_path, monkeypatch)
+    assert PIPELINE.pianifica(stato, partite) == []
+
+    # Nuova giornata di serie_a: solo i suoi tre nodi, premier e gli altri campionati restano fermi
+    with open("dati_csv/serie_a_2425.csv", "a", encoding="utf-8") as f:
+        f.write("2024-08-24,Lazio,Milan,2,1\n")
+    piano = dict(PIPELINE.pianifica(stato, partite))
+    assert list(piano) == ["classifiche:serie_a", "medie:serie_a", "pronostici:serie_a"]
+    assert all(motivi == ["input cambiati: serie_a_2425.csv"] for motivi in piano.values())
+
+
+def test_pianifica_propaga_a_valle(tmp_path, monkeypatch):
+    stato, partite = _prepara_campionati(tmp_path, monkeypatch)
+    stato["nodi"]["classifiche:premier"]["output"] = [os.path.join("classifiche_csv", "classifica_premier_corrente.csv")]
+    assert PIPELINE.pianifica(stato, partite) == [
+        ("classifiche:premier", ["output mancanti: classifica_premier_corrente.csv"]),
+        ("medie:premier", ["a valle di classifiche:premier"]),
+        ("pronostici:premier", ["a valle di medie:premier"]),
+    ]
+
+
+def test_file_arbitro_cambia_solo_i_pronostici_del_campionato(tmp_path, monkeypatch):
+    stato, partite = _prepara_campionati(tmp_path, monkeypatch)
+    with open("dati_arbitri/arbitro_mario_rossi.json", "w", encoding="utf-8") as f:
+        json.dump({"nome_arbitro": "Mario Rossi", "partite": 10}, f)
+    assert [nodo for nodo, _ in PIPELINE.pianifica(stato, partite)] == ["pronostici:serie_a"]
+
+
+def test_dry_run_non_scrive_nulla(tmp_path, monkeypatch):
+    _prepara_campionati(tmp_path, monkeypatch)
+    with open("dati_csv/premier_2425.csv", "a", encoding="utf-8") as f:
+        f.write("2024-08-24,Chelsea,Arsenal,0,0\n")
+    monkeypatch.setattr(PIPELINE.PRONOSTICI_GENERATI, "_REGISTRI_ARBITRI", {}) # Come un processo nuovo, senza registro salvato
+    if os.path.exists(PIPELINE.PRONOSTICI_GENERATI.PATH_REGISTRO_ARBITRI):
+        os.remove(PIPELINE.PRONOSTICI_GENERATI.PATH_REGISTRO_ARBITRI)
+    prima = _file_della_cartella(tmp_path)
+    with open(PIPELINE.FILE_STATO_PIPELINE, "rb") as f:
+        stato_prima = f.read()
+
+    nodi = PIPELINE.esegui_pipeline(dry_run=True, scarica=False, push=False)
+    assert nodi == ["classifiche:premier", "medie:premier", "pronostici:premier"]
+    assert _file_della_cartella(tmp_path) == prima # Nemmeno il registro arbitri
+    with open(PIPELINE.FILE_STATO_PIPELINE, "rb") as f:
+        assert f.read() == stato_prima
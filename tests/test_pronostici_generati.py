@@ -0,0 +1,459 @@
+import glob
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import poisson
+
+import CALCOLO_MEDIE_NEW
+import PRONOSTICI_GENERATI as pronostici
+from conftest import richiede_cartella
+
+CAMPIONATI = sorted(set(pronostici.MAPPA_COMPETIZIONE_DISPLAY_A_FILE_PREFIX.values()))
+
+
+# === H2H: indice contro la scansione originale dei file ===
+
+def get_h2h_stats_scansione(squadra_casa_std: str, squadra_trasf_std: str, num_partite_h2h: int,
+                            nome_file_campionato_attuale: str) -> dict:
+    """Implementazione originale (lettura e filtro di ogni file a ogni chiamata), riferimento per l'indice H2H."""
+    partite_considerate = []
+    all_csv_files = sorted(glob.glob(os.path.join(pronostici.PATH_DATI_CSV_STORICI, f"{nome_file_campionato_attuale}_*.csv")), reverse=True)
+    for file_csv in all_csv_files:
+        try:
+            df_match = pd.read_csv(file_csv)
+            if not all(col in df_match.columns for col in ['squadra_casa', 'squadra_trasferta', 'gol_casa', 'gol_trasferta']):
+                continue
+            h2h_matches = df_match[
+                ((df_match['squadra_casa'] == squadra_casa_std) & (df_match['squadra_trasferta'] == squadra_trasf_std)) |
+                ((df_match['squadra_casa'] == squadra_trasf_std) & (df_match['squadra_trasferta'] == squadra_casa_std))
+            ]
+            partite_considerate.extend(h2h_matches.to_dict('records'))
+        except Exception as e:
+            print(f"    Errore lettura H2H da {file_csv}: {e}")
+            continue
+
+    if not partite_considerate: return pronostici.riepilogo_h2h([], squadra_casa_std)
+
+    try:
+        df_partite_considerate = pd.DataFrame(partite_considerate)
+        df_partite_considerate['data'] = pd.to_datetime(df_partite_considerate['data'], errors='coerce')
+        df_partite_considerate.sort_values(by='data', ascending=False, inplace=True)
+        partite_considerate = df_partite_considerate.head(num_partite_h2h).to_dict('records')
+    except KeyError:
+        partite_considerate = partite_considerate[:num_partite_h2h]
+
+    return pronostici.riepilogo_h2h(partite_considerate, squadra_casa_std)
+
+
+@pytest.mark.parametrize("prefix", CAMPIONATI)
+def test_h2h_da_indice_uguale_alla_scansione(prefix):
+    """Campione deterministico di coppie che si sono affrontate, nei due versi e per diversi N."""
+    richiede_cartella("dati_csv")
+    indice = pronostici.indice_h2h_campionato(prefix)
+    coppie = sorted(indice.coppie())
+    if not coppie:
+        pytest.skip(f"Nessuna partita per {prefix}")
+    passo = max(len(coppie) / 10, 1)
+    for squadra_a, squadra_b in sorted({coppie[int(k * passo)] for k in range(min(10, len(coppie)))}):
+        for casa, trasferta in ((squadra_a, squadra_b), (squadra_b, squadra_a)):
+            for n in (1, 6, 50):
+                assert pronostici.get_h2h_stats(casa, trasferta, n, prefix, {}, indice) == \
+                       get_h2h_stats_scansione(casa, trasferta, n, prefix), (casa, trasferta, n)
+
+
+def test_h2h_coppia_mai_affrontata():
+    indice = pronostici.IndiceH2H([pd.DataFrame({'squadra_casa': ['A'], 'squadra_trasferta': ['B'], 'gol_casa': [1],
+                                                 'gol_trasferta': [0], 'data': ['2024-01-01']})])
+    assert pronostici.get_h2h_stats('A', 'C', 6, 'x', {}, indice) == pronostici.riepilogo_h2h([], 'A')
+    assert pronostici.get_h2h_stats('B', 'A', 6, 'x', {}, indice)['vittorie_trasferta'] == 1
+
+
+# === Motore Poisson: ricorrenza a tensore contro scipy cella per cella ===
+
+def genera_matrice_probabilita_poisson_scipy(xg_casa: float, xg_trasferta: float, max_gol: int) -> np.array:
+    """Implementazione originale (pmf scipy cella per cella), riferimento per il motore a tensore."""
+    prob_casa = np.array([poisson.pmf(i, xg_casa) for i in range(max_gol + 1)])
+    prob_trasferta = np.array([poisson.pmf(i, xg_trasferta) for i in range(max_gol + 1)])
+    prob_casa[-1] = max(0, 1 - np.sum(prob_casa[:-1]))
+    prob_trasferta[-1] = max(0, 1 - np.sum(prob_trasferta[:-1]))
+    matrice = np.outer(prob_casa, prob_trasferta)
+    return matrice
+
+
+@pytest.mark.parametrize("max_gol", [pronostici.MAX_GOL_POISSON_FT, pronostici.MAX_GOL_POISSON_HT])
+def test_matrici_poisson_uguali_a_scipy(max_gol):
+    rng = np.random.default_rng(0)
+    xg_casa, xg_trasferta = rng.uniform(0.05, 4.0, 2000), rng.uniform(0.05, 4.0, 2000)
+    tensore = pronostici.genera_matrici_probabilita_poisson(xg_casa, xg_trasferta, max_gol)
+    riferimento = np.array([genera_matrice_probabilita_poisson_scipy(c, t, max_gol) for c, t in zip(xg_casa, xg_trasferta)])
+    np.testing.assert_allclose(tensore, riferimento, rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(pronostici.genera_matrice_probabilita_poisson(xg_casa[0], xg_trasferta[0], max_gol), tensore[0])
+
+
+# === Estrazione dei mercati: maschere contro cicli sulle celle ===
+
+def estrai_pronostici_da_matrice_cicli(matrice: np.array, max_gol_matrice: int, xg_casa: float, xg_trasf:float, per_primo_tempo:bool = False) -> dict:
+    """Implementazione originale a cicli sulle celle, riferimento per l'estrazione a maschere."""
+    pronostici_partita = {}
+    p_1, p_x, p_2 = 0.0, 0.0, 0.0
+    p_gg, p_ng = 0.0, 0.0
+    prob_risultati_esatti_list = []
+
+    for i in range(max_gol_matrice + 1): 
+        for j in range(max_gol_matrice + 1): 
+            prob = matrice[i, j]
+            if prob < 0.00001 and not (i==max_gol_matrice or j==max_gol_matrice): continue 
+            if i > j: p_1 += prob
+            elif i < j: p_2 += prob
+            else: p_x += prob
+            if i > 0 and j > 0: p_gg += prob
+            else: p_ng += prob
+            prob_risultati_esatti_list.append({'risultato': f"{i}-{j}", 'prob': round(prob, 4)})
+
+    pronostici_partita['1X2'] = pronostici.get_pronostico_secco_1x2(p_1, p_x, p_2)
+    pronostici_partita['P(1)'] = round(p_1, 3); pronostici_partita['P(X)'] = round(p_x, 3); pronostici_partita['P(2)'] = round(p_2, 3)
+    pronostici_partita['GolNoGol'] = pronostici.get_pronostico_secco_ggng(p_gg, p_ng)
+    pronostici_partita['P(GG)'] = round(p_gg, 3); pronostici_partita['P(NG)'] = round(p_ng, 3)
+
+    soglie_ou_correnti = pronostici.SOGLIE_OVER_UNDER_HT if per_primo_tempo else pronostici.SOGLIE_OVER_UNDER_FT
+    for soglia in soglie_ou_correnti:
+        p_over_s, p_under_s = 0.0, 0.0
+        for r_info in prob_risultati_esatti_list: # Ottimizzabile iterando matrice
+            g_c, g_t = map(int, r_info['risultato'].split('-'))
+            if (g_c + g_t) > soglia: p_over_s += r_info['prob']
+            else: p_under_s += r_info['prob']
+        pronostici_partita[f'U/O_{soglia}'] = pronostici.get_pronostico_secco_uo(p_over_s, p_under_s)
+        pronostici_partita[f'P(Over_{soglia})'] = round(p_over_s, 3)
+        
+    if not per_primo_tempo:
+        p_1x = p_1 + p_x; p_x2 = p_2 + p_x
+        if pronostici_partita['1X2'] == "1": dc_secco = "1X"
+        elif pronostici_partita['1X2'] == "2": dc_secco = "X2"
+        elif pronostici_partita['1X2'] == "X": dc_secco = "1X" if p_1x > p_x2 else "X2"
+        else: 
+            if p_1x > 0.68 and p_1x > p_x2 : dc_secco = "1X"
+            elif p_x2 > 0.68 and p_x2 > p_1x : dc_secco = "X2"
+            else: dc_secco = "NoBet"
+        pronostici_partita['DC'] = dc_secco
+        pronostici_partita['P(DC_1X)'] = round(p_1x, 3); pronostici_partita['P(DC_X2)'] = round(p_x2, 3)
+
+        prob_risultati_esatti_list = sorted(prob_risultati_esatti_list, key=lambda x: x['prob'], reverse=True)
+        pronostici_partita['RisultatoEsatto'] = prob_risultati_esatti_list[0]['risultato'] if prob_risultati_esatti_list else "N/A"
+        pronostici_partita['RisultatoEsattoMultiesiti'] = [item['risultato'] for item in prob_risultati_esatti_list[:pronostici.TOP_N_RISULTATI_ESATTI]]
+
+        # MultiGol FT secco Poisson-driven
+        gol_totali_prob_ft = [0.0] * ((max_gol_matrice * 2) + 1)
+        for r_info in prob_risultati_esatti_list:
+            g_c,g_t = map(int, r_info['risultato'].split('-'))
+            idx = g_c+g_t
+            if idx < len(gol_totali_prob_ft): gol_totali_prob_ft[idx] += r_info['prob']
+
+        best_mg_ft_range = "NoBet"; max_p_mg_ft = 0.15 # Soglia minima per considerarlo
+        for nome_range, limiti in pronostici.RANGES_MULTIGOL_FT.items():
+            if isinstance(limiti, tuple):
+                min_g, max_g_range = limiti
+                current_p_mg = 0
+                if max_g_range is None: # Caso OverX.5
+                    if min_g < len(gol_totali_prob_ft):
+                        current_p_mg = sum(gol_totali_prob_ft[min_g:])
+                else:
+                    if min_g < len(gol_totali_prob_ft) and max_g_range < len(gol_totali_prob_ft):
+                         current_p_mg = sum(gol_totali_prob_ft[min_g : max_g_range+1])
+                    elif min_g < len(gol_totali_prob_ft): # Se max_g_range è fuori, somma fino alla fine
+                         current_p_mg = sum(gol_totali_prob_ft[min_g:])
+
+                if current_p_mg > max_p_mg_ft:
+                    max_p_mg_ft = current_p_mg
+                    best_mg_ft_range = nome_range
+        pronostici_partita['multigol_totale'] = best_mg_ft_range 
+    return pronostici_partita
+
+
+@pytest.mark.parametrize("max_gol, per_primo_tempo", [(pronostici.MAX_GOL_POISSON_FT, False), (pronostici.MAX_GOL_POISSON_HT, True)])
+def test_estrazione_a_maschere_uguale_ai_cicli(max_gol, per_primo_tempo):
+    """Matrici casuali, con xg anche molto bassi (dove scatta la soglia delle celle): valori, tipi e ordine delle chiavi."""
+    rng = np.random.default_rng(0)
+    xg = np.concatenate([rng.uniform(0.01, 5.0, 2000), rng.uniform(0.01, 0.2, 400)])
+    tensore = pronostici.genera_matrici_probabilita_poisson(xg, rng.permutation(xg), max_gol)
+    attesi = [estrai_pronostici_da_matrice_cicli(m, max_gol, 0, 0, per_primo_tempo) for m in tensore]
+    for atteso, ottenuto in zip(attesi, pronostici.estrai_pronostici_da_tensore(tensore, per_primo_tempo)):
+        assert ottenuto == atteso
+        assert list(ottenuto) == list(atteso)
+        assert all(type(ottenuto[c]) is type(atteso[c]) for c in atteso)
+    for atteso, matrice in zip(attesi[:200], tensore[:200]):
+        assert pronostici.estrai_pronostici_da_matrice(matrice, max_gol, 0, 0, per_primo_tempo) == atteso
+
+
+
+# === Combo: probabilità congiunte a maschere contro la somma cella per cella ===
+
+def vince_selezione(selezione: str, i: int, j: int) -> bool:
+    """La selezione di una combo è vinta con il risultato i-j (condizioni scritte a mano, indipendenti da maschera_selezione)."""
+    if selezione in ('1', 'X', '2'): return {'1': i > j, 'X': i == j, '2': i < j}[selezione]
+    if selezione.startswith('DC_'): return any(vince_selezione(s, i, j) for s in selezione[3:])
+    if selezione in ('GG', 'NG'): return (i > 0 and j > 0) == (selezione == 'GG')
+    mercato, _, valore = selezione.partition('_')
+    if mercato in ('Over', 'Under'): return (i + j > float(valore)) == (mercato == 'Over')
+    limiti = pronostici.RANGES_MULTIGOL_FT[valore]
+    if isinstance(limiti, str): return (i + j) % 2 == (0 if limiti == "Pari" else 1)
+    return i + j >= limiti[0] and (limiti[1] is None or i + j <= limiti[1])
+
+
+def test_combo_uguali_alla_somma_cella_per_cella():
+    rng = np.random.default_rng(0)
+    max_gol = pronostici.MAX_GOL_POISSON_FT
+    tensore = pronostici.genera_matrici_probabilita_poisson(rng.uniform(0.05, 4.0, 200), rng.uniform(0.05, 4.0, 200), max_gol)
+    combinazioni = pronostici.combinazioni_combo_v2()
+    congiunte = pronostici.probabilita_combo_tensore(tensore, combinazioni)
+    for selezioni in combinazioni:
+        celle = [(i, j) for i in range(max_gol + 1) for j in range(max_gol + 1) if all(vince_selezione(s, i, j) for s in selezioni)]
+        attese = [sum(matrice[i, j] for i, j in celle) for matrice in tensore]
+        np.testing.assert_allclose(congiunte[pronostici.chiave_combinazione(selezioni)], attese, rtol=0, atol=1e-12, err_msg=str(selezioni))
+
+
+
+# === Mercati estesi: somme cumulative contro il calcolo cella per cella ===
+
+def mercati_estesi_cella_per_cella(matrice_ft: np.ndarray, matrice_1t: np.ndarray, matrice_2t: np.ndarray) -> dict:
+    """Probabilità dei mercati estesi di una partita sommando le celle una a una, riferimento per mercati_estesi_tensore."""
+    def esito_linea(margine, linea): # Quota della puntata (vinta, rimborsata, persa) su una linea intera o .5
+        return (1.0, 0.0, 0.0) if margine + linea > 0 else (0.0, 1.0, 0.0) if margine + linea == 0 else (0.0, 0.0, 1.0)
+    segno = lambda margine: "1" if margine > 0 else "X" if margine == 0 else "2"
+    dim_ft, dim_ht = len(matrice_ft), len(matrice_1t)
+    attese = {}
+    for linea in pronostici.LINEE_HANDICAP_ASIATICO:
+        linee = (linea - 0.25, linea + 0.25) if (linea * 4) % 2 == 1 else (linea,)
+        for e, esito in enumerate(("vinta", "rimborsata", "persa")):
+            attese[f'P(AH_{linea:+g}_{esito})'] = sum(matrice_ft[i, j] * sum(esito_linea(i - j, l)[e] for l in linee) / len(linee)
+                                                        for i in range(dim_ft) for j in range(dim_ft))
+    for squadra, verso in (("casa", 1), ("trasferta", -1)):
+        for m in range(1, pronostici.MARGINE_VITTORIA_MAX + 1):
+            ultimo = m == pronostici.MARGINE_VITTORIA_MAX
+            attese[f'P(Margine_{squadra}_{m}{"+" if ultimo else ""})'] = sum(
+                matrice_ft[i, j] for i in range(dim_ft) for j in range(dim_ft) if (verso * (i - j) >= m if ultimo else verso * (i - j) == m))
+    attese['P(Margine_pareggio)'] = sum(matrice_ft[i, i] for i in range(dim_ft))
+    for g in range(dim_ft):
+        etichetta = f"{g}+" if g == dim_ft - 1 else str(g)
+        attese[f'P(Gol_casa_{etichetta})'] = sum(matrice_ft[g, j] for j in range(dim_ft))
+        attese[f'P(Gol_trasferta_{etichetta})'] = sum(matrice_ft[i, g] for i in range(dim_ft))
+    for esito in pronostici.ESITI_PARZIALE_FINALE:
+        attese[f'P(1T/FT_{esito})'] = 0.0
+    for a in range(dim_ht):
+        for b in range(dim_ht):
+            for c in range(dim_ht):
+                for d in range(dim_ht):
+                    attese[f'P(1T/FT_{segno(a - b)}/{segno(a + c - b - d)})'] += matrice_1t[a, b] * matrice_2t[c, d]
+    return attese
+
+
+def test_mercati_estesi_uguali_al_calcolo_cella_per_cella():
+    rng = np.random.default_rng(0)
+    xg_casa, xg_trasf, quota_1t = rng.uniform(0.05, 4.0, 100), rng.uniform(0.05, 4.0, 100), rng.uniform(0.3, 0.6, 100)
+    tensore_ft = pronostici.genera_matrici_probabilita_poisson(xg_casa, xg_trasf, pronostici.MAX_GOL_POISSON_FT)
+    tensore_1t = pronostici.genera_matrici_probabilita_poisson(xg_casa * quota_1t, xg_trasf * quota_1t, pronostici.MAX_GOL_POISSON_HT)
+    tensore_2t = pronostici.genera_matrici_probabilita_poisson(xg_casa * (1 - quota_1t), xg_trasf * (1 - quota_1t), pronostici.MAX_GOL_POISSON_HT)
+    prob = pronostici.mercati_estesi_tensore(tensore_ft, tensore_1t, tensore_2t)
+    for n in range(len(tensore_ft)):
+        attese = mercati_estesi_cella_per_cella(tensore_ft[n], tensore_1t[n], tensore_2t[n])
+        assert set(attese) == set(prob)
+        for chiave, valore in attese.items():
+            assert abs(prob[chiave][n] - valore) <= 1e-12, (n, chiave)
+
+
+# === JSON dei pronostici: formattazione a lotti contro JSON generati dalla versione originale ===
+
+CARTELLA_RIFERIMENTO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dati_pronostici_riferimento")
+
+
+def test_json_uguali_alla_versione_originale(tmp_path, monkeypatch):
+    """
+    ingresso/: statistiche, medie, H2H, arbitri e partite ridotti (Serie A e Premier League, più partite da saltare);
+    attesi/: JSON scritti su quegli ingressi dal main() della versione originale, che elaborava una partita alla volta.
+    Confronto delle chiavi originali, nello stesso ordine: probabilità delle combo e mercati estesi sono aggiunte successive.
+    """
+    shutil.copytree(os.path.join(CARTELLA_RIFERIMENTO, "ingresso"), tmp_path, dirs_exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+    for cache in ("_TABELLE_SQUADRE", "_INDICI_H2H", "_REGISTRI_ARBITRI", "_STORE_STATISTICHE_APERTI"):
+        monkeypatch.setattr(pronostici, cache, {})
+    monkeypatch.setattr(pronostici, "_CACHE_CAMPIONATI", pronostici.CacheCampionati())
+
+    file_partite = sorted(f for f in os.listdir(pronostici.PATH_PARTITE_INPUT) if f.endswith(".json"))
+    previsioni = pronostici.prevedi_partite(pronostici.leggi_partite(file_partite))
+    formattati = pronostici.formatta_pronostici_json(previsioni)
+    attesi = sorted(os.listdir(os.path.join(CARTELLA_RIFERIMENTO, "attesi")))
+    assert [f for f, p in zip(file_partite, formattati) if p is not None] == attesi
+
+    for file_partita, pronostici_output in zip(file_partite, formattati):
+        if pronostici_output is None: continue
+        with open(os.path.join(CARTELLA_RIFERIMENTO, "attesi", file_partita), 'r', encoding='utf-8') as f:
+            atteso = json.load(f)
+        ottenuto = json.loads(json.dumps(pronostici_output, ensure_ascii=False))
+        for sezione, valori in atteso.items():
+            originali = {k: v for k, v in ottenuto[sezione].items() if k in valori}
+            assert originali == valori, (file_partita, sezione)
+            assert list(originali) == list(valori), (file_partita, sezione)
+
+
+# === Store binario delle statistiche V2 contro il CSV ===
+
+def _store_da_csv(tmp_path, prefix):
+    """Copia il CSV delle statistiche V2 del campionato in tmp_path e ci scrive accanto lo store .npz."""
+    percorso_csv = os.path.join(pronostici.PATH_STATISTICHE_V2_BASE, f"{prefix}_statistiche_avanzate_V2.csv")
+    shutil.copy(percorso_csv, tmp_path)
+    CALCOLO_MEDIE_NEW.salva_store_statistiche_v2(pd.read_csv(percorso_csv), str(tmp_path / f"{prefix}_statistiche_avanzate_V2.npz"))
+    return pd.read_csv(percorso_csv)['squadra'].tolist()
+
+
+@pytest.fixture
+def cache_statistiche_vuote(monkeypatch):
+    monkeypatch.setattr(pronostici, "_STORE_STATISTICHE_APERTI", {})
+    monkeypatch.setattr(pronostici, "_CACHE_CAMPIONATI", pronostici.CacheCampionati())
+
+
+@pytest.mark.parametrize("prefix", CAMPIONATI)
+def test_store_statistiche_uguale_al_csv(prefix, tmp_path, cache_statistiche_vuote):
+    richiede_cartella(pronostici.PATH_STATISTICHE_V2_BASE)
+    if not os.path.exists(os.path.join(pronostici.PATH_STATISTICHE_V2_BASE, f"{prefix}_statistiche_avanzate_V2.csv")):
+        pytest.skip(f"Statistiche V2 di {prefix} assenti")
+    squadre = _store_da_csv(tmp_path, prefix)
+    dallo_store = pronostici.carica_statistiche_squadre_store_V2(squadre, prefix, str(tmp_path))
+    assert set(dallo_store) == set(squadre)
+    for squadra in squadre:
+        riga_csv = pronostici.carica_statistiche_squadra_V2_csv(squadra, prefix, str(tmp_path))
+        riga_cache = pronostici.carica_statistiche_squadra_V2(squadra, prefix, str(tmp_path))
+        for colonna in pronostici.colonne_statistiche_usate(riga_csv):
+            assert dallo_store[squadra][colonna] == riga_csv[colonna], (squadra, colonna)
+            assert riga_cache[colonna] == riga_csv[colonna], (squadra, colonna)
+
+
+def test_store_statistiche_colonne_e_squadre_richieste(tmp_path, cache_statistiche_vuote):
+    richiede_cartella(pronostici.PATH_STATISTICHE_V2_BASE)
+    squadre = _store_da_csv(tmp_path, "serie_a")
+    colonne = ['posizione_classifica_attuale', 'colonna_inesistente']
+    dallo_store = pronostici.carica_statistiche_squadre_store_V2([squadre[0], "Squadra Inesistente"], "serie_a", str(tmp_path), colonne)
+    assert list(dallo_store) == [squadre[0]] # La squadra mancante manca dal risultato
+    assert list(dallo_store[squadre[0]]) == ['squadra', 'posizione_classifica_attuale'] # Solo le colonne richieste presenti nello store
+    assert pronostici.carica_statistiche_squadre_store_V2(squadre, "premier", str(tmp_path)) is None # Store assente
+
+
+def test_store_statistiche_versione_schema_diversa(tmp_path, monkeypatch, cache_statistiche_vuote):
+    richiede_cartella(pronostici.PATH_STATISTICHE_V2_BASE)
+    monkeypatch.setattr(CALCOLO_MEDIE_NEW, "VERSIONE_SCHEMA_STORE_V2", pronostici.VERSIONE_SCHEMA_STORE_V2 + 1)
+    squadre = _store_da_csv(tmp_path, "serie_a")
+    assert pronostici.carica_statistiche_squadre_store_V2(squadre, "serie_a", str(tmp_path)) is None
+    # Chi carica una squadra ripiega sul CSV
+    assert pronostici.carica_statistiche_squadra_V2(squadre[0], "serie_a", str(tmp_path))['squadra'] == squadre[0]
+
+
+# === Cache dei file di campionato ===
+
+def _scrivi_csv(percorso, righe, mtime=None):
+    with open(percorso, 'w', encoding='utf-8') as f:
+        f.write("squadra,punti\n" + "".join(f"{squadra},{punti}\n" for squadra, punti in righe))
+    if mtime is not None:
+        os.utime(percorso, (mtime, mtime))
+
+
+def _lettore_contato(letture):
+    def lettore(percorso):
+        letture.append(percorso)
+        return pd.read_csv(percorso)
+    return lettore
+
+
+def test_cache_campionati_hit_se_il_file_non_cambia(tmp_path):
+    percorso = str(tmp_path / "classifica.csv")
+    _scrivi_csv(percorso, [("Milan", 3), ("Inter", 1)], mtime=1_700_000_000) # Scritto ben prima della lettura
+    cache, letture = pronostici.CacheCampionati(), []
+    primo = cache.ottieni(percorso, _lettore_contato(letture))
+    secondo = cache.ottieni(percorso, _lettore_contato(letture))
+    assert secondo is primo and len(letture) == 1
+    assert (cache.miss, cache.hit, cache.verifiche_hash) == (1, 1, 0) # Basta os.stat, nessun hash
+
+    # File riscritto con lo stesso contenuto: mtime diverso, hash uguale, nessuna rilettura
+    _scrivi_csv(percorso, [("Milan", 3), ("Inter", 1)])
+    assert cache.ottieni(percorso, _lettore_contato(letture)) is primo and len(letture) == 1
+    assert cache.verifiche_hash == 1
+
+
+def test_cache_campionati_ricarica_il_file_riscritto(tmp_path):
+    percorso = str(tmp_path / "classifica.csv")
+    _scrivi_csv(percorso, [("Milan", 3), ("Inter", 1)])
+    cache, letture = pronostici.CacheCampionati(), []
+    assert cache.ottieni(percorso, _lettore_contato(letture))['punti'].tolist() == [3, 1]
+
+    # Stessa dimensione e scrittura a ridosso della lettura: mtime/dimensione potrebbero non cambiare, decide l'hash
+    _scrivi_csv(percorso, [("Milan", 4), ("Inter", 1)])
+    assert cache.ottieni(percorso, _lettore_contato(letture))['punti'].tolist() == [4, 1]
+    _scrivi_csv(percorso, [("Milan", 4), ("Inter", 1), ("Lazio", 0)], mtime=1_700_000_000)
+    assert cache.ottieni(percorso, _lettore_contato(letture))['squadra'].tolist() == ["Milan", "Inter", "Lazio"]
+    assert len(letture) == 3 and cache.miss == 3
+
+    os.remove(percorso) # File sparito: niente valore vecchio dalla cache
+    with pytest.raises(FileNotFoundError):
+        cache.ottieni(percorso, _lettore_contato(letture))
+
+
+# === Registro degli arbitri ===
+
+def _scrivi_arbitri(cartella, arbitri):
+    os.makedirs(cartella, exist_ok=True)
+    for chiave, dati in arbitri.items():
+        with open(os.path.join(cartella, f"arbitro_{chiave}.json"), 'w', encoding='utf-8') as f:
+            json.dump(dati, f)
+
+
+@pytest.fixture
+def cartella_arbitri(tmp_path, monkeypatch):
+    monkeypatch.setattr(pronostici, "_REGISTRI_ARBITRI", {})
+    cartella = str(tmp_path / "dati_arbitri")
+    _scrivi_arbitri(cartella, {"rossi": {"nome_arbitro": "Rossi", "gialli_pg": 5.5}, "rossimario": {"gialli_pg": 3.0},
+                               "marcorossi": {"gialli_pg": 4.5}, "bianchi": {"gialli_pg": 2.0}})
+    return cartella
+
+
+def test_registro_arbitri_report_delle_ambiguita(cartella_arbitri, tmp_path):
+    registro = pronostici.registro_arbitri(cartella_arbitri, str(tmp_path / "registro.json"))
+    esiti = registro.report(["Rossi", "Mario", "Ross", "Verdi"])
+    assert esiti == {
+        "Rossi": ("esatto", "arbitro_rossi.json"), # Chiave esatta, anche se "rossi" compare in altri due file
+        "Mario": ("sottostringa", "arbitro_rossimario.json"),
+        "Ross": ("ambiguo", "arbitro_marcorossi.json"), # Più file, nessuna chiave esatta: il primo in ordine alfabetico
+        "Verdi": ("non trovato", None),
+    }
+    assert registro.ambiguita == {"Rossi": ["arbitro_rossi.json", "arbitro_marcorossi.json", "arbitro_rossimario.json"],
+                                  "Ross": ["arbitro_marcorossi.json", "arbitro_rossi.json", "arbitro_rossimario.json"]}
+
+
+def test_registro_arbitri_salvato_e_riletto(cartella_arbitri, tmp_path, monkeypatch):
+    percorso_registro = str(tmp_path / "registro.json")
+    pronostici.registro_arbitri(cartella_arbitri, percorso_registro, salva=False)
+    assert not os.path.exists(percorso_registro)
+    costruito = pronostici.registro_arbitri(cartella_arbitri, percorso_registro) # Stesso registro in memoria, ora salvato
+    assert os.path.exists(percorso_registro) and costruito.salvato
+
+    monkeypatch.setattr(pronostici, "_REGISTRI_ARBITRI", {}) # Come un processo nuovo
+    riletto = pronostici.registro_arbitri(cartella_arbitri, percorso_registro)
+    assert riletto is not costruito and riletto.voci == costruito.voci
+    assert riletto.trova_file("Mario") == "arbitro_rossimario.json"
+    dati = pronostici.carica_dati_arbitro_safe("Rossi", cartella_arbitri)
+    assert dati['gialli_pg'] == 5.5 and dati['nome_arbitro_originale'] == "Rossi" and dati['statistiche_trovate']
+
+
+def test_registro_arbitri_invalidato_se_cambia_la_cartella(cartella_arbitri, tmp_path, monkeypatch):
+    percorso_registro = str(tmp_path / "registro.json")
+    pronostici.registro_arbitri(cartella_arbitri, percorso_registro)
+    firma = pronostici.firma_cartella_arbitri(cartella_arbitri)
+    assert pronostici.RegistroArbitri.da_file(percorso_registro, firma) is not None
+
+    # File di un arbitro aggiornato (es. da REFEREE.py): la firma cambia, il registro salvato non vale più
+    _scrivi_arbitri(cartella_arbitri, {"bianchi": {"gialli_pg": 2.75}})
+    assert pronostici.firma_cartella_arbitri(cartella_arbitri) != firma
+    assert pronostici.RegistroArbitri.da_file(percorso_registro, pronostici.firma_cartella_arbitri(cartella_arbitri)) is None
+    monkeypatch.setattr(pronostici, "_REGISTRI_ARBITRI", {})
+    assert pronostici.registro_arbitri(cartella_arbitri, percorso_registro).voci["arbitro_bianchi.json"]['statistiche']['gialli_pg'] == 2.75
+    assert pronostici.RegistroArbitri.da_file(percorso_registro, pronostici.firma_cartella_arbitri(cartella_arbitri)) is not None